@@ -19,7 +19,9 @@ from backend.logging_config import setup_logging
 from backend.middleware.security import setup_security_headers
 from backend.middleware.error_handlers import register_error_handlers
 from backend.database import get_db_connection, init_db
-from backend.cache import init_redis, cache_health
+from backend.cache import init_redis, cache_health, start_cache_refresher
+from backend.job_host import job_host
+from backend.json_provider import init_json_provider
 
 # Blueprints
 from backend.routes.auth_routes import auth_bp
@@ -79,6 +81,7 @@ from backend.routes.painel51_routes import painel51_bp
 from backend.routes.tests_admin_routes import tests_bp
 from backend.routes.admin_acessos_routes import acessos_bp
 from backend.routes.tv_routes import tv_bp
+from backend.routes.stream_routes import stream_bp
 
 # =========================================================
 # CONFIGURAÇÃO INICIAL
@@ -98,6 +101,9 @@ app = Flask(__name__)
 config_class = get_config()
 app.config.from_object(config_class)
 
+# Respostas jsonify via orjson (request.get_json segue no json padrao do Flask)
+init_json_provider(app)
+
 # Proxy reverso (nginx → Gunicorn): garante que HTTPS e IP real sejam lidos corretamente
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
@@ -144,7 +150,7 @@ init_redis(app)
 # ── Rastreamento de acessos (suprime log do werkzeug no terminal) ──────────
 _logging.getLogger('werkzeug').setLevel(_logging.WARNING)  # Remove linhas "GET /api/... 200 -"
 
-from backend.access_tracker import init_access_tracker
+from backend.access_tracker import init_access_tracker, start_retencao_access_log
 init_access_tracker(app)
 
 # =========================================================
@@ -159,6 +165,7 @@ app.register_blueprint(admin_bp)
 app.register_blueprint(tests_bp)
 app.register_blueprint(acessos_bp)
 app.register_blueprint(tv_bp)
+app.register_blueprint(stream_bp)
 
 # Blueprints de Painéis
 paineis = [
@@ -200,6 +207,20 @@ def health_pool():
     return jsonify(pool_health())
 
 
+@app.route('/api/health/metrics')
+def health_metrics():
+    """Metricas no formato Prometheus: cache por key_prefix e pool PostgreSQL."""
+    from backend.metrics import render_prometheus
+    return app.response_class(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/health/stream')
+def health_stream():
+    """Status do canal SSE: conexoes abertas e assinantes por painel."""
+    from backend.stream import stream_health
+    return jsonify(stream_health())
+
+
 @app.route('/api/health/ocupacao')
 def health_ocupacao():
     """Status do worker de ocupação hospitalar: thread viva, último envio, próximo envio."""
@@ -207,25 +228,51 @@ def health_ocupacao():
     return jsonify(_get_status())
 
 
+@app.route('/api/health/jobs')
+def health_jobs():
+    """
+    Jobs de background: lideranca deste processo, agendador local (proximos
+    disparos, ciclos em andamento) e historico de execucoes (tabela
+    agendador_execucoes — o mesmo em qualquer worker) e filas do despachante
+    de notificacoes deste processo.
+    """
+    from backend.agendador import agendador, historico_execucoes
+    from backend.notificador_despacho import despacho
+    return jsonify({
+        'host': job_host.estado(),
+        'agendador': agendador.estado(),
+        'execucoes': historico_execucoes(),
+        'despacho': despacho.estado(),
+    })
+
+
 # =========================================================
 # CACHE INVALIDATION — chamado pelo ETL (Apache Hop) após carga
 # =========================================================
 
 import re as _re
 _PAINEL_RE = _re.compile(r'^painel\d+$')
+_TABELA_RE = _re.compile(r'^[a-z_][a-z0-9_]{0,62}$')
 
 @app.route('/api/health/cache-invalidate', methods=['POST'])
 def health_cache_invalidate():
     """
-    Invalida o cache Redis de um ou mais painéis imediatamente após uma carga ETL.
+    Invalida ou recalcula o cache de um ou mais painéis imediatamente após uma carga ETL.
     Protegido por CACHE_INVALIDATE_KEY no .env.
 
     Uso pelo Apache Hop: POST /api/health/cache-invalidate?key=SECRET
-    Body JSON: {"paineis": "painel4,painel12"}
-    Ou query string: ?paineis=painel4,painel12
+    Body JSON: {"paineis": "painel4,painel12", "modo": "refresh", "tabelas": "ocupacao_hospitalar"}
+    Ou query string: ?paineis=painel4,painel12&modo=refresh&tabelas=ocupacao_hospitalar
+
+    modo=invalidate (padrão): apaga as chaves painelN:* — próxima requisição recalcula.
+    modo=refresh: recalcula em background as variantes já acessadas dos endpoints
+                  do painel e sobrescreve o cache (TVs nunca veem cache frio).
+    tabelas: registra nova geração de carga; endpoints com depends_on nessas
+             tabelas trocam de chave na hora.
     """
     from flask import request as _req
-    from backend.cache import cache_delete_pattern
+    from backend.cache import cache_delete_pattern, cache_refresh_prefix, cache_bump_generation
+    from backend.stream import publicar
 
     expected_key = os.environ.get('CACHE_INVALIDATE_KEY', '').strip()
     if not expected_key:
@@ -237,20 +284,37 @@ def health_cache_invalidate():
 
     body = _req.get_json(silent=True) or {}
     paineis_raw = (_req.args.get('paineis') or body.get('paineis', '')).strip()
-    if not paineis_raw:
-        return jsonify({'success': False, 'error': 'Parametro paineis e obrigatorio'}), 400
+    tabelas_raw = (_req.args.get('tabelas') or body.get('tabelas', '')).strip()
+    modo = (_req.args.get('modo') or body.get('modo', 'invalidate')).strip().lower()
+    if not paineis_raw and not tabelas_raw:
+        return jsonify({'success': False, 'error': 'Parametro paineis ou tabelas e obrigatorio'}), 400
+    if modo not in ('invalidate', 'refresh'):
+        return jsonify({'success': False, 'error': 'Modo invalido: use invalidate ou refresh'}), 400
 
     nomes = [p.strip() for p in paineis_raw.split(',') if p.strip()]
     invalidos = [n for n in nomes if not _PAINEL_RE.match(n)]
     if invalidos:
         return jsonify({'success': False, 'error': 'Nome de painel invalido: ' + ', '.join(invalidos)}), 400
 
+    tabelas = [t.strip() for t in tabelas_raw.split(',') if t.strip()]
+    tabelas_invalidas = [t for t in tabelas if not _TABELA_RE.match(t)]
+    if tabelas_invalidas:
+        return jsonify({'success': False, 'error': 'Nome de tabela invalido: ' + ', '.join(tabelas_invalidas)}), 400
+
+    geracoes = cache_bump_generation(tabelas) if tabelas else {}
+
     resultado = {}
     for nome in nomes:
-        resultado[nome] = cache_delete_pattern(nome + ':*')
+        if modo == 'refresh':
+            resultado[nome] = cache_refresh_prefix(app, nome)
+        else:
+            resultado[nome] = cache_delete_pattern(nome + ':*')
+            # No modo refresh o aviso sai quando o recalculo grava dado novo
+            publicar(nome)
 
-    app.logger.info('[cache-invalidate] ETL limpou: %s', resultado)
-    return jsonify({'success': True, 'deletados': resultado})
+    app.logger.info('[cache-invalidate] ETL %s: %s geracoes=%s', modo, resultado, geracoes)
+    chave = 'recalculados' if modo == 'refresh' else 'deletados'
+    return jsonify({'success': True, 'modo': modo, chave: resultado, 'geracoes': geracoes})
 
 
 # =========================================================
@@ -264,92 +328,100 @@ def _shutdown_all_workers():
     """Sinaliza parada graceful a todos os workers ao encerrar o servidor."""
     for event in _worker_stop_events:
         event.set()
+    # Para os jobs de background e libera o lock de lider para outro processo
+    job_host.parar()
     app.logger.info(f'[shutdown] {len(_worker_stop_events)} workers sinalizados para parar')
+    # Grava o que ainda esta na fila do access_log antes do processo sair
+    from backend.access_tracker import parar_escritor_log
+    parar_escritor_log()
+    # Emails/pushes ja enfileirados (ex.: painel30) saem antes do processo sair
+    from backend.notificador_despacho import despacho
+    despacho.parar()
 
 
 atexit.register(_shutdown_all_workers)
 
 
+# Refresher proativo do cache — reaquece chaves compartilhadas antes de expirarem
+# OFF SWITCH: CACHE_PROACTIVE_REFRESH=false no .env (padrao)
+_evt = start_cache_refresher(app)
+if _evt is not None:
+    _worker_stop_events.append(_evt)
+
+# Jobs de background: registrados no job_host e iniciados SO no processo lider
+# (advisory lock no PostgreSQL) — os demais workers do gunicorn so atendem HTTP.
+# Veja backend/job_host.py.
+
 # Notificador de pareceres — integrado como thread daemon
-# OFF SWITCH: comente as 3 linhas abaixo para desativar, ou defina NOTIF_PARECERES_AUTO=false no .env
+# OFF SWITCH: comente as 2 linhas abaixo para desativar, ou defina NOTIF_PARECERES_AUTO=false no .env
 try:
     from notificador_pareceres import start_in_background as _start_notificador
-    _evt = _start_notificador()
-    if _evt is not None:
-        _worker_stop_events.append(_evt)
+    job_host.registrar('notificador_pareceres', _start_notificador)
 except Exception as e:
     app.logger.warning(f'[notificador_pareceres] Nao iniciado automaticamente: {e}')
 
 # Notificador Sentir e Agir — integrado como thread daemon
-# OFF SWITCH: comente as 3 linhas abaixo para desativar, ou defina NOTIF_SENTIR_AGIR_AUTO=false no .env
+# OFF SWITCH: comente as 2 linhas abaixo para desativar, ou defina NOTIF_SENTIR_AGIR_AUTO=false no .env
 try:
     from notificador_sentir_agir import start_in_background as _start_sentir_agir
-    _evt = _start_sentir_agir()
-    if _evt is not None:
-        _worker_stop_events.append(_evt)
+    job_host.registrar('notificador_sentir_agir', _start_sentir_agir)
 except Exception as e:
     app.logger.warning(f'[notificador_sentir_agir] Nao iniciado automaticamente: {e}')
 
 # Worker analise diaria Sentir e Agir (IA Groq, ciclo 18h) — integrado como thread daemon
-# OFF SWITCH: comente as 3 linhas abaixo para desativar, ou defina WORKER_SENTIR_AGIR_AUTO=false no .env
+# OFF SWITCH: comente as 2 linhas abaixo para desativar, ou defina WORKER_SENTIR_AGIR_AUTO=false no .env
 try:
     from worker_sentir_agir_analise import start_in_background as _start_worker_analise
-    _evt = _start_worker_analise()
-    if _evt is not None:
-        _worker_stop_events.append(_evt)
+    job_host.registrar('worker_sentir_agir_analise', _start_worker_analise)
 except Exception as e:
     app.logger.warning(f'[worker_sentir_agir_analise] Nao iniciado automaticamente: {e}')
 
 # Worker IMAP — captura respostas de email e regulariza tratativas automaticamente
-# OFF SWITCH: comente as 3 linhas abaixo para desativar, ou defina WORKER_IMAP_TRATATIVAS_AUTO=false no .env
+# OFF SWITCH: comente as 2 linhas abaixo para desativar, ou defina WORKER_IMAP_TRATATIVAS_AUTO=false no .env
 try:
     from worker_imap_tratativas import start_in_background as _start_imap_worker
-    _evt = _start_imap_worker()
-    if _evt is not None:
-        _worker_stop_events.append(_evt)
+    job_host.registrar('worker_imap_tratativas', _start_imap_worker)
 except Exception as e:
     app.logger.warning(f'[worker_imap_tratativas] Nao iniciado automaticamente: {e}')
 
 # Notificador Paciente PS — alerta quando há paciente aguardando >10min sem médico no PS
-# OFF SWITCH: comente as 3 linhas abaixo para desativar, ou defina NOTIF_PACIENTE_PS_AUTO=false no .env
+# OFF SWITCH: comente as 2 linhas abaixo para desativar, ou defina NOTIF_PACIENTE_PS_AUTO=false no .env
 try:
     from notificador_paciente_ps import start_in_background as _start_paciente_ps
-    _evt = _start_paciente_ps()
-    if _evt is not None:
-        _worker_stop_events.append(_evt)
+    job_host.registrar('notificador_paciente_ps', _start_paciente_ps)
 except Exception as e:
     app.logger.warning(f'[notificador_paciente_ps] Nao iniciado automaticamente: {e}')
 
 # Worker verificação do sistema — roda a cada 6h, envia relatório por email e executa auto-reparos
-# OFF SWITCH: comente as 3 linhas abaixo para desativar
+# OFF SWITCH: comente as 2 linhas abaixo para desativar
 try:
     from worker_tests_sistema import start_in_background as _start_tests_sistema
-    _evt = _start_tests_sistema()
-    if _evt is not None:
-        _worker_stop_events.append(_evt)
+    job_host.registrar('worker_tests_sistema', _start_tests_sistema)
 except Exception as e:
     app.logger.warning(f'[worker_tests_sistema] Nao iniciado automaticamente: {e}')
 
 # Notificador de Ocupação Hospitalar — envia Excel + resumo HTML nos horários configurados
-# OFF SWITCH: comente as 3 linhas abaixo para desativar, ou defina NOTIF_OCUPACAO_AUTO=false no .env
+# OFF SWITCH: comente as 2 linhas abaixo para desativar, ou defina NOTIF_OCUPACAO_AUTO=false no .env
 try:
     from backend.notificador_ocupacao_hospitalar import start_in_background as _start_notif_ocupacao
-    _evt = _start_notif_ocupacao()
-    if _evt is not None:
-        _worker_stop_events.append(_evt)
+    job_host.registrar('notificador_ocupacao', _start_notif_ocupacao)
 except Exception as e:
     app.logger.warning(f'[notificador_ocupacao] Nao iniciado automaticamente: {e}')
 
 # Notificador de Movimentações Padioleiro — envia Excel + resumo HTML nos horários configurados
-# OFF SWITCH: comente as 3 linhas abaixo para desativar, ou defina NOTIF_PADIOLEIRO_AUTO=false no .env
+# OFF SWITCH: comente as 2 linhas abaixo para desativar, ou defina NOTIF_PADIOLEIRO_AUTO=false no .env
 try:
     from backend.notificador_padioleiro import start_in_background as _start_notif_padioleiro
-    _evt = _start_notif_padioleiro()
-    if _evt is not None:
-        _worker_stop_events.append(_evt)
+    job_host.registrar('notificador_padioleiro', _start_notif_padioleiro)
 except Exception as e:
     app.logger.warning(f'[notificador_padioleiro] Nao iniciado automaticamente: {e}')
 
+# Retencao do access_log (DROP de particoes antigas) — so no lider: o DETACH
+# pede lock exclusivo em access_log
+job_host.registrar('access_log_retencao', start_retencao_access_log)
+
+job_host.iniciar()
+
 # =========================================================
 # ROTAS DE DESENVOLVIMENTO (Remover em produção)
 # =========================================================
@@ -0,0 +1,386 @@
+"""
+Armazenamento do access_log (particoes mensais + rollups)
+Sistema de Paineis Hospitalares
+
+Funcionalidades:
+- access_log particionada por mes (RANGE em dt_acesso); retencao de 6
+  meses por DROP da particao inteira, sem DELETE em massa
+- Rollups access_log_hora / access_log_dia por painel x ip x tipo,
+  mantidos no mesmo INSERT que grava o lote do escritor do access_tracker
+- Migracao da tabela antiga (nao particionada): vira a particao
+  access_log_legado (ATTACH, sem copiar linhas), com retencao por DELETE
+  ate todo o seu conteudo passar da retencao e ela ser descartada. Roda
+  pelo script scripts/migrar_access_log_particionada.py, fora do boot
+  dos workers: o init_db so avisa que a tabela ainda e a antiga
+
+Os endpoints de estatistica (admin_acessos_routes) leem so os rollups;
+o historico detalhado e a exportacao continuam na tabela bruta.
+"""
+
+import logging
+import os
+import re
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+ACCESS_LOG_RETENCAO_MESES = int(os.getenv('ACCESS_LOG_RETENCAO_MESES', '6'))
+ACCESS_LOG_MESES_A_FRENTE = int(os.getenv('ACCESS_LOG_MESES_A_FRENTE', '2'))
+ROLLUP_HORA_DIAS  = int(os.getenv('ACCESS_LOG_ROLLUP_HORA_DIAS', '35'))    # grafico por hora
+ROLLUP_DIA_MESES  = int(os.getenv('ACCESS_LOG_ROLLUP_DIA_MESES', '25'))    # pivot mensal (ate 24)
+
+# Serializa a migracao entre processos (init_db de workers/scripts em paralelo)
+_LOCK_MIGRACAO = 72_410_001
+
+# Nome da particao que recebe a tabela antiga na migracao
+PARTICAO_LEGADO = 'access_log_legado'
+
+_LIMITE_RE = re.compile(r"TO \('(\d{4}-\d{2}-\d{2})")
+
+
+_DDL_ACCESS_LOG = """
+    CREATE TABLE IF NOT EXISTS access_log (
+        id           BIGINT NOT NULL DEFAULT nextval(%s::regclass),
+        dt_acesso    TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        ip           VARCHAR(45) NOT NULL,
+        painel_codigo VARCHAR(50),
+        painel_nome  VARCHAR(150),
+        endpoint     VARCHAR(300),
+        descricao    TEXT NOT NULL,
+        metodo       VARCHAR(10) NOT NULL DEFAULT 'GET',
+        status_code  SMALLINT,
+        duracao_ms   INTEGER,
+        usuario_id   INTEGER,
+        usuario_nome VARCHAR(100),
+        tipo_acesso  VARCHAR(30) DEFAULT 'painel',
+        PRIMARY KEY (id, dt_acesso)
+    ) PARTITION BY RANGE (dt_acesso)
+"""
+
+_DDL_INDICES = [
+    "CREATE INDEX IF NOT EXISTS idx_access_log_dt ON access_log (dt_acesso DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_access_log_ip_dt ON access_log (ip, dt_acesso DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_access_log_painel ON access_log (painel_codigo, dt_acesso DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_access_log_tipo ON access_log (tipo_acesso, dt_acesso DESC)",
+]
+
+# Chave sem NULL: painel/tipo ausentes viram '' (NULLIF na leitura)
+_DDL_ROLLUPS = """
+    CREATE TABLE IF NOT EXISTS access_log_hora (
+        hora          TIMESTAMPTZ NOT NULL,
+        painel_codigo VARCHAR(50)  NOT NULL DEFAULT '',
+        ip            VARCHAR(45)  NOT NULL,
+        tipo_acesso   VARCHAR(30)  NOT NULL DEFAULT '',
+        painel_nome   VARCHAR(150),
+        acessos       INTEGER      NOT NULL DEFAULT 0,
+        ultimo_acesso TIMESTAMPTZ  NOT NULL,
+        PRIMARY KEY (hora, painel_codigo, ip, tipo_acesso)
+    );
+    CREATE TABLE IF NOT EXISTS access_log_dia (
+        dia           DATE         NOT NULL,
+        painel_codigo VARCHAR(50)  NOT NULL DEFAULT '',
+        ip            VARCHAR(45)  NOT NULL,
+        tipo_acesso   VARCHAR(30)  NOT NULL DEFAULT '',
+        painel_nome   VARCHAR(150),
+        acessos       INTEGER      NOT NULL DEFAULT 0,
+        ultimo_acesso TIMESTAMPTZ  NOT NULL,
+        PRIMARY KEY (dia, painel_codigo, ip, tipo_acesso)
+    );
+"""
+
+_UPSERT_ROLLUP = """
+    ON CONFLICT ({bucket}, painel_codigo, ip, tipo_acesso) DO UPDATE SET
+        acessos       = t.acessos + EXCLUDED.acessos,
+        ultimo_acesso = GREATEST(t.ultimo_acesso, EXCLUDED.ultimo_acesso),
+        painel_nome   = COALESCE(EXCLUDED.painel_nome, t.painel_nome)
+"""
+
+# Lote do escritor: linhas brutas + os dois rollups numa unica instrucao
+# (uma ida ao banco, uma transacao). Formato de VALUES para execute_values.
+INSERT_LOTE = """
+    WITH novos AS (
+        INSERT INTO access_log
+            (dt_acesso, ip, painel_codigo, painel_nome, endpoint, descricao,
+             metodo, status_code, duracao_ms, usuario_id, usuario_nome, tipo_acesso)
+        VALUES %s
+        RETURNING dt_acesso, ip, COALESCE(painel_codigo, '') AS painel_codigo,
+                  painel_nome, COALESCE(tipo_acesso, '') AS tipo_acesso
+    ), por_hora AS (
+        INSERT INTO access_log_hora AS t
+            (hora, painel_codigo, ip, tipo_acesso, painel_nome, acessos, ultimo_acesso)
+        SELECT date_trunc('hour', dt_acesso), painel_codigo, ip, tipo_acesso,
+               MAX(painel_nome), COUNT(*), MAX(dt_acesso)
+        FROM novos GROUP BY 1, 2, 3, 4
+    """ + _UPSERT_ROLLUP.format(bucket='hora') + """
+    )
+    INSERT INTO access_log_dia AS t
+        (dia, painel_codigo, ip, tipo_acesso, painel_nome, acessos, ultimo_acesso)
+    SELECT dt_acesso::date, painel_codigo, ip, tipo_acesso,
+           MAX(painel_nome), COUNT(*), MAX(dt_acesso)
+    FROM novos GROUP BY 1, 2, 3, 4
+""" + _UPSERT_ROLLUP.format(bucket='dia')
+
+
+# =========================================================
+# PARTICOES
+# =========================================================
+
+def _somar_meses(d: date, n: int) -> date:
+    m = d.month - 1 + n
+    return date(d.year + m // 12, m % 12 + 1, 1)
+
+
+def _particionada(cursor) -> bool:
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('access_log')")
+    row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def _particoes(cursor) -> list:
+    """[(nome, limite_superior: date|None)] das particoes de access_log."""
+    cursor.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'access_log'::regclass
+        ORDER BY c.relname
+    """)
+    resultado = []
+    for nome, limite in cursor.fetchall():
+        m = _LIMITE_RE.search(limite or '')
+        resultado.append((nome, date.fromisoformat(m.group(1)) if m else None))
+    return resultado
+
+
+def garantir_particoes(cursor, meses_a_frente: int = None) -> list:
+    """
+    Cria as particoes do mes atual e dos proximos meses (idempotente).
+    Meses ja cobertos (inclusive pela particao legado) sao pulados.
+    Retorna os nomes criados.
+    """
+    if meses_a_frente is None:
+        meses_a_frente = ACCESS_LOG_MESES_A_FRENTE
+    cobertos_ate = max((lim for _, lim in _particoes(cursor) if lim), default=None)
+
+    inicio = date.today().replace(day=1)
+    criadas = []
+    for n in range(meses_a_frente + 1):
+        mes = _somar_meses(inicio, n)
+        if cobertos_ate and mes < cobertos_ate:
+            continue
+        nome = 'access_log_{:%Y%m}'.format(mes)
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {nome} PARTITION OF access_log "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            (mes.isoformat(), _somar_meses(mes, 1).isoformat()),
+        )
+        criadas.append(nome)
+    return criadas
+
+
+def converter_legado(conn):
+    """
+    Transforma a access_log comum em particao 'access_log_legado' da nova
+    tabela particionada, sem copiar linhas (scripts/migrar_access_log_particionada.py).
+
+    As etapas pesadas rodam antes da troca, sem bloquear as escritas:
+    CHECK NOT VALID + VALIDATE (o ATTACH nao precisa varrer a tabela) e o
+    indice unico (id, dt_acesso) da PK nova por CREATE INDEX CONCURRENTLY
+    (o ATTACH o reaproveita). A troca em si (RENAME, tabela nova, ATTACH)
+    so mexe em catalogo. Os indices antigos sao renomeados e reaproveitados,
+    a sequence de id passa para a tabela nova. Retorna o limite superior
+    da particao legado.
+    """
+    cursor = conn.cursor()
+    if _particionada(cursor):
+        return None
+    # Limite: mes seguinte ao da ultima linha; com folga de um dia para a
+    # virada de mes nao barrar escritas durante a migracao
+    cursor.execute("""
+        SELECT date_trunc('month', GREATEST(MAX(dt_acesso), NOW() + INTERVAL '1 day'))
+               + INTERVAL '1 month'
+        FROM access_log
+    """)
+    limite = cursor.fetchone()[0].date()
+    # Execucao anterior interrompida: refaz o CHECK com o limite de agora
+    cursor.execute("ALTER TABLE access_log DROP CONSTRAINT IF EXISTS access_log_legado_limite")
+    cursor.execute(
+        "ALTER TABLE access_log ADD CONSTRAINT access_log_legado_limite "
+        "CHECK (dt_acesso IS NOT NULL AND dt_acesso < %s) NOT VALID", (limite.isoformat(),))
+    conn.commit()
+    logger.info('[access_log] validando limite da particao legado (%s)...', limite)
+    cursor.execute("ALTER TABLE access_log VALIDATE CONSTRAINT access_log_legado_limite")
+    conn.commit()
+
+    logger.info('[access_log] criando indice (id, dt_acesso) da particao legado...')
+    conn.autocommit = True
+    try:
+        cursor.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS access_log_id_dt_key "
+                       "ON access_log (id, dt_acesso)")
+    finally:
+        conn.autocommit = False
+
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_LOCK_MIGRACAO,))
+    if _particionada(cursor):
+        conn.rollback()
+        return None
+    cursor.execute("SELECT pg_get_serial_sequence('access_log', 'id')")
+    sequencia = cursor.fetchone()[0] or 'access_log_id_seq'
+    cursor.execute(f"ALTER TABLE access_log RENAME TO {PARTICAO_LEGADO}")
+    cursor.execute("""
+        DO $$
+        DECLARE r record;
+        BEGIN
+            FOR r IN SELECT indexname FROM pg_indexes
+                     WHERE schemaname = current_schema() AND tablename = 'access_log_legado'
+            LOOP
+                EXECUTE format('ALTER INDEX %I RENAME TO %I', r.indexname, 'legado_' || r.indexname);
+            END LOOP;
+        END $$
+    """)
+    cursor.execute(_DDL_ACCESS_LOG, (sequencia,))
+    cursor.execute(f"ALTER SEQUENCE {sequencia} OWNED BY access_log.id")
+    cursor.execute(f"ALTER TABLE {PARTICAO_LEGADO} ALTER COLUMN id DROP DEFAULT")
+    cursor.execute(
+        f"ALTER TABLE access_log ATTACH PARTITION {PARTICAO_LEGADO} "
+        "FOR VALUES FROM (MINVALUE) TO (%s)", (limite.isoformat(),))
+    for ddl in _DDL_INDICES:
+        cursor.execute(ddl)
+    garantir_particoes(cursor)
+    conn.commit()
+    cursor.close()
+    logger.info('[access_log] tabela convertida para particionada (legado ate %s)', limite)
+    return limite
+
+
+def recalcular_rollups(conn):
+    """
+    Refaz os rollups dos periodos ja fechados a partir das linhas brutas
+    (hora: ultimos ROLLUP_HORA_DIAS dias; dia: toda a tabela). A hora/dia
+    corrente fica com o que o escritor ja acumulou. Uso: script de migracao.
+    """
+    cursor = conn.cursor()
+    for tabela, coluna, bucket, corte, filtro in (
+            ('access_log_hora', 'hora', "date_trunc('hour', dt_acesso)", "date_trunc('hour', NOW())",
+             f"AND dt_acesso >= NOW() - INTERVAL '{ROLLUP_HORA_DIAS} days'"),
+            ('access_log_dia', 'dia', 'dt_acesso::date', 'CURRENT_DATE', '')):
+        cursor.execute(f"DELETE FROM {tabela} WHERE {coluna} < {corte}")
+        cursor.execute(f"""
+            INSERT INTO {tabela}
+                ({coluna}, painel_codigo, ip, tipo_acesso, painel_nome, acessos, ultimo_acesso)
+            SELECT {bucket}, COALESCE(painel_codigo, ''), ip, COALESCE(tipo_acesso, ''),
+                   MAX(painel_nome), COUNT(*), MAX(dt_acesso)
+            FROM access_log
+            WHERE dt_acesso < {corte} {filtro}
+            GROUP BY 1, 2, 3, 4
+        """)
+        logger.info('[access_log] rollup %s preenchido: %d linhas', tabela, cursor.rowcount)
+        conn.commit()
+    cursor.close()
+
+
+def init_access_log(conn) -> bool:
+    """
+    Cria access_log (particionada) e rollups (chamado por init_db). Cada
+    etapa tem o proprio commit: falha no particionamento nao impede os
+    rollups. Tabela antiga nao particionada continua funcionando (retencao
+    por DELETE) ate o script de migracao rodar — nada pesado no boot.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(_DDL_ROLLUPS)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f'[access_log] erro ao criar rollups: {e}')
+        return False
+
+    try:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_LOCK_MIGRACAO,))
+        cursor.execute("SELECT to_regclass('access_log') IS NOT NULL")
+        existe = cursor.fetchone()[0]
+        if not existe:
+            cursor.execute("CREATE SEQUENCE IF NOT EXISTS access_log_id_seq")
+            cursor.execute(_DDL_ACCESS_LOG, ('access_log_id_seq',))
+            cursor.execute("ALTER SEQUENCE access_log_id_seq OWNED BY access_log.id")
+        if existe and not _particionada(cursor):
+            logger.warning('[access_log] tabela ainda nao particionada: rode '
+                           'scripts/migrar_access_log_particionada.py (estatisticas '
+                           'dos rollups so cobrem os acessos a partir de agora)')
+        else:
+            for ddl in _DDL_INDICES:
+                cursor.execute(ddl)
+            garantir_particoes(cursor)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f'[access_log] particionamento nao aplicado: {e}')
+
+    # Trigram para ILIKE bilateral no historico (opcional)
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_access_log_descricao_gin
+                ON access_log USING GIN (descricao gin_trgm_ops)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_access_log_usuario_gin
+                ON access_log USING GIN (usuario_nome gin_trgm_ops)
+        """)
+        conn.commit()
+    except Exception:
+        conn.rollback()  # pg_trgm pode não estar disponível — sem impacto funcional
+    cursor.close()
+    return True
+
+
+# =========================================================
+# RETENCAO
+# =========================================================
+
+def aplicar_retencao(conn) -> dict:
+    """
+    Remove particoes inteiras mais antigas que ACCESS_LOG_RETENCAO_MESES e
+    poda os rollups. Garante tambem as particoes dos proximos meses.
+
+    Retorna {'particoes': [...], 'linhas_estimadas': n, 'criadas': [...]}.
+    A particao legado (limite no mes seguinte a migracao) leva DELETE por
+    linha ate sair inteira da retencao. Sem particionamento (migracao
+    ainda nao rodou) cai no DELETE antigo.
+    """
+    corte = _somar_meses(date.today().replace(day=1), -ACCESS_LOG_RETENCAO_MESES)
+    resultado = {'particoes': [], 'linhas_estimadas': 0, 'criadas': []}
+    cursor = conn.cursor()
+    try:
+        if _particionada(cursor):
+            resultado['criadas'] = garantir_particoes(cursor)
+            for nome, limite in _particoes(cursor):
+                if nome == PARTICAO_LEGADO and (limite is None or limite > corte):
+                    cursor.execute(f"DELETE FROM {nome} WHERE dt_acesso < %s", (corte.isoformat(),))
+                    resultado['linhas_estimadas'] += cursor.rowcount
+                    continue
+                if limite is None or limite > corte:
+                    continue
+                cursor.execute("SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE relname = %s",
+                               (nome,))
+                resultado['linhas_estimadas'] += cursor.fetchone()[0]
+                cursor.execute(f"ALTER TABLE access_log DETACH PARTITION {nome}")
+                cursor.execute(f"DROP TABLE {nome}")
+                resultado['particoes'].append(nome)
+        else:
+            cursor.execute("DELETE FROM access_log WHERE dt_acesso < %s", (corte.isoformat(),))
+            resultado['linhas_estimadas'] = cursor.rowcount
+
+        cursor.execute("DELETE FROM access_log_hora WHERE hora < NOW() - %s * INTERVAL '1 day'",
+                       (ROLLUP_HORA_DIAS,))
+        cursor.execute("DELETE FROM access_log_dia WHERE dia < CURRENT_DATE - %s * INTERVAL '1 month'",
+                       (ROLLUP_DIA_MESES,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    if resultado['particoes']:
+        logger.info('[access_log] retencao: particoes removidas %s', resultado['particoes'])
+    return resultado
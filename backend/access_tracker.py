@@ -9,20 +9,24 @@ Responsabilidades:
   4. Resolução lazy de hostname — DNS com cache 24h e timeout de 1,5s por IP
 
 Princípio: não atrasar NENHUMA requisição. Escritas no banco são
-assíncronas (thread daemon). Resolução DNS só ocorre na consulta admin.
+assíncronas e em lote (fila limitada + uma thread escritora; fila cheia
+descarta e conta). Resolução DNS só ocorre na consulta admin.
 """
 
 import os
 import re
 import time
+import queue
 import socket
 import threading
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
 
 from flask import request as flask_request, session as flask_session, g
 
+from backend.access_log_store import INSERT_LOTE, aplicar_retencao
+
 logger = logging.getLogger(__name__)
 
 # ─────────────────────────────────────────────────────────
@@ -151,9 +155,11 @@ ATIVO_SEGUNDOS       = 120    # < 2 min = ativo (verde)
 RECENTE_SEGUNDOS     = 600    # < 10 min = recente (amarelo)
 HOSTNAME_CACHE_TTL   = 86400  # 24h
 
-# Pool de threads para escritas assíncronas no banco
-# (substitui criação de thread por requisição — limita a 2 threads concorrentes)
-_write_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='access_w')
+# Escrita em lote no access_log: fila limitada drenada por UMA thread, que
+# grava a cada ACCESS_LOG_BATCH linhas ou ACCESS_LOG_FLUSH_MS (o que vier antes)
+ACCESS_LOG_QUEUE_MAX = int(os.getenv('ACCESS_LOG_QUEUE_MAX', '5000'))
+ACCESS_LOG_BATCH     = int(os.getenv('ACCESS_LOG_BATCH', '200'))
+ACCESS_LOG_FLUSH_MS  = int(os.getenv('ACCESS_LOG_FLUSH_MS', '2000'))
 
 # Paths completamente ignorados
 _IGNORAR = (
@@ -311,43 +317,160 @@ def _atualizar_sessao(ip: str, painel_codigo, usuario_id, usuario_nome: str) ->
 # ESCRITA ASSÍNCRONA NO BANCO
 # ─────────────────────────────────────────────────────────
 
+_fila_log: queue.Queue = queue.Queue(maxsize=ACCESS_LOG_QUEUE_MAX)
+_escritor_lock   = threading.Lock()
+_escritor_parar  = threading.Event()
+_escritor_thread = None
+
+_log_stats = {
+    'enfileirados': 0,   # linhas aceitas na fila
+    'gravados':     0,   # linhas confirmadas no banco
+    'lotes':        0,   # transacoes (1 por lote)
+    'descartados':  0,   # fila cheia — requisicao nao espera pelo banco
+    'perdidos':     0,   # lote que falhou ao gravar
+    'fila_pico':    0,
+    'ultimo_lote_ms': None,
+}
+_log_stats_lock = threading.Lock()
+
 def _write_log_async(ip, painel_codigo, painel_nome, endpoint,
                      descricao, metodo, status_code, duracao_ms,
                      usuario_id, usuario_nome, tipo_acesso) -> None:
-    """Grava no access_log via pool de threads — não bloqueia a resposta HTTP."""
-    def _write():
-        conn = None
+    """Enfileira a linha para o escritor em lote — não bloqueia a resposta HTTP."""
+    if _escritor_parar.is_set():
+        return
+    linha = (datetime.now(timezone.utc), ip, painel_codigo, painel_nome,
+             (endpoint or '')[:300], descricao, metodo, status_code, duracao_ms,
+             usuario_id, usuario_nome, tipo_acesso)
+    try:
+        _fila_log.put_nowait(linha)
+    except queue.Full:
+        with _log_stats_lock:
+            _log_stats['descartados'] += 1
+        return
+    with _log_stats_lock:
+        _log_stats['enfileirados'] += 1
+        _log_stats['fila_pico'] = max(_log_stats['fila_pico'], _fila_log.qsize())
+    _garantir_escritor()
+
+
+def _garantir_escritor() -> None:
+    """Inicia a thread escritora na primeira linha (após o fork do worker)."""
+    global _escritor_thread
+    if _escritor_thread is not None and _escritor_thread.is_alive():
+        return
+    with _escritor_lock:
+        if _escritor_thread is not None and _escritor_thread.is_alive():
+            return
+        if _escritor_parar.is_set():
+            return
+        _escritor_thread = threading.Thread(
+            target=_escritor_loop, name='access_log_writer', daemon=True)
+        _escritor_thread.start()
+
+
+def _coletar_lote() -> list:
+    """Espera a primeira linha e junta as seguintes até o lote encher ou o prazo vencer."""
+    intervalo = ACCESS_LOG_FLUSH_MS / 1000
+    try:
+        primeira = _fila_log.get(timeout=intervalo)
+    except queue.Empty:
+        return []
+    lote = [primeira] if primeira is not None else []
+    prazo = time.monotonic() + intervalo
+    while len(lote) < ACCESS_LOG_BATCH:
+        restante = prazo - time.monotonic()
+        try:
+            # Parando: drena o que já está na fila sem esperar o prazo
+            if _escritor_parar.is_set() or restante <= 0:
+                item = _fila_log.get_nowait()
+            else:
+                item = _fila_log.get(timeout=restante)
+        except queue.Empty:
+            break
+        if item is not None:
+            lote.append(item)
+    return lote
+
+
+def _gravar_lote(lote: list) -> bool:
+    """Grava o lote (linhas brutas + rollups) numa instrução e um único commit."""
+    conn = None
+    t0 = time.monotonic()
+    try:
+        from psycopg2.extras import execute_values
+        from backend.database import get_db_connection, release_connection
+        conn = get_db_connection()
+        if not conn:
+            raise ConnectionError('sem conexão com o banco')
+        cur = conn.cursor()
+        execute_values(cur, INSERT_LOTE, lote, page_size=len(lote))
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        if conn:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        with _log_stats_lock:
+            _log_stats['perdidos'] += len(lote)
+        logger.warning('[access_tracker] lote de %d linhas não gravado: %s', len(lote), e)
+        return False
+    finally:
+        if conn:
+            try:
+                release_connection(conn)
+            except Exception:
+                pass
+    with _log_stats_lock:
+        _log_stats['gravados'] += len(lote)
+        _log_stats['lotes'] += 1
+        _log_stats['ultimo_lote_ms'] = round((time.monotonic() - t0) * 1000, 1)
+    return True
+
+
+def _escritor_loop() -> None:
+    while True:
         try:
-            from backend.database import get_db_connection, release_connection
-            conn = get_db_connection()
-            if not conn:
-                return
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO access_log
-                    (ip, painel_codigo, painel_nome, endpoint, descricao,
-                     metodo, status_code, duracao_ms, usuario_id, usuario_nome, tipo_acesso)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-            """, (ip, painel_codigo, painel_nome,
-                  (endpoint or '')[:300],
-                  descricao, metodo, status_code, duracao_ms,
-                  usuario_id, usuario_nome, tipo_acesso))
-            conn.commit()
-            cur.close()
+            lote = _coletar_lote()
+            if lote:
+                _gravar_lote(lote)
+            elif _escritor_parar.is_set() and _fila_log.empty():
+                break
         except Exception as e:
-            logger.debug('[access_tracker] write failed: %s', e)
-        finally:
-            if conn:
-                try:
-                    release_connection(conn)
-                except Exception:
-                    pass
+            logger.debug('[access_tracker] writer error: %s', e)
 
+
+def parar_escritor_log(timeout: float = 5.0) -> int:
+    """
+    Grava o que resta na fila e encerra o escritor (shutdown do worker).
+    Idempotente. Retorna quantas linhas ficaram sem gravar.
+    """
+    _escritor_parar.set()
     try:
-        _write_pool.submit(_write)
-    except RuntimeError:
-        # Pool shutdown — ignorar silenciosamente
+        _fila_log.put_nowait(None)   # acorda o escritor parado no get()
+    except queue.Full:
         pass
+    t = _escritor_thread
+    if t is not None and t.is_alive() and t is not threading.current_thread():
+        t.join(timeout)
+    restantes = sum(1 for item in list(_fila_log.queue) if item is not None)
+    if restantes:
+        logger.warning('[access_tracker] %d linhas de access_log não gravadas no shutdown', restantes)
+    return restantes
+
+
+def access_log_stats() -> dict:
+    """Contadores do escritor em lote (fila, lotes, descartes)."""
+    with _log_stats_lock:
+        stats = dict(_log_stats)
+    stats['fila'] = _fila_log.qsize()
+    stats['fila_max'] = ACCESS_LOG_QUEUE_MAX
+    stats['lote_max'] = ACCESS_LOG_BATCH
+    stats['flush_ms'] = ACCESS_LOG_FLUSH_MS
+    stats['escritor_ativo'] = bool(_escritor_thread and _escritor_thread.is_alive())
+    return stats
 
 
 # ─────────────────────────────────────────────────────────
@@ -547,37 +670,43 @@ def _cleanup_hostname_cache() -> int:
     return len(expired)
 
 
-def _cleanup_access_log() -> int:
-    """Remove registros do access_log com mais de 6 meses."""
+def _retencao_access_log():
+    """Retenção de 6 meses: descarta partições antigas e poda os rollups."""
+    from backend.database import get_db_connection, release_connection
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError('sem conexão com o banco')
     try:
-        from backend.database import get_db_connection, release_connection
-        conn = get_db_connection()
-        if not conn:
-            return 0
-        try:
-            cur = conn.cursor()
-            cur.execute("""
-                DELETE FROM access_log
-                WHERE dt_acesso < NOW() - INTERVAL '6 months'
-            """)
-            deleted = cur.rowcount
-            conn.commit()
-            cur.close()
-            return deleted
-        except Exception:
-            conn.rollback()
-            return 0
-        finally:
-            release_connection(conn)
-    except Exception:
-        return 0
+        resultado = aplicar_retencao(conn)
+    finally:
+        release_connection(conn)
+    logger.info('[access_tracker] retenção: %d linhas removidas, partições criadas %s',
+                resultado['linhas_estimadas'], resultado['criadas'])
+
+
+_retencao_stop = threading.Event()
+
+
+def start_retencao_access_log():
+    """
+    Registra a retenção do access_log no agendador. Só no processo líder
+    (job_host): DETACH/DROP de partição pede ACCESS EXCLUSIVE em access_log,
+    não deve rodar em cada worker. Falhas ficam no log do agendador (ERROR)
+    e no histórico agendador_execucoes.
+    """
+    from backend.agendador import agendador, Horarios
+    _retencao_stop.clear()
+    agendador.registrar('access_log_retencao', _retencao_access_log,
+                        Horarios(['04:10']), parar=_retencao_stop)
+    return _retencao_stop
 
 
 def _periodic_cleanup():
     """
     Thread daemon que limpa dicts em memória a cada 30 minutos.
     Previne crescimento indefinido de _sessions, _throttle e _hostname_cache.
-    Também limpa registros antigos da tabela access_log (retenção de 6 meses).
+    A retenção do access_log roda no agendador do líder
+    (start_retencao_access_log).
     """
     while True:
         try:
@@ -585,12 +714,10 @@ def _periodic_cleanup():
             s = cleanup_old_sessions()
             t = _cleanup_throttle()
             h = _cleanup_hostname_cache()
-            a = _cleanup_access_log()
-            if s + t + h + a > 0:
+            if s + t + h > 0:
                 logger.debug(
-                    '[access_tracker] cleanup: %d sessions, %d throttle, '
-                    '%d hostnames, %d access_log removidos',
-                    s, t, h, a
+                    '[access_tracker] cleanup: %d sessions, %d throttle, %d hostnames removidos',
+                    s, t, h
                 )
         except Exception as e:
             logger.debug('[access_tracker] cleanup error: %s', e)
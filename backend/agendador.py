@@ -0,0 +1,501 @@
+"""
+Agendador Unico dos Jobs de Background
+Sistema de Paineis Hospitalares
+
+Os notificadores/workers registram seus ciclos aqui em vez de cada um
+manter a propria thread com schedule / _stop_event.wait:
+- Gatilhos: Intervalo(segundos), Horarios(['HH:MM', ...], dias_semana)
+  e UmaVez() (tarefa de inicializacao)
+- Uma thread despachante + pool fixo de AGENDADOR_THREADS threads: o
+  numero de threads nao cresce com o numero de jobs
+- max_concorrencia por job (padrao 1): disparo que vence com o ciclo
+  anterior ainda rodando e pulado e registrado como 'sobreposto'
+- jitter_seg: cada disparo atrasa ate jitter_seg aleatorios, para os
+  jobs nao baterem no banco no mesmo minuto
+- perdidos: disparo atrasado mais que AGENDADOR_TOLERANCIA_SEG (pool
+  ocupado, processo parado) e executado uma vez ('executar') ou pulado
+  ('pular'). Horarios com 'executar' tambem recupera, ao registrar, o
+  horario anterior que nenhum processo executou (troca de lider)
+- timeout_seg: threads Python nao podem ser interrompidas — ciclo que
+  passa do limite e avisado no log e termina com status 'timeout'
+- Historico em agendador_execucoes (previsto, inicio, fim, duracao,
+  status, erro), resumido em /api/health/jobs para todos os workers
+
+Parar um job: o Event passado em parar= (o _stop_event do modulo) —
+o despachante descarta o job; o ciclo em andamento termina normalmente.
+"""
+
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timedelta, time as dtime
+
+logger = logging.getLogger(__name__)
+
+# =========================================================
+# CONFIGURACAO
+# =========================================================
+
+AGENDADOR_THREADS        = int(os.getenv('AGENDADOR_THREADS', '4'))
+AGENDADOR_JITTER_SEG     = float(os.getenv('AGENDADOR_JITTER_SEG', '30'))
+AGENDADOR_TOLERANCIA_SEG = float(os.getenv('AGENDADOR_TOLERANCIA_SEG', '60'))
+AGENDADOR_RECUPERAR_SEG  = float(os.getenv('AGENDADOR_RECUPERAR_SEG', '7200'))
+AGENDADOR_TIMEOUT_SEG    = float(os.getenv('AGENDADOR_TIMEOUT_SEG', '3600'))
+AGENDADOR_HISTORICO      = os.getenv('AGENDADOR_HISTORICO', 'true').lower() == 'true'
+AGENDADOR_HISTORICO_DIAS = int(os.getenv('AGENDADOR_HISTORICO_DIAS', '30'))
+
+# Maior espera do despachante: vigia timeouts mesmo sem disparo proximo
+_TICK_SEG = 5.0
+
+_DDL = """
+    CREATE TABLE IF NOT EXISTS agendador_execucoes (
+        id           BIGSERIAL PRIMARY KEY,
+        job          VARCHAR(100) NOT NULL,
+        pid          INTEGER,
+        dt_previsto  TIMESTAMP,
+        dt_inicio    TIMESTAMP NOT NULL,
+        dt_fim       TIMESTAMP,
+        duracao_ms   INTEGER,
+        status       VARCHAR(20) NOT NULL,
+        erro         TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_agendador_execucoes_job
+        ON agendador_execucoes (job, dt_inicio DESC);
+"""
+
+_SQL_GRAVAR = """
+    INSERT INTO agendador_execucoes
+        (job, pid, dt_previsto, dt_inicio, dt_fim, duracao_ms, status, erro)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# Ultimo inicio de fato (ok/erro/timeout) — base da recuperacao de horario perdido
+_SQL_ULTIMO_INICIO = """
+    SELECT MAX(dt_inicio) FROM agendador_execucoes
+    WHERE job = %s AND status IN ('ok', 'erro', 'timeout')
+"""
+
+_SQL_ULTIMAS = """
+    SELECT DISTINCT ON (job) job, pid, dt_inicio, dt_fim, duracao_ms, status, erro
+    FROM agendador_execucoes
+    WHERE status IN ('ok', 'erro', 'timeout')
+    ORDER BY job, dt_inicio DESC
+"""
+
+_SQL_24H = """
+    SELECT job,
+           COUNT(*) FILTER (WHERE status IN ('ok', 'erro', 'timeout')) AS execucoes,
+           COUNT(*) FILTER (WHERE status = 'erro')       AS erros,
+           COUNT(*) FILTER (WHERE status = 'timeout')    AS timeouts,
+           COUNT(*) FILTER (WHERE status = 'sobreposto') AS sobrepostos,
+           COUNT(*) FILTER (WHERE status = 'perdido')    AS perdidos,
+           ROUND(AVG(duracao_ms))                        AS duracao_media_ms,
+           MAX(duracao_ms)                               AS duracao_max_ms
+    FROM agendador_execucoes
+    WHERE dt_inicio > NOW() - INTERVAL '24 hours'
+    GROUP BY job
+"""
+
+_SQL_LIMPEZA = """
+    DELETE FROM agendador_execucoes
+    WHERE dt_inicio < NOW() - %s * INTERVAL '1 day'
+"""
+
+
+# =========================================================
+# GATILHOS
+# =========================================================
+
+class Intervalo:
+    """A cada `segundos`, contados do disparo anterior."""
+
+    def __init__(self, segundos):
+        self.segundos = float(segundos)
+
+    def proximo(self, depois):
+        return depois + timedelta(seconds=self.segundos)
+
+    def anterior(self, agora):
+        return None
+
+    def __repr__(self):
+        return 'a cada {:g}s'.format(self.segundos)
+
+
+class Horarios:
+    """
+    Horarios fixos do dia ('HH:MM'), opcionalmente so em alguns dias da
+    semana (0 = segunda). `horarios` pode ser uma funcao — a configuracao
+    e relida a cada disparo. Horario invalido e ignorado.
+    """
+
+    def __init__(self, horarios, dias_semana=None):
+        self._horarios = horarios
+        self.dias_semana = set(dias_semana) if dias_semana is not None else None
+
+    def _lista(self):
+        brutos = self._horarios() if callable(self._horarios) else self._horarios
+        lista = []
+        for h in brutos or []:
+            try:
+                hora, minuto = map(int, str(h).split(':'))
+                lista.append(dtime(hora, minuto))
+            except ValueError:
+                continue
+        return lista
+
+    def _do_dia(self, dia):
+        if self.dias_semana is not None and dia.weekday() not in self.dias_semana:
+            return []
+        return [datetime.combine(dia, h) for h in self._lista()]
+
+    def proximo(self, depois):
+        for d in range(8):
+            candidatos = [c for c in self._do_dia(depois.date() + timedelta(days=d)) if c > depois]
+            if candidatos:
+                return min(candidatos)
+        return None
+
+    def anterior(self, agora):
+        for d in range(8):
+            candidatos = [c for c in self._do_dia(agora.date() - timedelta(days=d)) if c <= agora]
+            if candidatos:
+                return max(candidatos)
+        return None
+
+    def __repr__(self):
+        dias = '' if self.dias_semana is None else ' dias {}'.format(sorted(self.dias_semana))
+        return 'as {}{}'.format(','.join(h.strftime('%H:%M') for h in self._lista()), dias)
+
+
+class UmaVez:
+    """Dispara uma unica vez (use com imediato=True ou atraso_inicial)."""
+
+    def proximo(self, depois):
+        return None
+
+    def anterior(self, agora):
+        return None
+
+    def __repr__(self):
+        return 'uma vez'
+
+
+# =========================================================
+# JOB
+# =========================================================
+
+class Job:
+    """Um ciclo registrado e seu estado de execucao."""
+
+    def __init__(self, nome, funcao, gatilho, max_concorrencia=1, timeout_seg=None,
+                 jitter_seg=AGENDADOR_JITTER_SEG, perdidos='executar', imediato=False,
+                 atraso_inicial=0, parar=None):
+        if perdidos not in ('executar', 'pular'):
+            raise ValueError("perdidos deve ser 'executar' ou 'pular'")
+        self.nome = nome
+        self.funcao = funcao
+        self.gatilho = gatilho
+        self.max_concorrencia = max_concorrencia
+        # Ciclo de intervalo mais longo que o proprio intervalo ja e lento
+        self.timeout_seg = timeout_seg or getattr(gatilho, 'segundos', None) or AGENDADOR_TIMEOUT_SEG
+        self.jitter_seg = jitter_seg
+        self.perdidos = perdidos
+        self.imediato = imediato
+        self.atraso_inicial = atraso_inicial
+        self.parar = parar
+        self.previsto = None        # horario do gatilho (sem jitter)
+        self.proximo = None         # previsto + jitter
+        self.em_execucao = {}       # seq -> {'previsto', 'inicio', 't0', 'avisado'}
+        self.ultima = None          # ultima execucao concluida neste processo
+        self.contagem = {'ok': 0, 'erro': 0, 'timeout': 0, 'sobreposto': 0, 'perdido': 0}
+
+    def agendar(self, previsto):
+        self.previsto = previsto
+        self.proximo = None if previsto is None else \
+            previsto + timedelta(seconds=random.uniform(0, self.jitter_seg))
+
+
+# =========================================================
+# AGENDADOR
+# =========================================================
+
+class Agendador:
+    """
+    registrar(nome, funcao, gatilho, **opcoes) -> Job. Registrar de novo
+    com o mesmo nome substitui o job. O despachante e o pool sobem no
+    primeiro registro.
+    """
+
+    def __init__(self, threads=AGENDADOR_THREADS, relogio=datetime.now,
+                 historico=AGENDADOR_HISTORICO, conectar=None):
+        self._n_threads = threads
+        self._relogio = relogio
+        self._historico = historico
+        self._conectar = conectar
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._fila = queue.Queue()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._threads = []
+        self._seq = 0
+        self._tabela_ok = False
+
+    # ----------------------------------------------------- API
+
+    def registrar(self, nome, funcao, gatilho, **opcoes) -> Job:
+        job = Job(nome, funcao, gatilho, **opcoes)
+        agora = self._relogio()
+        if job.imediato or job.atraso_inicial:
+            previsto = agora + timedelta(seconds=job.atraso_inicial)
+        else:
+            previsto = gatilho.proximo(agora)
+            if self._perdeu_anterior(job, agora):
+                logger.info('[agendador] %s: recuperando horario perdido', nome)
+                previsto = agora
+        job.agendar(previsto)
+        with self._lock:
+            self._jobs[nome] = job
+        logger.info('[agendador] %s registrado (%r, proximo %s)', nome, gatilho,
+                    job.proximo.strftime('%d/%m %H:%M:%S') if job.proximo else '-')
+        self.iniciar()
+        self._acordar.set()
+        return job
+
+    def iniciar(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._parar.clear()
+            self._threads = [threading.Thread(target=self._loop, name='agendador', daemon=True)]
+            self._threads += [threading.Thread(target=self._trabalhar, name='agendador_{}'.format(i),
+                                               daemon=True)
+                              for i in range(self._n_threads)]
+            if self._historico:
+                limpeza = Job('agendador_limpeza', self.limpar_historico, Horarios(['03:30']))
+                limpeza.agendar(limpeza.gatilho.proximo(self._relogio()))
+                self._jobs.setdefault(limpeza.nome, limpeza)
+        for t in self._threads:
+            t.start()
+
+    def parar(self):
+        """Para o despachante e o pool (ciclos em andamento terminam sozinhos)."""
+        self._parar.set()
+        self._acordar.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads[1:]:
+            self._fila.put(None)
+
+    def ativo(self, nome) -> bool:
+        with self._lock:
+            return nome in self._jobs and bool(self._threads) and self._threads[0].is_alive()
+
+    def proximo(self, nome):
+        with self._lock:
+            job = self._jobs.get(nome)
+            return job.proximo if job else None
+
+    def estado(self) -> dict:
+        """Jobs deste processo: gatilho, proximo disparo, execucoes em andamento."""
+        agora_m = time.monotonic()
+        with self._lock:
+            jobs = {}
+            for nome, job in self._jobs.items():
+                jobs[nome] = {
+                    'gatilho': repr(job.gatilho),
+                    'proximo': job.proximo.isoformat() if job.proximo else None,
+                    'max_concorrencia': job.max_concorrencia,
+                    'timeout_seg': job.timeout_seg,
+                    'em_execucao': [round(agora_m - e['t0'], 1) for e in job.em_execucao.values()
+                                    if e['t0'] is not None],
+                    'na_fila': sum(1 for e in job.em_execucao.values() if e['t0'] is None),
+                    'ultima': job.ultima,
+                    'contagem': dict(job.contagem),
+                }
+            return {
+                'pid': os.getpid(),
+                'threads': self._n_threads,
+                'ativo': bool(self._threads) and self._threads[0].is_alive(),
+                'jobs': jobs,
+            }
+
+    # ----------------------------------------------------- despacho
+
+    def despachar(self) -> float:
+        """Dispara os jobs vencidos. Retorna quantos segundos esperar ate o proximo."""
+        agora = self._relogio()
+        espera = _TICK_SEG
+        pulados = []
+        with self._lock:
+            for nome, job in list(self._jobs.items()):
+                if job.parar is not None and job.parar.is_set():
+                    del self._jobs[nome]
+                    continue
+                self._vigiar(job)
+                if job.proximo is None:
+                    continue
+                if job.proximo > agora:
+                    espera = min(espera, (job.proximo - agora).total_seconds())
+                    continue
+
+                previsto = job.previsto
+                atraso = (agora - previsto).total_seconds() - job.jitter_seg
+                job.agendar(job.gatilho.proximo(agora))
+                if atraso > AGENDADOR_TOLERANCIA_SEG and job.perdidos == 'pular':
+                    pulados.append((job, previsto, 'perdido'))
+                elif len(job.em_execucao) >= job.max_concorrencia:
+                    pulados.append((job, previsto, 'sobreposto'))
+                else:
+                    self._seq += 1
+                    job.em_execucao[self._seq] = {'previsto': previsto, 'inicio': None,
+                                                  't0': None, 'avisado': False}
+                    self._fila.put((job, self._seq))
+
+        for job, previsto, status in pulados:
+            logger.warning('[agendador] %s: disparo de %s %s', job.nome,
+                           previsto.strftime('%d/%m %H:%M:%S'),
+                           'pulado (ciclo anterior em execucao)' if status == 'sobreposto'
+                           else 'perdido (atrasado)')
+            with self._lock:
+                job.contagem[status] += 1
+            self._gravar(job.nome, previsto, agora, None, None, status, None)
+        return max(0.05, espera)
+
+    def _vigiar(self, job):
+        """Avisa (uma vez) os ciclos que passaram do timeout."""
+        agora_m = time.monotonic()
+        for execucao in job.em_execucao.values():
+            if execucao['t0'] is not None and not execucao['avisado'] \
+                    and agora_m - execucao['t0'] > job.timeout_seg:
+                execucao['avisado'] = True
+                logger.warning('[agendador] %s: ciclo rodando ha mais de %ss', job.nome, job.timeout_seg)
+
+    def _loop(self):
+        while not self._parar.is_set():
+            try:
+                espera = self.despachar()
+            except Exception as e:
+                logger.error('[agendador] Erro no despachante: %s', e, exc_info=True)
+                espera = _TICK_SEG
+            self._acordar.wait(espera)
+            self._acordar.clear()
+
+    def _trabalhar(self):
+        while True:
+            item = self._fila.get()
+            if item is None:
+                return
+            self.executar(*item)
+
+    def executar(self, job, seq):
+        """Roda um ciclo do job (numa thread do pool) e registra o resultado."""
+        with self._lock:
+            execucao = job.em_execucao[seq]
+            execucao['inicio'] = self._relogio()
+            execucao['t0'] = time.monotonic()
+        status, erro = 'ok', None
+        try:
+            job.funcao()
+        except Exception as e:
+            status, erro = 'erro', str(e)
+            logger.error('[agendador] %s falhou: %s', job.nome, e, exc_info=True)
+        duracao = time.monotonic() - execucao['t0']
+        if status == 'ok' and duracao > job.timeout_seg:
+            status = 'timeout'
+        fim = self._relogio()
+        with self._lock:
+            job.em_execucao.pop(seq, None)
+            job.contagem[status] += 1
+            job.ultima = {'inicio': execucao['inicio'].isoformat(), 'duracao_seg': round(duracao, 1),
+                          'status': status, 'erro': erro}
+        self._gravar(job.nome, execucao['previsto'], execucao['inicio'], fim,
+                     int(duracao * 1000), status, erro)
+        self._acordar.set()
+
+    # ----------------------------------------------------- historico
+
+    def _conexao(self):
+        if self._conectar is not None:
+            return self._conectar()
+        from backend.database import get_db_connection
+        return get_db_connection()
+
+    def _sql(self, sql, params, retorna=False):
+        """Executa no banco; None em erro ou sem historico (nunca derruba o job)."""
+        if not self._historico:
+            return None
+        conn = None
+        try:
+            conn = self._conexao()
+            if conn is None:
+                return None
+            cur = conn.cursor()
+            if not self._tabela_ok:
+                cur.execute(_DDL)
+                self._tabela_ok = True
+            cur.execute(sql, params)
+            resultado = cur.fetchone() if retorna else cur.rowcount
+            cur.close()
+            conn.commit()
+            return resultado
+        except Exception as e:
+            logger.debug('[agendador] Historico indisponivel: %s', e)
+            return None
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+    def _gravar(self, nome, previsto, inicio, fim, duracao_ms, status, erro):
+        self._sql(_SQL_GRAVAR, (nome, os.getpid(), previsto, inicio, fim, duracao_ms, status,
+                                erro[:2000] if erro else None))
+
+    def _perdeu_anterior(self, job, agora) -> bool:
+        """
+        Horario anterior dentro de AGENDADOR_RECUPERAR_SEG sem execucao
+        registrada depois dele (so com historico; job novo nao recupera).
+        """
+        if job.perdidos != 'executar':
+            return False
+        anterior = job.gatilho.anterior(agora)
+        if anterior is None or (agora - anterior).total_seconds() > AGENDADOR_RECUPERAR_SEG:
+            return False
+        linha = self._sql(_SQL_ULTIMO_INICIO, (job.nome,), retorna=True)
+        return bool(linha and linha[0] is not None and linha[0] < anterior)
+
+    def limpar_historico(self):
+        removidos = self._sql(_SQL_LIMPEZA, (AGENDADOR_HISTORICO_DIAS,))
+        if removidos:
+            logger.info('[agendador] Historico: %s execucoes antigas removidas', removidos)
+
+
+def historico_execucoes() -> dict:
+    """
+    Ultima execucao e totais das ultimas 24h por job, lidos da tabela —
+    iguais em qualquer worker, nao so no lider.
+    """
+    from backend.database import get_db_cursor
+    try:
+        with get_db_cursor() as cursor:
+            cursor.execute(_SQL_ULTIMAS)
+            ultimas = cursor.fetchall()
+            cursor.execute(_SQL_24H)
+            totais = {row['job']: row for row in cursor.fetchall()}
+    except Exception as e:
+        return {'erro': str(e)}
+    resultado = {}
+    for row in ultimas:
+        resultado[row['job']] = {'ultima': dict(row), 'ultimas_24h': dict(totais.get(row['job']) or {})}
+    for job, row in totais.items():
+        resultado.setdefault(job, {'ultima': None, 'ultimas_24h': dict(row)})
+    return resultado
+
+
+agendador = Agendador()
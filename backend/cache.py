@@ -4,30 +4,232 @@ Sistema de Paineis Hospitalares
 
 Funcionalidades:
 - Conexao Redis com fallback gracioso (app nunca quebra sem Redis)
+- Cache L1 em memoria (LRU com TTL e orcamento de bytes) na frente do Redis
 - Decorator @cache_route para endpoints Flask
+- Single-flight no miss: uma unica thread/worker recalcula cada chave
+- Stale-while-revalidate (stale_ttl) com recalculo em background
+- Refresher proativo que reaquece as chaves compartilhadas mais acessadas
+- Registro dos endpoints cacheados e geracoes de carga por tabela (ETL)
+- Notificacao de mudanca de conteudo (alimenta o canal SSE dos paineis)
+- Corpo guardado comprimido (gzip/zstd) e servido com Content-Encoding
+- Metricas por key_prefix (hit/miss/stale, tempo de recalculo, tamanho)
+- Chave por parametro de URL e tags de dependencia (cache_invalidate_tags),
+  com a invalidacao avisada ao L1 dos outros workers via pub/sub
 - cache_get / cache_set / cache_delete / cache_delete_pattern
 - cache_health para endpoint de health check
 
 Principio fundamental: se o Redis estiver indisponivel,
-o sistema funciona normalmente — busca direto no banco.
+o sistema funciona normalmente — o L1 continua servindo e, no miss,
+busca direto no banco.
 """
 
 import redis
 import json
 import logging
 import functools
+import fnmatch
+import gzip
+import hashlib
+import os
+import re
+import threading
 import time
+from collections import OrderedDict
 
-from flask import jsonify
+from backend.metrics import Histogram
+
+try:
+    import orjson as _orjson
+    _ORJSON_OK = True
+    # Mesmo resultado do json.dumps(default=str): datetime/dataclass passam pelo default
+    _ORJSON_CACHE_OPTS = (_orjson.OPT_NON_STR_KEYS | _orjson.OPT_PASSTHROUGH_DATETIME
+                          | _orjson.OPT_PASSTHROUGH_DATACLASS)
+except ImportError:
+    _orjson = None
+    _ORJSON_OK = False
+
+try:
+    import zstandard as _zstd
+    _ZSTD_OK = True
+except ImportError:
+    _zstd = None
+    _ZSTD_OK = False
 
 logger = logging.getLogger(__name__)
 
 # Cliente Redis global — None enquanto nao inicializado ou indisponivel
 _redis_client = None
+# Cliente binario (decode_responses=False) para os corpos comprimidos do
+# cache_route. Mesmo servidor; usado apenas se _redis_client estiver ativo.
+_redis_bin = None
 
 # Contador de fallbacks (P1.4): exposto no health check para detectar degradação
 _fallback_count = 0
 
+# Cache L1 (por processo). As threads de um worker compartilham o mesmo L1;
+# com GUNICORN_WORKERS > 1 cada worker tem o seu (invalidacao por tag e
+# avisada aos demais via pub/sub do Redis). CACHE_L1_MAX_MB limita a
+# memoria; CACHE_L1_MAX_ITEMS o numero de chaves.
+CACHE_L1_ENABLED   = os.getenv('CACHE_L1_ENABLED', 'true').lower() == 'true'
+CACHE_L1_MAX_ITEMS = int(os.getenv('CACHE_L1_MAX_ITEMS', '2000'))
+CACHE_L1_MAX_BYTES = int(os.getenv('CACHE_L1_MAX_MB', '64')) * 1024 * 1024
+
+# Single-flight: tempo maximo que uma requisicao espera pelo calculo de outra
+# (mesma chave) antes de executar o handler por conta propria.
+CACHE_SINGLEFLIGHT_WAIT = float(os.getenv('CACHE_SINGLEFLIGHT_WAIT', '15'))
+# Lock Redis entre workers: expira sozinho se o worker que calcula morrer.
+CACHE_LOCK_TTL_MS = int(os.getenv('CACHE_LOCK_TTL_MS', '30000'))
+
+# Recalculo em background (stale-while-revalidate e refresher proativo)
+CACHE_REFRESH_WORKERS = int(os.getenv('CACHE_REFRESH_WORKERS', '2'))
+# Refresher proativo: OFF por padrao. Reaquece chaves vary_by_user=False
+# acessadas recentemente quando faltam CACHE_REFRESH_AHEAD segundos para expirar.
+CACHE_PROACTIVE_REFRESH  = os.getenv('CACHE_PROACTIVE_REFRESH', 'false').lower() == 'true'
+CACHE_REFRESH_INTERVAL   = int(os.getenv('CACHE_REFRESH_INTERVAL', '5'))
+CACHE_REFRESH_AHEAD      = int(os.getenv('CACHE_REFRESH_AHEAD', '15'))
+CACHE_REFRESH_TOP_N      = int(os.getenv('CACHE_REFRESH_TOP_N', '20'))
+
+# Geracoes de carga por tabela (ETL): espelho local sincronizado com o Redis
+# a cada CACHE_GEN_SYNC_INTERVAL segundos.
+CACHE_GEN_SYNC_INTERVAL = float(os.getenv('CACHE_GEN_SYNC_INTERVAL', '1'))
+_GEN_HASH = 'cache:geracoes'
+# Variantes (path + query string) lembradas por endpoint para o refresh do ETL
+_MAX_VARIANTS = 32
+
+# Deteccao de mudanca de conteudo: ignora o campo "timestamp" que quase todo
+# endpoint devolve com datetime.now() — senao todo recalculo pareceria mudanca.
+_MAX_DIGESTS = 4096
+_VOLATIL_RE = re.compile(rb'"timestamp":\s*"[^"]*"')
+
+# Compressao dos corpos do cache_route (L1 e Redis guardam o corpo comprimido;
+# a resposta sai com Content-Encoding se o cliente aceitar). zstd exige o
+# pacote zstandard — sem ele, cai para gzip.
+CACHE_COMPRESSION        = os.getenv('CACHE_COMPRESSION', 'gzip').lower()   # gzip | zstd | none
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv('CACHE_COMPRESS_MIN_BYTES', '1024'))
+CACHE_GZIP_LEVEL         = int(os.getenv('CACHE_GZIP_LEVEL', '6'))
+CACHE_ZSTD_LEVEL         = int(os.getenv('CACHE_ZSTD_LEVEL', '3'))
+
+
+# =========================================================
+# CACHE L1 — LRU EM MEMORIA
+# =========================================================
+
+class _LocalCache:
+    """
+    LRU thread-safe com TTL por entrada e orcamento total de bytes.
+
+    Guarda o corpo JSON ja serializado (bytes) de cada resposta: um HIT
+    e apenas um lookup no dict, sem json.loads nem jsonify.
+
+    Entradas expiradas nao sao removidas no get(): continuam disponiveis
+    via peek() ate serem despejadas pelo LRU, e via get_stale() ate o fim
+    da janela stale_ttl, servindo de copia "velha" enquanto a chave e
+    recalculada (no proprio worker ou em outro).
+    """
+
+    def __init__(self, max_items: int, max_bytes: int):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()   # key -> (expires_at, stale_until, body)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, _, body = entry
+            if expires_at <= now:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def peek(self, key: str):
+        """Retorna (body, expires_at, stale_until) sem afetar LRU nem contadores."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, stale_until, body = entry
+            return body, expires_at, stale_until
+
+    def get_stale(self, key: str):
+        """
+        Retorna o corpo mesmo se expirado, enquanto dentro da janela
+        stale_until (None se ja despejado ou velho demais).
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= now:
+                return None
+            return entry[2]
+
+    def set(self, key: str, body: bytes, ttl: float, stale_ttl: float = 0):
+        size = len(body)
+        if ttl + stale_ttl <= 0 or size > self.max_bytes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (now + ttl, now + ttl + stale_ttl, body)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_items or self._bytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key: str) -> int:
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+                return 1
+            return 0
+
+    def delete_pattern(self, pattern: str) -> int:
+        with self._lock:
+            keys = [k for k in self._data if fnmatch.fnmatchcase(k, pattern)]
+            for k in keys:
+                self._remove(k)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': CACHE_L1_ENABLED,
+                'keys': len(self._data),
+                'bytes': self._bytes,
+                'max_items': self.max_items,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate_pct': round(self.hits / total * 100, 1) if total else 0,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, key: str):
+        # Chamado sempre com self._lock adquirido
+        body = self._data.pop(key)[2]
+        self._bytes -= len(body)
+
+
+_l1 = _LocalCache(CACHE_L1_MAX_ITEMS, CACHE_L1_MAX_BYTES)
+
 
 # =========================================================
 # INICIALIZACAO
@@ -42,7 +244,7 @@ def init_redis(app):
     o _redis_client permanece None e o cache fica desabilitado
     sem impactar o funcionamento do sistema.
     """
-    global _redis_client
+    global _redis_client, _redis_bin
 
     if not app.config.get('CACHE_ENABLED', True):
         app.logger.info('Cache Redis desabilitado por configuracao (CACHE_ENABLED=false)')
@@ -59,6 +261,11 @@ def init_redis(app):
         )
         client.ping()
         _redis_client = client
+        _redis_bin = redis.Redis.from_url(
+            redis_url,
+            socket_connect_timeout=2,
+            socket_timeout=2,
+        )
         app.logger.info(f'Redis conectado com sucesso: {redis_url}')
 
         # Aplica limite de memória para evitar crescimento ilimitado.
@@ -78,6 +285,7 @@ def init_redis(app):
             'cache desabilitado, sistema funciona normalmente sem cache'
         )
         _redis_client = None
+        _redis_bin = None
 
 
 def get_redis():
@@ -98,22 +306,31 @@ def cache_get(key: str):
         return None
     try:
         value = _redis_client.get(key)
-        return json.loads(value) if value is not None else None
+        if value is None:
+            return None
+        return _orjson.loads(value) if _ORJSON_OK else json.loads(value)
     except Exception as e:
         logger.warning(f'Erro ao ler cache [{key}]: {e}')
         return None
 
 
-def cache_set(key: str, value, ttl: int = 120) -> bool:
+def cache_set(key: str, value, ttl: int = 120, tags=()) -> bool:
     """
     Salva um valor no cache com TTL em segundos.
     Serializa automaticamente para JSON (incluindo datetime via default=str).
+    Com tags, a chave entra no indice de cada tag (cache_invalidate_tags).
     Retorna True se salvou, False se Redis offline ou erro.
     """
     if _redis_client is None:
         return False
     try:
-        _redis_client.setex(key, ttl, json.dumps(value, default=str))
+        if _ORJSON_OK:
+            data = _orjson.dumps(value, default=str, option=_ORJSON_CACHE_OPTS)
+        else:
+            data = json.dumps(value, default=str)
+        _redis_client.setex(key, ttl, data)
+        if tags:
+            _index_tags(key, tags, ttl)
         return True
     except Exception as e:
         logger.warning(f'Erro ao salvar cache [{key}]: {e}')
@@ -121,7 +338,8 @@ def cache_set(key: str, value, ttl: int = 120) -> bool:
 
 
 def cache_delete(key: str):
-    """Remove uma chave especifica do cache."""
+    """Remove uma chave especifica do cache (L1 e Redis)."""
+    _l1.delete(key)
     if _redis_client is None:
         return
     try:
@@ -136,10 +354,11 @@ def cache_delete_pattern(pattern: str) -> int:
     Ex: cache_delete_pattern('painel4:*') remove todo o cache do painel4.
 
     Usa SCAN ao inves de KEYS para evitar bloqueio do Redis
-    em keyspaces grandes.
+    em keyspaces grandes. O L1 local e limpo com o mesmo pattern.
     """
+    removidos_l1 = _l1.delete_pattern(pattern)
     if _redis_client is None:
-        return 0
+        return removidos_l1
     try:
         deleted = 0
         cursor = '0'
@@ -159,79 +378,1137 @@ def cache_delete_pattern(pattern: str) -> int:
 # DECORATOR
 # =========================================================
 
+def _remaining_ttl(key: str, ttl: int, stale_ttl: int = 0) -> float:
+    """
+    Tempo de vida restante (fresco + janela stale) de uma chave no Redis.
+    Usado ao promover para o L1, que assim nunca serve alem da expiracao do L2.
+    """
+    try:
+        pttl = _redis_client.pttl(key)
+        if pttl is not None and pttl > 0:
+            return min(ttl + stale_ttl, pttl / 1000)
+    except Exception:
+        pass
+    return ttl + stale_ttl
+
+
+def _promote(key: str, body: bytes, ttl: int, stale_ttl: int = 0) -> bool:
+    """
+    Copia para o L1 um corpo lido do Redis. A chave no Redis vive
+    ttl + stale_ttl segundos: o que passar de stale_ttl ainda e fresco.
+    Retorna True se a entrada ainda esta fresca.
+    """
+    remaining = _remaining_ttl(key, ttl, stale_ttl)
+    fresh = remaining - stale_ttl
+    if CACHE_L1_ENABLED:
+        if fresh > 0:
+            _l1.set(key, body, fresh, stale_ttl)
+        else:
+            _l1.set(key, body, 0, remaining)
+    return fresh > 0
+
+
+# Formato do corpo guardado (L1 e Redis): 1 byte de codec + payload.
+# JSON nunca comeca com 'j', 'g' ou 'z' — valores sem prefixo (gravados
+# antes da compressao) sao lidos como JSON puro.
+_CODEC_RAW  = b'j'
+_CODEC_GZIP = b'g'
+_CODEC_ZSTD = b'z'
+_CONTENT_ENCODING = {_CODEC_GZIP: 'gzip', _CODEC_ZSTD: 'zstd'}
+
+
+def _encode(body: bytes) -> bytes:
+    """Comprime o corpo JSON se passar de CACHE_COMPRESS_MIN_BYTES."""
+    if len(body) >= CACHE_COMPRESS_MIN_BYTES:
+        if CACHE_COMPRESSION == 'zstd' and _ZSTD_OK:
+            return _CODEC_ZSTD + _zstd.ZstdCompressor(level=CACHE_ZSTD_LEVEL).compress(body)
+        if CACHE_COMPRESSION in ('gzip', 'zstd'):
+            return _CODEC_GZIP + gzip.compress(body, compresslevel=CACHE_GZIP_LEVEL, mtime=0)
+    return _CODEC_RAW + body
+
+
+def _decode(blob: bytes) -> bytes:
+    """Devolve o corpo JSON original de um valor guardado por _encode."""
+    codec, payload = blob[:1], blob[1:]
+    if codec == _CODEC_RAW:
+        return payload
+    if codec == _CODEC_GZIP:
+        return gzip.decompress(payload)
+    if codec == _CODEC_ZSTD:
+        return _zstd.ZstdDecompressor().decompress(payload)
+    return blob
+
+
+def _body_redis():
+    """Cliente para os corpos do cache_route (binario quando disponivel)."""
+    if _redis_client is None:
+        return None
+    return _redis_bin if _redis_bin is not None else _redis_client
+
+
+def _etag(blob: bytes) -> str:
+    """ETag forte: hash do valor guardado (identico para o mesmo corpo)."""
+    return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+
+def _conditional(response, blob: bytes, identity: bool = False):
+    """
+    Adiciona ETag e responde 304 Not Modified quando o If-None-Match da
+    requisicao casa com o corpo atual. O Cache-Control continua no-store
+    (security.py): quem guarda o ultimo corpo e o fetch do frontend.
+
+    identity=True: corpo comprimido no cache mas servido descomprimido —
+    outra representacao, entao outro ETag.
+    """
+    from flask import request as flask_request
+    etag = _etag(blob)
+    response.set_etag(etag + '-id' if identity else etag)
+    return response.make_conditional(flask_request)
+
+
+def _cached_response(blob: bytes, status: str):
+    """
+    Monta a resposta JSON direto dos bytes em cache (sem jsonify). Se o
+    corpo esta comprimido e o cliente aceita o encoding, envia como esta;
+    senao descomprime.
+    """
+    from flask import current_app, request as flask_request
+    encoding = _CONTENT_ENCODING.get(blob[:1])
+    if encoding and encoding in flask_request.accept_encodings:
+        response = current_app.response_class(blob[1:], mimetype='application/json')
+        response.headers['Content-Encoding'] = encoding
+        identity = False
+    else:
+        response = current_app.response_class(_decode(blob), mimetype='application/json')
+        identity = encoding is not None
+    if encoding:
+        response.vary.add('Accept-Encoding')
+    response.headers['X-Cache'] = status
+    return _conditional(response, blob, identity)
+
+
+def _lookup(cache_key: str, ttl: int, stale_ttl: int = 0):
+    """
+    Busca o corpo guardado no L1 e depois no Redis.
+
+    Returns:
+        (blob, fresh) — blob None se miss; fresh False se a entrada
+        esta na janela stale (serve, mas precisa ser recalculada).
+    """
+    if CACHE_L1_ENABLED:
+        blob = _l1.get(cache_key)
+        if blob is not None:
+            return blob, True
+
+    client = _body_redis()
+    if client is not None and not (_tombstones and _tombstoned(cache_key)):
+        try:
+            cached = client.get(cache_key)
+        except Exception as e:
+            logger.warning(f'Erro ao ler cache [{cache_key}]: {e}')
+            cached = None
+        if cached is not None:
+            blob = cached.encode('utf-8') if isinstance(cached, str) else cached
+            return blob, _promote(cache_key, blob, ttl, stale_ttl)
+
+    # Redis sem a chave (ou offline): ultima chance e a copia stale do L1
+    if stale_ttl and CACHE_L1_ENABLED:
+        entry = _l1.peek(cache_key)
+        if entry is not None and entry[2] > time.monotonic():
+            return entry[0], False
+
+    return None, False
+
+
+def _store(cache_key: str, body: bytes, ttl: int, stale_ttl: int = 0, tags=()) -> bytes:
+    """
+    Codifica o corpo e grava no L1 e no Redis (TTL fisico = ttl + stale_ttl),
+    registrando a chave no indice de cada tag. Retorna o valor guardado.
+    """
+    blob = _encode(body)
+    _tombstones.pop(cache_key, None)
+    if CACHE_L1_ENABLED and _l1_aceita(tags):
+        _l1.set(cache_key, blob, ttl, stale_ttl)
+    client = _body_redis()
+    if client is not None:
+        try:
+            client.setex(cache_key, ttl + stale_ttl, blob)
+        except Exception as e:
+            logger.warning(f'Erro ao salvar cache [{cache_key}]: {e}')
+    if tags:
+        _index_tags(cache_key, tags, ttl + stale_ttl)
+    _notify_change(cache_key, body)
+    return blob
+
+
+# =========================================================
+# NOTIFICACAO DE MUDANCA DE CONTEUDO
+# =========================================================
+
+_change_listeners = []
+_digests = OrderedDict()          # cache_key -> digest do ultimo corpo gravado
+_digests_lock = threading.Lock()
+
+
+def on_cache_change(callback):
+    """
+    Registra callback(cache_key) chamado quando um recalculo grava um corpo
+    diferente do anterior para a mesma chave. Usado pelo canal SSE.
+    """
+    if callback not in _change_listeners:
+        _change_listeners.append(callback)
+
+
+def _notify_change(cache_key: str, body: bytes):
+    if not _change_listeners:
+        return
+    digest = hashlib.blake2b(_VOLATIL_RE.sub(b'', body), digest_size=8).digest()
+    with _digests_lock:
+        anterior = _digests.get(cache_key)
+        _digests[cache_key] = digest
+        _digests.move_to_end(cache_key)
+        while len(_digests) > _MAX_DIGESTS:
+            _digests.popitem(last=False)
+    if anterior == digest:
+        return
+    for callback in list(_change_listeners):
+        try:
+            callback(cache_key)
+        except Exception as e:
+            logger.warning(f'Erro no listener de mudanca de cache [{cache_key}]: {e}')
+
+
+# =========================================================
+# TAGS DE DEPENDENCIA (invalidacao por entidade)
+# =========================================================
+
+_TAG_PREFIX = 'cache:tag:'
+_MAX_TAGS_LOCAL = 4096
+_tag_index = OrderedDict()        # tag -> set(cache_key) — espelho local (L1 / Redis offline)
+_tag_index_lock = threading.Lock()
+# Chaves invalidadas cuja remocao no Redis ainda esta na fila (-> expira em)
+CACHE_TOMBSTONE_SEC = 5
+_tombstones = {}
+_invalidate_pool = None
+_invalidate_pool_lock = threading.Lock()
+# Invalidacao entre processos: cada worker do gunicorn tem o seu L1. Quem
+# invalida publica as chaves/tags no canal; os outros processos as removem
+# do proprio L1. Sem Redis nao ha canal: com mais de um worker, entradas
+# com tag nao entram no L1 (seriam servidas velhas pelos outros workers).
+_MULTI_WORKER = int(os.getenv('GUNICORN_WORKERS', '1')) > 1
+CACHE_INVALIDACAO_PUBSUB = os.getenv(
+    'CACHE_INVALIDACAO_PUBSUB', 'true' if _MULTI_WORKER else 'false').lower() == 'true'
+_INVALIDATE_CHANNEL = 'cache:invalidar'
+_assinante_pid = None
+_assinante_lock = threading.Lock()
+
+# SADD + EXPIRE que nunca encurta o TTL do conjunto (entradas com TTLs diferentes)
+_TAG_ADD_SCRIPT = """
+redis.call('SADD', KEYS[1], ARGV[1])
+if redis.call('TTL', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+
+def _index_tags(cache_key: str, tags, ttl: int):
+    """Registra a chave no conjunto de cada tag (local e no Redis)."""
+    with _tag_index_lock:
+        for tag in tags:
+            chaves = _tag_index.get(tag)
+            if chaves is None:
+                chaves = _tag_index[tag] = set()
+            chaves.add(cache_key)
+            _tag_index.move_to_end(tag)
+        while len(_tag_index) > _MAX_TAGS_LOCAL:
+            _tag_index.popitem(last=False)
+
+    if _redis_client is None:
+        return
+    try:
+        pipe = _redis_client.pipeline(transaction=False)
+        for tag in tags:
+            pipe.eval(_TAG_ADD_SCRIPT, 1, _TAG_PREFIX + tag, cache_key, int(ttl))
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f'Erro ao indexar tags do cache [{cache_key}]: {e}')
+
+
+def _invalidate_local(tags) -> set:
+    """
+    Remove do L1 as chaves que este processo indexou nas tags e marca cada
+    uma com tombstone: ate o Redis ser limpo, _lookup nao promove de volta
+    a copia antiga (leitura logo apos a escrita ja ve o dado novo).
+    """
+    chaves = set()
+    with _tag_index_lock:
+        for tag in tags:
+            chaves |= _tag_index.pop(tag, set())
+        limite = time.monotonic() + CACHE_TOMBSTONE_SEC
+        for key in chaves:
+            _tombstones[key] = limite
+    for key in chaves:
+        _l1.delete(key)
+    return chaves
+
+
+def _invalidate_remote(tags, chaves_locais=()) -> int:
+    """Le os conjuntos das tags no Redis e apaga as chaves (e os conjuntos)."""
+    chaves = set(chaves_locais)
+    if _redis_client is not None:
+        try:
+            for tag in tags:
+                chaves |= set(_redis_client.smembers(_TAG_PREFIX + tag))
+            _redis_client.delete(*[_TAG_PREFIX + t for t in tags])
+        except Exception as e:
+            logger.warning(f'Erro ao ler tags do cache {list(tags)}: {e}')
+
+    # Chaves indexadas por outro processo tambem podem estar neste L1
+    for key in chaves.difference(chaves_locais):
+        _l1.delete(key)
+    if chaves and _redis_client is not None:
+        try:
+            _redis_client.delete(*chaves)
+        except Exception as e:
+            logger.warning(f'Erro ao invalidar tags do cache {list(tags)}: {e}')
+    with _tag_index_lock:
+        for key in chaves_locais:
+            _tombstones.pop(key, None)
+    _publicar_invalidacao(tags, chaves)
+    return len(chaves)
+
+
+def _l1_aceita(tags) -> bool:
+    """
+    Entrada com tag so vai para o L1 se a invalidacao alcanca todos os
+    processos: um worker so, ou o canal pub/sub do Redis (iniciado aqui).
+    """
+    if not tags or not _MULTI_WORKER:
+        return True
+    if _redis_client is None or not CACHE_INVALIDACAO_PUBSUB:
+        return False
+    _garantir_assinante()
+    return True
+
+
+def _publicar_invalidacao(tags, chaves):
+    """Avisa os outros processos (apos o DEL no Redis, que nao promovem mais a copia velha)."""
+    if _redis_client is None or not CACHE_INVALIDACAO_PUBSUB:
+        return
+    try:
+        _redis_client.publish(_INVALIDATE_CHANNEL, json.dumps(
+            {'pid': os.getpid(), 'tags': list(tags), 'chaves': sorted(chaves)}))
+    except Exception as e:
+        logger.warning(f'Erro ao publicar invalidacao de tags {list(tags)}: {e}')
+
+
+def _aplicar_invalidacao(mensagem) -> int:
+    """Remove do L1 deste processo as chaves avisadas por outro processo."""
+    dados = json.loads(mensagem)
+    if dados.get('pid') == os.getpid():
+        return 0
+    chaves = set(dados.get('chaves', ()))
+    with _tag_index_lock:
+        for tag in dados.get('tags', ()):
+            chaves |= _tag_index.pop(tag, set())
+    for key in chaves:
+        _l1.delete(key)
+    return len(chaves)
+
+
+def _descartar_com_tag():
+    """Avisos podem ter se perdido (assinatura caiu): descarta o L1 das entradas com tag."""
+    with _tag_index_lock:
+        chaves = set().union(*_tag_index.values())
+        _tag_index.clear()
+    for key in chaves:
+        _l1.delete(key)
+
+
+def _garantir_assinante():
+    """Uma thread assinante por processo (recriada apos fork)."""
+    global _assinante_pid
+    if _assinante_pid == os.getpid():
+        return
+    with _assinante_lock:
+        if _assinante_pid == os.getpid():
+            return
+        _assinante_pid = os.getpid()
+    threading.Thread(target=_escutar_invalidacoes, args=(_redis_client,),
+                     name='cache_invalidate_sub', daemon=True).start()
+
+
+def _escutar_invalidacoes(client, parar=None):
+    falhou = False
+    while parar is None or not parar.is_set():
+        pubsub = None
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(_INVALIDATE_CHANNEL)
+            if falhou:
+                _descartar_com_tag()
+                falhou = False
+            while parar is None or not parar.is_set():
+                msg = pubsub.get_message(timeout=1.0)
+                if msg and msg.get('type') == 'message':
+                    _aplicar_invalidacao(msg['data'])
+        except Exception as e:
+            logger.warning(f'Assinatura de invalidacao do cache interrompida: {e}')
+            falhou = True
+            time.sleep(5)
+        finally:
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+
+def _tombstoned(cache_key: str) -> bool:
+    limite = _tombstones.get(cache_key)
+    if limite is None:
+        return False
+    if limite > time.monotonic():
+        return True
+    _tombstones.pop(cache_key, None)
+    return False
+
+
+def cache_invalidate_tags(tags) -> int:
+    """
+    Remove todas as entradas marcadas com qualquer uma das tags
+    (ex: ['paciente:123']), sem SCAN: custo proporcional as chaves da tag.
+    Retorna o numero de chaves removidas.
+    """
+    tags = list(tags)
+    if not tags:
+        return 0
+    return _invalidate_remote(tags, _invalidate_local(tags))
+
+
+def cache_invalidate_tags_async(tags) -> int:
+    """
+    Versao para o caminho de escrita (after_request): limpa o L1 na hora e
+    agenda a limpeza do Redis em uma thread de background, fora da resposta.
+    Retorna o numero de chaves locais removidas.
+    """
+    tags = list(tags)
+    if not tags:
+        return 0
+    chaves = _invalidate_local(tags)
+    if _redis_client is None:
+        with _tag_index_lock:
+            for key in chaves:
+                _tombstones.pop(key, None)
+        return len(chaves)
+    try:
+        _get_invalidate_pool().submit(_invalidate_remote, tags, chaves)
+    except Exception as e:
+        logger.warning(f'Erro ao agendar invalidacao de tags {tags}: {e}')
+        _invalidate_remote(tags, chaves)
+    return len(chaves)
+
+
+def _get_invalidate_pool():
+    global _invalidate_pool
+    with _invalidate_pool_lock:
+        if _invalidate_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _invalidate_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache_invalidate')
+        return _invalidate_pool
+
+
+# =========================================================
+# METRICAS POR ENDPOINT (key_prefix)
+# =========================================================
+
+class _RouteMetrics:
+    """Contadores de um endpoint: resultado das requisicoes, tempo e tamanho do corpo."""
+
+    def __init__(self, ttl: int, stale_ttl: int):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.counts = {'hit': 0, 'stale': 0, 'miss': 0, 'bypass': 0, 'not_modified': 0}
+        self.compute = Histogram()
+        self.payload_bytes = 0
+        self.stored_bytes = 0
+        self._lock = threading.Lock()
+
+    def count(self, resultado: str, not_modified: bool = False):
+        with self._lock:
+            self.counts[resultado] += 1
+            if not_modified:
+                self.counts['not_modified'] += 1
+
+    def computed(self, segundos: float, body: bytes = None, blob: bytes = None):
+        self.compute.observe(segundos)
+        if body is not None:
+            self.payload_bytes = len(body)
+            self.stored_bytes = len(blob)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            dados = dict(self.counts)
+        dados.update({
+            'ttl': self.ttl,
+            'stale_ttl': self.stale_ttl,
+            'payload_bytes': self.payload_bytes,
+            'stored_bytes': self.stored_bytes,
+            'compute': self.compute.snapshot(),
+        })
+        return dados
+
+
+def cache_metrics() -> dict:
+    """Metricas por key_prefix para /api/health/metrics."""
+    with _registry_lock:
+        rotas = list(_registry.values())
+    return {
+        'rotas': {r.prefix: r.metrics.snapshot() for r in rotas},
+        'fallback': _fallback_count,
+        'l1': _l1.stats(),
+    }
+
+
+def _compute(func, args, kwargs, cache_key: str, ttl: int, stale_ttl: int = 0):
+    """
+    Executa o handler e cacheia a resposta se for JSON 2xx.
+    Retorna (response, blob) — blob (valor guardado) e None quando a
+    resposta nao foi cacheada.
+    """
+    from flask import make_response
+
+    inicio = time.perf_counter()
+    response = make_response(func(*args, **kwargs))
+    rota = _routes_by_func.get(func)
+
+    if (200 <= response.status_code < 300 and response.is_json and not response.is_streamed
+            and 'Content-Encoding' not in response.headers):
+        body = response.get_data()
+        tags = rota.entry_tags(kwargs) if rota is not None and rota.tags else ()
+        blob = _store(cache_key, body, ttl, stale_ttl, tags)
+        if rota is not None:
+            rota.metrics.computed(time.perf_counter() - inicio, body, blob)
+        return response, blob
+
+    if rota is not None:
+        rota.metrics.computed(time.perf_counter() - inicio)
+    return response, None
+
+
+# =========================================================
+# SINGLE-FLIGHT (coalescencia de misses)
+# =========================================================
+
+class _Flight:
+    """Calculo em andamento de uma chave; seguidores aguardam o event."""
+
+    __slots__ = ('event', 'body', 'status')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.body = None
+        self.status = 'HIT'   # 'STALE' quando o lider serviu a copia velha
+
+
+_inflight = {}                    # cache_key -> _Flight
+_inflight_lock = threading.Lock()
+
+# Remove o lock apenas se ainda pertencer a quem o criou (token)
+_UNLOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _join_flight(cache_key: str):
+    """Retorna (flight, is_leader). O lider e quem executa o handler."""
+    with _inflight_lock:
+        flight = _inflight.get(cache_key)
+        if flight is not None:
+            return flight, False
+        flight = _Flight()
+        _inflight[cache_key] = flight
+        return flight, True
+
+
+def _finish_flight(cache_key: str, flight: _Flight):
+    with _inflight_lock:
+        if _inflight.get(cache_key) is flight:
+            del _inflight[cache_key]
+    flight.event.set()
+
+
+def _acquire_lock(cache_key: str):
+    """
+    Lock curto no Redis para coalescer misses entre workers.
+    Retorna o token (str) se adquiriu, None se o Redis estiver offline
+    ou com erro (segue sem lock) e False se outro worker ja calcula.
+    """
+    if _redis_client is None:
+        return None
+    token = f'{os.getpid()}:{threading.get_ident()}:{time.monotonic()}'
+    try:
+        if _redis_client.set(f'lock:{cache_key}', token, nx=True, px=CACHE_LOCK_TTL_MS):
+            return token
+        return False
+    except Exception as e:
+        logger.warning(f'Erro ao adquirir lock de cache [{cache_key}]: {e}')
+        return None
+
+
+def _release_lock(cache_key: str, token):
+    if not token or _redis_client is None:
+        return
+    try:
+        _redis_client.eval(_UNLOCK_SCRIPT, 1, f'lock:{cache_key}', token)
+    except Exception as e:
+        logger.warning(f'Erro ao liberar lock de cache [{cache_key}]: {e}')
+
+
+def _wait_remote(cache_key: str, ttl: int, stale_ttl: int = 0):
+    """
+    Outro worker detem o lock: aguarda o valor aparecer no Redis
+    (polling curto) ate o lock ser liberado ou o tempo esgotar.
+    """
+    deadline = time.monotonic() + CACHE_SINGLEFLIGHT_WAIT
+    delay = 0.025
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 0.2)
+        try:
+            cached = _body_redis().get(cache_key)
+            if cached is not None:
+                blob = cached.encode('utf-8') if isinstance(cached, str) else cached
+                _promote(cache_key, blob, ttl, stale_ttl)
+                return blob
+            if not _redis_client.exists(f'lock:{cache_key}'):
+                return None
+        except Exception:
+            return None
+    return None
+
+
+# =========================================================
+# GERACOES DE CARGA POR TABELA
+# =========================================================
+
+_generations = {}                 # tabela -> geracao (int)
+_generations_synced_at = 0.0
+_generations_lock = threading.Lock()
+
+
+def _sync_generations():
+    """Atualiza o espelho local a partir do Redis (no maximo 1x por intervalo)."""
+    global _generations_synced_at
+    now = time.monotonic()
+    if _redis_client is None or now - _generations_synced_at < CACHE_GEN_SYNC_INTERVAL:
+        return
+    _generations_synced_at = now
+    try:
+        remoto = _redis_client.hgetall(_GEN_HASH)
+    except Exception as e:
+        logger.warning(f'Erro ao ler geracoes de cache: {e}')
+        return
+    if isinstance(remoto, dict):
+        with _generations_lock:
+            for tabela, geracao in remoto.items():
+                _generations[tabela] = int(geracao)
+
+
+def get_generations(tables) -> dict:
+    """Geracao atual de cada tabela (0 se nunca houve carga registrada)."""
+    _sync_generations()
+    with _generations_lock:
+        return {t: _generations.get(t, 0) for t in tables}
+
+
+def cache_bump_generation(tables) -> dict:
+    """
+    Registra uma nova carga das tabelas informadas (chamado pelo ETL).
+    Endpoints com depends_on nessas tabelas passam a usar chaves novas;
+    as entradas antigas simplesmente deixam de ser lidas e expiram.
+    Retorna {tabela: nova_geracao}.
+    """
+    resultado = {}
+    for tabela in tables:
+        geracao = None
+        if _redis_client is not None:
+            try:
+                geracao = int(_redis_client.hincrby(_GEN_HASH, tabela, 1))
+            except Exception as e:
+                logger.warning(f'Erro ao incrementar geracao [{tabela}]: {e}')
+        with _generations_lock:
+            if geracao is None:
+                geracao = _generations.get(tabela, 0) + 1
+            _generations[tabela] = geracao
+        resultado[tabela] = geracao
+    return resultado
+
+
+# =========================================================
+# REGISTRO DE ENDPOINTS CACHEADOS
+# =========================================================
+
+class _CachedRoute:
+    """Metadados de um endpoint decorado com @cache_route."""
+
+    __slots__ = ('prefix', 'func', 'ttl', 'stale_ttl', 'vary_by_user', 'vary_by_query',
+                 'vary_by_path', 'depends_on', 'tags', 'variants', 'metrics')
+
+    def __init__(self, prefix, func, ttl, stale_ttl, vary_by_user, vary_by_query,
+                 depends_on, vary_by_path=True, tags=()):
+        self.prefix = prefix
+        self.func = func
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.vary_by_user = vary_by_user
+        self.vary_by_query = vary_by_query
+        self.vary_by_path = vary_by_path
+        self.depends_on = depends_on
+        self.tags = tags
+        self.variants = OrderedDict()   # (path, query_string) -> kwargs da view
+        self.metrics = _RouteMetrics(ttl, stale_ttl)
+
+    def remember(self, path: str, query_string: str, kwargs: dict):
+        variant = (path, query_string)
+        with _registry_lock:
+            self.variants[variant] = kwargs
+            self.variants.move_to_end(variant)
+            while len(self.variants) > _MAX_VARIANTS:
+                self.variants.popitem(last=False)
+
+    def entry_tags(self, kwargs: dict) -> list:
+        """Tags da entrada: 'paciente:{nr_atendimento}' preenchido com os parametros da URL."""
+        tags = []
+        for modelo in self.tags:
+            try:
+                tags.append(modelo.format(**kwargs))
+            except (KeyError, IndexError):
+                logger.warning(f'Tag de cache sem parametro na rota [{self.prefix}]: {modelo}')
+        return tags
+
+
+_registry = {}                    # key_prefix -> _CachedRoute
+_routes_by_func = {}              # handler original -> _CachedRoute
+_registry_lock = threading.Lock()
+
+
+_PATH_SEGMENT_RE = re.compile(r'^[\w.-]{1,64}$')
+
+
+def _path_segment(view_args: dict) -> str:
+    """Parametros da URL na chave: valores legiveis ('12345') ou hash se tiverem caracteres especiais."""
+    valores = [str(view_args[k]) for k in sorted(view_args)]
+    if all(_PATH_SEGMENT_RE.match(v) for v in valores):
+        return ','.join(valores)
+    return 'p' + hashlib.md5('\x00'.join(valores).encode()).hexdigest()[:10]
+
+
+def _build_key(prefix: str, uid=None, query_string: str = '', depends_on=(),
+               view_args: dict = None) -> str:
+    """Monta a chave: prefixo[:u<id>][:parametros_url][:hash_query][:g<geracoes>]."""
+    parts = [prefix]
+    if uid is not None:
+        parts.append(f'u{uid}')
+    if view_args:
+        parts.append(_path_segment(view_args))
+    if query_string:
+        parts.append(hashlib.md5(query_string.encode()).hexdigest()[:10])
+    if depends_on:
+        geracoes = get_generations(depends_on)
+        parts.append('g' + '.'.join(str(geracoes[t]) for t in depends_on))
+    return ':'.join(parts)
+
+
+def get_cached_routes() -> list:
+    """Lista os endpoints cacheados registrados (para diagnostico)."""
+    with _registry_lock:
+        return [
+            {
+                'prefix': r.prefix,
+                'ttl': r.ttl,
+                'stale_ttl': r.stale_ttl,
+                'vary_by_user': r.vary_by_user,
+                'vary_by_query': r.vary_by_query,
+                'vary_by_path': r.vary_by_path,
+                'depends_on': list(r.depends_on),
+                'tags': list(r.tags),
+                'variants': len(r.variants),
+            }
+            for r in _registry.values()
+        ]
+
+
+# =========================================================
+# RECALCULO EM BACKGROUND (stale-while-revalidate / refresher)
+# =========================================================
+
+_refresh_pool = None
+_refresh_pool_lock = threading.Lock()
+
+# Chaves compartilhadas (vary_by_user=False) candidatas ao refresher proativo
+_hot_keys = {}                    # cache_key -> _HotKey
+_hot_keys_lock = threading.Lock()
+
+
+class _HotKey:
+    """Como recalcular uma chave fora da requisicao original."""
+
+    __slots__ = ('func', 'args', 'kwargs', 'ttl', 'stale_ttl', 'path',
+                 'query_string', 'hits', 'last_access', 'expires_at')
+
+    def __init__(self, func, args, kwargs, ttl, stale_ttl, path, query_string):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.path = path
+        self.query_string = query_string
+        self.hits = 0
+        self.last_access = 0.0
+        self.expires_at = 0.0
+
+
+def _get_refresh_pool():
+    global _refresh_pool
+    with _refresh_pool_lock:
+        if _refresh_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _refresh_pool = ThreadPoolExecutor(
+                max_workers=CACHE_REFRESH_WORKERS, thread_name_prefix='cache_refresh'
+            )
+        return _refresh_pool
+
+
+def _request_snapshot():
+    """Captura path, query string e cookie para reexecutar o handler em background."""
+    from flask import request as flask_request
+    return {
+        'path': flask_request.path,
+        'query_string': flask_request.query_string.decode('utf-8'),
+        'headers': {'Cookie': flask_request.headers.get('Cookie', '')},
+    }
+
+
+def _refresh_task(app, snapshot, func, args, kwargs, cache_key, ttl, stale_ttl, flight):
+    token = None
+    try:
+        token = _acquire_lock(cache_key)
+        if token is False:
+            return  # outro worker ja esta recalculando
+        with app.test_request_context(snapshot['path'],
+                                      query_string=snapshot['query_string'],
+                                      headers=snapshot['headers']):
+            _, flight.body = _compute(func, args, kwargs, cache_key, ttl, stale_ttl)
+    except Exception as e:
+        logger.warning(f'Erro ao recalcular cache em background [{cache_key}]: {e}')
+    finally:
+        _release_lock(cache_key, token)
+        _finish_flight(cache_key, flight)
+
+
+def _schedule_refresh(app, snapshot, func, args, kwargs, cache_key, ttl, stale_ttl) -> bool:
+    """
+    Agenda o recalculo da chave no pool de background.
+    Retorna False se a chave ja esta sendo recalculada (nada a fazer).
+    """
+    flight, is_leader = _join_flight(cache_key)
+    if not is_leader:
+        return False
+    try:
+        _get_refresh_pool().submit(
+            _refresh_task, app, snapshot, func, args, kwargs,
+            cache_key, ttl, stale_ttl, flight
+        )
+    except Exception as e:
+        logger.warning(f'Erro ao agendar recalculo de cache [{cache_key}]: {e}')
+        _finish_flight(cache_key, flight)
+        return False
+    return True
+
+
+def _track_hot_key(cache_key, func, args, kwargs, ttl, stale_ttl, computed=False):
+    """Registra o acesso a uma chave compartilhada para o refresher proativo."""
+    now = time.monotonic()
+    with _hot_keys_lock:
+        hot = _hot_keys.get(cache_key)
+        if hot is None:
+            snap = _request_snapshot()
+            hot = _HotKey(func, args, kwargs, ttl, stale_ttl, snap['path'], snap['query_string'])
+            _hot_keys[cache_key] = hot
+        hot.hits += 1
+        hot.last_access = now
+        if computed:
+            hot.expires_at = now + ttl
+
+
+def _refresh_hot_keys(app) -> int:
+    """
+    Um ciclo do refresher: reaquece as CACHE_REFRESH_TOP_N chaves mais
+    acessadas desde o ultimo ciclo que expiram em ate CACHE_REFRESH_AHEAD s.
+    Chaves sem acesso ha mais de 2x o TTL saem do registro.
+    """
+    now = time.monotonic()
+    candidatos = []
+    with _hot_keys_lock:
+        for key, hot in list(_hot_keys.items()):
+            if now - hot.last_access > 2 * (hot.ttl + hot.stale_ttl):
+                del _hot_keys[key]
+                continue
+            if hot.hits and hot.expires_at - now <= CACHE_REFRESH_AHEAD:
+                candidatos.append((hot.hits, key, hot))
+            hot.hits = 0
+
+    candidatos.sort(key=lambda c: c[0], reverse=True)
+    agendados = 0
+    for _, key, hot in candidatos[:CACHE_REFRESH_TOP_N]:
+        snapshot = {'path': hot.path, 'query_string': hot.query_string, 'headers': {}}
+        if _schedule_refresh(app, snapshot, hot.func, hot.args, hot.kwargs,
+                             key, hot.ttl, hot.stale_ttl):
+            hot.expires_at = now + hot.ttl
+            agendados += 1
+    return agendados
+
+
+_refresher_started = False
+_refresher_stop = threading.Event()
+
+
+def start_cache_refresher(app):
+    """
+    Inicia o refresher proativo como thread daemon.
+    OFF SWITCH: CACHE_PROACTIVE_REFRESH=false no .env (padrao)
+    Retorna o Event de parada (para o graceful shutdown do app.py) ou None.
+    """
+    global _refresher_started
+    if _refresher_started or not CACHE_PROACTIVE_REFRESH:
+        return None
+    _refresher_started = True
+    _refresher_stop.clear()
+
+    def _run():
+        while not _refresher_stop.wait(CACHE_REFRESH_INTERVAL):
+            try:
+                _refresh_hot_keys(app)
+            except Exception as e:
+                logger.warning(f'[cache_refresher] Erro no ciclo: {e}')
+
+    threading.Thread(target=_run, name='cache_refresher', daemon=True).start()
+    app.logger.info(
+        f'[cache_refresher] Ativo (intervalo {CACHE_REFRESH_INTERVAL}s, '
+        f'antecedencia {CACHE_REFRESH_AHEAD}s, top {CACHE_REFRESH_TOP_N})'
+    )
+    return _refresher_stop
+
+
+def _routes_of(nome: str) -> list:
+    """Endpoints registrados cujo key_prefix pertence ao painel `nome`."""
+    with _registry_lock:
+        return [r for p, r in _registry.items() if p == nome or p.startswith(nome + ':')]
+
+
+def has_shared_routes(nome: str) -> bool:
+    """True se o painel tem endpoints cacheados compartilhados (vary_by_user=False)."""
+    return any(not r.vary_by_user for r in _routes_of(nome))
+
+
+def _refresh_routes(app, nome: str, somente_expiradas: bool) -> dict:
+    rotas = _routes_of(nome)
+    with _registry_lock:
+        variantes = {id(r): list(r.variants.items()) for r in rotas}
+
+    agendados = 0
+    removidos = 0
+    for rota in rotas:
+        if rota.vary_by_user:
+            if not somente_expiradas:
+                removidos += cache_delete_pattern(f'{rota.prefix}:u*')
+            continue
+        for (path, qs), kwargs in variantes[id(rota)]:
+            cache_key = _build_key(rota.prefix, None, qs if rota.vary_by_query else '',
+                                   rota.depends_on, kwargs if rota.vary_by_path else None)
+            if somente_expiradas:
+                body, fresh = _lookup(cache_key, rota.ttl, rota.stale_ttl)
+                if body is not None and fresh:
+                    continue
+            snapshot = {'path': path, 'query_string': qs, 'headers': {}}
+            if _schedule_refresh(app, snapshot, rota.func, (), kwargs,
+                                 cache_key, rota.ttl, rota.stale_ttl):
+                agendados += 1
+    return {'agendados': agendados, 'removidos': removidos}
+
+
+def cache_refresh_prefix(app, nome: str) -> dict:
+    """
+    Recalcula em background todos os endpoints cujo key_prefix pertence
+    a `nome` (ex: 'painel4' casa 'painel4:dashboard', 'painel4:setores'...),
+    sobrescrevendo as entradas sem apaga-las antes — as TVs continuam
+    recebendo o dado anterior ate o novo ficar pronto.
+
+    Apenas endpoints vary_by_user=False podem ser recalculados sem a sessao
+    do usuario; as chaves por usuario desses paineis sao removidas.
+
+    Returns:
+        {'agendados': N, 'removidos': M}
+    """
+    return _refresh_routes(app, nome, somente_expiradas=False)
+
+
+def cache_revalidate_prefix(app, nome: str) -> int:
+    """
+    Recalcula em background apenas as variantes compartilhadas do painel
+    que ja expiraram (ou sairam do cache). Usado pelo produtor do canal SSE.
+    Retorna o numero de recalculos agendados.
+    """
+    return _refresh_routes(app, nome, somente_expiradas=True)['agendados']
+
+
 def cache_route(ttl: int = 120, key_prefix: str = None,
-                vary_by_user: bool = True, vary_by_query: bool = False):
+                vary_by_user: bool = True, vary_by_query: bool = False,
+                stale_ttl: int = 0, depends_on=(), vary_by_path: bool = True, tags=()):
     """
-    Decorator que aplica cache Redis em endpoints Flask.
+    Decorator que aplica cache em dois niveis em endpoints Flask:
+    L1 em memoria (por processo) na frente do Redis (L2, compartilhado).
 
     Logica de seguranca:
     - vary_by_user=True (padrao): cache separado por usuario_id.
       Garante que verificacoes de permissao internas ao handler
       nao sejam bypassadas por respostas em cache de outro usuario.
-    - Apenas respostas 2xx sao cacheadas. Respostas 403/500 sempre
+    - Apenas respostas 2xx JSON sao cacheadas. Respostas 403/500 sempre
       executam o handler completo (com checagem de permissao).
 
+    Os dois niveis guardam o corpo JSON ja serializado — comprimido com
+    gzip/zstd acima de CACHE_COMPRESS_MIN_BYTES — entao um HIT devolve os
+    bytes sem json.loads/jsonify, com Content-Encoding se o cliente aceitar
+    (senao descomprime). Se o Redis estiver offline, o L1 continua
+    servindo e so o miss vai ao banco.
+
+    Misses simultaneos da mesma chave sao coalescidos (single-flight):
+    dentro do processo, uma thread calcula e as demais aguardam; entre
+    workers, um lock curto no Redis elege quem calcula e os outros servem
+    a copia velha do L1 (ou aguardam o valor aparecer no Redis).
+
+    Com stale_ttl > 0 (stale-while-revalidate), a entrada continua sendo
+    servida por mais stale_ttl segundos apos expirar enquanto uma thread
+    de background a recalcula — nenhuma TV paga o custo da query.
+
+    Com depends_on, a chave inclui a geracao de carga de cada tabela
+    (cache_bump_generation, chamado pelo ETL): uma nova carga troca a
+    chave imediatamente, sem depender do TTL. O TTL continua valendo
+    como rede de seguranca para cargas nao notificadas.
+
     Args:
         ttl:            Segundos ate o cache expirar.
         key_prefix:     Prefixo da chave Redis. Default: nome da funcao.
         vary_by_user:   Se True, inclui usuario_id na chave.
         vary_by_query:  Se True, inclui hash dos query params na chave.
                         Usar em endpoints com filtros (?setor=X&status=Y).
+        stale_ttl:      Segundos extras em que a entrada expirada ainda e
+                        servida (X-Cache: STALE) durante o recalculo.
+        depends_on:     Tabelas cujas cargas ETL invalidam o endpoint.
+        vary_by_path:   Se True (padrao), inclui os parametros da URL
+                        (request.view_args) na chave — /paciente/<nr>
+                        tem uma entrada por paciente.
+        tags:           Tags de dependencia da entrada, com parametros da URL
+                        entre chaves (ex: 'paciente:{nr_atendimento}').
+                        cache_invalidate_tags(['paciente:123']) remove so
+                        as entradas daquele paciente.
 
     Header de resposta:
-        X-Cache: HIT  — servido do cache
-        X-Cache: MISS — buscado no banco e cacheado
+        X-Cache: HIT   — servido do cache (L1 ou Redis)
+        X-Cache: MISS  — buscado no banco e cacheado
+        X-Cache: STALE — copia expirada servida enquanto a chave e recalculada
+        ETag: hash do corpo; If-None-Match igual responde 304 sem corpo
     """
+    tabelas = tuple(depends_on)
+
     def decorator(func):
+        prefix = key_prefix or func.__name__
+        rota = _CachedRoute(prefix, func, ttl, stale_ttl, vary_by_user, vary_by_query,
+                            tabelas, vary_by_path, tuple(tags))
+        metrics = rota.metrics
+        with _registry_lock:
+            _registry[prefix] = rota
+            _routes_by_func[func] = rota
+
+        def _serve(blob: bytes, status: str):
+            response = _cached_response(blob, status)
+            metrics.count(status.lower(), response.status_code == 304)
+            return response
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            # Se Redis estiver offline, executa normalmente sem cache
-            if _redis_client is None:
-                global _fallback_count
-                _fallback_count += 1
-                return func(*args, **kwargs)
-
-            import hashlib
+            global _fallback_count
             from flask import session, request as flask_request
 
             # Monta a chave de cache com os segmentos ativos
-            prefix = key_prefix or func.__name__
-            parts = [prefix]
+            uid = session.get('usuario_id', 'anon') if vary_by_user else None
+            qs = flask_request.query_string.decode('utf-8') if vary_by_query else ''
+            view_args = flask_request.view_args if vary_by_path else None
+            cache_key = _build_key(prefix, uid, qs, tabelas, view_args)
 
-            if vary_by_user:
-                uid = session.get('usuario_id', 'anon')
-                parts.append(f'u{uid}')
+            if not vary_by_user:
+                rota.remember(flask_request.path, qs, kwargs)
 
-            if vary_by_query:
-                qs = flask_request.query_string.decode('utf-8')
-                if qs:
-                    qs_hash = hashlib.md5(qs.encode()).hexdigest()[:10]
-                    parts.append(qs_hash)
+            blob, fresh = _lookup(cache_key, ttl, stale_ttl)
 
-            cache_key = ':'.join(parts)
+            if not vary_by_user and CACHE_PROACTIVE_REFRESH:
+                _track_hot_key(cache_key, func, args, kwargs, ttl, stale_ttl,
+                               computed=blob is None)
 
-            # Tenta servir do cache
-            cached = cache_get(cache_key)
-            if cached is not None:
-                response = jsonify(cached)
-                response.headers['X-Cache'] = 'HIT'
-                return response
+            if blob is not None:
+                if fresh:
+                    return _serve(blob, 'HIT')
+                # Stale-while-revalidate: serve a copia velha e recalcula em background
+                from flask import current_app
+                _schedule_refresh(current_app._get_current_object(), _request_snapshot(),
+                                  func, args, kwargs, cache_key, ttl, stale_ttl)
+                return _serve(blob, 'STALE')
 
-            # Cache MISS — executa o handler original
-            response = func(*args, **kwargs)
+            if _redis_client is None:
+                _fallback_count += 1
 
-            # Cacheia apenas respostas de sucesso (2xx)
-            status = getattr(response, 'status_code', 200)
-            if 200 <= status < 300:
-                try:
-                    data = response.get_json()
-                    if data is not None:
-                        cache_set(cache_key, data, ttl=ttl)
-                        response.headers['X-Cache'] = 'MISS'
-                except Exception:
-                    pass
+            # Single-flight: apenas o lider executa o handler; as demais
+            # threads com a mesma chave aguardam o resultado dele.
+            flight, is_leader = _join_flight(cache_key)
+            if not is_leader:
+                if flight.event.wait(CACHE_SINGLEFLIGHT_WAIT) and flight.body is not None:
+                    return _serve(flight.body, flight.status)
+                # Lider falhou, resposta nao cacheavel ou timeout: executa sozinho
+                response, blob = _compute(func, args, kwargs, cache_key, ttl, stale_ttl)
+                if blob is not None:
+                    return _serve(blob, 'MISS')
+                metrics.count('bypass')
+                return response
 
-            return response
+            token = None
+            try:
+                token = _acquire_lock(cache_key)
+                if token is False:
+                    # Outro worker ja esta calculando: serve a copia velha do L1
+                    # se ainda dentro do stale_ttl; senao aguarda o valor dele no Redis.
+                    stale = _l1.get_stale(cache_key) if CACHE_L1_ENABLED else None
+                    if stale is not None:
+                        flight.body, flight.status = stale, 'STALE'
+                        return _serve(stale, 'STALE')
+                    remote = _wait_remote(cache_key, ttl, stale_ttl)
+                    if remote is not None:
+                        flight.body = remote
+                        return _serve(remote, 'HIT')
+
+                response, flight.body = _compute(func, args, kwargs, cache_key, ttl, stale_ttl)
+                if flight.body is not None:
+                    return _serve(flight.body, 'MISS')
+                metrics.count('bypass')
+                return response
+            finally:
+                _release_lock(cache_key, token)
+                _finish_flight(cache_key, flight)
 
         return wrapper
     return decorator
@@ -251,6 +1528,7 @@ def cache_health() -> dict:
             'status': 'disabled',
             'message': 'Redis nao conectado ou desabilitado por configuracao',
             'fallback_count': _fallback_count,
+            'l1': _l1.stats(),
         }
 
     try:
@@ -277,6 +1555,7 @@ def cache_health() -> dict:
             'keyspace_hits': info_stats.get('keyspace_hits', 0),
             'keyspace_misses': info_stats.get('keyspace_misses', 0),
             'fallback_count': _fallback_count,
+            'l1': _l1.stats(),
         }
 
     except Exception as e:
@@ -5,9 +5,11 @@ Sistema de Paineis Hospitalares
 Funcionalidades:
 - Conexao com PostgreSQL
 - Suporte a DATABASE_URL (Docker) e variaveis separadas
-- Connection pooling para melhor performance
+- Connection pooling com espera bloqueante (FIFO, timeout) e sub-pools
+  separados para requisicoes web e workers em background
 - Retry logic para ambientes containerizados
 - Health check do banco de dados
+- Instrumentacao por consulta (backend.query_stats)
 """
 
 import psycopg2
@@ -16,9 +18,14 @@ from psycopg2 import pool
 import os
 import time
 import logging
+import threading
+from collections import deque
 from contextlib import contextmanager
 from dotenv import load_dotenv
 
+from backend.query_stats import connection_extras
+from backend.access_log_store import init_access_log
+
 load_dotenv()
 
 # Configuracao do logger
@@ -70,6 +77,8 @@ _CONNECTION_EXTRAS = {
     'keepalives_interval': 10,
     'keepalives_count': 5,
     'options': '-c statement_timeout=60000',  # mata queries presas apos 60s
+    # Cursores instrumentados (tempo por consulta, slow-query log) — DB_QUERY_STATS
+    **connection_extras(),
 }
 
 
@@ -92,6 +101,216 @@ POOL_MIN_CONNECTIONS = int(os.getenv('DB_POOL_MIN', str(max(1, _pool_per_worker
 POOL_MAX_CONNECTIONS = int(os.getenv('DB_POOL_MAX', str(_pool_per_worker)))
 USE_CONNECTION_POOL  = os.getenv('DB_USE_POOL', 'true').lower() == 'true'
 
+# Parte do pool reservada para threads sem requisicao (notificadores, jobs,
+# ETL): nao disputam conexao com as requisicoes web e vice-versa.
+POOL_WORKER_CONNECTIONS = int(os.getenv('DB_POOL_WORKERS', str(max(1, POOL_MAX_CONNECTIONS // 4))))
+# Tempo maximo esperando uma conexao livre antes de desistir (back-pressure)
+POOL_TIMEOUT   = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# Conexao ociosa ha mais que isso e testada (SELECT 1) antes de ser entregue
+POOL_IDLE_CHECK = float(os.getenv('DB_POOL_IDLE_CHECK', '30'))
+
+
+class PoolTimeout(pool.PoolError):
+    """Nenhuma conexao liberada dentro de DB_POOL_TIMEOUT."""
+
+
+class _Espera:
+    """Uma thread na fila de um sub-pool, aguardando a conexao ser entregue."""
+
+    __slots__ = ('evento', 'conn', 'vaga')
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.conn = None       # conexao ociosa entregue diretamente
+        self.vaga = False      # ou: vaga para abrir uma conexao nova
+
+
+class _SubPool:
+    """
+    Pool bloqueante com limite fixo de conexoes.
+
+    - getconn espera ate `timeout` segundos; a ordem de atendimento e FIFO
+      (quem devolve entrega a conexao direto para o primeiro da fila)
+    - conexoes ociosas ha mais de POOL_IDLE_CHECK s sao validadas antes do uso
+    - o tempo de espera de cada getconn vai para um histograma
+    """
+
+    def __init__(self, nome: str, minconn: int, maxconn: int, connect):
+        from backend.metrics import Histogram
+
+        self.nome = nome
+        self.maxconn = maxconn
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._ociosas = deque()        # (conn, devolvida_em)
+        self._em_uso = 0
+        self._abertas = 0
+        self._fila = deque()           # _Espera, ordem de chegada
+        self.espera = Histogram()
+        self.timeouts = 0
+        self.descartadas = 0
+        self._fechado = False
+
+        for _ in range(min(minconn, maxconn)):
+            self._ociosas.append((self._abrir(), time.monotonic()))
+
+    def _abrir(self):
+        conn = self._connect()
+        with self._lock:
+            self._abertas += 1
+        return conn
+
+    def _valida(self, conn, devolvida_em: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - devolvida_em < POOL_IDLE_CHECK:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _fechar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self, timeout: float = None):
+        timeout = POOL_TIMEOUT if timeout is None else timeout
+        inicio = time.monotonic()
+        with self._lock:
+            if not self._fila and self._ociosas:
+                conn, devolvida_em = self._ociosas.pop()
+                self._em_uso += 1
+                espera = None
+            elif not self._fila and self._em_uso + len(self._ociosas) < self.maxconn:
+                conn, devolvida_em = None, None
+                self._em_uso += 1
+                espera = None
+            else:
+                espera = _Espera()
+                self._fila.append(espera)
+
+        if espera is not None:
+            if not espera.evento.wait(timeout):
+                with self._lock:
+                    if not espera.evento.is_set():
+                        self._fila.remove(espera)
+                        self.timeouts += 1
+                        self.espera.observe(time.monotonic() - inicio)
+                        raise PoolTimeout(
+                            f'Pool {self.nome}: nenhuma conexao livre em {timeout:.0f}s '
+                            f'({self.maxconn} em uso)'
+                        )
+            conn = espera.conn
+            devolvida_em = time.monotonic()     # acabou de ser usada
+        self.espera.observe(time.monotonic() - inicio)
+
+        if conn is not None and self._valida(conn, devolvida_em):
+            return conn
+        if conn is not None:
+            self._descartar(conn)
+        try:
+            return self._abrir()
+        except Exception:
+            self._liberar_vaga()
+            raise
+
+    def _descartar(self, conn):
+        self._fechar(conn)
+        with self._lock:
+            self._abertas -= 1
+            self.descartadas += 1
+
+    def _liberar_vaga(self):
+        """Uma vaga em uso foi liberada sem conexao (descartada/erro ao abrir)."""
+        with self._lock:
+            if self._fila:
+                espera = self._fila.popleft()
+                espera.vaga = True
+                espera.evento.set()
+            else:
+                self._em_uso -= 1
+
+    def putconn(self, conn, close: bool = False):
+        if close or conn.closed or self._fechado:
+            self._descartar(conn)
+            self._liberar_vaga()
+            return
+        with self._lock:
+            if self._fila:
+                espera = self._fila.popleft()
+                espera.conn = conn
+                espera.evento.set()
+            else:
+                self._em_uso -= 1
+                self._ociosas.append((conn, time.monotonic()))
+
+    def closeall(self):
+        """Fecha as ociosas; as em uso sao fechadas quando forem devolvidas."""
+        with self._lock:
+            self._fechado = True
+            ociosas, self._ociosas = list(self._ociosas), deque()
+            self._abertas -= len(ociosas)
+        for conn, _ in ociosas:
+            self._fechar(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'max_connections': self.maxconn,
+                'used': self._em_uso,
+                'available': len(self._ociosas),
+                'opened': self._abertas,
+                'waiting': len(self._fila),
+                'timeouts': self.timeouts,
+                'discarded': self.descartadas,
+            }
+
+
+class BlockingConnectionPool:
+    """
+    Pool de conexoes limitado a POOL_MAX_CONNECTIONS, dividido em dois
+    sub-pools: 'web' (threads atendendo requisicao) e 'worker' (threads em
+    background). Sem conexao livre, a thread espera em fila ate
+    DB_POOL_TIMEOUT — nunca abre conexao extra fora do pool.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, worker_conns: int, **kwargs):
+        worker_conns = max(1, min(worker_conns, maxconn - 1))
+
+        def _connect():
+            return psycopg2.connect(**kwargs)
+
+        self.maxconn = maxconn
+        self.subpools = {
+            'web': _SubPool('web', minconn, maxconn - worker_conns, _connect),
+            'worker': _SubPool('worker', 0, worker_conns, _connect),
+        }
+
+    def getconn(self, nome: str = None, timeout: float = None):
+        """Retorna (sub-pool, conexao)."""
+        subpool = self.subpools[nome or _subpool_atual()]
+        return subpool, subpool.getconn(timeout)
+
+    def closeall(self):
+        for subpool in self.subpools.values():
+            subpool.closeall()
+
+
+def _subpool_atual() -> str:
+    """'web' dentro de uma requisicao Flask, 'worker' nas demais threads."""
+    try:
+        from flask import has_request_context
+        return 'web' if has_request_context() else 'worker'
+    except Exception:
+        return 'worker'
+
 
 def init_connection_pool():
     """
@@ -104,15 +323,18 @@ def init_connection_pool():
         return _connection_pool
 
     try:
-        _connection_pool = pool.ThreadedConnectionPool(
+        _connection_pool = BlockingConnectionPool(
             POOL_MIN_CONNECTIONS,
             POOL_MAX_CONNECTIONS,
+            POOL_WORKER_CONNECTIONS,
             **DB_CONFIG,
             **_CONNECTION_EXTRAS
         )
         logger.info(
             f"Connection pool inicializado: "
-            f"min={POOL_MIN_CONNECTIONS}, max={POOL_MAX_CONNECTIONS}"
+            f"min={POOL_MIN_CONNECTIONS}, max={POOL_MAX_CONNECTIONS} "
+            f"(workers={_connection_pool.subpools['worker'].maxconn}), "
+            f"timeout={POOL_TIMEOUT:.0f}s"
         )
         return _connection_pool
     except Exception as e:
@@ -140,18 +362,19 @@ class _PoolConnectionWrapper:
     putconn(), e delega todos os outros acessos ao objeto real.
     """
 
-    __slots__ = ('_conn', '_returned')
+    __slots__ = ('_conn', '_returned', '_subpool')
 
-    def __init__(self, conn):
+    def __init__(self, conn, subpool=None):
         object.__setattr__(self, '_conn', conn)
         object.__setattr__(self, '_returned', False)
+        object.__setattr__(self, '_subpool', subpool)
 
     # --- Delegacao transparente ----------------------------------------
     def __getattr__(self, name):
         return getattr(object.__getattribute__(self, '_conn'), name)
 
     def __setattr__(self, name, value):
-        if name in ('_conn', '_returned'):
+        if name in ('_conn', '_returned', '_subpool'):
             object.__setattr__(self, name, value)
         else:
             setattr(object.__getattribute__(self, '_conn'), name, value)
@@ -173,28 +396,32 @@ class _PoolConnectionWrapper:
 
     # --- close() que devolve ao pool -----------------------------------
     def close(self):
-        global _connection_pool
         conn = object.__getattribute__(self, '_conn')
         returned = object.__getattribute__(self, '_returned')
+        subpool = object.__getattribute__(self, '_subpool')
 
         if returned:
             return  # ja devolvida — evita dupla devolucao
 
         object.__setattr__(self, '_returned', True)
 
-        try:
-            if _connection_pool is not None and not conn.closed:
-                # Sempre faz rollback antes de devolver ao pool.
-                # O pool NAO reseta o estado da conexao — sem isso, uma transacao
-                # abortada ou pendente contamina o proximo chamador.
+        if subpool is not None:
+            # Sempre faz rollback antes de devolver ao pool.
+            # O pool NAO reseta o estado da conexao — sem isso, uma transacao
+            # abortada ou pendente contamina o proximo chamador.
+            # Se o rollback falhar a conexao esta quebrada: o pool a descarta
+            # e libera a vaga (nunca deixa o limite preso).
+            quebrada = conn.closed
+            if not quebrada:
                 try:
                     conn.rollback()
                 except Exception:
-                    pass
-                _connection_pool.putconn(conn)
+                    quebrada = True
+            try:
+                subpool.putconn(conn, close=quebrada)
                 return
-        except Exception:
-            pass
+            except Exception:
+                pass
 
         # Fallback: fecha a conexao diretamente
         try:
@@ -210,12 +437,12 @@ class _PoolConnectionWrapper:
         return returned or conn.closed
 
 
-def _make_pool_conn(conn):
+def _make_pool_conn(conn, subpool=None):
     """
     Envolve uma conexao do pool em um wrapper que intercepta close()
-    para devolver automaticamente ao pool via putconn().
+    para devolver automaticamente ao sub-pool de origem via putconn().
     """
-    return _PoolConnectionWrapper(conn)
+    return _PoolConnectionWrapper(conn, subpool)
 
 
 # =========================================================
@@ -233,21 +460,28 @@ def get_db_connection(use_dict_cursor=False, retry_count=3, retry_delay=2):
 
     Returns:
         Connection object ou None em caso de erro
+
+    Com o pool ativo, espera ate DB_POOL_TIMEOUT por uma conexao livre e
+    retorna None se o tempo esgotar — nao abre conexoes fora do pool.
     """
     global _connection_pool
 
-    # Tenta usar o pool se estiver habilitado e inicializado
+    # Usa o pool se estiver habilitado e inicializado
     if USE_CONNECTION_POOL and _connection_pool is not None:
         try:
-            conn = _connection_pool.getconn()
-            # Sempre redefine cursor_factory — o pool não reseta entre requests,
-            # então conexões reutilizadas podem carregar RealDictCursor de chamadas anteriores.
-            conn.cursor_factory = RealDictCursor if use_dict_cursor else psycopg2.extensions.cursor
-            return _make_pool_conn(conn)
+            subpool, conn = _connection_pool.getconn()
+        except PoolTimeout as e:
+            logger.error(f"Erro ao obter conexao do pool: {e}")
+            return None
         except Exception as e:
-            logger.warning(f"Erro ao obter conexao do pool: {e}. Usando conexao direta.")
-
-    # Conexao direta (padrao)
+            logger.error(f"Erro ao abrir conexao do pool: {e}")
+            return None
+        # Sempre redefine cursor_factory — o pool não reseta entre requests,
+        # então conexões reutilizadas podem carregar RealDictCursor de chamadas anteriores.
+        conn.cursor_factory = RealDictCursor if use_dict_cursor else psycopg2.extensions.cursor
+        return _make_pool_conn(conn, subpool)
+
+    # Conexao direta (pool desabilitado ou ainda nao inicializado)
     last_error = None
 
     for attempt in range(1, retry_count + 1):
@@ -360,10 +594,9 @@ def pool_health():
         }
 
     try:
-        # ThreadedConnectionPool expoe _used (dict de conexoes em uso)
-        # e _pool (lista de conexoes disponiveis)
-        used = len(getattr(_connection_pool, '_used', {}))
-        available = len(getattr(_connection_pool, '_pool', []))
+        subpools = {nome: sp.stats() for nome, sp in _connection_pool.subpools.items()}
+        used = sum(sp['used'] for sp in subpools.values())
+        available = sum(sp['available'] for sp in subpools.values())
 
         return {
             'status': 'healthy',
@@ -373,6 +606,9 @@ def pool_health():
             'available': available,
             'total': used + available,
             'utilization_pct': round(used / POOL_MAX_CONNECTIONS * 100, 1) if POOL_MAX_CONNECTIONS > 0 else 0,
+            'waiting': sum(sp['waiting'] for sp in subpools.values()),
+            'timeout_s': POOL_TIMEOUT,
+            'subpools': subpools,
         }
     except Exception as e:
         return {
@@ -381,6 +617,13 @@ def pool_health():
         }
 
 
+def pool_wait_histograms() -> dict:
+    """Histograma do tempo de espera por conexao, por sub-pool ({} sem pool)."""
+    if _connection_pool is None:
+        return {}
+    return {nome: sp.espera.snapshot() for nome, sp in _connection_pool.subpools.items()}
+
+
 def check_db_health():
     """
     Verifica a saude da conexao com o banco.
@@ -597,35 +840,6 @@ def init_db():
             CREATE INDEX IF NOT EXISTS idx_historico_criado ON historico_usuarios(criado_em);
         """)
 
-        # Log de acessos — histórico auditável de 6 meses
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS access_log (
-                id           BIGSERIAL PRIMARY KEY,
-                dt_acesso    TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                ip           VARCHAR(45) NOT NULL,
-                painel_codigo VARCHAR(50),
-                painel_nome  VARCHAR(150),
-                endpoint     VARCHAR(300),
-                descricao    TEXT NOT NULL,
-                metodo       VARCHAR(10) NOT NULL DEFAULT 'GET',
-                status_code  SMALLINT,
-                duracao_ms   INTEGER,
-                usuario_id   INTEGER,
-                usuario_nome VARCHAR(100),
-                tipo_acesso  VARCHAR(30) DEFAULT 'painel'
-            )
-        """)
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_access_log_dt
-                ON access_log(dt_acesso DESC);
-            CREATE INDEX IF NOT EXISTS idx_access_log_ip_dt
-                ON access_log(ip, dt_acesso DESC);
-            CREATE INDEX IF NOT EXISTS idx_access_log_painel
-                ON access_log(painel_codigo, dt_acesso DESC);
-            CREATE INDEX IF NOT EXISTS idx_access_log_tipo
-                ON access_log(tipo_acesso, dt_acesso DESC);
-        """)
-
         # Dispositivos TV — terminais de plantão com autenticação por token
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS dispositivos_tv (
@@ -676,21 +890,11 @@ def init_db():
         except Exception:
             conn.rollback()  # tabela pode não existir neste schema
 
-        # P2.12 — access_log GIN trigram para ILIKE bilateral
-        try:
-            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_access_log_descricao_gin
-                    ON access_log USING GIN (descricao gin_trgm_ops)
-            """)
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_access_log_usuario_gin
-                    ON access_log USING GIN (usuario_nome gin_trgm_ops)
-            """)
-        except Exception:
-            conn.rollback()  # pg_trgm pode não estar disponível — sem impacto funcional
-
         conn.commit()
+
+        # Log de acessos — particionado por mes + rollups (access_log_store)
+        init_access_log(conn)
+
         cursor.close()
         conn.close()
 
@@ -0,0 +1,319 @@
+"""
+Estimador de Tempo de Espera do Pronto Socorro
+Sistema de Paineis Hospitalares
+
+Fonte unica da espera (senha/entrada -> medico) por clinica, usada pelo
+painel17 (mediana, faixa e tendencia) e pela mediana do painel10:
+- Ingestao incremental de painel17_atendimentos_ps: a cada carga do ETL
+  (geracao da tabela em backend.cache) so entram os atendimentos com
+  dt_inicio_atendimento_med a partir do ultimo ja visto, menos uma margem
+  para linhas que chegam atrasadas; nr_atendimento deduplica
+- Janela deslizante por clinica: ultimos JANELA_RECENTES atendidos mais o
+  que ainda pode cair na janela de tendencia (1-2h atras) — o resto e
+  descartado na ingestao, entao a memoria nao cresce com o historico
+- calcular_metricas(): mediana, faixa estreita e tendencia; os dois
+  paineis usam a mesma funcao e por isso nunca divergem
+- Recarga completa periodica (ESPERA_PS_RECARGA_SEG) corrige linhas que o
+  ETL alterou fora da margem
+- A consulta ao banco roda fora do lock das janelas: os paineis continuam
+  lendo os agregados enquanto o incremento (ou a recarga de 7 dias) chega
+
+Limite conhecido: a marca d'agua e o proprio dt_inicio_atendimento_med,
+nao o horario da carga (a tabela vem do ETL sem coluna de carga). Uma
+linha que chega com dt_inicio_atendimento_med mais de
+ESPERA_PS_SOBREPOSICAO_MIN antes da marca so entra na proxima recarga
+completa — ate ESPERA_PS_RECARGA_SEG de atraso.
+
+As amostras por clinica sao poucas (JANELA_RECENTES), entao mediana e
+percentis sao exatos — mesma definicao de PERCENTILE_CONT/PERCENTILE_DISC.
+"""
+
+import bisect
+import logging
+import math
+import os
+import statistics
+import threading
+import time
+from datetime import timedelta
+
+from backend.cache import get_generations
+
+logger = logging.getLogger(__name__)
+
+# =========================================================
+# CONFIGURACAO
+# =========================================================
+
+TABELA = 'painel17_atendimentos_ps'
+CHAVE_ACOLHIMENTO = 'acolhimento'
+
+JANELA_RECENTES = 5
+MAX_ESPERA_MINUTOS = 300
+
+# Historico considerado para "ultimos N atendidos" e para a inatividade
+DIAS_HISTORICO = 7
+
+# Tendencia: mediana atual contra a dos atendidos entre 2h e 1h atras
+HORAS_TENDENCIA_INI = 2
+HORAS_TENDENCIA_FIM = 1
+
+# Faixa estreita: spread maximo de 5 min em torno da mediana
+SPREAD_MAX = 5
+SPREAD_MIN = 3
+
+# Apos HORAS_INATIVIDADE sem atendimento, retorna TEMPO_PADRAO_INATIVIDADE em vez dos dados antigos
+TEMPO_PADRAO_INATIVIDADE = 15
+HORAS_INATIVIDADE = 2
+
+# Margem do incremento para linhas atrasadas; mais atrasadas que isso, so na recarga completa
+ESPERA_PS_SOBREPOSICAO_MIN = int(os.getenv('ESPERA_PS_SOBREPOSICAO_MIN', '30'))
+# Sem ETL registrando geracao (Redis fora), consulta o incremento neste intervalo
+ESPERA_PS_INTERVALO_SEG = float(os.getenv('ESPERA_PS_INTERVALO_SEG', '60'))
+ESPERA_PS_RECARGA_SEG   = float(os.getenv('ESPERA_PS_RECARGA_SEG', '3600'))
+
+SQL_INGESTAO = """
+    SELECT nr_atendimento, cd_clinica, clinica, dt_entrada, retirada_senha,
+           dt_inicio_atendimento, dt_inicio_atendimento_med
+    FROM painel17_atendimentos_ps
+    WHERE dt_inicio_atendimento_med >= %(desde)s
+"""
+
+
+# =========================================================
+# METRICAS
+# =========================================================
+
+def _espera(inicio, fim):
+    """Minutos entre inicio e fim (1 casa), ou None fora de (0, MAX_ESPERA_MINUTOS]."""
+    if inicio is None or fim is None:
+        return None
+    diff = (fim - inicio).total_seconds() / 60.0
+    return round(diff, 1) if 0 < diff <= MAX_ESPERA_MINUTOS else None
+
+
+def _percentil_disc(ordenados, p):
+    """PERCENTILE_DISC: primeiro valor com distribuicao acumulada >= p."""
+    if not ordenados:
+        return None
+    return ordenados[max(0, math.ceil(p * len(ordenados)) - 1)]
+
+
+def _sem_dados(mediana=None):
+    return {
+        'mediana': mediana,
+        'faixa_min': mediana,
+        'faixa_max': mediana,
+        'tendencia': 'sem_dados',
+        'amostra': 0
+    }
+
+
+def calcular_metricas(row, agora):
+    """
+    Converte o agregado de uma clinica em mediana, faixa estreita
+    (spread max 5 min) e tendencia. Clinica sem atendimento ha mais de
+    HORAS_INATIVIDADE horas recebe TEMPO_PADRAO_INATIVIDADE.
+    """
+    ultimo = row.get('ultimo')
+    if ultimo is None:
+        return _sem_dados()
+    if agora - ultimo >= timedelta(hours=HORAS_INATIVIDADE):
+        return _sem_dados(TEMPO_PADRAO_INATIVIDADE)
+    if not row.get('amostra'):
+        return _sem_dados()
+
+    mediana = float(row['mediana'])
+
+    # Faixa estreita centrada na mediana (percentis 35-65 da amostra)
+    if row['amostra'] >= 3:
+        spread_natural = float(row['p65']) - float(row['p35'])
+    else:
+        spread_natural = SPREAD_MIN
+
+    # Limita o spread entre SPREAD_MIN e SPREAD_MAX
+    spread = max(SPREAD_MIN, min(SPREAD_MAX, spread_natural))
+
+    # Distribui o spread: 40% abaixo, 60% acima da mediana
+    faixa_min = max(1, round(mediana - spread * 0.4))
+    faixa_max = round(mediana + spread * 0.6)
+
+    # Garantir minimo de SPREAD_MIN de diferenca
+    if faixa_max - faixa_min < SPREAD_MIN:
+        faixa_max = faixa_min + SPREAD_MIN
+
+    # Tendencia
+    tendencia = 'estavel'
+    if row.get('mediana_1h') is not None:
+        mediana_1h = float(row['mediana_1h'])
+        diff_pct = ((mediana - mediana_1h) / mediana_1h * 100) if mediana_1h > 0 else 0
+
+        if diff_pct > 15:
+            tendencia = 'subindo'
+        elif diff_pct < -15:
+            tendencia = 'descendo'
+
+    return {
+        'mediana': round(mediana),
+        'faixa_min': faixa_min,
+        'faixa_max': faixa_max,
+        'tendencia': tendencia,
+        'amostra': row['amostra']
+    }
+
+
+# =========================================================
+# ESTIMADOR
+# =========================================================
+
+class EstimadorEspera:
+    """
+    Janelas de atendimentos por chave (cd_clinica ou CHAVE_ACOLHIMENTO),
+    cada uma uma lista de (fim, nr_atendimento, espera) ordenada por fim.
+    espera None = atendimento fora da faixa valida: ocupa posicao entre os
+    ultimos N, mas nao entra na mediana (como no agregado SQL original).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()           # janelas (ingestao e leitura)
+        self._ingestao_lock = threading.Lock()  # uma consulta ao banco por vez
+        self._janelas = {}          # chave -> [(fim, nr, espera)]
+        self._nomes = {}            # cd_clinica -> nome mais recente
+        self._indice = {}           # nr -> {chave: fim}
+        self._marca = None          # maior dt_inicio_atendimento_med ingerido
+        self._carregado = False
+        self._geracao = None
+        self._verificado_em = 0.0
+        self._recarregado_em = 0.0
+
+    # ----------------------------------------------------- ingestao
+
+    def atualizar(self, cursor, agora, forcar=False) -> int:
+        """
+        Le o incremento de painel17_atendimentos_ps quando houve carga nova
+        (ou passou ESPERA_PS_INTERVALO_SEG). Retorna as linhas lidas.
+        A consulta roda so sob _ingestao_lock; o lock das janelas e tomado
+        apenas para aplicar as linhas.
+        """
+        geracao = get_generations((TABELA,))[TABELA]
+        with self._ingestao_lock:
+            agora_m = time.monotonic()
+            completa = not self._carregado or agora_m - self._recarregado_em >= ESPERA_PS_RECARGA_SEG
+            if (not completa and not forcar and geracao == self._geracao
+                    and agora_m - self._verificado_em < ESPERA_PS_INTERVALO_SEG):
+                return 0
+
+            if completa or self._marca is None:
+                desde = agora - timedelta(days=DIAS_HISTORICO)
+            else:
+                desde = self._marca - timedelta(minutes=ESPERA_PS_SOBREPOSICAO_MIN)
+            cursor.execute(SQL_INGESTAO, {'desde': desde})
+            linhas = cursor.fetchall()
+
+            with self._lock:
+                if completa:
+                    self._janelas, self._nomes, self._indice = {}, {}, {}
+                    self._marca = None
+                for row in linhas:
+                    self._ingerir(row)
+                self._podar(agora)
+
+            if completa:
+                self._recarregado_em = agora_m
+            self._carregado = True
+            self._geracao = geracao
+            self._verificado_em = agora_m
+        logger.debug('Espera PS: %d linhas (%s)', len(linhas), 'completa' if completa else 'incremental')
+        return len(linhas)
+
+    def _ingerir(self, row):
+        nr = row['nr_atendimento']
+        fim_med = row['dt_inicio_atendimento_med']
+        inicio = row['retirada_senha'] or row['dt_entrada']
+        self._remover(nr)
+
+        entradas = {}
+        cd = row['cd_clinica']
+        if cd is not None:
+            entradas[cd] = (fim_med, _espera(inicio, fim_med))
+            if row['clinica']:
+                self._nomes[cd] = row['clinica']
+        # Acolhimento so conta quando aconteceu antes do medico
+        fim_acol = row['dt_inicio_atendimento']
+        if fim_acol is not None and fim_acol < fim_med:
+            entradas[CHAVE_ACOLHIMENTO] = (fim_acol, _espera(inicio, fim_acol))
+
+        for chave, (fim, espera) in entradas.items():
+            bisect.insort(self._janelas.setdefault(chave, []), (fim, nr, espera))
+        if entradas:
+            self._indice[nr] = {chave: fim for chave, (fim, _) in entradas.items()}
+        if self._marca is None or fim_med > self._marca:
+            self._marca = fim_med
+
+    def _remover(self, nr):
+        """Tira a versao anterior de um atendimento (o ETL atualiza linhas)."""
+        for chave, fim in self._indice.pop(nr, {}).items():
+            lista = self._janelas.get(chave, [])
+            i = bisect.bisect_left(lista, (fim, nr))
+            if i < len(lista) and lista[i][:2] == (fim, nr):
+                del lista[i]
+
+    def _podar(self, agora):
+        """Mantem por chave os ultimos JANELA_RECENTES e tudo a partir do inicio da tendencia."""
+        limite = agora - timedelta(hours=HORAS_TENDENCIA_INI)
+        for chave, lista in self._janelas.items():
+            corte = max(0, min(bisect.bisect_left(lista, (limite,)), len(lista) - JANELA_RECENTES))
+            for _, nr, _ in lista[:corte]:
+                fins = self._indice.get(nr)
+                if fins is not None:
+                    fins.pop(chave, None)
+                    if not fins:
+                        del self._indice[nr]
+            del lista[:corte]
+
+    # ----------------------------------------------------- leitura
+
+    def agregados(self, agora) -> dict:
+        """
+        {chave: {clinica, ultimo, amostra, mediana, p35, p65, mediana_1h}}
+        para as chaves com atendimento nos ultimos DIAS_HISTORICO dias —
+        o formato que calcular_metricas() recebe.
+        """
+        desde = agora - timedelta(days=DIAS_HISTORICO)
+        tend_ini = agora - timedelta(hours=HORAS_TENDENCIA_INI)
+        tend_fim = agora - timedelta(hours=HORAS_TENDENCIA_FIM)
+        resultado = {}
+        with self._lock:
+            for chave, lista in self._janelas.items():
+                inicio = max(bisect.bisect_left(lista, (desde,)), len(lista) - JANELA_RECENTES)
+                recentes = lista[inicio:]
+                if not recentes:
+                    continue
+                esperas = sorted(e for _, _, e in recentes if e is not None)
+
+                i0 = bisect.bisect_left(lista, (tend_ini,))
+                i1 = bisect.bisect_right(lista, (tend_fim, math.inf))
+                tendencia = lista[max(i0, i1 - JANELA_RECENTES):i1]
+                esperas_1h = [e for _, _, e in tendencia if e is not None]
+
+                resultado[chave] = {
+                    'clinica': self._nomes.get(chave),
+                    'ultimo': recentes[-1][0],
+                    'amostra': len(esperas),
+                    'mediana': statistics.median(esperas) if esperas else None,
+                    'p35': _percentil_disc(esperas, 0.35),
+                    'p65': _percentil_disc(esperas, 0.65),
+                    'mediana_1h': statistics.median(esperas_1h) if esperas_1h else None,
+                }
+        return resultado
+
+    def medianas_por_clinica(self, agora) -> dict:
+        """{nome da clinica: mediana exibida no painel17} (None sem dados)."""
+        return {
+            ag['clinica']: calcular_metricas(ag, agora)['mediana']
+            for chave, ag in self.agregados(agora).items()
+            if chave != CHAVE_ACOLHIMENTO and ag['clinica']
+        }
+
+
+estimador_espera = EstimadorEspera()
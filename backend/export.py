@@ -0,0 +1,150 @@
+"""
+Exportacao em Streaming (CSV / XLSX)
+Sistema de Paineis Hospitalares
+
+Funcionalidades:
+- ConsultaStream: cursor nomeado (server-side) com itersize — as linhas
+  chegam do PostgreSQL em lotes, sem fetchall()
+- csv_response: resposta Flask em streaming, gerando o CSV em blocos
+- xlsx_response: grava um Workbook openpyxl write-only em arquivo
+  temporario e envia (memoria constante, sem limite de linhas)
+
+Uso:
+    linhas = consulta_stream(sql, params)
+    return csv_response('relatorio.csv', ['Col A', 'Col B'],
+                        ([r['a'], r['b']] for r in linhas), ao_fechar=linhas.fechar)
+"""
+
+import csv
+import io
+import logging
+import os
+import tempfile
+import uuid
+
+from flask import Response, send_file, stream_with_context
+from psycopg2.extras import RealDictCursor
+
+from backend.database import get_db_connection, release_connection
+
+logger = logging.getLogger(__name__)
+
+EXPORT_ITERSIZE    = int(os.getenv('EXPORT_ITERSIZE', '2000'))       # linhas por ida ao banco
+EXPORT_CHUNK_BYTES = int(os.getenv('EXPORT_CHUNK_BYTES', '65536'))   # tamanho dos blocos enviados
+# XLSX acima disso vai para disco em vez de memoria
+EXPORT_XLSX_SPOOL_BYTES = int(os.getenv('EXPORT_XLSX_SPOOL_BYTES', str(8 * 1024 * 1024)))
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class ConsultaStream:
+    """
+    Itera as linhas de uma consulta por um cursor nomeado.
+
+    A conexao fica reservada enquanto a exportacao e enviada e e devolvida
+    ao pool ao fim da iteracao ou em fechar() (idempotente — registrar com
+    call_on_close para cobrir cliente que desconecta no meio do download).
+    Erros de sintaxe/planejamento aparecem ja no construtor.
+    """
+
+    def __init__(self, sql, params=None, itersize: int = None, cursor_factory=RealDictCursor, conn=None):
+        self._propria = conn is None
+        self.conn = get_db_connection() if conn is None else conn
+        if self.conn is None:
+            raise ConnectionError('Nao foi possivel obter conexao com o banco')
+        self.cursor = None
+        try:
+            self.cursor = self.conn.cursor(name=f'export_{uuid.uuid4().hex[:12]}',
+                                           cursor_factory=cursor_factory)
+            self.cursor.itersize = itersize or EXPORT_ITERSIZE
+            self.cursor.execute(sql, params)
+        except Exception:
+            self.fechar()
+            raise
+
+    def __iter__(self):
+        try:
+            yield from self.cursor
+        finally:
+            self.fechar()
+
+    def fechar(self):
+        cursor, self.cursor = self.cursor, None
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        conn, self.conn = self.conn, None
+        if conn is not None and self._propria:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            release_connection(conn)
+
+
+def consulta_stream(sql, params=None, itersize: int = None, conn=None) -> ConsultaStream:
+    """Atalho para ConsultaStream com RealDictCursor."""
+    return ConsultaStream(sql, params, itersize=itersize, conn=conn)
+
+
+# =========================================================
+# CSV
+# =========================================================
+
+def csv_stream(cabecalho, linhas, quoting=csv.QUOTE_MINIMAL, bom: bool = True):
+    """Gera o CSV em blocos de ~EXPORT_CHUNK_BYTES (UTF-8, BOM para o Excel)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, quoting=quoting)
+    if bom:
+        buf.write('\ufeff')
+    writer.writerow(cabecalho)
+    for linha in linhas:
+        writer.writerow(linha)
+        if buf.tell() >= EXPORT_CHUNK_BYTES:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode('utf-8')
+
+
+def csv_response(nome_arquivo: str, cabecalho, linhas, quoting=csv.QUOTE_MINIMAL,
+                 bom: bool = True, ao_fechar=None) -> Response:
+    """
+    Resposta CSV em streaming. `linhas` e um iteravel de listas (tipicamente
+    um gerador sobre ConsultaStream); ao_fechar libera a consulta mesmo se o
+    download for interrompido.
+    """
+    response = Response(
+        stream_with_context(csv_stream(cabecalho, linhas, quoting=quoting, bom=bom)),
+        mimetype='text/csv',            # werkzeug acrescenta charset=utf-8
+        headers={'Content-Disposition': f'attachment; filename="{nome_arquivo}"'},
+    )
+    if ao_fechar is not None:
+        response.call_on_close(ao_fechar)
+    return response
+
+
+# =========================================================
+# XLSX
+# =========================================================
+
+def xlsx_workbook():
+    """Workbook openpyxl em modo write-only (linhas vao para arquivo temporario)."""
+    import openpyxl
+    return openpyxl.Workbook(write_only=True)
+
+
+def xlsx_response(wb, nome_arquivo: str):
+    """Salva o workbook write-only e envia como anexo."""
+    arquivo = tempfile.SpooledTemporaryFile(max_size=EXPORT_XLSX_SPOOL_BYTES)
+    try:
+        wb.save(arquivo)
+        arquivo.seek(0)
+    except Exception:
+        arquivo.close()
+        raise
+    return send_file(arquivo, mimetype=XLSX_MIMETYPE, as_attachment=True,
+                     download_name=nome_arquivo)
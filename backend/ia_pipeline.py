@@ -0,0 +1,366 @@
+"""
+Pipeline de Analises IA (Groq)
+Sistema de Paineis Hospitalares
+
+Fila unica para os workers que chamam o LLM (ia_risk_analyzer_groq,
+painel7_sepse_worker):
+- Fila de prioridade: CRITICO > ALTO > MODERADO > BAIXO; dentro do mesmo
+  nivel, a ordem de chegada (a ordem do SELECT do worker)
+- GROQ_CONCORRENCIA chamadas simultaneas, limitadas por dois token
+  buckets (requisicoes/min e tokens/min) — a vazao acompanha o limite da
+  conta em vez de um sleep fixo entre pacientes
+- 429: a tentativa volta a fila com backoff exponencial com jitter (ou o
+  Retry-After da resposta) e segura o bucket para todas as threads
+- Gravacao por um unico escritor com conexao persistente: cada resultado e
+  gravado assim que fica pronto, sem abrir uma conexao por paciente
+
+Uso:
+    pipeline = PipelineIA('sepse', conectar=get_db_connection)
+    futuros = [pipeline.submeter(executar, gravar, nivel='CRITICO', tokens=1500)
+               for ...]
+    pipeline.aguardar(futuros)
+"""
+
+import itertools
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future, wait
+
+logger = logging.getLogger(__name__)
+
+# =========================================================
+# CONFIGURACAO
+# =========================================================
+
+GROQ_RPM         = int(os.getenv('GROQ_RPM', '30'))          # requisicoes/minuto
+GROQ_TPM         = int(os.getenv('GROQ_TPM', '12000'))       # tokens/minuto
+GROQ_CONCORRENCIA = int(os.getenv('GROQ_CONCORRENCIA', '4'))
+GROQ_MAX_TENTATIVAS = int(os.getenv('GROQ_MAX_TENTATIVAS', '5'))
+GROQ_BACKOFF_BASE = float(os.getenv('GROQ_BACKOFF_BASE', '2'))   # segundos
+GROQ_BACKOFF_MAX  = float(os.getenv('GROQ_BACKOFF_MAX', '60'))
+# Tamanho tipico de uma resposta, para o bucket de tokens (max_tokens superestima)
+GROQ_TOKENS_RESPOSTA = int(os.getenv('GROQ_TOKENS_RESPOSTA', '600'))
+
+PRIORIDADES = {'CRITICO': 0, 'ALTO': 1, 'MODERADO': 2, 'BAIXO': 3}
+_PRIORIDADE_PADRAO = PRIORIDADES['MODERADO']
+
+
+class ErroLimiteTaxa(Exception):
+    """HTTP 429 do provedor; retry_after em segundos quando a resposta informa."""
+
+    def __init__(self, mensagem='limite de taxa', retry_after=None):
+        super().__init__(mensagem)
+        self.retry_after = retry_after
+
+
+def retry_after(headers):
+    """Segundos do cabecalho Retry-After (None se ausente/invalido)."""
+    try:
+        valor = (headers or {}).get('retry-after')
+        return float(valor) if valor is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def estimar_tokens(prompt: str, resposta: int = GROQ_TOKENS_RESPOSTA) -> int:
+    """~4 caracteres por token no prompt + tamanho tipico da resposta."""
+    return len(prompt) // 4 + resposta
+
+
+def prioridade(nivel) -> int:
+    """'CRÍTICO'/'CRITICO'/'critico' -> 0 ... nivel desconhecido -> MODERADO."""
+    if not nivel:
+        return _PRIORIDADE_PADRAO
+    nfkd = unicodedata.normalize('NFKD', str(nivel).upper().strip())
+    return PRIORIDADES.get(''.join(c for c in nfkd if not unicodedata.combining(c)), _PRIORIDADE_PADRAO)
+
+
+# =========================================================
+# LIMITADOR (TOKEN BUCKET)
+# =========================================================
+
+class LimitadorTaxa:
+    """Dois baldes (requisicoes e tokens) reabastecidos continuamente por minuto."""
+
+    def __init__(self, rpm=GROQ_RPM, tpm=GROQ_TPM, relogio=time.monotonic):
+        self._rpm = float(rpm)
+        self._tpm = float(tpm)
+        self._req = float(rpm)
+        self._tok = float(tpm)
+        self._relogio = relogio
+        self._atualizado = relogio()
+        self._bloqueado_ate = 0.0
+        self._lock = threading.Lock()
+
+    def _reabastecer(self, agora):
+        decorrido = agora - self._atualizado
+        self._atualizado = agora
+        self._req = min(self._rpm, self._req + decorrido * self._rpm / 60.0)
+        self._tok = min(self._tpm, self._tok + decorrido * self._tpm / 60.0)
+
+    def tentar(self, tokens) -> float:
+        """Consome e retorna 0 se ha saldo; senao, os segundos ate haver."""
+        tokens = min(float(tokens), self._tpm)
+        with self._lock:
+            agora = self._relogio()
+            self._reabastecer(agora)
+            if agora < self._bloqueado_ate:
+                return self._bloqueado_ate - agora
+            if self._req >= 1 and self._tok >= tokens:
+                self._req -= 1
+                self._tok -= tokens
+                return 0.0
+            falta_req = max(0.0, 1 - self._req) * 60.0 / self._rpm
+            falta_tok = max(0.0, tokens - self._tok) * 60.0 / self._tpm
+            return max(falta_req, falta_tok)
+
+    def aguardar(self, tokens, parar=None):
+        """Bloqueia ate consumir 1 requisicao + `tokens`. False se `parar` foi sinalizado."""
+        while True:
+            espera = self.tentar(tokens)
+            if espera <= 0:
+                return True
+            if parar is not None:
+                if parar.wait(espera):
+                    return False
+            else:
+                time.sleep(espera)
+
+    def segurar(self, segundos):
+        """Ninguem chama o provedor pelos proximos `segundos` (apos um 429)."""
+        with self._lock:
+            self._bloqueado_ate = max(self._bloqueado_ate, self._relogio() + segundos)
+            self._req = 0.0
+
+
+def backoff(tentativa, retry=None) -> float:
+    """Retry-After quando informado; senao exponencial com jitter total."""
+    if retry is not None:
+        return min(GROQ_BACKOFF_MAX, retry)
+    return random.uniform(0, min(GROQ_BACKOFF_MAX, GROQ_BACKOFF_BASE * (2 ** tentativa)))
+
+
+# =========================================================
+# PIPELINE
+# =========================================================
+
+class _Tarefa:
+    __slots__ = ('executar', 'gravar', 'tokens', 'limitar', 'rotulo', 'futuro', 'tentativa')
+
+    def __init__(self, executar, gravar, tokens, limitar, rotulo):
+        self.executar = executar
+        self.gravar = gravar
+        self.tokens = tokens
+        self.limitar = limitar
+        self.rotulo = rotulo
+        self.futuro = Future()
+        self.tentativa = 0
+
+
+class PipelineIA:
+    """
+    executar() -> resultado (None = falha sem nova tentativa; ErroLimiteTaxa
+    = 429, volta para a fila). gravar(conn, resultado) -> bool roda na thread
+    escritora, com a conexao persistente; o commit fica por conta do escritor.
+    O futuro de cada tarefa termina com o retorno de gravar (ou False).
+    """
+
+    def __init__(self, nome, conectar, concorrencia=GROQ_CONCORRENCIA, limitador=None):
+        self.nome = nome
+        self._conectar = conectar
+        self._concorrencia = max(1, concorrencia)
+        self.limitador = limitador or LimitadorTaxa()
+        self._fila = []             # (prioridade, liberada_em, seq, tarefa)
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._gravacoes = queue.Queue()
+        self._gravacoes_lock = threading.Lock()
+        self._gravacoes_abertas = False
+        self._parar = threading.Event()
+        self._threads = []
+        self._escritor = None
+        self._conn = None
+        self._stats_lock = threading.Lock()
+        self.stats = {'chamadas': 0, 'limite_429': 0, 'falhas': 0, 'gravadas': 0}
+
+    # ----------------------------------------------------- API
+
+    def submeter(self, executar, gravar, nivel=None, tokens=0, rotulo='', limitar=True) -> Future:
+        """
+        limitar=False: a tarefa nao passa pelo bucket antes de executar();
+        ela mesma cobra cada chamada real a API com consumir() (fallback de
+        modelo, resposta que pode sair do backend.llm_cache).
+        """
+        tarefa = _Tarefa(executar, gravar, tokens, limitar, rotulo)
+        self._iniciar()
+        self._enfileirar(prioridade(nivel), tarefa, 0.0)
+        return tarefa.futuro
+
+    def consumir(self, tokens) -> bool:
+        """Cobra 1 requisicao + `tokens` do bucket, esperando saldo. False apos parar()."""
+        return self.limitador.aguardar(tokens, self._parar)
+
+    def aguardar(self, futuros, timeout=None) -> dict:
+        """Espera os futuros; retorna {'sucessos', 'falhas'}."""
+        feitos, _ = wait(futuros, timeout=timeout)
+        sucessos = sum(1 for f in feitos if not f.exception() and f.result())
+        return {'sucessos': sucessos, 'falhas': len(futuros) - sucessos}
+
+    def parar(self, timeout=10.0):
+        """
+        Encerra as threads; tarefas ainda na fila terminam como falha.
+        As chamadas em andamento terminam primeiro e o escritor grava os
+        resultados delas antes de sair; o que chegar depois disso (thread
+        que estourou o timeout) termina como falha.
+        """
+        self._parar.set()
+        with self._cond:
+            pendentes = [t for _, _, _, t in self._fila]
+            self._fila.clear()
+            self._cond.notify_all()
+        for tarefa in pendentes:
+            tarefa.futuro.set_result(False)
+        for t in self._threads:
+            t.join(timeout)
+        with self._gravacoes_lock:
+            self._gravacoes_abertas = False
+            self._gravacoes.put(None)
+        if self._escritor is not None:
+            self._escritor.join(timeout)
+            if not self._escritor.is_alive():
+                self._descartar_gravacoes()
+        self._threads = []
+        self._escritor = None
+        self._fechar_conexao()
+
+    def _contar(self, chave):
+        with self._stats_lock:
+            self.stats[chave] += 1
+
+    # ----------------------------------------------------- fila
+
+    def _iniciar(self):
+        if self._threads:
+            return
+        self._parar.clear()
+        self._gravacoes_abertas = True
+        for i in range(self._concorrencia):
+            t = threading.Thread(target=self._loop_chamadas, name=f'ia_{self.nome}_{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+        self._escritor = threading.Thread(target=self._loop_escritor, name=f'ia_{self.nome}_escritor',
+                                          daemon=True)
+        self._escritor.start()
+
+    def _enfileirar(self, prio, tarefa, atraso):
+        with self._cond:
+            self._fila.append((prio, time.monotonic() + atraso, next(self._seq), tarefa))
+            self._cond.notify()
+
+    def _proxima(self):
+        """Tarefa de maior prioridade ja liberada (respeitando o backoff)."""
+        with self._cond:
+            while not self._parar.is_set():
+                agora = time.monotonic()
+                prontas = [item for item in self._fila if item[1] <= agora]
+                if prontas:
+                    item = min(prontas)
+                    self._fila.remove(item)
+                    return item[0], item[3]
+                proximo = min((item[1] for item in self._fila), default=None)
+                self._cond.wait(None if proximo is None else proximo - agora)
+        return None, None
+
+    # ----------------------------------------------------- chamadas
+
+    def _loop_chamadas(self):
+        while not self._parar.is_set():
+            prio, tarefa = self._proxima()
+            if tarefa is None:
+                return
+            if tarefa.limitar and not self.limitador.aguardar(tarefa.tokens, self._parar):
+                tarefa.futuro.set_result(False)
+                return
+            self._contar('chamadas')
+            try:
+                resultado = tarefa.executar()
+            except ErroLimiteTaxa as e:
+                self._contar('limite_429')
+                tarefa.tentativa += 1
+                if tarefa.tentativa >= GROQ_MAX_TENTATIVAS:
+                    logger.error('[ia:%s] %s: limite de taxa apos %d tentativas',
+                                 self.nome, tarefa.rotulo, tarefa.tentativa)
+                    self._contar('falhas')
+                    tarefa.futuro.set_result(False)
+                    continue
+                atraso = backoff(tarefa.tentativa, e.retry_after)
+                self.limitador.segurar(atraso)
+                logger.warning('[ia:%s] 429 em %s; nova tentativa em %.1fs', self.nome, tarefa.rotulo, atraso)
+                self._enfileirar(prio, tarefa, atraso)
+                continue
+            except Exception as e:
+                logger.error('[ia:%s] Erro em %s: %s', self.nome, tarefa.rotulo, e)
+                resultado = None
+            if resultado is None:
+                self._contar('falhas')
+                tarefa.futuro.set_result(False)
+            else:
+                self._entregar(tarefa, resultado)
+
+    # ----------------------------------------------------- escritor
+
+    def _conexao(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = self._conectar()
+        return self._conn
+
+    def _fechar_conexao(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _entregar(self, tarefa, resultado):
+        """Passa o resultado ao escritor; depois do parar() a tarefa falha."""
+        with self._gravacoes_lock:
+            if self._gravacoes_abertas:
+                self._gravacoes.put((tarefa, resultado))
+                return
+        tarefa.futuro.set_result(False)
+
+    def _descartar_gravacoes(self):
+        while True:
+            try:
+                item = self._gravacoes.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                item[0].futuro.set_result(False)
+
+    def _loop_escritor(self):
+        while True:
+            item = self._gravacoes.get()
+            if item is None:
+                return
+            tarefa, resultado = item
+            ok = False
+            try:
+                conn = self._conexao()
+                ok = bool(tarefa.gravar(conn, resultado))
+                if ok:
+                    conn.commit()
+                    self._contar('gravadas')
+                else:
+                    conn.rollback()
+            except Exception as e:
+                logger.error('[ia:%s] Erro ao gravar %s: %s', self.nome, tarefa.rotulo, e)
+                # Conexao possivelmente quebrada: a proxima gravacao reconecta
+                self._fechar_conexao()
+            tarefa.futuro.set_result(ok)
@@ -5,6 +5,8 @@ Worker de Análise Clínica IA - VERSÃO MELHORADA
 ✅ Persistência de análises
 ✅ Hash para detectar mudanças
 ✅ Evita reprocessamento desnecessário
+✅ Pipeline IA compartilhado (backend.ia_pipeline): prioridade pela última
+   criticidade, chamadas paralelas dentro do limite de taxa, um escritor
 """
 
 import os
@@ -16,7 +18,14 @@ from typing import Dict, List, Optional
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
-from groq import Groq
+from groq import Groq, RateLimitError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.ia_pipeline import (  # noqa: E402
+    PipelineIA, ErroLimiteTaxa, estimar_tokens, retry_after,
+)
+from backend.llm_cache import CacheLLM  # noqa: E402
 
 load_dotenv()
 
@@ -34,6 +43,10 @@ BATCH_SIZE = 30  # Pacientes por ciclo
 MAX_TOKENS = 2000  # Tokens máximos da resposta IA
 HORAS_VALIDADE_ANALISE = 24  # Análise válida por 24 horas
 
+# Suba a versão quando o texto do prompt mudar de significado (invalida o llm_cache)
+VERSAO_PROMPT = 'risco-1'
+PARAMS_IA = {'temperature': 0.3, 'max_tokens': MAX_TOKENS}
+
 if not GROQ_API_KEY:
     print("ERRO: GROQ_API_KEY não configurada no .env")
     sys.exit(1)
@@ -48,9 +61,12 @@ class ClinicalAIAnalyzer:
     """
 
     def __init__(self):
-        self.client = Groq(api_key=GROQ_API_KEY)
+        # Sem retry interno do SDK: 429 e backoff ficam com o pipeline
+        self.client = Groq(api_key=GROQ_API_KEY, max_retries=0)
         self.modelo = "llama-3.3-70b-versatile"
         self.ciclo_atual = 0
+        self.pipeline = PipelineIA('risco', conectar=self.get_db_connection)
+        self.cache = CacheLLM(self.get_db_connection, nome='risco')
         print(f"Cliente Groq inicializado: {self.modelo}")
         print(f"Limite: {MAX_CICLOS} ciclos")
         print(f"Intervalo: {INTERVALO_ANALISE}s")
@@ -130,7 +146,8 @@ class ClinicalAIAnalyzer:
                     p.exm_troponina,
                     p.exm_hemoglobina,
                     ia.dt_analise AS ultima_analise,
-                    ia.hash_dados AS hash_anterior
+                    ia.hash_dados AS hash_anterior,
+                    ia.nivel_criticidade AS criticidade_anterior
                 FROM 
                     public.painel_clinico_tasy p
                     LEFT JOIN public.painel_clinico_analise_ia ia
@@ -200,14 +217,10 @@ EXAMES LABORATORIAIS:
 - Troponina: {fmt(paciente.get('exm_troponina'), 'ng/mL')}
 """
 
-    def analisar_paciente(self, paciente: Dict) -> Optional[Dict]:
-        """
-        Realiza análise clínica usando IA
-        Retorna dict com análise ou None se erro
-        """
+    def montar_prompt(self, paciente: Dict) -> str:
         contexto = self.formatar_contexto_clinico(paciente)
 
-        prompt = f"""Você é um médico intensivista experiente analisando pacientes em UTI/Enfermaria.
+        return f"""Você é um médico intensivista experiente analisando pacientes em UTI/Enfermaria.
 
 {contexto}
 
@@ -223,27 +236,47 @@ Analise o quadro clínico e forneça:
 
 Seja conciso e objetivo. Foque nos achados mais relevantes."""
 
+    def montar_mensagens(self, paciente: Dict) -> List[Dict]:
+        return [
+            {
+                "role": "system",
+                "content": "Você é um médico intensivista experiente. Suas análises são claras, objetivas e baseadas em evidências."
+            },
+            {
+                "role": "user",
+                "content": self.montar_prompt(paciente)
+            }
+        ]
+
+    def _chamar_groq(self, mensagens: List[Dict]) -> Optional[str]:
+        # Só a chamada real à API é cobrada do limite de taxa (acerto de cache não)
+        if not self.pipeline.consumir(estimar_tokens(mensagens[-1]['content'])):
+            return None
+        response = self.client.chat.completions.create(
+            messages=mensagens,
+            model=self.modelo,
+            **PARAMS_IA
+        )
+        return response.choices[0].message.content
+
+    def analisar_paciente(self, paciente: Dict) -> Optional[Dict]:
+        """
+        Realiza análise clínica usando IA
+        Retorna dict com análise ou None se erro; 429 sobe como ErroLimiteTaxa
+        Prompt idêntico (mesmos dados, modelo e versão) sai do llm_cache
+        """
+        mensagens = self.montar_mensagens(paciente)
+
         try:
             inicio = time.time()
 
-            response = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Você é um médico intensivista experiente. Suas análises são claras, objetivas e baseadas em evidências."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                model=self.modelo,
-                temperature=0.3,
-                max_tokens=MAX_TOKENS,
+            analise_texto = self.cache.resolver(
+                VERSAO_PROMPT, self.modelo, mensagens,
+                lambda: self._chamar_groq(mensagens), **PARAMS_IA
             )
-
             tempo_ms = int((time.time() - inicio) * 1000)
-            analise_texto = response.choices[0].message.content
+            if not analise_texto:
+                return None
 
             # Extrai nível de criticidade da resposta
             criticidade = "MODERADO"  # Default
@@ -272,19 +305,18 @@ Seja conciso e objetivo. Foque nos achados mais relevantes."""
                 'hash_dados': self.calcular_hash_dados(paciente)
             }
 
+        except RateLimitError as e:
+            raise ErroLimiteTaxa(str(e), retry_after(getattr(e.response, 'headers', None)))
         except Exception as e:
             print(f"Erro na análise IA: {e}")
             return None
 
-    def salvar_analise(self, nr_atendimento: int, paciente: Dict, analise: Dict) -> bool:
+    def salvar_analise(self, conn, nr_atendimento: int, paciente: Dict, analise: Dict) -> bool:
         """
         Salva análise no banco com hash
         Usa UPSERT para atualizar se já existe
+        Roda no escritor do pipeline (conexão persistente; commit dele)
         """
-        conn = self.get_db_connection()
-        if not conn:
-            return False
-
         try:
             cursor = conn.cursor()
 
@@ -322,19 +354,22 @@ Seja conciso e objetivo. Foque nos achados mais relevantes."""
                 analise['tempo_processamento_ms'],
                 analise['hash_dados']
             ))
-
-            conn.commit()
             cursor.close()
-            conn.close()
             return True
 
         except Exception as e:
             print(f"Erro ao salvar análise: {e}")
-            if conn:
-                conn.rollback()
-                conn.close()
             return False
 
+    def _gravar(self, conn, paciente: Dict, analise: Dict) -> bool:
+        nr = paciente['nr_atendimento']
+        if not self.salvar_analise(conn, nr, paciente, analise):
+            print(f"    ❌ Falha ao salvar atend={nr}")
+            return False
+        print(f"    ✅ atend={nr}: {analise['nivel_criticidade']} (Score: {analise['score_ia']}) "
+              f"⏱️  {analise['tempo_processamento_ms']}ms")
+        return True
+
     def arquivar_analises_antigas(self):
         """
         Marca como inativo análises de pacientes que:
@@ -458,21 +493,23 @@ Seja conciso e objetivo. Foque nos achados mais relevantes."""
 
         print(f"{len(pacientes)} paciente(s) para analisar")
 
-        for idx, paciente in enumerate(pacientes, 1):
-            nr = paciente['nr_atendimento']
-
-            print(f"\n[{idx}/{len(pacientes)}] 🤖 Analisando atend={nr}...")
-
-            analise = self.analisar_paciente(paciente)
-
-            if analise and self.salvar_analise(nr, paciente, analise):
-                print(f"    ✅ Salvo: {analise['nivel_criticidade']} (Score: {analise['score_ia']})")
-                print(f"    ⏱️  Tempo: {analise['tempo_processamento_ms']}ms")
-            else:
-                print(f"    ❌ Falha ao processar")
+        # Todos entram no pipeline; quem estava CRÍTICO na última análise sai primeiro
+        futuros = []
+        for paciente in pacientes:
+            futuro = self.pipeline.submeter(
+                lambda p=paciente: self.analisar_paciente(p),
+                lambda conn, analise, p=paciente: self._gravar(conn, p, analise),
+                nivel=paciente.get('criticidade_anterior'),
+                rotulo=f"atend={paciente['nr_atendimento']}",
+                # O limite de taxa é cobrado em _chamar_groq, só quando o
+                # llm_cache não tem a resposta: nenhuma consulta ao cache aqui
+                limitar=False,
+            )
+            futuros.append(futuro)
 
-            # Delay entre pacientes para respeitar rate limits
-            time.sleep(2)
+        resultado = self.pipeline.aguardar(futuros)
+        print(f"✅ {resultado['sucessos']} salvo(s) | ❌ {resultado['falhas']} falha(s)")
+        print(f"🗃️  Cache IA: {self.cache.resumo()}")
 
     def run_limited(self):
         """Executa worker com limite de ciclos"""
@@ -504,6 +541,8 @@ Seja conciso e objetivo. Foque nos achados mais relevantes."""
             print(f"\n\n❌ Erro fatal: {e}")
             import traceback
             traceback.print_exc()
+        finally:
+            self.pipeline.parar()
 
 
 if __name__ == "__main__":
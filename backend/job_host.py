@@ -0,0 +1,209 @@
+"""
+Host dos Jobs de Background (eleicao de lider)
+Sistema de Paineis Hospitalares
+
+Garante que os notificadores/workers daemon (pareceres, sentir_agir,
+IMAP, paciente_ps, ocupacao, padioleiro...) rodem em UM processo so,
+enquanto qualquer numero de workers do gunicorn atende HTTP:
+- Cada processo registra os starters (start_in_background) no host
+- Lider = quem segura o advisory lock de sessao JOB_HOST_LOCK no
+  PostgreSQL, numa conexao propria (fora do pool)
+- Heartbeat a cada JOB_HOST_INTERVALO_SEG: o lider confirma a conexao,
+  os demais tentam o lock — processo que morre ou perde a conexao tem o
+  lock liberado pelo servidor e outro assume (failover automatico)
+- Conexao do lider caiu: reconecta e tenta retomar o lock; se outro
+  processo ja o pegou, para os jobs (rebaixado)
+
+Os starters nao podem ser reiniciados no mesmo processo (cada modulo
+marca _background_started), entao um processo rebaixado nao concorre
+de novo: sob o gunicorn ele pede para ser reciclado (SIGTERM em si mesmo)
+e o arbiter sobe um worker novo, que volta a disputar a lideranca.
+
+OFF SWITCH da eleicao: JOB_HOST_ELEICAO=false — os jobs sobem direto no
+processo (comportamento antigo, so seguro com GUNICORN_WORKERS=1).
+"""
+
+import logging
+import os
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# =========================================================
+# CONFIGURACAO
+# =========================================================
+
+JOB_HOST_ELEICAO       = os.getenv('JOB_HOST_ELEICAO', 'true').lower() == 'true'
+JOB_HOST_INTERVALO_SEG = float(os.getenv('JOB_HOST_INTERVALO_SEG', '15'))
+# Definido pelo post_fork do gunicorn.conf.py: processo rebaixado sai e e substituido
+JOB_HOST_RECICLAR      = os.getenv('JOB_HOST_RECICLAR', 'false').lower() == 'true'
+
+# Chave do advisory lock (mesma faixa de backend.access_log_store._LOCK_MIGRACAO)
+JOB_HOST_LOCK = int(os.getenv('JOB_HOST_LOCK', '72410002'))
+
+
+def _conectar():
+    """Conexao dedicada ao lock: autocommit, keepalive TCP (derruba sessao morta)."""
+    import psycopg2
+    from backend.database import DB_CONFIG, _CONNECTION_EXTRAS
+    conn = psycopg2.connect(**DB_CONFIG, **_CONNECTION_EXTRAS)
+    conn.autocommit = True
+    return conn
+
+
+# =========================================================
+# HOST
+# =========================================================
+
+class HostJobs:
+    """
+    registrar(nome, iniciar): iniciar() sobe o job e devolve o Event de
+    parada (ou None se o job esta desligado). Os jobs so sobem quando o
+    processo vira lider.
+    """
+
+    def __init__(self, conectar=_conectar, chave=JOB_HOST_LOCK,
+                 intervalo=JOB_HOST_INTERVALO_SEG, reciclar=JOB_HOST_RECICLAR):
+        self._conectar = conectar
+        self.chave = chave
+        self.intervalo = intervalo
+        self.reciclar = reciclar
+        self._lock = threading.RLock()
+        self._jobs = []             # [(nome, iniciar)]
+        self._eventos = {}          # nome -> Event de parada do job em execucao
+        self._conn = None
+        self._retomar = False       # lider perdeu a conexao: proximo ciclo tenta o lock de novo
+        self._parar = threading.Event()
+        self._thread = None
+        self.lider = False
+        self.rebaixado = False
+        self.lider_desde = None
+        self.ultimo_heartbeat = None
+        self.ultimo_erro = None
+
+    # ----------------------------------------------------- API
+
+    def registrar(self, nome, iniciar):
+        with self._lock:
+            self._jobs.append((nome, iniciar))
+
+    def iniciar(self):
+        """Sobe a thread de eleicao (ou os jobs direto, sem eleicao)."""
+        if not JOB_HOST_ELEICAO:
+            logger.info('[job_host] Eleicao desativada (JOB_HOST_ELEICAO=false) — jobs neste processo')
+            with self._lock:
+                self._assumir()
+            return
+        if self._thread is not None:
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name='job_host', daemon=True)
+        self._thread.start()
+
+    def ciclo(self) -> bool:
+        """Um passo de eleicao/heartbeat. Retorna se o processo e lider."""
+        with self._lock:
+            if self.rebaixado or self._parar.is_set():
+                return self.lider
+            try:
+                if self._conn is None or self._conn.closed:
+                    self._conn = self._conectar()
+                cur = self._conn.cursor()
+                if self.lider and not self._retomar:
+                    cur.execute('SELECT 1')
+                    cur.fetchone()
+                else:
+                    cur.execute('SELECT pg_try_advisory_lock(%s)', (self.chave,))
+                    obtido = bool(cur.fetchone()[0])
+                    if obtido and self.lider:
+                        logger.warning('[job_host] Conexao refeita — lideranca mantida (PID %s)', os.getpid())
+                    elif obtido:
+                        self._assumir()
+                    elif self.lider:
+                        self._rebaixar()
+                    self._retomar = False
+                cur.close()
+                self.ultimo_heartbeat = time.time()
+                self.ultimo_erro = None
+            except Exception as e:
+                self.ultimo_erro = str(e)
+                self._descartar_conexao()
+                if self.lider:
+                    # Jobs continuam: sem banco ninguem mais pega o lock
+                    self._retomar = True
+                    logger.warning('[job_host] Lider sem conexao, tentando retomar: %s', e)
+                else:
+                    logger.debug('[job_host] Eleicao indisponivel: %s', e)
+            return self.lider
+
+    def parar(self):
+        """Para os jobs e libera o lock (encerramento do processo)."""
+        self._parar.set()
+        with self._lock:
+            self._parar_jobs()
+            self.lider = False
+            self._descartar_conexao()
+
+    def estado(self) -> dict:
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'eleicao': JOB_HOST_ELEICAO,
+                'thread_viva': self._thread is not None and self._thread.is_alive(),
+                'lider': self.lider,
+                'rebaixado': self.rebaixado,
+                'lider_desde': self.lider_desde,
+                'ultimo_heartbeat': self.ultimo_heartbeat,
+                'ultimo_erro': self.ultimo_erro,
+                'registrados': [nome for nome, _ in self._jobs],
+                'em_execucao': sorted(self._eventos),
+            }
+
+    # ----------------------------------------------------- internos
+
+    def _loop(self):
+        while not self._parar.is_set():
+            self.ciclo()
+            self._parar.wait(self.intervalo)
+
+    def _assumir(self):
+        self.lider = True
+        self.lider_desde = time.time()
+        logger.info('[job_host] PID %s assumiu os jobs de background', os.getpid())
+        for nome, iniciar in self._jobs:
+            try:
+                evento = iniciar()
+                if evento is not None:
+                    self._eventos[nome] = evento
+            except Exception as e:
+                logger.warning('[%s] Nao iniciado automaticamente: %s', nome, e)
+
+    def _rebaixar(self):
+        logger.error('[job_host] PID %s perdeu a lideranca — parando %d jobs',
+                     os.getpid(), len(self._eventos))
+        self._parar_jobs()
+        self.lider = False
+        self.rebaixado = True
+        self._descartar_conexao()
+        if self.reciclar:
+            logger.warning('[job_host] Reciclando o worker para voltar a disputar a lideranca')
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    def _parar_jobs(self):
+        for evento in self._eventos.values():
+            evento.set()
+        self._eventos = {}
+
+    def _descartar_conexao(self):
+        """Fecha a conexao do lock (o servidor libera o advisory lock)."""
+        try:
+            if self._conn is not None:
+                self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+
+job_host = HostJobs()
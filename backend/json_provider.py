@@ -0,0 +1,78 @@
+"""
+Serializacao JSON rapida (orjson) para jsonify
+Sistema de Paineis Hospitalares
+
+Provider JSON do Flask que serializa as respostas com orjson, com a
+mesma estrutura do padrao: chaves ordenadas, formato compacto, datas em
+http_date e Decimal/UUID como string (acentos saem em UTF-8, e nao como
+escapes \\uXXXX — o mesmo JSON para qualquer cliente).
+
+Fica no provider, e nao so no cache, porque o corpo que o @cache_route
+guarda e o proprio jsonify da rota: as listas grandes dos paineis sao
+serializadas a cada recalculo.
+
+So a saida muda: o parse de request.get_json() continua no json do
+Flask (mesmas mensagens de erro e mesmos tipos, ex.: floats). Se o orjson
+nao estiver instalado, o provider padrao continua em uso.
+"""
+
+import dataclasses
+import decimal
+import uuid
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+    _ORJSON_OK = True
+except ImportError:
+    orjson = None
+    _ORJSON_OK = False
+
+
+if _ORJSON_OK:
+    # Datas passam por _padrao (http_date), como no json.dumps do Flask
+    _OPTS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+             | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+
+
+def _padrao(o):
+    """Tipos fora do JSON, como o default do provider do Flask."""
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Provider JSON do Flask com dumps e response em orjson (loads padrao)."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        # Argumentos do json.dumps (indent, cls...) ficam com o provider padrao
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_padrao, option=_OPTS).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        # Em DEBUG o Flask indenta a saida; mantem o comportamento padrao
+        if self._app.debug:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_padrao, option=_OPTS) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_json_provider(app):
+    """Instala o OrjsonProvider na app (no-op sem orjson)."""
+    if not _ORJSON_OK:
+        app.logger.info('orjson nao instalado — usando serializacao JSON padrao do Flask')
+        return
+    app.json_provider_class = OrjsonProvider
+    app.json = OrjsonProvider(app)
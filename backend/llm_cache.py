@@ -0,0 +1,181 @@
+"""
+Cache de Respostas LLM
+Sistema de Paineis Hospitalares
+
+Cache enderecado por conteudo para as chamadas a Groq dos workers de IA
+(ia_risk_analyzer_groq, painel7_sepse_worker, sentir_agir_analise):
+- Chave = SHA-256 de (versao do template, modelo, parametros, mensagens
+  com espaco em branco normalizado): mesmo prompt -> mesma resposta,
+  inclusive entre pacientes diferentes e entre reinicios do worker
+- Frente em memoria (LRU, LLM_CACHE_MEMORIA_MAX entradas) sobre a tabela
+  llm_cache no PostgreSQL; validade LLM_CACHE_TTL_HORAS
+- Contadores de acerto/falha para o log de cada ciclo (resumo())
+
+Mudou o texto do prompt de um jeito que altera o significado? Suba a
+versao do template no worker — as chaves antigas deixam de ser lidas e
+expiram sozinhas. Erro no banco nunca derruba a chamada: vira falha de
+cache e a API e chamada normalmente.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ATIVO        = os.getenv('LLM_CACHE', 'true').lower() == 'true'
+LLM_CACHE_TTL_HORAS    = int(os.getenv('LLM_CACHE_TTL_HORAS', '168'))
+LLM_CACHE_MEMORIA_MAX  = int(os.getenv('LLM_CACHE_MEMORIA_MAX', '512'))
+
+_DDL = """
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        chave          CHAR(64) PRIMARY KEY,
+        versao         VARCHAR(50) NOT NULL,
+        modelo         VARCHAR(100) NOT NULL,
+        resposta       TEXT NOT NULL,
+        dt_criacao     TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        dt_ultimo_uso  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        usos           INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_llm_cache_criacao ON llm_cache (dt_criacao);
+"""
+
+# Um acesso: marca o uso e devolve a resposta com o tempo de validade restante
+_SQL_OBTER = """
+    UPDATE llm_cache
+    SET usos = usos + 1, dt_ultimo_uso = NOW()
+    WHERE chave = %s
+      AND dt_criacao > NOW() - %s * INTERVAL '1 hour'
+    RETURNING resposta,
+              EXTRACT(EPOCH FROM (dt_criacao + %s * INTERVAL '1 hour' - NOW())) AS restante
+"""
+
+_SQL_GRAVAR = """
+    INSERT INTO llm_cache (chave, versao, modelo, resposta)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (chave) DO UPDATE SET
+        resposta = EXCLUDED.resposta,
+        dt_criacao = NOW(),
+        dt_ultimo_uso = NOW(),
+        usos = 0
+"""
+
+
+def chave_llm(versao, modelo, mensagens, **params) -> str:
+    """SHA-256 do pedido normalizado (role + conteudo sem espacos repetidos)."""
+    normalizadas = [(m['role'], ' '.join(str(m['content']).split())) for m in mensagens]
+    bruto = json.dumps([str(versao), modelo, sorted(params.items()), normalizadas],
+                       ensure_ascii=False, default=str)
+    return hashlib.sha256(bruto.encode('utf-8')).hexdigest()
+
+
+class CacheLLM:
+    """
+    conectar() -> conexao psycopg2 (a do proprio worker). A conexao fica
+    aberta e e compartilhada pelas threads do pipeline, sob um lock proprio:
+    a frente em memoria e os contadores usam outro, e um acerto em memoria
+    nao espera a ida ao banco de outra thread.
+    """
+
+    def __init__(self, conectar, nome=''):
+        self.nome = nome
+        self._conectar = conectar
+        self._conn = None
+        self._tabela_ok = False
+        self._lock = threading.Lock()          # memoria e contadores
+        self._conn_lock = threading.Lock()     # conexao (ida ao banco)
+        self._memoria = OrderedDict()       # chave -> (expira_em monotonic, resposta)
+        self.stats = {'acertos': 0, 'falhas': 0, 'lidos_banco': 0, 'gravados': 0, 'erros_banco': 0}
+
+    # ----------------------------------------------------- API
+
+    def resolver(self, versao, modelo, mensagens, chamar, **params):
+        """Resposta em cache para o pedido ou chamar() (gravando o resultado)."""
+        if not LLM_CACHE_ATIVO:
+            return chamar()
+        chave = chave_llm(versao, modelo, mensagens, **params)
+        resposta = self.obter(chave)
+        self._contar('acertos' if resposta is not None else 'falhas')
+        if resposta is not None:
+            return resposta
+        resposta = chamar()
+        if resposta:
+            self.gravar(chave, versao, modelo, resposta)
+        return resposta
+
+    def contem(self, versao, modelo, mensagens, **params) -> bool:
+        """Ha resposta valida? (carrega do banco para a memoria; nao conta acerto)."""
+        return LLM_CACHE_ATIVO and self.obter(chave_llm(versao, modelo, mensagens, **params)) is not None
+
+    def obter(self, chave):
+        with self._lock:
+            item = self._memoria.get(chave)
+            if item is not None:
+                if item[0] > time.monotonic():
+                    self._memoria.move_to_end(chave)
+                    return item[1]
+                del self._memoria[chave]
+        linha = self._banco(_SQL_OBTER, (chave, LLM_CACHE_TTL_HORAS, LLM_CACHE_TTL_HORAS), retorna=True)
+        if not linha:
+            return None
+        resposta, restante = linha
+        self._contar('lidos_banco')
+        self._lembrar(chave, resposta, float(restante))
+        return resposta
+
+    def gravar(self, chave, versao, modelo, resposta):
+        self._lembrar(chave, resposta, LLM_CACHE_TTL_HORAS * 3600.0)
+        if self._banco(_SQL_GRAVAR, (chave, str(versao), modelo, resposta)) is not None:
+            self._contar('gravados')
+
+    def resumo(self) -> dict:
+        """Contadores + taxa de acerto (0-1) desde o inicio do processo."""
+        with self._lock:
+            resumo = dict(self.stats)
+            resumo['memoria'] = len(self._memoria)
+        consultas = resumo['acertos'] + resumo['falhas']
+        resumo['taxa_acerto'] = round(resumo['acertos'] / consultas, 3) if consultas else None
+        return resumo
+
+    # ----------------------------------------------------- internos
+
+    def _contar(self, chave):
+        with self._lock:
+            self.stats[chave] += 1
+
+    def _lembrar(self, chave, resposta, validade):
+        with self._lock:
+            self._memoria[chave] = (time.monotonic() + validade, resposta)
+            self._memoria.move_to_end(chave)
+            while len(self._memoria) > LLM_CACHE_MEMORIA_MAX:
+                self._memoria.popitem(last=False)
+
+    def _banco(self, sql, params, retorna=False):
+        """Executa e faz commit; None em erro (a conexao e descartada)."""
+        with self._conn_lock:
+            try:
+                if self._conn is None or self._conn.closed:
+                    self._conn = self._conectar()
+                cur = self._conn.cursor()
+                if not self._tabela_ok:
+                    cur.execute(_DDL)
+                    self._tabela_ok = True
+                cur.execute(sql, params)
+                linha = cur.fetchone() if retorna else True
+                cur.close()
+                self._conn.commit()
+                return linha
+            except Exception as e:
+                self._contar('erros_banco')
+                logger.warning('[llm_cache%s] Banco indisponivel: %s', ':' + self.nome if self.nome else '', e)
+                try:
+                    if self._conn is not None:
+                        self._conn.close()
+                except Exception:
+                    pass
+                self._conn = None
+                return None
@@ -0,0 +1,188 @@
+"""
+Metricas em Memoria e Exposicao Prometheus
+Sistema de Paineis Hospitalares
+
+Funcionalidades:
+- Histogram: contagem por faixa (buckets cumulativos), soma e total
+- render_prometheus: texto no formato de exposicao do Prometheus com as
+  metricas do cache (por key_prefix) e do pool de conexoes PostgreSQL
+  (incluindo espera por conexao em cada sub-pool) e da fila de escrita
+  do access_log
+
+As metricas vivem na memoria de cada processo e zeram quando o worker
+reinicia — o Prometheus trata isso como reset de contador. Com
+GUNICORN_WORKERS > 1 cada worker tem os seus valores e /api/health/metrics
+responde so com os do worker que atendeu a requisicao: toda linha leva o
+label worker="<pid>" para as series de workers diferentes nao se
+misturarem, e os totais saem de sum without (worker) no Prometheus. Como
+os workers dividem a mesma porta, um scrape alcanca um worker por vez;
+para ver todos a cada scrape, rode com GUNICORN_WORKERS=1.
+"""
+
+import os
+import threading
+
+# Label do processo nas linhas expostas (so com mais de um worker)
+METRICAS_LABEL_WORKER = int(os.getenv('GUNICORN_WORKERS', '1')) > 1
+
+# Buckets padrao (segundos) para tempos de consulta/recalculo
+TEMPO_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Histograma thread-safe com buckets fixos (limites superiores)."""
+
+    def __init__(self, buckets=TEMPO_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)   # ultimo = +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> dict:
+        """{'buckets': [(limite, acumulado)...], 'sum', 'count'} — ultimo limite e '+Inf'."""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        acumulado = 0
+        buckets = []
+        for limite, n in zip(self.buckets + ('+Inf',), counts):
+            acumulado += n
+            buckets.append((limite, acumulado))
+        return {'buckets': buckets, 'sum': total, 'count': count}
+
+
+# =========================================================
+# FORMATO DE EXPOSICAO PROMETHEUS
+# =========================================================
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    partes = []
+    for k, v in labels.items():
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{k}="{v}"')
+    return '{' + ','.join(partes) + '}'
+
+
+class _Saida:
+    """Acumula linhas no formato texto do Prometheus (HELP/TYPE uma vez por metrica)."""
+
+    def __init__(self, labels_base: dict = None):
+        self.linhas = []
+        self._declaradas = set()
+        self._base = labels_base or {}
+
+    def _declarar(self, nome: str, tipo: str, ajuda: str):
+        if nome not in self._declaradas:
+            self._declaradas.add(nome)
+            self.linhas.append(f'# HELP {nome} {ajuda}')
+            self.linhas.append(f'# TYPE {nome} {tipo}')
+
+    def valor(self, nome: str, tipo: str, ajuda: str, valor, labels: dict = None):
+        self._declarar(nome, tipo, ajuda)
+        self.linhas.append(f'{nome}{_labels({**self._base, **(labels or {})})} {valor}')
+
+    def histograma(self, nome: str, ajuda: str, snap: dict, labels: dict = None):
+        self._declarar(nome, 'histogram', ajuda)
+        labels = {**self._base, **(labels or {})}
+        for limite, acumulado in snap['buckets']:
+            self.linhas.append(f'{nome}_bucket{_labels({**labels, "le": limite})} {acumulado}')
+        self.linhas.append(f'{nome}_sum{_labels(labels)} {round(snap["sum"], 6)}')
+        self.linhas.append(f'{nome}_count{_labels(labels)} {snap["count"]}')
+
+    def texto(self) -> str:
+        return '\n'.join(self.linhas) + '\n'
+
+
+def _render_cache(out: _Saida):
+    from backend.cache import cache_metrics
+
+    dados = cache_metrics()
+    for prefix, m in sorted(dados['rotas'].items()):
+        lb = {'prefix': prefix}
+        for resultado in ('hit', 'stale', 'miss', 'bypass'):
+            out.valor('painel_cache_requests_total', 'counter',
+                      'Requisicoes a endpoints com cache_route por resultado',
+                      m[resultado], {**lb, 'result': resultado})
+        out.valor('painel_cache_not_modified_total', 'counter',
+                  'Respostas 304 (If-None-Match) servidas do cache', m['not_modified'], lb)
+        out.valor('painel_cache_ttl_seconds', 'gauge',
+                  'TTL configurado do endpoint', m['ttl'], lb)
+        out.valor('painel_cache_stale_ttl_seconds', 'gauge',
+                  'Janela stale configurada do endpoint', m['stale_ttl'], lb)
+        out.valor('painel_cache_payload_bytes', 'gauge',
+                  'Tamanho do ultimo corpo JSON calculado', m['payload_bytes'], lb)
+        out.valor('painel_cache_stored_bytes', 'gauge',
+                  'Tamanho do ultimo corpo guardado (apos compressao)', m['stored_bytes'], lb)
+        out.histograma('painel_cache_compute_seconds',
+                       'Tempo de execucao do handler no miss/recalculo', m['compute'], lb)
+
+    out.valor('painel_cache_fallback_total', 'counter',
+              'Requisicoes atendidas sem Redis', dados['fallback'])
+    l1 = dados['l1']
+    out.valor('painel_cache_l1_keys', 'gauge', 'Chaves no cache L1', l1['keys'])
+    out.valor('painel_cache_l1_bytes', 'gauge', 'Bytes ocupados no cache L1', l1['bytes'])
+    out.valor('painel_cache_l1_evictions_total', 'counter', 'Remocoes por LRU no cache L1',
+              l1['evictions'])
+
+
+def _render_pool(out: _Saida):
+    from backend.database import pool_health, pool_wait_histograms
+
+    pool = pool_health()
+    out.valor('painel_db_pool_up', 'gauge', 'Pool de conexoes PostgreSQL ativo',
+              1 if pool.get('status') == 'healthy' else 0)
+    for campo, ajuda in (('used', 'Conexoes em uso'),
+                         ('available', 'Conexoes livres no pool'),
+                         ('max_connections', 'Limite de conexoes do pool')):
+        if campo in pool:
+            out.valor(f'painel_db_pool_{campo}', 'gauge', ajuda, pool[campo])
+
+    for nome, sp in sorted(pool.get('subpools', {}).items()):
+        lb = {'pool': nome}
+        out.valor('painel_db_subpool_used', 'gauge', 'Conexoes em uso no sub-pool', sp['used'], lb)
+        out.valor('painel_db_subpool_max', 'gauge', 'Limite de conexoes do sub-pool',
+                  sp['max_connections'], lb)
+        out.valor('painel_db_subpool_waiting', 'gauge', 'Threads esperando conexao',
+                  sp['waiting'], lb)
+        out.valor('painel_db_subpool_timeouts_total', 'counter',
+                  'Esperas por conexao que estouraram DB_POOL_TIMEOUT', sp['timeouts'], lb)
+    for nome, snap in sorted(pool_wait_histograms().items()):
+        out.histograma('painel_db_pool_wait_seconds',
+                       'Tempo de espera por uma conexao do pool', snap, {'pool': nome})
+
+
+def _render_access_log(out: _Saida):
+    from backend.access_tracker import access_log_stats
+
+    st = access_log_stats()
+    out.valor('painel_access_log_queue', 'gauge', 'Linhas aguardando gravacao no access_log',
+              st['fila'])
+    out.valor('painel_access_log_written_total', 'counter', 'Linhas gravadas no access_log',
+              st['gravados'])
+    out.valor('painel_access_log_batches_total', 'counter',
+              'Lotes (transacoes) gravados no access_log', st['lotes'])
+    out.valor('painel_access_log_dropped_total', 'counter',
+              'Linhas descartadas com a fila cheia', st['descartados'])
+    out.valor('painel_access_log_failed_total', 'counter',
+              'Linhas perdidas em lotes com erro de gravacao', st['perdidos'])
+
+
+def render_prometheus() -> str:
+    """Texto de exposicao Prometheus (text/plain; version=0.0.4)."""
+    out = _Saida({'worker': os.getpid()} if METRICAS_LABEL_WORKER else None)
+    _render_cache(out)
+    _render_pool(out)
+    _render_access_log(out)
+    return out.texto()
@@ -88,6 +88,63 @@ def admin_required(f):
     return decorated_function
 
 
+def verificar_acesso_painel(panel_name):
+    """
+    Verifica se o usuário da sessão pode acessar o painel.
+    Admins têm acesso automático; TVs usam as permissões gravadas na sessão.
+
+    Returns:
+        None se o acesso é permitido, ou a resposta de negação
+        (redirect/página de acesso negado/JSON 401/403)
+    """
+    if 'usuario_id' not in session:
+        current_app.logger.warning(f'Acesso não autorizado ao {panel_name}: {request.url}')
+        if _e_requisicao_de_pagina():
+            return _redirecionar_para_login()
+        return jsonify({
+            'success': False,
+            'error': 'Não autenticado',
+            'redirect': '/login.html'
+        }), 401
+
+    usuario_id = session.get('usuario_id')
+    is_admin = session.get('is_admin', False)
+
+    # Admin tem acesso a tudo
+    if is_admin:
+        return None
+
+    # Dispositivo TV — permissões armazenadas diretamente na sessão
+    if session.get('is_tv'):
+        if panel_name in set(session.get('permissoes', [])):
+            return None
+        current_app.logger.warning(
+            'TV sem permissão para %s: %s', panel_name, session.get('usuario')
+        )
+        if _e_requisicao_de_pagina():
+            from flask import send_from_directory
+            return send_from_directory('frontend', 'acesso-negado.html')
+        return jsonify({
+            'success': False,
+            'error': 'Dispositivo TV sem permissão para {}'.format(panel_name)
+        }), 403
+
+    # Verifica permissão específica do painel
+    if not verificar_permissao_painel(usuario_id, panel_name):
+        current_app.logger.warning(
+            f'Acesso negado ao {panel_name}: {session.get("usuario")}'
+        )
+        if _e_requisicao_de_pagina():
+            from flask import send_from_directory
+            return send_from_directory('frontend', 'acesso-negado.html')
+        return jsonify({
+            'success': False,
+            'error': f'Sem permissão para acessar {panel_name}'
+        }), 403
+
+    return None
+
+
 def panel_permission_required(panel_name):
     """
     Decorator que verifica se o usuário tem permissão para acessar um painel específico
@@ -105,53 +162,11 @@ def panel_permission_required(panel_name):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if 'usuario_id' not in session:
-                current_app.logger.warning(f'Acesso não autorizado ao {panel_name}: {request.url}')
-                if _e_requisicao_de_pagina():
-                    return _redirecionar_para_login()
-                return jsonify({
-                    'success': False,
-                    'error': 'Não autenticado',
-                    'redirect': '/login.html'
-                }), 401
-
-            usuario_id = session.get('usuario_id')
-            is_admin = session.get('is_admin', False)
-
-            # Admin tem acesso a tudo
-            if is_admin:
-                return f(*args, **kwargs)
-
-            # Dispositivo TV — permissões armazenadas diretamente na sessão
-            if session.get('is_tv'):
-                if panel_name in set(session.get('permissoes', [])):
-                    return f(*args, **kwargs)
-                current_app.logger.warning(
-                    'TV sem permissão para %s: %s', panel_name, session.get('usuario')
-                )
-                if _e_requisicao_de_pagina():
-                    from flask import send_from_directory
-                    return send_from_directory('frontend', 'acesso-negado.html')
-                return jsonify({
-                    'success': False,
-                    'error': 'Dispositivo TV sem permissão para {}'.format(panel_name)
-                }), 403
-
-            # Verifica permissão específica do painel
-            if not verificar_permissao_painel(usuario_id, panel_name):
-                current_app.logger.warning(
-                    f'Acesso negado ao {panel_name}: {session.get("usuario")}'
-                )
-                if _e_requisicao_de_pagina():
-                    from flask import send_from_directory
-                    return send_from_directory('frontend', 'acesso-negado.html')
-                return jsonify({
-                    'success': False,
-                    'error': f'Sem permissão para acessar {panel_name}'
-                }), 403
-
+            negado = verificar_acesso_painel(panel_name)
+            if negado is not None:
+                return negado
             return f(*args, **kwargs)
 
         return decorated_function
 
-    return decorator
\ No newline at end of file
+    return decorator
@@ -16,7 +16,9 @@ def add_security_headers(response, app_config):
     Returns:
         response: Modified response with security headers
     """
-    # Cache-Control: dados médicos nunca devem ser cacheados por proxy/browser
+    # Cache-Control: dados médicos nunca devem ser cacheados por proxy/browser.
+    # O ETag das rotas com cache_route continua valendo: o 304 é negociado
+    # pelo fetch do frontend (auto-auth.js), que guarda o último corpo em memória.
     if request.path.startswith('/api/'):
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, private'
         response.headers['Pragma'] = 'no-cache'
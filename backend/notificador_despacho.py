@@ -0,0 +1,389 @@
+"""
+Despachante de Notificacoes (ntfy e email)
+Sistema de Paineis Hospitalares
+
+Envio compartilhado pelos notificadores e pelas rotas, em vez de um
+requests.post / Apprise por destinatario:
+- ntfy: uma requests.Session por processo (keep-alive, pool de conexoes);
+  o fan-out para N topicos sai em paralelo (DESPACHO_NTFY_CONCORRENCIA) e
+  custa ~1 round-trip em vez de N
+- email: cada thread do canal mantem sua conexao SMTP autenticada e a
+  reusa entre mensagens; conexao ociosa por DESPACHO_OCIOSO_SEG e fechada,
+  conexao derrubada pelo servidor e reaberta no proximo envio
+- Concorrencia limitada por canal (threads fixas, iniciadas no 1o envio)
+- Falha transitoria (timeout, conexao, HTTP 429/5xx, SMTP 4xx) volta para
+  a fila com backoff exponencial com jitter, ate DESPACHO_MAX_TENTATIVAS;
+  falha permanente termina na hora
+- enfileirar() nao bloqueia: uma rota HTTP responde sem esperar o servidor
+  SMTP; ao_concluir(ok, detalhe) roda na thread do canal
+
+Uso:
+    despacho.enviar_ntfy(topicos, titulo, mensagem)         # espera o fan-out
+    despacho.enviar_email(emails, titulo, html)             # espera o envio
+    despacho.enfileirar('email', {'destinatarios': emails, 'titulo': ..., 'html': ...},
+                        ao_concluir=registrar)              # retorna na hora
+"""
+
+import itertools
+import logging
+import os
+import random
+import smtplib
+import threading
+import time
+from concurrent.futures import Future
+from email.header import Header
+from email.mime.text import MIMEText
+from email.utils import formataddr
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from backend.notificador_utils import get_smtp_config
+
+logger = logging.getLogger(__name__)
+
+# =========================================================
+# CONFIGURACAO
+# =========================================================
+
+DESPACHO_NTFY_CONCORRENCIA = int(os.getenv('DESPACHO_NTFY_CONCORRENCIA', '8'))
+DESPACHO_SMTP_CONEXOES     = int(os.getenv('DESPACHO_SMTP_CONEXOES', '2'))
+DESPACHO_MAX_TENTATIVAS    = int(os.getenv('DESPACHO_MAX_TENTATIVAS', '3'))
+DESPACHO_BACKOFF_BASE      = float(os.getenv('DESPACHO_BACKOFF_BASE', '2'))    # segundos
+DESPACHO_BACKOFF_MAX       = float(os.getenv('DESPACHO_BACKOFF_MAX', '60'))
+DESPACHO_NTFY_TIMEOUT      = float(os.getenv('DESPACHO_NTFY_TIMEOUT', '10'))
+DESPACHO_SMTP_TIMEOUT      = float(os.getenv('DESPACHO_SMTP_TIMEOUT', '30'))
+DESPACHO_OCIOSO_SEG        = float(os.getenv('DESPACHO_OCIOSO_SEG', '60'))
+NTFY_URL = os.getenv('NTFY_URL', 'https://ntfy.sh')
+
+_PARAR = object()
+
+
+class FalhaEnvio(Exception):
+    """Envio recusado; transitoria=True vale nova tentativa (retry_after em segundos)."""
+
+    def __init__(self, mensagem, transitoria=False, retry_after=None):
+        super().__init__(mensagem)
+        self.transitoria = transitoria
+        self.retry_after = retry_after
+
+
+def backoff(tentativa, retry=None) -> float:
+    """Retry-After quando informado; senao exponencial com jitter total."""
+    if retry is not None:
+        return min(DESPACHO_BACKOFF_MAX, retry)
+    return random.uniform(0, min(DESPACHO_BACKOFF_MAX, DESPACHO_BACKOFF_BASE * (2 ** tentativa)))
+
+
+# =========================================================
+# REMETENTES
+# =========================================================
+
+class RemetenteNtfy:
+    """POST no topico com a Session do processo (recriada apos fork)."""
+
+    def __init__(self, timeout=DESPACHO_NTFY_TIMEOUT, conexoes=DESPACHO_NTFY_CONCORRENCIA):
+        self.timeout = timeout
+        self._conexoes = max(1, conexoes)
+        self._sessao = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def sessao(self) -> requests.Session:
+        with self._lock:
+            if self._sessao is None or self._pid != os.getpid():
+                sessao = requests.Session()
+                sessao.mount('http://', HTTPAdapter(pool_maxsize=self._conexoes))
+                sessao.mount('https://', HTTPAdapter(pool_maxsize=self._conexoes))
+                self._sessao, self._pid = sessao, os.getpid()
+            return self._sessao
+
+    def enviar(self, msg) -> str:
+        try:
+            resp = self.sessao().post(
+                '{}/{}'.format(msg.get('url', NTFY_URL), msg['topico']),
+                data=msg['mensagem'].encode('utf-8'),
+                headers={
+                    'Title': msg['titulo'].encode('utf-8'),
+                    'Priority': str(msg.get('prioridade', '3')),
+                },
+                timeout=self.timeout
+            )
+        except requests.exceptions.Timeout:
+            raise FalhaEnvio('Timeout', transitoria=True)
+        except requests.exceptions.ConnectionError:
+            raise FalhaEnvio('Conexao recusada', transitoria=True)
+        if resp.status_code == 200:
+            return 'HTTP 200'
+        if resp.status_code == 429 or resp.status_code >= 500:
+            try:
+                retry = float(resp.headers.get('retry-after'))
+            except (TypeError, ValueError):
+                retry = None
+            raise FalhaEnvio('HTTP {}'.format(resp.status_code), transitoria=True, retry_after=retry)
+        raise FalhaEnvio('HTTP {}'.format(resp.status_code))
+
+    def fechar(self):
+        """A Session e compartilhada entre as threads do canal; fica aberta."""
+
+
+class ConexaoSMTP:
+    """Conexao SMTP autenticada de uma thread, reusada entre mensagens."""
+
+    def __init__(self, config=None, timeout=DESPACHO_SMTP_TIMEOUT):
+        self._config = config or get_smtp_config()
+        self.timeout = timeout
+        self._smtp = None
+
+    def _abrir(self):
+        cfg = self._config
+        if cfg['port'] == 465:
+            smtp = smtplib.SMTP_SSL(cfg['host'], cfg['port'], timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(cfg['host'], cfg['port'], timeout=self.timeout)
+            smtp.ehlo()
+            if smtp.has_extn('starttls'):
+                smtp.starttls()
+                smtp.ehlo()
+        smtp.login(cfg['user'], cfg['password'])
+        return smtp
+
+    def enviar(self, msg) -> str:
+        """
+        msg: destinatarios (emails), titulo, html, remetente (nome exibido).
+        Uma mensagem por destinatario, como o Apprise fazia; os ja atendidos
+        ficam em msg['_enviados'] e nao recebem de novo numa nova tentativa.
+        """
+        cfg = self._config
+        if not cfg['host'] or not cfg['user'] or not cfg['password']:
+            raise FalhaEnvio('SMTP nao configurado')
+        remetente = cfg['sender'] or cfg['user']
+        enviados = msg.setdefault('_enviados', set())
+        pendentes = [d for d in msg['destinatarios'] if d not in enviados]
+
+        mime = MIMEText(msg['html'], 'html', 'utf-8')
+        mime['Subject'] = Header(msg['titulo'], 'utf-8')
+        mime['From'] = formataddr((msg.get('remetente', 'Notificacao HAC'), remetente))
+        for dest in pendentes:
+            del mime['To']
+            mime['To'] = dest
+            self._sendmail(remetente, dest, mime.as_bytes())
+            enviados.add(dest)
+        return 'Email enviado para {}'.format(len(enviados))
+
+    def _sendmail(self, remetente, dest, corpo):
+        reusada = self._smtp is not None
+        try:
+            if self._smtp is None:
+                self._smtp = self._abrir()
+            self._smtp.sendmail(remetente, [dest], corpo)
+        except smtplib.SMTPServerDisconnected:
+            self.fechar()
+            if not reusada:
+                raise FalhaEnvio('Servidor SMTP desconectou', transitoria=True)
+            # Conexao ociosa derrubada pelo servidor: reabre uma vez
+            self._sendmail(remetente, dest, corpo)
+        except smtplib.SMTPRecipientsRefused:
+            raise FalhaEnvio('Destinatario recusado: {}'.format(dest))
+        except smtplib.SMTPResponseException as e:
+            if e.smtp_code >= 500:
+                raise FalhaEnvio('SMTP {} {}'.format(e.smtp_code, e.smtp_error))
+            self.fechar()
+            raise FalhaEnvio('SMTP {}'.format(e.smtp_code), transitoria=True)
+        except (OSError, smtplib.SMTPException) as e:
+            self.fechar()
+            raise FalhaEnvio(str(e) or type(e).__name__, transitoria=True)
+
+    def fechar(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+
+# =========================================================
+# CANAL
+# =========================================================
+
+class _Envio:
+    __slots__ = ('mensagem', 'ao_concluir', 'futuro', 'tentativa', 'max_tentativas')
+
+    def __init__(self, mensagem, ao_concluir, max_tentativas):
+        self.mensagem = mensagem
+        self.ao_concluir = ao_concluir
+        self.futuro = Future()
+        self.tentativa = 0
+        self.max_tentativas = max_tentativas
+
+
+class Canal:
+    """
+    Fila com backoff e `concorrencia` threads; cada thread cria seu
+    remetente (criar_remetente()) e o reusa ate ficar ociosa ou parar.
+    O futuro de cada envio termina com (ok, detalhe).
+    """
+
+    def __init__(self, nome, criar_remetente, concorrencia, ocioso_seg=DESPACHO_OCIOSO_SEG):
+        self.nome = nome
+        self._criar_remetente = criar_remetente
+        self._concorrencia = max(1, concorrencia)
+        self._ocioso_seg = ocioso_seg
+        self._fila = []             # (liberado_em, seq, envio)
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._parando = False
+        self._threads = []
+        self.stats = {'enviados': 0, 'falhas': 0, 'novas_tentativas': 0}
+
+    def enfileirar(self, mensagem, ao_concluir=None, max_tentativas=None) -> Future:
+        envio = _Envio(mensagem, ao_concluir, max_tentativas or DESPACHO_MAX_TENTATIVAS)
+        with self._cond:
+            if self._parando:
+                envio.futuro.set_result((False, 'Despachante encerrado'))
+                return envio.futuro
+            self._iniciar()
+        self._colocar(envio, 0.0)
+        return envio.futuro
+
+    def parar(self, timeout=10.0):
+        """Envia o que ja esta liberado; novas tentativas agendadas sao descartadas."""
+        with self._cond:
+            self._parando = True
+            self._cond.notify_all()
+        limite = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, limite - time.monotonic()))
+        with self._cond:
+            restantes = [envio for _, _, envio in self._fila]
+            self._fila.clear()
+        for envio in restantes:
+            self._concluir(envio, False, 'Descartado no shutdown')
+
+    def estado(self) -> dict:
+        with self._cond:
+            return dict(self.stats, fila=len(self._fila), threads=len(self._threads))
+
+    # ----------------------------------------------------- fila
+
+    def _iniciar(self):
+        if self._threads:
+            return
+        for i in range(self._concorrencia):
+            t = threading.Thread(target=self._loop, name=f'despacho_{self.nome}_{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _colocar(self, envio, atraso):
+        with self._cond:
+            self._fila.append((time.monotonic() + atraso, next(self._seq), envio))
+            self._cond.notify()
+
+    def _proximo(self):
+        """Envio liberado mais antigo; None apos _ocioso_seg sem nada; _PARAR ao encerrar."""
+        ocioso_ate = time.monotonic() + self._ocioso_seg
+        with self._cond:
+            while True:
+                agora = time.monotonic()
+                prontos = [item for item in self._fila if item[0] <= agora]
+                if prontos:
+                    item = min(prontos)
+                    self._fila.remove(item)
+                    return item[2]
+                if self._parando:
+                    return _PARAR
+                if agora >= ocioso_ate:
+                    return None
+                proximo = min((item[0] for item in self._fila), default=ocioso_ate)
+                self._cond.wait(min(proximo, ocioso_ate) - agora)
+
+    def _loop(self):
+        remetente = self._criar_remetente()
+        try:
+            while True:
+                envio = self._proximo()
+                if envio is _PARAR:
+                    return
+                if envio is None:
+                    remetente.fechar()      # ociosa: nao segura conexao no servidor
+                    continue
+                self._enviar(remetente, envio)
+        finally:
+            remetente.fechar()
+
+    def _enviar(self, remetente, envio):
+        try:
+            ok, detalhe = True, remetente.enviar(envio.mensagem)
+        except FalhaEnvio as e:
+            envio.tentativa += 1
+            if e.transitoria and envio.tentativa < envio.max_tentativas and not self._parando:
+                atraso = backoff(envio.tentativa, e.retry_after)
+                self._contar('novas_tentativas')
+                logger.warning('[despacho:%s] %s; nova tentativa em %.1fs', self.nome, e, atraso)
+                self._colocar(envio, atraso)
+                return
+            ok, detalhe = False, str(e)
+        except Exception as e:
+            logger.error('[despacho:%s] Erro no envio: %s', self.nome, e)
+            ok, detalhe = False, str(e)
+        self._concluir(envio, ok, detalhe)
+
+    def _contar(self, chave):
+        with self._cond:
+            self.stats[chave] += 1
+
+    def _concluir(self, envio, ok, detalhe):
+        self._contar('enviados' if ok else 'falhas')
+        if envio.ao_concluir is not None:
+            try:
+                envio.ao_concluir(ok, detalhe)
+            except Exception as e:
+                logger.error('[despacho:%s] Erro em ao_concluir: %s', self.nome, e)
+        envio.futuro.set_result((ok, detalhe))
+
+
+# =========================================================
+# DESPACHANTE
+# =========================================================
+
+class Despachante:
+    """Canais 'ntfy' e 'email'; as threads de cada canal sobem no primeiro envio."""
+
+    def __init__(self, canais=None):
+        if canais is None:
+            ntfy = RemetenteNtfy()
+            canais = {
+                'ntfy': Canal('ntfy', lambda: ntfy, DESPACHO_NTFY_CONCORRENCIA),
+                'email': Canal('email', ConexaoSMTP, DESPACHO_SMTP_CONEXOES),
+            }
+        self.canais = canais
+
+    def enfileirar(self, canal, mensagem, ao_concluir=None, max_tentativas=None) -> Future:
+        """Nao bloqueia. O futuro termina com (ok, detalhe) apos as novas tentativas."""
+        return self.canais[canal].enfileirar(mensagem, ao_concluir, max_tentativas)
+
+    def enviar_ntfy(self, topicos, titulo, mensagem, prioridade='3', url=NTFY_URL) -> list:
+        """Fan-out em paralelo; retorna [(topico, ok, detalhe)] na ordem dos topicos."""
+        futuros = [
+            (topico, self.enfileirar('ntfy', {'url': url, 'topico': topico, 'titulo': titulo,
+                                              'mensagem': mensagem, 'prioridade': prioridade}))
+            for topico in topicos
+        ]
+        return [(topico, *futuro.result()) for topico, futuro in futuros]
+
+    def enviar_email(self, destinatarios, titulo, html, remetente='Notificacao HAC'):
+        """Envio bloqueante pela conexao SMTP persistente; retorna (ok, detalhe)."""
+        return self.enfileirar('email', {'destinatarios': list(destinatarios), 'titulo': titulo,
+                                         'html': html, 'remetente': remetente}).result()
+
+    def parar(self, timeout=10.0):
+        for canal in self.canais.values():
+            canal.parar(timeout)
+
+    def estado(self) -> dict:
+        return {nome: canal.estado() for nome, canal in self.canais.items()}
+
+
+despacho = Despachante()
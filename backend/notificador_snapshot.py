@@ -0,0 +1,171 @@
+"""
+Snapshot e Log de Notificacoes em Lote
+Sistema de Paineis Hospitalares
+
+Motor compartilhado pelos notificadores (pareceres, admissao) para
+detectar mudancas e registrar envios com poucas idas ao banco,
+independente de quantos pareceres/pacientes estao ativos:
+- diff_snapshot(): UMA instrucao compara o estado atual com
+  notificacoes_snapshot, devolve novos/alterados/removidos e ja grava o
+  estado novo (upsert pela constraint uk_snapshot_tipo_atend + delete
+  dos que sairam). O commit fica com o chamador, depois dos envios — se o
+  ciclo falhar, o snapshot antigo continua valendo
+- chaves_registradas(): todas as chaves do ciclo num SELECT so
+- gravar_notificacoes(): updates e inserts do notificacoes_log em lote
+  (execute_values)
+"""
+
+import json
+from datetime import datetime
+
+from psycopg2.extensions import cursor as _cursor_tupla
+from psycopg2.extras import execute_values
+
+# Linhas atuais chegam como dois arrays (unnest); os CTEs de escrita veem o
+# snapshot anterior, entao o diff e a gravacao saem da mesma instrucao.
+SQL_DIFF = """
+    WITH atual AS (
+        SELECT nr_atendimento, dados::jsonb AS dados
+        FROM unnest(%(nrs)s::bigint[], %(dados)s::text[]) AS u(nr_atendimento, dados)
+    ), anterior AS (
+        SELECT nr_atendimento, dados_snapshot
+        FROM notificacoes_snapshot
+        WHERE tipo_snapshot = %(tipo)s
+    ), removidos AS (
+        DELETE FROM notificacoes_snapshot s
+        WHERE s.tipo_snapshot = %(tipo)s
+          AND NOT EXISTS (SELECT 1 FROM atual a WHERE a.nr_atendimento = s.nr_atendimento)
+        RETURNING s.nr_atendimento
+    ), gravados AS (
+        INSERT INTO notificacoes_snapshot (tipo_snapshot, nr_atendimento, dados_snapshot, dt_snapshot)
+        SELECT %(tipo)s, nr_atendimento, dados, CURRENT_TIMESTAMP FROM atual
+        ON CONFLICT (tipo_snapshot, nr_atendimento) DO UPDATE
+            SET dados_snapshot = EXCLUDED.dados_snapshot,
+                dt_snapshot = EXCLUDED.dt_snapshot
+            WHERE notificacoes_snapshot.dados_snapshot IS DISTINCT FROM EXCLUDED.dados_snapshot
+        RETURNING 1
+    )
+    SELECT 'novo', a.nr_atendimento, NULL::jsonb
+    FROM atual a
+    WHERE NOT EXISTS (SELECT 1 FROM anterior p WHERE p.nr_atendimento = a.nr_atendimento)
+    UNION ALL
+    SELECT 'alterado', a.nr_atendimento, p.dados_snapshot
+    FROM atual a JOIN anterior p ON p.nr_atendimento = a.nr_atendimento
+    WHERE a.dados IS DISTINCT FROM p.dados_snapshot
+    UNION ALL
+    SELECT 'removido', nr_atendimento, NULL FROM removidos
+    UNION ALL
+    SELECT 'vazio', NULL, NULL WHERE NOT EXISTS (SELECT 1 FROM anterior)
+"""
+
+# Registro mais relevante por chave: 'notificado' antes de 'pendente', o mais recente
+SQL_CHAVES = """
+    SELECT DISTINCT ON (chave_evento)
+           chave_evento, id, status, qt_notificacoes, dt_ultima_notificacao
+    FROM notificacoes_log
+    WHERE chave_evento = ANY(%s) AND status = ANY(%s)
+    ORDER BY chave_evento, (status = 'notificado') DESC, dt_detectado DESC
+"""
+
+SQL_ATUALIZAR_LOG = """
+    UPDATE notificacoes_log AS l
+    SET dt_ultima_notificacao = v.agora,
+        qt_notificacoes = l.qt_notificacoes + 1,
+        status = v.status,
+        resposta_ntfy = v.resposta
+    FROM (VALUES %s) AS v(id, status, resposta, agora)
+    WHERE l.id = v.id
+"""
+
+SQL_INSERIR_LOG = """
+    INSERT INTO notificacoes_log
+        (tipo_evento, chave_evento, nr_atendimento, nm_paciente,
+         cd_setor_atendimento, nm_setor, cd_unidade, dados_extra,
+         topico_ntfy, status, dt_detectado,
+         dt_primeira_notificacao, dt_ultima_notificacao,
+         qt_notificacoes, resposta_ntfy)
+    VALUES %s
+"""
+
+_COLUNAS_LOG = ('nr_atendimento', 'nm_paciente', 'cd_setor_atendimento', 'nm_setor',
+                'cd_unidade', 'dados_extra', 'topico_ntfy')
+
+
+def diff_snapshot(conn, tipo_snapshot, atuais) -> dict:
+    """
+    atuais: {nr_atendimento: dados (dict serializavel) ou None}.
+
+    Retorna {'novos': set, 'alterados': {nr: dados anteriores},
+    'removidos': set, 'primeira_execucao': bool (snapshot estava vazio)}.
+    Nao faz commit.
+    """
+    nrs = list(atuais)
+    dados = [None if atuais[nr] is None else json.dumps(atuais[nr], default=str) for nr in nrs]
+    cur = conn.cursor(cursor_factory=_cursor_tupla)
+    cur.execute(SQL_DIFF, {'tipo': tipo_snapshot, 'nrs': nrs, 'dados': dados})
+    delta = {'novos': set(), 'alterados': {}, 'removidos': set(), 'primeira_execucao': False}
+    for tipo, nr, anteriores in cur.fetchall():
+        if tipo == 'novo':
+            delta['novos'].add(nr)
+        elif tipo == 'alterado':
+            delta['alterados'][nr] = anteriores or {}
+        elif tipo == 'removido':
+            delta['removidos'].add(nr)
+        else:
+            delta['primeira_execucao'] = True
+    cur.close()
+    return delta
+
+
+def chaves_registradas(conn, chaves, status=('notificado', 'pendente')) -> dict:
+    """{chave_evento: {id, status, qt_notificacoes, dt_ultima_notificacao}} das chaves com registro."""
+    if not chaves:
+        return {}
+    cur = conn.cursor(cursor_factory=_cursor_tupla)
+    cur.execute(SQL_CHAVES, (list(chaves), list(status)))
+    registros = {
+        chave: {'id': id_, 'status': st, 'qt_notificacoes': qt, 'dt_ultima_notificacao': dt}
+        for chave, id_, st, qt, dt in cur.fetchall()
+    }
+    cur.close()
+    return registros
+
+
+def gravar_notificacoes(conn, linhas, existentes=None, agora=None) -> int:
+    """
+    linhas: dicts com tipo_evento, chave_evento, sucesso, resposta e as
+    colunas opcionais de _COLUNAS_LOG (dados_extra como dict).
+    Chave presente em existentes ({chave: {'id': ...}}) vira renotificacao
+    (qt_notificacoes + 1); as demais sao inseridas. Nao faz commit.
+    """
+    if not linhas:
+        return 0
+    existentes = existentes or {}
+    agora = agora or datetime.now()
+    atualizar, inserir = [], []
+    for linha in linhas:
+        status = 'notificado' if linha['sucesso'] else 'erro'
+        registro = existentes.get(linha['chave_evento'])
+        if registro is not None:
+            atualizar.append((registro['id'], status, linha['resposta'], agora))
+            continue
+        extra = linha.get('dados_extra')
+        valores = {c: linha.get(c) for c in _COLUNAS_LOG}
+        valores['dados_extra'] = json.dumps(extra) if extra is not None else None
+        inserir.append((
+            linha['tipo_evento'], linha['chave_evento'],
+            *(valores[c] for c in _COLUNAS_LOG),
+            status, agora,
+            agora if linha['sucesso'] else None,
+            agora if linha['sucesso'] else None,
+            1 if linha['sucesso'] else 0, linha['resposta'],
+        ))
+
+    cur = conn.cursor()
+    if atualizar:
+        execute_values(cur, SQL_ATUALIZAR_LOG, atualizar,
+                       template='(%s, %s, %s, %s::timestamp)', page_size=len(atualizar))
+    if inserir:
+        execute_values(cur, SQL_INSERIR_LOG, inserir, page_size=len(inserir))
+    cur.close()
+    return len(linhas)
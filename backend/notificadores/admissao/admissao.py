@@ -4,7 +4,7 @@ from psycopg2.extras import RealDictCursor
 from .config import logger
 from .banco import get_connection, buscar_topicos_ntfy, dentro_do_horario
 from .ntfy import montar_mensagem_ntfy, enviar_ntfy_topicos
-from .snapshot import ja_notificado, registrar_notificacao
+from .snapshot import chaves_notificadas, linha_notificacao, registrar_notificacoes
 
 
 def verificar_admissao_nova(configs):
@@ -36,24 +36,28 @@ def verificar_admissao_nova(configs):
 
         pacientes_novos = cursor.fetchall()
         cursor.close()
-        notificados = 0
 
-        for pac in pacientes_novos:
-            chave = 'admissao_{}'.format(pac['nr_atendimento'])
-            if not ja_notificado(conn, chave):
-                # LGPD: canal publico — sem dados de paciente
-                titulo = montar_mensagem_ntfy(config['titulo_template'], pac)
-                mensagem = montar_mensagem_ntfy(config['mensagem_template'], pac)
-                sucesso, resposta = enviar_ntfy_topicos(
-                    topicos, titulo, mensagem,
-                    str(config.get('prioridade_ntfy', 3))
-                )
-                topicos_str = ','.join(topicos) if topicos else 'nenhum'
-                registrar_notificacao(
-                    conn, 'admissao_nova', chave,
-                    dict(pac), topicos_str, sucesso, resposta
-                )
-                notificados += 1
+        por_chave = {'admissao_{}'.format(pac['nr_atendimento']): pac for pac in pacientes_novos}
+        registrados = chaves_notificadas(conn, list(por_chave))
+        linhas = []
+
+        for chave, pac in por_chave.items():
+            if chave in registrados:
+                continue
+            # LGPD: canal publico — sem dados de paciente
+            titulo = montar_mensagem_ntfy(config['titulo_template'], pac)
+            mensagem = montar_mensagem_ntfy(config['mensagem_template'], pac)
+            sucesso, resposta = enviar_ntfy_topicos(
+                topicos, titulo, mensagem,
+                str(config.get('prioridade_ntfy', 3))
+            )
+            topicos_str = ','.join(topicos) if topicos else 'nenhum'
+            linhas.append(linha_notificacao(
+                'admissao_nova', chave, dict(pac), topicos_str, sucesso, resposta
+            ))
+
+        registrar_notificacoes(conn, linhas)
+        notificados = len(linhas)
 
         if notificados > 0:
             logger.info('[admissao_nova] %s notificadas -> %s topicos', notificados, len(topicos))
@@ -1,25 +1,17 @@
 # -*- coding: utf-8 -*-
 import sys
 import time
-import schedule
 from datetime import datetime
 from .config import logger, DB_CONFIG, NTFY_URL, INTERVALO_VERIFICACAO
 from .banco import get_connection, carregar_configs
 from .admissao import verificar_admissao_nova
 from .parecer import verificar_parecer_pendente
 from .prescricao import verificar_prescricao_pendente
-
-_ciclo_em_execucao = False  # evita sobreposicao de ciclos
+from backend.agendador import agendador, Intervalo, Horarios
 
 
 def ciclo_verificacao():
-    """Executa todos os modulos em sequencia."""
-    global _ciclo_em_execucao
-    if _ciclo_em_execucao:
-        logger.warning('Ciclo anterior ainda em execucao — pulando.')
-        return
-    _ciclo_em_execucao = True
-
+    """Executa todos os modulos em sequencia (o agendador impede ciclos sobrepostos)."""
     logger.info('=' * 50)
     logger.info('Iniciando ciclo de verificacao...')
 
@@ -36,8 +28,6 @@ def ciclo_verificacao():
         logger.info('Ciclo concluido')
     except Exception as e:
         logger.error('Erro no ciclo: %s', e)
-    finally:
-        _ciclo_em_execucao = False
 
 
 def limpeza_diaria():
@@ -111,15 +101,13 @@ def main():
 
     logger.info('Conexao com banco OK')
 
-    ciclo_verificacao()
-
-    schedule.every(INTERVALO_VERIFICACAO).minutes.do(ciclo_verificacao)
-    schedule.every().day.at('06:00').do(limpeza_diaria)
-    logger.info('Scheduler ativo. Proximo ciclo em %s min...', INTERVALO_VERIFICACAO)
+    agendador.registrar('notificador_admissao', ciclo_verificacao,
+                        Intervalo(INTERVALO_VERIFICACAO * 60), imediato=True, jitter_seg=0)
+    agendador.registrar('notificador_admissao_limpeza', limpeza_diaria, Horarios(['06:00']))
+    logger.info('Scheduler ativo. Ciclo a cada %s min...', INTERVALO_VERIFICACAO)
 
     try:
         while True:
-            schedule.run_pending()
             time.sleep(30)
     except KeyboardInterrupt:
         logger.info('Encerrado pelo usuario (Ctrl+C)')
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import requests
+from backend.notificador_despacho import despacho
 from .config import logger, NTFY_URL
 
 
@@ -31,51 +31,25 @@ def montar_mensagem_ntfy(template, dados):
 
 
 def enviar_ntfy_topicos(topicos, titulo, mensagem, prioridade='3'):
-    """Envia notificacao para todos os topicos ntfy configurados."""
+    """Envia notificacao para todos os topicos ntfy configurados (em paralelo)."""
     if not topicos:
         logger.debug('Nenhum topico ntfy configurado')
         return True, 'Sem topicos ntfy'
 
     enviados = 0
-    erros = 0
     erros_detalhe = []
 
-    for topico in topicos:
-        url = '{}/{}'.format(NTFY_URL, topico)
-        headers = {
-            'Title': titulo.encode('utf-8'),
-            'Priority': str(prioridade),
-        }
-        try:
-            resp = requests.post(
-                url,
-                data=mensagem.encode('utf-8'),
-                headers=headers,
-                timeout=10
-            )
-            if resp.status_code == 200:
-                logger.info('ntfy OK: [%s] %s', topico, titulo)
-                enviados += 1
-            else:
-                logger.warning('ntfy [%s] status %s', topico, resp.status_code)
-                erros += 1
-                erros_detalhe.append('[{}] HTTP {}'.format(topico, resp.status_code))
-        except requests.exceptions.Timeout:
-            logger.error('Timeout ntfy: %s', topico)
-            erros += 1
-            erros_detalhe.append('[{}] Timeout'.format(topico))
-        except requests.exceptions.ConnectionError:
-            logger.error('Conexao recusada ntfy: %s', topico)
-            erros += 1
-            erros_detalhe.append('[{}] Conexao recusada'.format(topico))
-        except Exception as e:
-            logger.error('Erro ntfy [%s]: %s', topico, e)
-            erros += 1
-            erros_detalhe.append('[{}] {}'.format(topico, str(e)))
+    for topico, ok, detalhe in despacho.enviar_ntfy(topicos, titulo, mensagem, prioridade, url=NTFY_URL):
+        if ok:
+            logger.info('ntfy OK: [%s] %s', topico, titulo)
+            enviados += 1
+        else:
+            logger.error('Erro ntfy [%s]: %s', topico, detalhe)
+            erros_detalhe.append('[{}] {}'.format(topico, detalhe))
 
-    if erros > 0:
-        resposta = 'ntfy: {} OK, {} erros - {}'.format(enviados, erros, '; '.join(erros_detalhe))
+    if erros_detalhe:
+        resposta = 'ntfy: {} OK, {} erros - {}'.format(enviados, len(erros_detalhe), '; '.join(erros_detalhe))
     else:
         resposta = 'ntfy: {} enviados para {} topicos'.format(enviados, len(topicos))
 
-    return erros == 0, resposta
+    return not erros_detalhe, resposta
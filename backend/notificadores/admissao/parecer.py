@@ -1,11 +1,11 @@
 # -*- coding: utf-8 -*-
-import json
 from datetime import datetime
 from psycopg2.extras import RealDictCursor
 from .config import logger
 from .banco import get_connection, buscar_topicos_ntfy, dentro_do_horario
 from .ntfy import montar_mensagem_ntfy, enviar_ntfy_topicos
-from .snapshot import registrar_notificacao
+from .snapshot import linha_notificacao, registrar_notificacoes
+from backend.notificador_snapshot import diff_snapshot
 
 
 def verificar_parecer_pendente(configs):
@@ -32,23 +32,23 @@ def verificar_parecer_pendente(configs):
             WHERE ie_status_unidade = 'P' AND nr_atendimento IS NOT NULL
         """)
         pacientes_atuais = cursor.fetchall()
+        cursor.close()
+        por_atendimento = {pac['nr_atendimento']: pac for pac in pacientes_atuais}
 
-        cursor.execute("""
-            SELECT nr_atendimento, dados_snapshot
-            FROM notificacoes_snapshot WHERE tipo_snapshot = 'parecer_estado'
-        """)
-        snapshot_rows = cursor.fetchall()
-        estado_anterior = {}
-        for row in snapshot_rows:
-            dados = row['dados_snapshot'] if row['dados_snapshot'] else {}
-            estado_anterior[row['nr_atendimento']] = dados.get('parecer_pendente', 'Nao')
+        # Diff + gravacao do estado novo numa instrucao (commit junto com o log)
+        delta = diff_snapshot(conn, 'parecer_estado', {
+            nr: {'parecer_pendente': pac.get('parecer_pendente', 'Nao')}
+            for nr, pac in por_atendimento.items()
+        })
+        # Sem estado anterior conta como 'Nao'
+        mudaram = [(nr, 'Nao') for nr in delta['novos']]
+        mudaram += [(nr, anterior.get('parecer_pendente', 'Nao'))
+                    for nr, anterior in delta['alterados'].items()]
 
-        notificados = 0
-
-        for pac in pacientes_atuais:
-            nr_atend = pac['nr_atendimento']
+        linhas = []
+        for nr_atend, parecer_anterior in mudaram:
+            pac = por_atendimento[nr_atend]
             parecer_atual = pac.get('parecer_pendente', 'Nao')
-            parecer_anterior = estado_anterior.get(nr_atend, 'Nao')
 
             if parecer_atual == 'Sim' and parecer_anterior != 'Sim':
                 chave = 'parecer_{}_{}'.format(nr_atend, datetime.now().strftime('%Y%m%d_%H%M'))
@@ -60,19 +60,13 @@ def verificar_parecer_pendente(configs):
                     str(config.get('prioridade_ntfy', 3))
                 )
                 topicos_str = ','.join(topicos) if topicos else 'nenhum'
-                registrar_notificacao(
-                    conn, 'parecer_pendente', chave,
-                    dict(pac), topicos_str, sucesso, resposta
-                )
-                notificados += 1
+                linhas.append(linha_notificacao(
+                    'parecer_pendente', chave, dict(pac), topicos_str, sucesso, resposta
+                ))
 
-        cursor.execute("DELETE FROM notificacoes_snapshot WHERE tipo_snapshot = 'parecer_estado'")
-        for pac in pacientes_atuais:
-            cursor.execute("""
-                INSERT INTO notificacoes_snapshot (tipo_snapshot, nr_atendimento, dados_snapshot)
-                VALUES ('parecer_estado', %s, %s)
-            """, (pac['nr_atendimento'], json.dumps({'parecer_pendente': pac.get('parecer_pendente', 'Nao')})))
-        conn.commit()
+        # Chave por minuto: sempre registro novo
+        registrar_notificacoes(conn, linhas)
+        notificados = len(linhas)
 
         if notificados > 0:
             logger.info('[parecer_pendente] %s detectados -> %s topicos', notificados, len(topicos))
@@ -4,7 +4,7 @@ from psycopg2.extras import RealDictCursor
 from .config import logger
 from .banco import get_connection, buscar_topicos_ntfy, dentro_do_horario
 from .ntfy import montar_mensagem_ntfy, enviar_ntfy_topicos
-from .snapshot import ja_notificado, precisa_renotificar, registrar_notificacao
+from .snapshot import chaves_notificadas, precisa_renotificar, linha_notificacao, registrar_notificacoes
 
 
 def verificar_prescricao_pendente(configs):
@@ -39,25 +39,9 @@ def verificar_prescricao_pendente(configs):
               AND dt_entrada_unid::timestamp <= (NOW() - INTERVAL '2 hours')
         """)
         novos_sem = cursor.fetchall()
-        notificados_novos = 0
-
-        for pac in novos_sem:
-            chave = 'prescricao_novo_{}_{}'.format(hoje, pac['nr_atendimento'])
-            if not ja_notificado(conn, chave):
-                titulo = montar_mensagem_ntfy(config['titulo_template'], pac)
-                mensagem = montar_mensagem_ntfy(config['mensagem_template'], pac)
-                sucesso, resposta = enviar_ntfy_topicos(
-                    topicos, titulo, mensagem, str(config.get('prioridade_ntfy', 4))
-                )
-                topicos_str = ','.join(topicos) if topicos else 'nenhum'
-                registrar_notificacao(
-                    conn, 'prescricao_pendente', chave, dict(pac), topicos_str, sucesso, resposta
-                )
-                notificados_novos += 1
 
         # CENARIO B: Existentes sem prescricao (apos 11h)
-        notificados_exist = 0
-
+        existentes_sem = []
         if agora.hour >= 11:
             cursor.execute("""
                 SELECT nr_atendimento, nm_pessoa_fisica, cd_setor_atendimento,
@@ -72,28 +56,34 @@ def verificar_prescricao_pendente(configs):
             """)
             existentes_sem = cursor.fetchall()
 
-            for pac in existentes_sem:
-                chave = 'prescricao_dia_{}_{}'.format(hoje, pac['nr_atendimento'])
-                titulo = montar_mensagem_ntfy(config['titulo_template'], pac)
-                mensagem = montar_mensagem_ntfy(config['mensagem_template'], pac)
-                if not ja_notificado(conn, chave):
-                    sucesso, resposta = enviar_ntfy_topicos(
-                        topicos, titulo, mensagem, str(config.get('prioridade_ntfy', 4))
-                    )
-                    topicos_str = ','.join(topicos) if topicos else 'nenhum'
-                    registrar_notificacao(
-                        conn, 'prescricao_pendente', chave, dict(pac), topicos_str, sucesso, resposta
-                    )
-                    notificados_exist += 1
-                elif precisa_renotificar(conn, chave, config):
-                    sucesso, resposta = enviar_ntfy_topicos(
-                        topicos, titulo, mensagem, str(config.get('prioridade_ntfy', 4))
-                    )
-                    topicos_str = ','.join(topicos) if topicos else 'nenhum'
-                    registrar_notificacao(
-                        conn, 'prescricao_pendente', chave, dict(pac), topicos_str, sucesso, resposta
-                    )
-                    notificados_exist += 1
+        novos = {'prescricao_novo_{}_{}'.format(hoje, p['nr_atendimento']): p for p in novos_sem}
+        existentes = {'prescricao_dia_{}_{}'.format(hoje, p['nr_atendimento']): p for p in existentes_sem}
+        # Uma consulta ao log para as chaves dos dois cenarios
+        registrados = chaves_notificadas(conn, list(novos) + list(existentes))
+        topicos_str = ','.join(topicos) if topicos else 'nenhum'
+        linhas = []
+
+        def _enviar(chave, pac):
+            titulo = montar_mensagem_ntfy(config['titulo_template'], pac)
+            mensagem = montar_mensagem_ntfy(config['mensagem_template'], pac)
+            sucesso, resposta = enviar_ntfy_topicos(
+                topicos, titulo, mensagem, str(config.get('prioridade_ntfy', 4))
+            )
+            linhas.append(linha_notificacao(
+                'prescricao_pendente', chave, dict(pac), topicos_str, sucesso, resposta
+            ))
+
+        for chave, pac in novos.items():
+            if chave not in registrados:
+                _enviar(chave, pac)
+        notificados_novos = len(linhas)
+
+        for chave, pac in existentes.items():
+            if chave not in registrados or precisa_renotificar(registrados[chave], config, agora):
+                _enviar(chave, pac)
+        notificados_exist = len(linhas) - notificados_novos
+
+        registrar_notificacoes(conn, linhas, registrados)
 
         cursor.close()
 
@@ -8,6 +8,9 @@ from .config import logger, _cfg
 from .banco import buscar_dados
 from .excel import gerar_excel
 from .email import gerar_corpo_html, enviar_email
+from backend.agendador import agendador, Intervalo, Horarios
+
+JOB = 'notificador_ocupacao'
 
 _background_started = False
 _stop_event = threading.Event()
@@ -29,10 +32,11 @@ _status = {
 def get_status():
     """Retorna estado atual do worker para o endpoint de health check."""
     cfg = _cfg()
-    alive = any(t.name == 'notificador_ocupacao' and t.is_alive() for t in threading.enumerate())
+    proximo = agendador.proximo(JOB)
     return {
         **_status,
-        'thread_alive': alive,
+        'thread_alive': agendador.ativo(JOB),
+        'proximo_envio': proximo.strftime('%d/%m/%Y %H:%M') if proximo else None,
         'auto_start': os.getenv('NOTIF_OCUPACAO_AUTO', 'true').lower() == 'true',
         'destinatarios_configurados': len(cfg['destinatarios']),
         'horarios_configurados': cfg['horarios'],
@@ -123,32 +127,15 @@ def start_in_background():
     _background_started = True
     _stop_event.clear()
 
-    def _run():
-        global _status
-        try:
-            cfg = _cfg()
-            logger.info(
-                '[notificador_ocupacao] Thread daemon iniciada - destinatarios: %s | horarios: %s | intervalo: %sh',
-                cfg['destinatarios'], cfg['horarios'], cfg['intervalo_h']
-            )
-            while not _stop_event.is_set():
-                cfg = _cfg()
-                proximo = _proximo_horario(cfg['horarios']) if cfg['horarios'] else \
-                          datetime.now() + timedelta(hours=cfg['intervalo_h'])
-                if proximo is None:
-                    proximo = datetime.now() + timedelta(hours=6)
-                _status['proximo_envio'] = proximo.strftime('%d/%m/%Y %H:%M')
-                logger.info('[notificador_ocupacao] Proximo envio: %s', proximo.strftime('%d/%m/%Y %H:%M'))
-                while not _stop_event.is_set() and datetime.now() < proximo:
-                    _stop_event.wait(30)
-                if not _stop_event.is_set():
-                    executar_envio()
-        except Exception as e:
-            logger.error('[notificador_ocupacao] Erro fatal na thread daemon: %s', e, exc_info=True)
-
-    t = threading.Thread(target=_run, name='notificador_ocupacao', daemon=True)
-    t.start()
-    logger.info('[notificador_ocupacao] Thread daemon registrada')
+    cfg = _cfg()
+    # Horarios fixos relidos a cada envio; sem horarios, a cada intervalo_h
+    gatilho = Horarios(lambda: _cfg()['horarios']) if cfg['horarios'] else \
+              Intervalo(cfg['intervalo_h'] * 3600)
+    agendador.registrar(JOB, executar_envio, gatilho, parar=_stop_event)
+    logger.info(
+        '[notificador_ocupacao] Registrado no agendador - destinatarios: %s | horarios: %s | intervalo: %sh',
+        cfg['destinatarios'], cfg['horarios'], cfg['intervalo_h']
+    )
     return _stop_event
 
 
@@ -10,6 +10,7 @@ from .config import (logger, DB_CONFIG, SMTP_HOST, SMTP_USER, SMTP_PASS, SMTP_FR
                      INTERVALO_MIN, GCHAT_WEBHOOK_PS)
 from .banco import get_connection, buscar_destinatarios_email, detectar_alertas, clinica_em_cooldown, _chave_clinica
 from .email import montar_email_html, enviar_email, enviar_gchat
+from backend.agendador import agendador, Intervalo
 
 _background_started = False
 _stop_event = threading.Event()
@@ -152,23 +153,10 @@ def start_in_background():
     _background_started = True
     _stop_event.clear()
 
-    def _run():
-        try:
-            import schedule as _sched
-            _scheduler = _sched.Scheduler()
-            logger.info('[notificador_paciente_ps] Thread daemon iniciada (PID %s, intervalo %smin)',
-                        os.getpid(), INTERVALO_MIN)
-            verificar_pacientes_ps()
-            _scheduler.every(INTERVALO_MIN).minutes.do(verificar_pacientes_ps)
-            while not _stop_event.is_set():
-                _scheduler.run_pending()
-                _stop_event.wait(30)
-        except Exception as e:
-            logger.error('[notificador_paciente_ps] Erro fatal na thread daemon: %s', e, exc_info=True)
-
-    t = threading.Thread(target=_run, name='notificador_paciente_ps', daemon=True)
-    t.start()
-    logger.info('[notificador_paciente_ps] Thread daemon registrada')
+    agendador.registrar('notificador_paciente_ps', verificar_pacientes_ps,
+                        Intervalo(INTERVALO_MIN * 60), imediato=True, parar=_stop_event)
+    logger.info('[notificador_paciente_ps] Registrado no agendador (PID %s, intervalo %smin)',
+                os.getpid(), INTERVALO_MIN)
     return _stop_event
 
 
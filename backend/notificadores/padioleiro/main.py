@@ -9,6 +9,7 @@ from .banco import buscar_dados
 from .utils import _calcular_periodo
 from .excel import gerar_excel
 from .email import gerar_html, enviar_email
+from backend.agendador import agendador, Intervalo, Horarios
 
 _background_started = False
 _stop_event = threading.Event()
@@ -89,28 +90,11 @@ def start_in_background():
     _background_started = True
     _stop_event.clear()
 
-    def _run():
-        try:
-            cfg = _cfg()
-            logger.info('[notificador_padioleiro] Thread daemon iniciada - destinatarios: %s | horarios: %s',
-                        cfg['destinatarios'], cfg['horarios'])
-            while not _stop_event.is_set():
-                cfg = _cfg()
-                proximo = _proximo_horario(cfg['horarios']) if cfg['horarios'] else \
-                          datetime.now() + timedelta(hours=12)
-                if proximo is None:
-                    proximo = datetime.now() + timedelta(hours=12)
-                logger.info('[notificador_padioleiro] Proximo envio: %s', proximo.strftime('%d/%m/%Y %H:%M'))
-                while not _stop_event.is_set() and datetime.now() < proximo:
-                    _stop_event.wait(30)
-                if not _stop_event.is_set():
-                    executar_envio()
-        except Exception as e:
-            logger.error('[notificador_padioleiro] Erro fatal na thread daemon: %s', e, exc_info=True)
-
-    t = threading.Thread(target=_run, name='notificador_padioleiro', daemon=True)
-    t.start()
-    logger.info('[notificador_padioleiro] Thread daemon registrada')
+    cfg = _cfg()
+    gatilho = Horarios(lambda: _cfg()['horarios']) if cfg['horarios'] else Intervalo(12 * 3600)
+    agendador.registrar('notificador_padioleiro', executar_envio, gatilho, parar=_stop_event)
+    logger.info('[notificador_padioleiro] Registrado no agendador - destinatarios: %s | horarios: %s',
+                cfg['destinatarios'], cfg['horarios'])
     return _stop_event
 
 
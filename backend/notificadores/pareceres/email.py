@@ -1,9 +1,8 @@
 # -*- coding: utf-8 -*-
-import apprise
 from datetime import datetime
-from urllib.parse import quote as url_encode
+from backend.notificador_despacho import despacho
 from backend.notificador_utils import render_email
-from .config import logger, SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, SMTP_FROM
+from .config import logger, SMTP_USER, SMTP_PASS
 
 
 def _anonimizar(nome):
@@ -30,7 +29,7 @@ def montar_email_html(parecer):
 
 
 def enviar_email(destinatarios, titulo, corpo_html):
-    """Envia email para lista de destinatarios via Apprise."""
+    """Envia email para lista de destinatarios pela conexao SMTP persistente do despachante."""
     if not destinatarios:
         logger.warning('Nenhum destinatario email para enviar')
         return False, 'Sem destinatarios'
@@ -39,36 +38,11 @@ def enviar_email(destinatarios, titulo, corpo_html):
         logger.error('SMTP nao configurado no .env')
         return False, 'SMTP nao configurado'
 
-    try:
-        ap = apprise.Apprise()
-        user_encoded = url_encode(SMTP_USER, safe='')
-        pass_encoded = url_encode(SMTP_PASS, safe='')
-        from_addr = SMTP_FROM if SMTP_FROM else SMTP_USER
-
-        for dest in destinatarios:
-            url = 'mailtos://{user}:{pwd}@{host}:{port}?from={sender}&to={to}&name=Notificacao+Tasy'.format(
-                user=user_encoded, pwd=pass_encoded,
-                host=SMTP_HOST, port=SMTP_PORT,
-                sender=url_encode(from_addr, safe=''),
-                to=url_encode(dest['email'], safe='')
-            )
-            ap.add(url)
-
-        resultado = ap.notify(
-            title=titulo,
-            body=corpo_html,
-            body_format=apprise.NotifyFormat.HTML,
-            notify_type=apprise.NotifyType.WARNING
-        )
-
-        emails_lista = ', '.join([d['email'] for d in destinatarios])
-        if resultado:
-            logger.info('Email OK para: %s', emails_lista)
-            return True, 'Email enviado para {}'.format(len(destinatarios))
-        else:
-            logger.warning('Falha email para: %s', emails_lista)
-            return False, 'Falha no envio para {}'.format(emails_lista)
-
-    except Exception as e:
-        logger.error('Erro email: %s', e)
-        return False, str(e)
+    emails = [d['email'] for d in destinatarios]
+    emails_lista = ', '.join(emails)
+    ok, detalhe = despacho.enviar_email(emails, titulo, corpo_html, remetente='Notificacao Tasy')
+    if ok:
+        logger.info('Email OK para: %s', emails_lista)
+        return True, 'Email enviado para {}'.format(len(destinatarios))
+    logger.warning('Falha email para %s: %s', emails_lista, detalhe)
+    return False, 'Falha no envio para {}'.format(emails_lista)
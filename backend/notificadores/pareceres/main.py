@@ -8,7 +8,9 @@ from .config import logger, DB_CONFIG, NTFY_URL, INTERVALO_VERIFICACAO, SMTP_HOS
 from .banco import get_connection, buscar_destinatarios_email, buscar_topicos_ntfy
 from .email import montar_email_html, enviar_email
 from .ntfy import enviar_ntfy_topicos
-from .snapshot import registrar_log
+from .snapshot import registrar_logs
+from backend.notificador_snapshot import diff_snapshot
+from backend.agendador import agendador, Intervalo
 
 _background_started = False
 _stop_event = threading.Event()
@@ -20,6 +22,8 @@ def verificar_pareceres():
 
     Primeira execucao (snapshot vazio): popula snapshot SEM notificar.
     Execucoes seguintes: detecta delta com horas_pendente <= 0.5 (30min).
+    Diff e gravacao do snapshot numa instrucao (backend.notificador_snapshot);
+    o commit sai depois dos envios, junto com o log em lote.
     """
     logger.info('=' * 50)
     logger.info('Verificando pareceres pendentes...')
@@ -40,37 +44,25 @@ def verificar_pareceres():
         """)
 
         pareceres_atuais = cursor.fetchall()
+        cursor.close()
         pareceres_map = {p['nr_parecer']: dict(p) for p in pareceres_atuais}
-        pareceres_atuais_set = set(pareceres_map.keys())
 
-        cursor.execute("""
-            SELECT nr_atendimento
-            FROM notificacoes_snapshot
-            WHERE tipo_snapshot = 'pareceres_ativos'
-        """)
-        pareceres_anteriores = {row['nr_atendimento'] for row in cursor.fetchall()}
+        delta = diff_snapshot(conn, 'pareceres_ativos', dict.fromkeys(pareceres_map))
 
         # PRIMEIRA EXECUCAO: popula snapshot sem notificar
-        if not pareceres_anteriores:
+        if delta['primeira_execucao']:
+            conn.commit()
             logger.info(
-                '[pareceres] Primeira execucao - populando snapshot com %s pareceres (sem notificar)',
-                len(pareceres_atuais_set)
+                '[pareceres] Primeira execucao - snapshot populado com %s pareceres (sem notificar). '
+                'Proximos ciclos detectarao novos.', len(pareceres_map)
             )
-            for nr_parecer in pareceres_atuais_set:
-                cursor.execute("""
-                    INSERT INTO notificacoes_snapshot (tipo_snapshot, nr_atendimento)
-                    VALUES ('pareceres_ativos', %s)
-                """, (nr_parecer,))
-            conn.commit()
-            cursor.close()
-            logger.info('[pareceres] Snapshot populado. Proximos ciclos detectarao novos.')
             return
 
-        novos = pareceres_atuais_set - pareceres_anteriores
-        notificados = 0
         ignorados = 0
+        envios = []
+        destinatarios_por_esp = {}
 
-        for nr_parecer in novos:
+        for nr_parecer in delta['novos']:
             parecer = pareceres_map[nr_parecer]
             horas = parecer.get('horas_pendente') or 0
 
@@ -80,7 +72,9 @@ def verificar_pareceres():
                 continue
 
             especialidade = parecer.get('especialidade_destino')
-            destinatarios = buscar_destinatarios_email(conn, especialidade)
+            if especialidade not in destinatarios_por_esp:
+                destinatarios_por_esp[especialidade] = buscar_destinatarios_email(conn, especialidade)
+            destinatarios = destinatarios_por_esp[especialidade]
             titulo = 'Parecer Pendente - {}'.format(especialidade or 'Sem especialidade')
 
             sucesso_email = False
@@ -96,25 +90,19 @@ def verificar_pareceres():
             mensagem_ntfy = 'Novo parecer pendente: {}'.format(especialidade or '-')
             enviar_ntfy_topicos(topicos_ntfy, titulo, mensagem_ntfy)
 
-            sucesso = sucesso_email or len(topicos_ntfy) > 0
-            registrar_log(
-                conn, nr_parecer,
-                parecer.get('nr_atendimento'),
-                especialidade,
-                destinatarios,
-                topicos_ntfy,
-                sucesso, resposta_email
-            )
-            notificados += 1
-
-        cursor.execute("DELETE FROM notificacoes_snapshot WHERE tipo_snapshot = 'pareceres_ativos'")
-        for nr_parecer in pareceres_atuais_set:
-            cursor.execute("""
-                INSERT INTO notificacoes_snapshot (tipo_snapshot, nr_atendimento)
-                VALUES ('pareceres_ativos', %s)
-            """, (nr_parecer,))
+            envios.append({
+                'nr_parecer': nr_parecer,
+                'nr_atendimento': parecer.get('nr_atendimento'),
+                'especialidade': especialidade,
+                'destinatarios': destinatarios,
+                'topicos': topicos_ntfy,
+                'sucesso': sucesso_email or len(topicos_ntfy) > 0,
+                'resposta': resposta_email,
+            })
+
+        registrar_logs(conn, envios)
         conn.commit()
-        cursor.close()
+        notificados = len(envios)
 
         if notificados > 0:
             logger.info('[pareceres] %s notificados (email + %s topicos ntfy)', notificados, len(topicos_ntfy))
@@ -156,27 +144,10 @@ def start_in_background():
     _background_started = True
     _stop_event.clear()
 
-    def _run():
-        try:
-            import schedule as _sched
-            _scheduler = _sched.Scheduler()
-
-            logger.info('[notificador_pareceres] Thread daemon iniciada (PID %s, intervalo %smin)',
-                        os.getpid(), INTERVALO_VERIFICACAO)
-
-            verificar_pareceres()
-            _scheduler.every(INTERVALO_VERIFICACAO).minutes.do(verificar_pareceres)
-
-            while not _stop_event.is_set():
-                _scheduler.run_pending()
-                _stop_event.wait(30)
-
-        except Exception as e:
-            logger.error('[notificador_pareceres] Erro fatal na thread daemon: %s', e, exc_info=True)
-
-    t = threading.Thread(target=_run, name='notificador_pareceres', daemon=True)
-    t.start()
-    logger.info('[notificador_pareceres] Thread daemon registrada')
+    agendador.registrar('notificador_pareceres', verificar_pareceres,
+                        Intervalo(INTERVALO_VERIFICACAO * 60), imediato=True, parar=_stop_event)
+    logger.info('[notificador_pareceres] Registrado no agendador (PID %s, intervalo %smin)',
+                os.getpid(), INTERVALO_VERIFICACAO)
     return _stop_event
 
 
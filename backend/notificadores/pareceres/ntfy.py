@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
-import requests
+from backend.notificador_despacho import despacho
 from .config import logger, NTFY_URL
 
 
 def enviar_ntfy_topicos(topicos, titulo, mensagem):
-    """Envia push para todos os topicos ntfy configurados no banco."""
+    """Envia push para todos os topicos ntfy configurados no banco (em paralelo)."""
     if not topicos:
         logger.debug('Nenhum topico ntfy configurado para parecer_pendente')
         return
@@ -12,32 +12,12 @@ def enviar_ntfy_topicos(topicos, titulo, mensagem):
     enviados = 0
     erros = 0
 
-    for topico in topicos:
-        try:
-            url = '{}/{}'.format(NTFY_URL, topico)
-            resp = requests.post(
-                url,
-                data=mensagem.encode('utf-8'),
-                headers={
-                    'Title': titulo.encode('utf-8'),
-                    'Priority': '3',
-                },
-                timeout=10
-            )
-            if resp.status_code == 200:
-                logger.info('ntfy OK: [%s] %s', topico, titulo)
-                enviados += 1
-            else:
-                logger.warning('ntfy [%s] status %s', topico, resp.status_code)
-                erros += 1
-        except requests.exceptions.Timeout:
-            logger.error('Timeout ntfy: %s', topico)
-            erros += 1
-        except requests.exceptions.ConnectionError:
-            logger.error('Conexao recusada ntfy: %s', topico)
-            erros += 1
-        except Exception as e:
-            logger.error('Erro ntfy [%s]: %s', topico, e)
+    for topico, ok, detalhe in despacho.enviar_ntfy(topicos, titulo, mensagem, url=NTFY_URL):
+        if ok:
+            logger.info('ntfy OK: [%s] %s', topico, titulo)
+            enviados += 1
+        else:
+            logger.error('Erro ntfy [%s]: %s', topico, detalhe)
             erros += 1
 
     if enviados > 0 or erros > 0:
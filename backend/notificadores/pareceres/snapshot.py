@@ -1,56 +1,47 @@
 # -*- coding: utf-8 -*-
-import json
 from datetime import datetime
+from backend.notificador_snapshot import chaves_registradas, gravar_notificacoes
 from .config import logger
 
 
-def registrar_log(conn, nr_parecer, nr_atendimento, especialidade, destinatarios, topicos, sucesso, resposta):
-    """Registra notificacao no log com detalhes de destinatarios e topicos."""
-    cursor = conn.cursor()
-    agora = datetime.now()
-    chave = 'parecer_email_{}_{}'.format(nr_parecer, agora.strftime('%Y%m%d'))
-
-    cursor.execute("""
-        SELECT id FROM notificacoes_log
-        WHERE chave_evento = %s AND status = 'notificado'
-        LIMIT 1
-    """, (chave,))
-
-    if cursor.fetchone():
-        cursor.close()
-        return
+def chave_log(nr_parecer, agora=None):
+    """Uma notificacao por parecer por dia."""
+    return 'parecer_email_{}_{}'.format(nr_parecer, (agora or datetime.now()).strftime('%Y%m%d'))
 
-    emails = ', '.join([d['email'] for d in destinatarios]) if destinatarios else 'nenhum'
-    topicos_str = ', '.join(topicos) if topicos else 'nenhum'
 
-    dados_extra = json.dumps({
-        'destinatarios_email': emails,
-        'topicos_ntfy': topicos_str,
-        'especialidade': especialidade or 'geral'
-    })
-
-    cursor.execute("""
-        INSERT INTO notificacoes_log
-            (tipo_evento, chave_evento, nr_atendimento, nm_setor,
-             dados_extra, topico_ntfy, status, dt_detectado,
-             dt_primeira_notificacao, dt_ultima_notificacao,
-             qt_notificacoes, resposta_ntfy)
-        VALUES
-            (%s, %s, %s, %s,
-             %s, %s, %s, %s,
-             %s, %s,
-             %s, %s)
-    """, (
-        'parecer_email', chave, nr_atendimento, especialidade,
-        dados_extra,
-        topicos_str,
-        'notificado' if sucesso else 'erro',
-        agora,
-        agora if sucesso else None,
-        agora if sucesso else None,
-        1 if sucesso else 0,
-        resposta
-    ))
-
-    conn.commit()
-    cursor.close()
+def registrar_logs(conn, envios):
+    """
+    Registra os envios do ciclo no log em lote, com detalhes de destinatarios
+    e topicos. envios: dicts com nr_parecer, nr_atendimento, especialidade,
+    destinatarios, topicos, sucesso, resposta. Chave ja notificada hoje nao
+    e gravada de novo. Nao faz commit.
+    """
+    agora = datetime.now()
+    for envio in envios:
+        envio['chave'] = chave_log(envio['nr_parecer'], agora)
+    ja_notificados = chaves_registradas(conn, [e['chave'] for e in envios], status=('notificado',))
+
+    linhas = []
+    for envio in envios:
+        if envio['chave'] in ja_notificados:
+            continue
+        destinatarios, topicos = envio['destinatarios'], envio['topicos']
+        emails = ', '.join([d['email'] for d in destinatarios]) if destinatarios else 'nenhum'
+        topicos_str = ', '.join(topicos) if topicos else 'nenhum'
+        linhas.append({
+            'tipo_evento': 'parecer_email',
+            'chave_evento': envio['chave'],
+            'nr_atendimento': envio['nr_atendimento'],
+            'nm_setor': envio['especialidade'],
+            'dados_extra': {
+                'destinatarios_email': emails,
+                'topicos_ntfy': topicos_str,
+                'especialidade': envio['especialidade'] or 'geral'
+            },
+            'topico_ntfy': topicos_str,
+            'sucesso': envio['sucesso'],
+            'resposta': envio['resposta'],
+        })
+    if len(linhas) < len(envios):
+        logger.debug('[pareceres] %s envio(s) ja registrados hoje', len(envios) - len(linhas))
+    return gravar_notificacoes(conn, linhas, agora=agora)
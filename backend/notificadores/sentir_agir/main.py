@@ -11,6 +11,7 @@ from .snapshot import (
     registrar_log, registrar_log_chave,
     _chave_atencao
 )
+from backend.agendador import agendador, Intervalo
 
 _background_started = False
 _stop_event = threading.Event()
@@ -139,23 +140,10 @@ def start_in_background():
     _background_started = True
     _stop_event.clear()
 
-    def _run():
-        try:
-            import schedule as _sched
-            _scheduler = _sched.Scheduler()
-            logger.info('[notificador_sentir_agir] Thread daemon iniciada (PID %s, intervalo %smin)',
-                        os.getpid(), INTERVALO_VERIFICACAO)
-            verificar_tratativas()
-            _scheduler.every(INTERVALO_VERIFICACAO).minutes.do(verificar_tratativas)
-            while not _stop_event.is_set():
-                _scheduler.run_pending()
-                _stop_event.wait(30)
-        except Exception as e:
-            logger.error('[notificador_sentir_agir] Erro fatal na thread daemon: %s', e, exc_info=True)
-
-    t = threading.Thread(target=_run, name='notificador_sentir_agir', daemon=True)
-    t.start()
-    logger.info('[notificador_sentir_agir] Thread daemon registrada')
+    agendador.registrar('notificador_sentir_agir', verificar_tratativas,
+                        Intervalo(INTERVALO_VERIFICACAO * 60), imediato=True, parar=_stop_event)
+    logger.info('[notificador_sentir_agir] Registrado no agendador (PID %s, intervalo %smin)',
+                os.getpid(), INTERVALO_VERIFICACAO)
     return _stop_event
 
 
@@ -93,6 +93,13 @@ def processar_resposta(conn, tratativa_id, remetente, corpo, data_email=''):
     conn.commit()
     cursor.close()
 
+    # Detalhe da tratativa (painel30) esta em cache por tratativa_id
+    try:
+        from backend.cache import cache_invalidate_tags
+        cache_invalidate_tags(['tratativa:{}'.format(tratativa_id)])
+    except Exception as e:
+        logger.warning('[IMAP] Falha ao invalidar cache da tratativa #%d: %s', tratativa_id, e)
+
     logger.info('[IMAP] Tratativa #%d em tratativa via resposta email | Remetente: %s | Status visita: %s',
                 tratativa_id, remetente, novo_status_visita)
     return True
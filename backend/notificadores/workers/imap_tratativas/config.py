@@ -13,6 +13,14 @@ IMAP_PORT = int(os.getenv('IMAP_PORT', 993))
 INTERVALO_HORAS = float(os.getenv('IMAP_REPLY_INTERVALO_H', '1'))
 INTERVALO_SEG   = int(INTERVALO_HORAS * 3600)
 
+# Sessao persistente com IDLE (push); false = verificacao pelo agendador a cada INTERVALO_SEG
+IMAP_IDLE = os.getenv('IMAP_IDLE', 'true').lower() == 'true'
+# RFC 2177: o servidor pode encerrar IDLE apos 30 min; renova antes disso
+IMAP_IDLE_RENOVAR_SEG  = int(os.getenv('IMAP_IDLE_RENOVAR_SEG', '540'))
+# Servidor sem IDLE: polling na mesma sessao
+IMAP_POLL_SEG          = int(os.getenv('IMAP_POLL_SEG', '300'))
+IMAP_RECONEXAO_MAX_SEG = int(os.getenv('IMAP_RECONEXAO_MAX_SEG', '300'))
+
 # Regex que extrai o tratativa_id do assunto: [TRAT:12345]
 _TOKEN_RE = re.compile(r'\[TRAT:(\d+)\]', re.IGNORECASE)
 
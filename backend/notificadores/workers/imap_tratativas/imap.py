@@ -3,7 +3,9 @@ import imaplib
 import email
 import email.header
 import re
-from .config import IMAP_HOST, IMAP_PORT, SMTP_USER, SMTP_PASS
+import select
+import time
+from .config import IMAP_HOST, IMAP_PORT, SMTP_USER, SMTP_PASS, IMAP_IDLE_RENOVAR_SEG, IMAP_POLL_SEG
 
 _DIAS_PT  = ['seg.', 'ter.', 'qua.', 'qui.', 'sex.', 'sab.', 'dom.']
 _MESES_PT = ['jan.', 'fev.', 'mar.', 'abr.', 'mai.', 'jun.',
@@ -84,3 +86,158 @@ def conectar_imap():
     imap = imaplib.IMAP4_SSL(IMAP_HOST, IMAP_PORT)
     imap.login(SMTP_USER, SMTP_PASS)
     return imap
+
+
+# ============================================================
+# FETCH EM LOTE (por UID)
+# ============================================================
+
+_UID_RE = re.compile(rb'UID (\d+)')
+CAMPOS_CABECALHO = '(BODY.PEEK[HEADER.FIELDS (SUBJECT FROM DATE)])'
+
+
+def conjunto_uids(uids):
+    """[1, 2, 3, 7, 9, 10] -> '1:3,7,9:10' (um unico comando UID para o lote)."""
+    faixas = []
+    for uid in sorted(set(uids)):
+        if faixas and uid == faixas[-1][1] + 1:
+            faixas[-1][1] = uid
+        else:
+            faixas.append([uid, uid])
+    return ','.join(str(a) if a == b else '{}:{}'.format(a, b) for a, b in faixas)
+
+
+def _respostas_por_uid(data):
+    """
+    Resposta do UID FETCH -> {uid: bytes}. O UID vem no prefixo do literal
+    ou, em alguns servidores, no fechamento logo depois dele.
+    """
+    resultado = {}
+    pendente = None
+    for item in data or []:
+        if isinstance(item, tuple):
+            m = _UID_RE.search(item[0])
+            if m:
+                resultado[int(m.group(1))] = item[1]
+                pendente = None
+            else:
+                pendente = item[1]
+        elif isinstance(item, bytes) and pendente is not None:
+            m = _UID_RE.search(item)
+            if m:
+                resultado[int(m.group(1))] = pendente
+            pendente = None
+    return resultado
+
+
+def buscar_nao_lidos(imap):
+    _, data = imap.uid('SEARCH', None, 'UNSEEN')
+    return [int(u) for u in (data[0] or b'').split()]
+
+
+def buscar_cabecalhos(imap, uids):
+    """Um UID FETCH so com Subject/From/Date -> {uid: Message (so cabecalhos)}."""
+    if not uids:
+        return {}
+    _, data = imap.uid('FETCH', conjunto_uids(uids), CAMPOS_CABECALHO)
+    return {uid: email.message_from_bytes(raw) for uid, raw in _respostas_por_uid(data).items()}
+
+
+def buscar_mensagens(imap, uids):
+    """Um UID FETCH com a mensagem completa, sem marcar como lida -> {uid: Message}."""
+    if not uids:
+        return {}
+    _, data = imap.uid('FETCH', conjunto_uids(uids), '(BODY.PEEK[])')
+    return {uid: email.message_from_bytes(raw) for uid, raw in _respostas_por_uid(data).items()}
+
+
+def marcar_lidos(imap, uids):
+    if uids:
+        imap.uid('STORE', conjunto_uids(uids), '+FLAGS.SILENT', '(\\Seen)')
+
+
+# ============================================================
+# SESSAO PERSISTENTE (IDLE)
+# ============================================================
+
+# Maior espera sem olhar o Event de parada
+_TICK_SEG = 5.0
+
+
+class SessaoIMAP:
+    """
+    Conexao IMAP mantida entre verificacoes, com a INBOX selecionada.
+    aguardar() bloqueia ate chegar email (IDLE, RFC 2177) ou ate a
+    renovacao; sem IDLE no servidor, apenas espera IMAP_POLL_SEG.
+    """
+
+    def __init__(self, conectar=conectar_imap):
+        self._conectar = conectar
+        self.imap = None
+        self.suporta_idle = False
+
+    @property
+    def aberta(self):
+        return self.imap is not None
+
+    def abrir(self):
+        self.imap = self._conectar()
+        self.imap.select('INBOX')
+        # Capacidades apos o login (podem diferir das anunciadas na saudacao)
+        _, data = self.imap.capability()
+        self.suporta_idle = b'IDLE' in (data[0] or b'').upper().split()
+
+    def fechar(self):
+        if self.imap is not None:
+            try:
+                self.imap.logout()
+            except Exception:
+                pass
+            self.imap = None
+
+    def aguardar(self, parar, renovar_seg=IMAP_IDLE_RENOVAR_SEG, poll_seg=IMAP_POLL_SEG) -> bool:
+        """True se o servidor avisou email novo; False na renovacao/polling/parada."""
+        if not self.suporta_idle:
+            parar.wait(poll_seg)
+            return False
+
+        imap = self.imap
+        # imaplib (< 3.14) nao tem IDLE: comando enviado direto no socket
+        tag = imap._new_tag()
+        imap.send(tag + b' IDLE\r\n')
+        linha = imap.readline()
+        if not linha.startswith(b'+'):
+            raise imaplib.IMAP4.error('IDLE recusado: {!r}'.format(linha))
+
+        novo = False
+        limite = time.monotonic() + renovar_seg
+        while not novo and not parar.is_set():
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            if not self._pronto(min(_TICK_SEG, restante)):
+                continue
+            linha = imap.readline()
+            if not linha:
+                raise imaplib.IMAP4.abort('conexao encerrada durante IDLE')
+            novo = linha.startswith(b'*') and (b'EXISTS' in linha or b'RECENT' in linha)
+
+        imap.send(b'DONE\r\n')
+        while True:
+            linha = imap.readline()
+            if not linha:
+                raise imaplib.IMAP4.abort('conexao encerrada durante IDLE')
+            if linha.startswith(tag):
+                break
+        return novo
+
+    def _pronto(self, espera):
+        """
+        Ha resposta do servidor para ler? Dados ja decifrados pelo SSL contam;
+        o que estiver no buffer do imaplib so e visto na proxima renovacao,
+        que sempre termina com uma verificacao completa.
+        """
+        sock = self.imap.sock
+        if getattr(sock, 'pending', None) and sock.pending():
+            return True
+        return bool(select.select([sock], [], [], espera)[0])
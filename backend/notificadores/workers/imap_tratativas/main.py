@@ -1,87 +1,103 @@
 # -*- coding: utf-8 -*-
 import os
 import time
-import email
 import threading
 import traceback
-from .config import logger, INTERVALO_SEG, _TOKEN_RE
-from .imap import conectar_imap, _decodificar_header, _extrair_texto_reply, _formatar_data_email
+from .config import (logger, INTERVALO_SEG, IMAP_IDLE, IMAP_POLL_SEG,
+                     IMAP_RECONEXAO_MAX_SEG, _TOKEN_RE)
+from .imap import (conectar_imap, _decodificar_header, _extrair_texto_reply, _formatar_data_email,
+                   SessaoIMAP, buscar_nao_lidos, buscar_cabecalhos, buscar_mensagens, marcar_lidos)
 from .banco import _get_conn, processar_resposta
+from backend.agendador import agendador, Intervalo
 
 _background_started = False
 _stop_event = threading.Event()
 
 
-def verificar_respostas_email():
+def processar_caixa(imap):
     """
-    Conecta ao IMAP, procura emails nao lidos que contenham [TRAT:N] no assunto,
-    processa cada resposta e marca como lido.
+    Verifica a INBOX ja selecionada. Um UID FETCH so com os cabecalhos de
+    todos os nao lidos; a mensagem completa apenas dos que tem [TRAT:N] no
+    assunto (outro FETCH unico); os lidos marcados num STORE so. Email que o
+    servidor nao devolveu (cabecalho ou corpo) fica nao lido para a proxima
+    verificacao.
+    Erros de IMAP sobem para o chamador (a sessao persistente reconecta).
     """
-    logger.info('[IMAP] Iniciando verificacao de respostas...')
-
-    try:
-        imap = conectar_imap()
-    except Exception as e:
-        logger.error('[IMAP] Falha ao conectar ao IMAP: %s', e)
-        return
-
-    try:
-        imap.select('INBOX')
-        _, ids = imap.search(None, 'UNSEEN')
-        ids_lista = [i for i in ids[0].split() if i]
-
-        if not ids_lista:
-            logger.info('[IMAP] Nenhum email nao lido.')
-            imap.logout()
-            return
-
-        logger.info('[IMAP] %d email(s) nao lido(s) na INBOX.', len(ids_lista))
-        processados = 0
-
-        for uid in ids_lista:
-            try:
-                _, data = imap.fetch(uid, '(RFC822)')
-                raw = data[0][1]
-                msg = email.message_from_bytes(raw)
-
-                assunto = _decodificar_header(msg.get('Subject', ''))
-                remetente = _decodificar_header(msg.get('From', ''))
-                date_header = msg.get('Date', '')
-
-                match = _TOKEN_RE.search(assunto)
-                if not match:
-                    # Nao e resposta de tratativa — apenas marca como lido
-                    imap.store(uid, '+FLAGS', '\\Seen')
+    uids = buscar_nao_lidos(imap)
+    if not uids:
+        logger.info('[IMAP] Nenhum email nao lido.')
+        return 0
+
+    logger.info('[IMAP] %d email(s) nao lido(s) na INBOX.', len(uids))
+    cabecalhos = buscar_cabecalhos(imap, uids)
+    lidos = set(cabecalhos)
+    tratativas = {}
+    for uid, cabecalho in cabecalhos.items():
+        assunto = _decodificar_header(cabecalho.get('Subject', ''))
+        match = _TOKEN_RE.search(assunto)
+        if match:
+            tratativas[uid] = (int(match.group(1)), assunto)
+
+    processados = 0
+    if tratativas:
+        mensagens = buscar_mensagens(imap, list(tratativas))
+        conn = None
+        try:
+            for uid in sorted(tratativas):
+                tratativa_id, assunto = tratativas[uid]
+                msg = mensagens.get(uid)
+                if msg is None:
+                    logger.error('[IMAP] Email uid=%s nao retornado pelo servidor', uid)
+                    lidos.discard(uid)
                     continue
-
-                tratativa_id = int(match.group(1))
+                remetente = _decodificar_header(msg.get('From', ''))
                 corpo = _extrair_texto_reply(msg)
-                data_email = _formatar_data_email(date_header)
+                data_email = _formatar_data_email(msg.get('Date', ''))
 
                 logger.info('[IMAP] Email encontrado | Tratativa #%d | De: %s | Assunto: %s',
                             tratativa_id, remetente, assunto)
-
                 try:
-                    conn = _get_conn()
-                    try:
-                        ok = processar_resposta(conn, tratativa_id, remetente, corpo, data_email)
-                        if ok:
-                            processados += 1
-                    finally:
-                        conn.close()
+                    if conn is None or conn.closed:
+                        conn = _get_conn()
+                    if processar_resposta(conn, tratativa_id, remetente, corpo, data_email):
+                        processados += 1
                 except Exception as e:
                     logger.error('[IMAP] Erro ao processar resposta da tratativa #%d: %s',
                                  tratativa_id, e)
+                    if conn is not None and not conn.closed:
+                        conn.rollback()
+        finally:
+            if conn is not None:
+                conn.close()
+
+    # Marca como lidos: respostas independente do resultado (evita
+    # reprocessar) e emails sem token, que nao sao resposta de tratativa
+    pendentes = len(uids) - len(lidos)
+    if pendentes:
+        logger.warning('[IMAP] %d email(s) nao retornado(s) pelo servidor; ficam nao lidos.', pendentes)
+    marcar_lidos(imap, sorted(lidos))
+
+    logger.info('[IMAP] Verificacao concluida. Processados: %d/%d emails com token TRAT.',
+                processados, len(uids))
+    return processados
 
-                # Marca como lido independente do resultado (evita reprocessar)
-                imap.store(uid, '+FLAGS', '\\Seen')
 
-            except Exception as e:
-                logger.error('[IMAP] Erro ao processar email uid=%s: %s', uid, e)
+def verificar_respostas_email():
+    """
+    Conecta ao IMAP, processa as respostas [TRAT:N] nao lidas e desconecta
+    (modo polling: agendador / main standalone).
+    """
+    logger.info('[IMAP] Iniciando verificacao de respostas...')
 
-        logger.info('[IMAP] Verificacao concluida. Processados: %d/%d emails com token TRAT.',
-                    processados, len(ids_lista))
+    try:
+        imap = conectar_imap()
+    except Exception as e:
+        logger.error('[IMAP] Falha ao conectar ao IMAP: %s', e)
+        return
 
+    try:
+        imap.select('INBOX')
+        processar_caixa(imap)
     except Exception as e:
         logger.error('[IMAP] Erro durante verificacao de emails: %s', e)
         traceback.print_exc()
@@ -92,6 +108,34 @@ def verificar_respostas_email():
             pass
 
 
+def escutar(parar=_stop_event, sessao=None):
+    """
+    Sessao IMAP persistente: verifica a caixa, espera em IDLE (ou polling,
+    se o servidor nao suporta) e verifica de novo. Queda de conexao ->
+    reconecta com espera crescente ate IMAP_RECONEXAO_MAX_SEG.
+    """
+    sessao = sessao or SessaoIMAP()
+    espera_erro = 5
+    while not parar.is_set():
+        try:
+            if not sessao.aberta:
+                sessao.abrir()
+                logger.info('[IMAP] Sessao aberta (%s)',
+                            'IDLE' if sessao.suporta_idle else 'polling a cada {}s'.format(IMAP_POLL_SEG))
+            while not parar.is_set():
+                processar_caixa(sessao.imap)
+                espera_erro = 5
+                if sessao.aguardar(parar):
+                    logger.info('[IMAP] Servidor avisou email novo')
+        except Exception as e:
+            logger.error('[IMAP] Sessao interrompida: %s — reconectando em %ds', e, espera_erro)
+            sessao.fechar()
+            parar.wait(espera_erro)
+            espera_erro = min(espera_erro * 2, IMAP_RECONEXAO_MAX_SEG)
+    sessao.fechar()
+    logger.info('[IMAP] Sessao encerrada')
+
+
 def stop():
     _stop_event.set()
 
@@ -100,6 +144,8 @@ def start_in_background():
     """
     Inicia como thread daemon junto ao Flask.
     OFF SWITCH: WORKER_IMAP_TRATATIVAS_AUTO=false no .env
+    IMAP_IDLE=true (padrao): sessao persistente com IDLE numa thread propria;
+    false: verificacao pelo agendador a cada IMAP_REPLY_INTERVALO_H.
     Aguarda 30s no startup para nao sobrecarregar a inicializacao do Flask.
     """
     global _background_started
@@ -117,40 +163,38 @@ def start_in_background():
     _background_started = True
     _stop_event.clear()
 
-    def _run():
-        try:
-            logger.info('[imap_tratativas] Thread daemon iniciada. Aguardando 30s...')
-            _stop_event.wait(30)
-
-            if _stop_event.is_set():
-                return
+    if IMAP_IDLE:
+        def _rodar():
+            if not _stop_event.wait(30):
+                escutar(_stop_event)
 
-            logger.info('[imap_tratativas] Iniciando ciclos (intervalo: %ds = %.1fh)',
-                        INTERVALO_SEG, INTERVALO_SEG / 3600)
+        threading.Thread(target=_rodar, name='worker_imap_tratativas', daemon=True).start()
+        logger.info('[imap_tratativas] Sessao IMAP persistente (IDLE) iniciada')
+        return _stop_event
 
-            while not _stop_event.is_set():
-                try:
-                    verificar_respostas_email()
-                except Exception as e:
-                    logger.error('[imap_tratativas] Erro no ciclo: %s', e, exc_info=True)
-
-                _stop_event.wait(INTERVALO_SEG)
-
-        except Exception as e:
-            logger.error('[imap_tratativas] Erro fatal na thread daemon: %s', e, exc_info=True)
-
-    t = threading.Thread(target=_run, name='worker_imap_tratativas', daemon=True)
-    t.start()
-    logger.info('[imap_tratativas] Thread daemon registrada')
+    agendador.registrar('worker_imap_tratativas', verificar_respostas_email,
+                        Intervalo(INTERVALO_SEG), atraso_inicial=30, parar=_stop_event)
+    logger.info('[imap_tratativas] Registrado no agendador (intervalo: %ds = %.1fh)',
+                INTERVALO_SEG, INTERVALO_SEG / 3600)
     return _stop_event
 
 
 def main():
     logger.info('=' * 60)
     logger.info('WORKER IMAP TRATATIVAS - INICIANDO')
-    logger.info('Intervalo: %.1fh (%ds)', INTERVALO_SEG / 3600, INTERVALO_SEG)
+    if IMAP_IDLE:
+        logger.info('Modo: sessao persistente (IDLE)')
+    else:
+        logger.info('Intervalo: %.1fh (%ds)', INTERVALO_SEG / 3600, INTERVALO_SEG)
     logger.info('=' * 60)
 
+    if IMAP_IDLE:
+        try:
+            escutar(_stop_event)
+        except KeyboardInterrupt:
+            logger.info('Worker encerrado pelo usuario.')
+        return
+
     while True:
         try:
             verificar_respostas_email()
@@ -1,6 +1,15 @@
 # -*- coding: utf-8 -*-
+from backend.llm_cache import CacheLLM
+from .banco import _get_conn
 from .config import logger, GROQ_API_KEY, GROQ_MODEL, PERIODO_SEMANAL_DIAS
 
+# Suba a versao quando o texto do prompt mudar de significado (invalida o llm_cache)
+VERSAO_PROMPT_DIARIA = 'sentir-agir-diaria-1'
+VERSAO_PROMPT_SEMANAL = 'sentir-agir-semanal-1'
+
+# Mesmos dados do dia (inclusive num --forcar) -> resposta do cache, sem chamar a API
+_cache = CacheLLM(_get_conn, nome='sentir_agir')
+
 
 def _get_groq_client():
     if not GROQ_API_KEY:
@@ -65,27 +74,32 @@ def gerar_analise_ia(dados):
         'Seja objetivo e profissional. Responda em portugues do Brasil.'
     ).format(data_str, blocos)
 
+    mensagens = [
+        {
+            'role': 'system',
+            'content': (
+                'Voce e um analista de qualidade hospitalar especializado em '
+                'experiencia do paciente. Responda sempre em portugues do Brasil, '
+                'de forma objetiva e profissional.'
+            )
+        },
+        {'role': 'user', 'content': prompt}
+    ]
+    params = {'max_tokens': 3000, 'temperature': 0.3}
+
     try:
-        response = client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=[
-                {
-                    'role': 'system',
-                    'content': (
-                        'Voce e um analista de qualidade hospitalar especializado em '
-                        'experiencia do paciente. Responda sempre em portugues do Brasil, '
-                        'de forma objetiva e profissional.'
-                    )
-                },
-                {'role': 'user', 'content': prompt}
-            ],
-            max_tokens=3000,
-            temperature=0.3
+        return _cache.resolver(
+            VERSAO_PROMPT_DIARIA, GROQ_MODEL, mensagens,
+            lambda: client.chat.completions.create(
+                model=GROQ_MODEL, messages=mensagens, **params
+            ).choices[0].message.content,
+            **params
         )
-        return response.choices[0].message.content
     except Exception as e:
         logger.error('Erro ao chamar Groq: %s', e)
         return None
+    finally:
+        logger.info('Cache IA: %s', _cache.resumo())
 
 
 def gerar_analise_categorias(dados):
@@ -132,23 +146,28 @@ def gerar_analise_categorias(dados):
         dados.get('periodo_dias', 7), dados['total_aberto'], blocos
     )
 
+    mensagens = [
+        {
+            'role': 'system',
+            'content': (
+                'Voce e um analista de qualidade hospitalar. '
+                'Responda sempre em portugues do Brasil, de forma objetiva e profissional.'
+            )
+        },
+        {'role': 'user', 'content': prompt}
+    ]
+    params = {'max_tokens': 2500, 'temperature': 0.3}
+
     try:
-        response = client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=[
-                {
-                    'role': 'system',
-                    'content': (
-                        'Voce e um analista de qualidade hospitalar. '
-                        'Responda sempre em portugues do Brasil, de forma objetiva e profissional.'
-                    )
-                },
-                {'role': 'user', 'content': prompt}
-            ],
-            max_tokens=2500,
-            temperature=0.3
+        return _cache.resolver(
+            VERSAO_PROMPT_SEMANAL, GROQ_MODEL, mensagens,
+            lambda: client.chat.completions.create(
+                model=GROQ_MODEL, messages=mensagens, **params
+            ).choices[0].message.content,
+            **params
         )
-        return response.choices[0].message.content
     except Exception as e:
         logger.error('[semanal] Erro ao chamar Groq: %s', e)
         return None
+    finally:
+        logger.info('[semanal] Cache IA: %s', _cache.resumo())
@@ -14,6 +14,7 @@ from .banco import (
     PERIODO_SEMANAL_DIAS
 )
 from .ia import gerar_analise_ia, gerar_analise_categorias
+from backend.agendador import agendador, Horarios, UmaVez
 
 _background_started = False
 _stop_event = threading.Event()
@@ -160,6 +161,17 @@ def ciclo_semanal_categorias():
     logger.info('=== CICLO SEMANAL CATEGORIAS CONCLUIDO (%d chars) ===', len(analise))
 
 
+def inicializar():
+    """Tabelas, dias uteis pendentes e a semana atual — uma vez ao subir."""
+    garantir_tabela()
+    garantir_tabela_categorias()
+    verificacao_inicial()
+    try:
+        ciclo_semanal_categorias()
+    except Exception as e:
+        logger.error('[worker_sentir_agir] Erro no ciclo semanal de categorias: %s', e)
+
+
 def stop():
     _stop_event.set()
 
@@ -189,38 +201,16 @@ def start_in_background():
     _background_started = True
     _stop_event.clear()
 
-    def _run():
-        try:
-            import schedule as _sched
-            _scheduler = _sched.Scheduler()
-
-            logger.info('[worker_sentir_agir] Thread daemon iniciada (PID %s, ciclo diario as %s)',
-                        os.getpid(), HORARIO_EXECUCAO)
-
-            garantir_tabela()
-            garantir_tabela_categorias()
-            verificacao_inicial()
-
-            try:
-                ciclo_semanal_categorias()
-            except Exception as e:
-                logger.error('[worker_sentir_agir] Erro no ciclo semanal de categorias: %s', e)
-
-            _scheduler.every().day.at(HORARIO_EXECUCAO).do(ciclo_diario)
-            _scheduler.every().monday.at(HORARIO_SEMANAL).do(ciclo_semanal_categorias)
-            logger.info('[worker_sentir_agir] Agendado: diario as %s | semanal categorias toda segunda as %s',
-                        HORARIO_EXECUCAO, HORARIO_SEMANAL)
-
-            while not _stop_event.is_set():
-                _scheduler.run_pending()
-                _stop_event.wait(30)
-
-        except Exception as e:
-            logger.error('[worker_sentir_agir] Erro fatal na thread daemon: %s', e, exc_info=True)
-
-    t = threading.Thread(target=_run, name='worker_sentir_agir_analise', daemon=True)
-    t.start()
-    logger.info('[worker_sentir_agir] Thread daemon registrada')
+    agendador.registrar('worker_sentir_agir_inicial', inicializar, UmaVez(),
+                        imediato=True, parar=_stop_event)
+    agendador.registrar('worker_sentir_agir_diario', ciclo_diario, Horarios([HORARIO_EXECUCAO]),
+                        parar=_stop_event)
+    # A semana atual ja e conferida em inicializar()
+    agendador.registrar('worker_sentir_agir_semanal', ciclo_semanal_categorias,
+                        Horarios([HORARIO_SEMANAL], dias_semana=[0]), perdidos='pular',
+                        parar=_stop_event)
+    logger.info('[worker_sentir_agir] Agendado (PID %s): diario as %s | semanal categorias toda segunda as %s',
+                os.getpid(), HORARIO_EXECUCAO, HORARIO_SEMANAL)
     return _stop_event
 
 
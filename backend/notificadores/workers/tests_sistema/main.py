@@ -6,6 +6,7 @@ from .config import logger, INTERVALO_HORAS
 from .verificacoes import executar_verificacoes
 from .reparos import executar_reparos
 from .relatorio import montar_saida_terminal, enviar_relatorio
+from backend.agendador import agendador, Intervalo
 
 _background_started = False
 _stop_event = threading.Event()
@@ -82,20 +83,10 @@ def start_in_background():
     _background_started = True
     _stop_event.clear()
 
-    def _run():
-        import schedule as _sched
-        _scheduler = _sched.Scheduler()
-
-        logger.info('[tests_sistema] Worker iniciado — verificação a cada %sh', INTERVALO_HORAS)
-        _scheduler.every(INTERVALO_HORAS).hours.do(ciclo_automatico)
-
-        while not _stop_event.is_set():
-            _scheduler.run_pending()
-            _stop_event.wait(60)
-
-    t = threading.Thread(target=_run, name='worker_tests_sistema', daemon=True)
-    t.start()
-    logger.info('[tests_sistema] Thread daemon registrada (ciclo a cada %sh)', INTERVALO_HORAS)
+    # Verificação pesada: disparo atrasado é descartado em vez de recuperado
+    agendador.registrar('worker_tests_sistema', ciclo_automatico,
+                        Intervalo(INTERVALO_HORAS * 3600), perdidos='pular', parar=_stop_event)
+    logger.info('[tests_sistema] Registrado no agendador (ciclo a cada %sh)', INTERVALO_HORAS)
     return _stop_event
 
 
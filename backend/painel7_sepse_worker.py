@@ -11,8 +11,10 @@ Funcionalidades:
 - Analisa critérios de sepse e sinais vitais
 - Gera recomendações clínicas baseadas em evidências
 - Salva análises na tabela painel_sepse_analise_ia
-- Sistema de retry e fallback
-- Logs detalhados
+- Pipeline IA compartilhado (backend.ia_pipeline): CRÍTICO primeiro,
+  chamadas em paralelo dentro do limite de taxa da Groq, backoff em 429 e
+  um único escritor no banco
+- Fallback de modelo e logs detalhados
 
 Autor: Sistema de Painéis - Hospital Anchieta Ceilândia
 Data: 2024
@@ -30,6 +32,13 @@ from dotenv import load_dotenv
 import requests
 import json
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.ia_pipeline import (  # noqa: E402
+    PipelineIA, ErroLimiteTaxa, estimar_tokens, retry_after,
+)
+from backend.llm_cache import CacheLLM  # noqa: E402
+
 # ========================================
 # CONFIGURAÇÃO
 # ========================================
@@ -53,9 +62,9 @@ CONFIG = {
     'intervalo_ciclo': 300,  # 5 minutos entre ciclos
     'batch_size': 10,  # Processar 10 pacientes por vez
     'timeout_api': 30,  # Timeout de 30s por requisição
-    'max_retries': 3,  # Máximo de tentativas por paciente
-    'delay_entre_requests': 2  # 2 segundos entre chamadas API
+    'max_tokens': 1000,  # Tokens máximos da resposta IA
 }
+# Concorrência e limites de taxa: GROQ_CONCORRENCIA / GROQ_RPM / GROQ_TPM (ia_pipeline)
 
 # Credenciais API
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
@@ -288,15 +297,55 @@ Seja objetivo, direto e baseado em evidências científicas. Use linguagem médi
 # CHAMAR API GROQ
 # ========================================
 
-def chamar_groq_api(prompt: str, modelo: str = "llama-3.3-70b-versatile") -> Optional[str]:
+# Suba a versão quando o texto do prompt mudar de significado (invalida o llm_cache)
+VERSAO_PROMPT = 'sepse-1'
+
+SYSTEM_PROMPT = "Você é um médico intensivista especialista em sepse e medicina de emergência. Forneça análises clínicas precisas, objetivas e baseadas em evidências científicas."
+
+PARAMS_IA = {
+    "temperature": 0.3,  # Baixa temperatura para respostas mais consistentes
+    "max_tokens": CONFIG['max_tokens'],
+    "top_p": 0.9
+}
+
+_cache = None
+
+
+def get_cache() -> CacheLLM:
+    global _cache
+    if _cache is None:
+        _cache = CacheLLM(get_db_connection, nome='sepse')
+    return _cache
+
+
+def _mensagens(prompt: str) -> List[Dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def chamar_groq_api(prompt: str, modelo: str = "llama-3.3-70b-versatile",
+                    pipeline: Optional[PipelineIA] = None) -> Optional[str]:
     """
-    Chama API Groq para análise de IA
+    Chama API Groq para análise de IA; prompt idêntico (mesmo modelo e
+    versão) sai do llm_cache sem chamar a API. Com `pipeline`, cada chamada
+    real à API é cobrada do limite de taxa dele (acerto de cache não cobra)
 
     Modelos disponíveis:
     - llama-3.3-70b-versatile (padrão - melhor qualidade)
     - llama-3.1-70b-versatile (alternativa)
     - mixtral-8x7b-32768 (fallback)
     """
+    def chamar():
+        if pipeline is not None and not pipeline.consumir(estimar_tokens(prompt)):
+            return None
+        return _chamar_groq(prompt, modelo)
+
+    return get_cache().resolver(VERSAO_PROMPT, modelo, _mensagens(prompt), chamar, **PARAMS_IA)
+
+
+def _chamar_groq(prompt: str, modelo: str) -> Optional[str]:
     try:
         url = "https://api.groq.com/openai/v1/chat/completions"
 
@@ -305,22 +354,7 @@ def chamar_groq_api(prompt: str, modelo: str = "llama-3.3-70b-versatile") -> Opt
             "Content-Type": "application/json"
         }
 
-        payload = {
-            "model": modelo,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "Você é um médico intensivista especialista em sepse e medicina de emergência. Forneça análises clínicas precisas, objetivas e baseadas em evidências científicas."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.3,  # Baixa temperatura para respostas mais consistentes
-            "max_tokens": 1000,
-            "top_p": 0.9
-        }
+        payload = {"model": modelo, "messages": _mensagens(prompt), **PARAMS_IA}
 
         logger.info(f"📡 Chamando Groq API (modelo: {modelo})...")
 
@@ -336,10 +370,15 @@ def chamar_groq_api(prompt: str, modelo: str = "llama-3.3-70b-versatile") -> Opt
             analise = data['choices'][0]['message']['content']
             logger.info(f"✅ Análise recebida ({len(analise)} caracteres)")
             return analise
+        elif response.status_code == 429:
+            # Limite de taxa: o pipeline reagenda com backoff
+            raise ErroLimiteTaxa(response.text[:200], retry_after(response.headers))
         else:
             logger.error(f"❌ Erro API Groq: {response.status_code} - {response.text}")
             return None
 
+    except ErroLimiteTaxa:
+        raise
     except requests.Timeout:
         logger.error("⏱️ Timeout na chamada API Groq")
         return None
@@ -352,12 +391,17 @@ def chamar_groq_api(prompt: str, modelo: str = "llama-3.3-70b-versatile") -> Opt
 # SALVAR ANÁLISE NO BANCO
 # ========================================
 
-def salvar_analise(paciente: Dict, analise: str, modelo: str, tempo_ms: int) -> bool:
+def salvar_analise(conn, resultado: Dict) -> bool:
     """
-    Salva análise de IA no banco de dados
+    Salva análise de IA no banco de dados.
+    Roda no escritor do pipeline, com a conexão persistente dele; o commit
+    fica por conta do pipeline.
     """
+    paciente = resultado['paciente']
+    analise = resultado['analise']
+    modelo = resultado['modelo']
+    tempo_ms = resultado['tempo_ms']
     try:
-        conn = get_db_connection()
         cursor = conn.cursor()
 
         # Marcar análises antigas como inativas
@@ -441,10 +485,7 @@ def salvar_analise(paciente: Dict, analise: str, modelo: str, tempo_ms: int) ->
             modelo,
             tempo_ms
         ))
-
-        conn.commit()
         cursor.close()
-        conn.close()
 
         logger.info(f"✅ Análise salva: Atendimento {paciente['nr_atendimento']}")
         return True
@@ -455,66 +496,63 @@ def salvar_analise(paciente: Dict, analise: str, modelo: str, tempo_ms: int) ->
 
 
 # ========================================
-# PROCESSAR PACIENTE
+# ANALISAR PACIENTE
 # ========================================
 
-def processar_paciente(paciente: Dict) -> bool:
+MODELOS = [
+    "llama-3.3-70b-versatile",
+    "llama-3.1-70b-versatile",
+    "mixtral-8x7b-32768"
+]
+
+
+def analisar_paciente(paciente: Dict, pipeline: Optional[PipelineIA] = None) -> Optional[Dict]:
     """
-    Processa análise de IA para um paciente específico
+    Chama a IA para um paciente, com fallback de modelo.
+    Retorna o resultado para o escritor do pipeline (None se todos os
+    modelos falharam); 429 sobe como ErroLimiteTaxa e o pipeline reagenda.
+    Cada modelo tentado é uma requisição ao limite de taxa do `pipeline`.
     """
     nr_atend = paciente['nr_atendimento']
-    risco = paciente['nivel_risco_sepse']
-
-    logger.info(f"🔍 Processando: atend={nr_atend} | risco={risco}")
+    logger.info(f"🔍 Processando: atend={nr_atend} | risco={paciente['nivel_risco_sepse']}")
 
     inicio = time.time()
+    prompt = gerar_prompt_sepse(paciente)
 
-    try:
-        # Gerar prompt
-        prompt = gerar_prompt_sepse(paciente)
-
-        # Chamar API com retry
-        analise = None
-        modelos = [
-            "llama-3.3-70b-versatile",
-            "llama-3.1-70b-versatile",
-            "mixtral-8x7b-32768"
-        ]
-
-        for tentativa, modelo in enumerate(modelos, 1):
-            if tentativa > 1:
-                logger.warning(f"⚠️ Tentativa {tentativa} com modelo alternativo: {modelo}")
-                time.sleep(CONFIG['delay_entre_requests'])
-
-            analise = chamar_groq_api(prompt, modelo)
-
-            if analise:
-                tempo_ms = int((time.time() - inicio) * 1000)
-
-                # Salvar no banco
-                if salvar_analise(paciente, analise, modelo, tempo_ms):
-                    logger.info(f"✅ Sucesso: {nr_atend} ({tempo_ms}ms)")
-                    return True
-                else:
-                    logger.error(f"❌ Erro ao salvar: {nr_atend}")
-                    return False
-
-        # Se chegou aqui, todas as tentativas falharam
-        logger.error(f"❌ Falha total: {nr_atend} (todas tentativas esgotadas)")
-        return False
+    for tentativa, modelo in enumerate(MODELOS, 1):
+        if tentativa > 1:
+            logger.warning(f"⚠️ Tentativa {tentativa} com modelo alternativo: {modelo}")
 
-    except Exception as e:
-        logger.error(f"❌ Erro ao processar {nr_atend}: {e}")
-        return False
+        analise = chamar_groq_api(prompt, modelo, pipeline)
+        if analise:
+            tempo_ms = int((time.time() - inicio) * 1000)
+            logger.info(f"✅ Sucesso: {nr_atend} ({tempo_ms}ms)")
+            return {'paciente': paciente, 'analise': analise, 'modelo': modelo, 'tempo_ms': tempo_ms}
+
+    # Se chegou aqui, todas as tentativas falharam
+    logger.error(f"❌ Falha total: {nr_atend} (todas tentativas esgotadas)")
+    return None
 
 
 # ========================================
 # CICLO PRINCIPAL
 # ========================================
 
+_pipeline = None
+
+
+def get_pipeline() -> PipelineIA:
+    """Pipeline do worker (threads e conexão do escritor vivem entre ciclos)."""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = PipelineIA('sepse', conectar=get_db_connection)
+    return _pipeline
+
+
 def executar_ciclo():
     """
-    Executa um ciclo completo de processamento
+    Executa um ciclo completo de processamento: todos os pacientes entram
+    no pipeline de uma vez e os CRÍTICOS são chamados primeiro.
     """
     logger.info("=" * 60)
     logger.info("🚀 INICIANDO CICLO DE ANÁLISE DE SEPSE")
@@ -532,21 +570,20 @@ def executar_ciclo():
 
         logger.info(f"📊 {len(pacientes)} pacientes para processar")
 
-        # Processar cada paciente
-        sucessos = 0
-        falhas = 0
-
-        for i, paciente in enumerate(pacientes, 1):
-            logger.info(f"\n--- Paciente {i}/{len(pacientes)} ---")
-
-            if processar_paciente(paciente):
-                sucessos += 1
-            else:
-                falhas += 1
-
-            # Delay entre pacientes
-            if i < len(pacientes):
-                time.sleep(CONFIG['delay_entre_requests'])
+        pipeline = get_pipeline()
+        futuros = []
+        for paciente in pacientes:
+            futuros.append(pipeline.submeter(
+                lambda p=paciente: analisar_paciente(p, pipeline),
+                salvar_analise,
+                nivel=paciente['nivel_risco_sepse'],
+                rotulo=f"atend={paciente['nr_atendimento']}",
+                # O limite de taxa é cobrado por chamada à API, dentro do
+                # fallback de modelos; acerto do llm_cache não espera o limite
+                limitar=False,
+            ))
+        resultado = pipeline.aguardar(futuros)
+        sucessos, falhas = resultado['sucessos'], resultado['falhas']
 
         # Estatísticas do ciclo
         tempo_total = time.time() - inicio_ciclo
@@ -556,6 +593,7 @@ def executar_ciclo():
         logger.info(f"Sucessos: {sucessos}")
         logger.info(f"Falhas: {falhas}")
         logger.info(f"Taxa de sucesso: {(sucessos / len(pacientes) * 100):.1f}%")
+        logger.info(f"Cache IA: {get_cache().resumo()}")
         logger.info("=" * 60 + "\n")
 
     except Exception as e:
@@ -592,6 +630,8 @@ def main():
 
         except KeyboardInterrupt:
             logger.info("\n👋 Worker finalizado pelo usuário")
+            if _pipeline is not None:
+                _pipeline.parar()
             break
         except Exception as e:
             logger.error(f"❌ Erro fatal no loop principal: {e}")
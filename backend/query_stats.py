@@ -0,0 +1,388 @@
+"""
+Instrumentacao de Consultas SQL
+Sistema de Paineis Hospitalares
+
+Funcionalidades:
+- Conexao/cursor instrumentados: cada execute() registra fingerprint da
+  consulta (literais e parametros normalizados), duracao, linhas e o
+  endpoint (ou thread) que chamou
+- Agregado em memoria por fingerprint: contagem, tempo total/maximo,
+  histograma de duracao e endpoints de origem
+- Log de consultas lentas (DB_SLOW_QUERY_MS) com amostragem opcional do
+  plano generico (EXPLAIN sem ANALYZE, parametros como $n) em background,
+  numa transacao READ ONLY: nao reexecuta a consulta nem expoe valores
+- query_stats(): top-N para o endpoint de administracao
+
+Ativado por padrao (DB_QUERY_STATS=false desliga): o custo por consulta e
+uma medicao de tempo e um acesso a dicionario — o fingerprint de cada texto
+SQL e calculado uma vez e reaproveitado.
+"""
+
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+import psycopg2.extensions
+
+from backend.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+QUERY_STATS_ENABLED = os.getenv('DB_QUERY_STATS', 'true').lower() == 'true'
+QUERY_STATS_MAX     = int(os.getenv('DB_QUERY_STATS_MAX', '500'))        # fingerprints mantidos
+SLOW_QUERY_MS       = float(os.getenv('DB_SLOW_QUERY_MS', '500'))
+# Fracao das consultas lentas (SELECT/WITH) que recebem EXPLAIN do plano generico; 0 desliga
+SLOW_QUERY_EXPLAIN_RATE     = float(os.getenv('DB_SLOW_QUERY_EXPLAIN_RATE', '0'))
+SLOW_QUERY_EXPLAIN_INTERVAL = int(os.getenv('DB_SLOW_QUERY_EXPLAIN_INTERVAL', '600'))  # por fingerprint
+
+_SQL_MAX_CHARS = 2000
+_MAX_ENDPOINTS = 10
+
+
+# =========================================================
+# FINGERPRINT
+# =========================================================
+
+_RE_COMENTARIO = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_RE_STRING     = re.compile(r"'(?:''|[^'])*'")
+_RE_PARAMETRO  = re.compile(r'%\([^)]+\)s|%s')
+_RE_NUMERO     = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_RE_LISTA      = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_RE_ESPACO     = re.compile(r'\s+')
+
+_fingerprints = OrderedDict()       # texto SQL -> (fingerprint, sql normalizado)
+_fingerprints_lock = threading.Lock()
+
+
+def normalizar(sql: str) -> str:
+    """Texto SQL sem literais: valores e parametros viram '?', listas IN (?)."""
+    sql = _RE_COMENTARIO.sub(' ', sql)
+    sql = _RE_STRING.sub('?', sql)
+    sql = _RE_PARAMETRO.sub('?', sql)
+    sql = _RE_NUMERO.sub('?', sql)
+    sql = _RE_LISTA.sub('(?)', sql)
+    return _RE_ESPACO.sub(' ', sql).strip()[:_SQL_MAX_CHARS]
+
+
+def fingerprint(sql: str):
+    """(id curto, sql normalizado) — memorizado por texto de consulta."""
+    item = _fingerprints.get(sql)
+    if item is not None:
+        return item
+    normal = normalizar(sql)
+    item = (hashlib.blake2b(normal.lower().encode('utf-8'), digest_size=6).hexdigest(), normal)
+    with _fingerprints_lock:
+        _fingerprints[sql] = item
+        while len(_fingerprints) > QUERY_STATS_MAX * 4:
+            _fingerprints.popitem(last=False)
+    return item
+
+
+# =========================================================
+# AGREGADO POR FINGERPRINT
+# =========================================================
+
+class _Consulta:
+    """Estatisticas de um fingerprint."""
+
+    __slots__ = ('id', 'sql', 'count', 'total', 'max', 'rows', 'slow', 'errors',
+                 'hist', 'endpoints', 'plano', 'plano_em', 'explain_em', 'ultima_em')
+
+    def __init__(self, fid: str, sql: str):
+        self.id = fid
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.errors = 0
+        self.hist = Histogram()
+        self.endpoints = {}           # endpoint -> chamadas
+        self.plano = None
+        self.plano_em = None
+        self.explain_em = 0.0
+        self.ultima_em = 0.0
+
+    def snapshot(self) -> dict:
+        endpoints = sorted(self.endpoints.items(), key=lambda e: -e[1])
+        return {
+            'fingerprint': self.id,
+            'sql': self.sql,
+            'count': self.count,
+            'total_ms': round(self.total * 1000, 1),
+            'avg_ms': round(self.total * 1000 / self.count, 2) if self.count else 0,
+            'max_ms': round(self.max * 1000, 1),
+            'rows': self.rows,
+            'slow': self.slow,
+            'errors': self.errors,
+            'endpoints': dict(endpoints),
+            'histogram': self.hist.snapshot(),
+            'plan': self.plano,
+            'plan_at': self.plano_em,
+        }
+
+
+_consultas = {}                     # fingerprint -> _Consulta
+_consultas_lock = threading.Lock()
+_local = threading.local()          # .silencioso: nao registra (EXPLAIN proprio)
+_explain_pool = None
+
+
+def _origem() -> str:
+    """Endpoint Flask da requisicao atual ou nome da thread (workers)."""
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            return request.endpoint or request.path
+    except Exception:
+        pass
+    return 'thread:' + threading.current_thread().name
+
+
+def _texto(cursor, query) -> str:
+    if isinstance(query, str):
+        return query
+    if isinstance(query, bytes):
+        return query.decode('utf-8', 'replace')
+    try:
+        return query.as_string(cursor)       # psycopg2.sql.Composed
+    except Exception:
+        return str(query)
+
+
+def registrar(cursor, query, params, duracao: float, erro: bool = False):
+    """Contabiliza uma execucao; loga e amostra EXPLAIN se for lenta."""
+    if getattr(_local, 'silencioso', False):
+        return
+    try:
+        texto = _texto(cursor, query)
+        fid, normal = fingerprint(texto)
+        origem = _origem()
+        linhas = cursor.rowcount if not erro and cursor.rowcount > 0 else 0
+
+        with _consultas_lock:
+            c = _consultas.get(fid)
+            if c is None:
+                if len(_consultas) >= QUERY_STATS_MAX:
+                    # Descarta o fingerprint menos custoso para abrir espaco
+                    menor = min(_consultas.values(), key=lambda x: x.total)
+                    del _consultas[menor.id]
+                c = _consultas[fid] = _Consulta(fid, normal)
+            c.count += 1
+            c.total += duracao
+            c.max = max(c.max, duracao)
+            c.rows += linhas
+            c.ultima_em = time.time()
+            if erro:
+                c.errors += 1
+            if origem in c.endpoints or len(c.endpoints) < _MAX_ENDPOINTS:
+                c.endpoints[origem] = c.endpoints.get(origem, 0) + 1
+            lenta = duracao * 1000 >= SLOW_QUERY_MS
+            if lenta:
+                c.slow += 1
+        c.hist.observe(duracao)
+
+        if lenta and not erro:
+            logger.warning(
+                f'[slow-query] {duracao * 1000:.0f}ms rows={linhas} fp={fid} '
+                f'origem={origem} sql={normal[:300]}'
+            )
+            _talvez_explain(cursor, c, query, params)
+    except Exception as e:
+        logger.debug(f'Erro ao registrar consulta: {e}')
+
+
+# =========================================================
+# EXPLAIN AMOSTRADO
+# =========================================================
+
+_RE_EXPLICAVEL = re.compile(r'^\s*(select|with)\b', re.I)
+_RE_ESCRITA    = re.compile(r'\b(insert|update|delete|merge|for\s+update)\b', re.I)
+_RE_MARCADOR   = re.compile(r'%%|%\((\w+)\)s|%s')
+
+
+def parametrizar(sql: str):
+    """
+    Troca os marcadores do psycopg2 (%s, %(nome)s) por $1..$n, para o
+    PREPARE do plano generico. Retorna (sql, n).
+    """
+    numeros = {}
+
+    def trocar(m):
+        if m.group(0) == '%%':
+            return '%'
+        chave = m.group(1) if m.group(1) is not None else len(numeros)
+        if chave not in numeros:
+            numeros[chave] = len(numeros) + 1
+        return '${}'.format(numeros[chave])
+
+    return _RE_MARCADOR.sub(trocar, sql), len(numeros)
+
+
+def _talvez_explain(cursor, c: _Consulta, query, params):
+    if SLOW_QUERY_EXPLAIN_RATE <= 0 or random.random() >= SLOW_QUERY_EXPLAIN_RATE:
+        return
+    agora = time.monotonic()
+    if c.explain_em and agora - c.explain_em < SLOW_QUERY_EXPLAIN_INTERVAL:
+        return
+    texto = _texto(cursor, query)
+    if not _RE_EXPLICAVEL.match(texto) or _RE_ESCRITA.search(texto):
+        return
+    c.explain_em = agora
+    # Texto com marcadores, nunca o mogrify: os valores (dados de paciente)
+    # nao chegam ao plano, ao log nem ao /api/admin/queries
+    sql, n = parametrizar(texto)
+    _get_explain_pool().submit(_explain, c, sql, n)
+
+
+def _get_explain_pool():
+    global _explain_pool
+    with _consultas_lock:
+        if _explain_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _explain_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='query_explain')
+        return _explain_pool
+
+
+def _explain(c: _Consulta, sql: str, n: int):
+    """
+    Plano generico da consulta (PREPARE + EXPLAIN EXECUTE com parametros
+    NULL e plan_cache_mode=force_generic_plan) em transacao READ ONLY: so
+    planeja, sem executar. Literais de texto do proprio SQL sao mascarados
+    no plano guardado (consultas que interpolam valores no texto).
+    """
+    from backend.database import get_db_connection, release_connection
+
+    _local.silencioso = True
+    conn = get_db_connection()
+    if conn is None:
+        return
+    nome = 'query_stats_' + c.id
+    try:
+        cur = conn.cursor()
+        cur.execute('SET TRANSACTION READ ONLY')
+        cur.execute("SET LOCAL statement_timeout = '30s'")
+        cur.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+        cur.execute('PREPARE {} AS {}'.format(nome, sql))
+        argumentos = '({})'.format(', '.join(['NULL'] * n)) if n else ''
+        cur.execute('EXPLAIN EXECUTE {}{}'.format(nome, argumentos))
+        plano = '\n'.join(_RE_STRING.sub("'?'", row[0]) for row in cur.fetchall())
+        cur.close()
+        c.plano = plano
+        c.plano_em = time.strftime('%Y-%m-%dT%H:%M:%S')
+        logger.warning(f'[slow-query] plano fp={c.id} disponivel em /api/admin/queries')
+    except Exception as e:
+        logger.warning(f'Erro no EXPLAIN da consulta {c.id}: {type(e).__name__}')
+    finally:
+        try:
+            conn.rollback()
+            # PREPARE nao e desfeito pelo rollback; a conexao volta ao pool
+            conn.cursor().execute('DEALLOCATE {}'.format(nome))
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        release_connection(conn)
+
+
+# =========================================================
+# CURSOR / CONEXAO INSTRUMENTADOS
+# =========================================================
+
+class _Instrumentado:
+    """Mixin: mede execute/executemany do cursor base."""
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        erro = True
+        try:
+            resultado = super().execute(query, vars)
+            erro = False
+            return resultado
+        finally:
+            registrar(self, query, vars, time.perf_counter() - inicio, erro)
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        erro = True
+        try:
+            resultado = super().executemany(query, vars_list)
+            erro = False
+            return resultado
+        finally:
+            registrar(self, query, None, time.perf_counter() - inicio, erro)
+
+
+_classes = {}                        # cursor_factory -> subclasse instrumentada
+
+
+def instrumentar(cursor_class):
+    """Subclasse instrumentada de um cursor psycopg2 (memorizada)."""
+    if issubclass(cursor_class, _Instrumentado):
+        return cursor_class
+    cls = _classes.get(cursor_class)
+    if cls is None:
+        cls = type('Instrumentado' + cursor_class.__name__, (_Instrumentado, cursor_class), {})
+        _classes[cursor_class] = cls
+    return cls
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """
+    Conexao cujos cursores sao instrumentados, inclusive quando a rota passa
+    cursor_factory=RealDictCursor explicitamente em conn.cursor().
+    """
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = instrumentar(base)
+        return super().cursor(*args, **kwargs)
+
+
+def connection_extras() -> dict:
+    """Parametros para psycopg2.connect: connection_factory se ativado."""
+    return {'connection_factory': InstrumentedConnection} if QUERY_STATS_ENABLED else {}
+
+
+# =========================================================
+# CONSULTA DAS ESTATISTICAS
+# =========================================================
+
+_ORDENS = {
+    'total': lambda c: c.total,
+    'media': lambda c: c.total / c.count if c.count else 0,
+    'max': lambda c: c.max,
+    'count': lambda c: c.count,
+    'slow': lambda c: c.slow,
+}
+
+
+def query_stats(ordem: str = 'total', limite: int = 20) -> dict:
+    """Top-N fingerprints pela ordem pedida (total, media, max, count, slow)."""
+    chave = _ORDENS.get(ordem, _ORDENS['total'])
+    with _consultas_lock:
+        consultas = sorted(_consultas.values(), key=chave, reverse=True)[:max(1, limite)]
+        resumo = {
+            'enabled': QUERY_STATS_ENABLED,
+            'fingerprints': len(_consultas),
+            'statements': sum(c.count for c in _consultas.values()),
+            'slow': sum(c.slow for c in _consultas.values()),
+            'slow_threshold_ms': SLOW_QUERY_MS,
+            'explain_rate': SLOW_QUERY_EXPLAIN_RATE,
+        }
+        top = [c.snapshot() for c in consultas]
+    return {**resumo, 'order': ordem if ordem in _ORDENS else 'total', 'queries': top}
+
+
+def query_stats_reset():
+    with _consultas_lock:
+        _consultas.clear()
@@ -18,6 +18,8 @@ from flask import Blueprint, jsonify, send_from_directory, request, Response, se
 
 from backend.middleware.decorators import admin_required, login_required
 from backend.database import get_db_connection
+from backend.export import consulta_stream, csv_response
+from backend.access_log_store import aplicar_retencao
 from backend.access_tracker import (
     get_connected_users, PAINEIS_NOMES,
     _write_log_async, _SERVER_IPS,
@@ -209,26 +211,27 @@ def get_stats():
         from psycopg2.extras import RealDictCursor
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
-        # Totais — limitado a 6 meses para evitar full scan em tabela grande
+        # Tudo sai dos rollups (access_log_dia / access_log_hora), nunca da
+        # tabela bruta: o custo não cresce com o histórico guardado.
         cur.execute("""
             SELECT
-                COUNT(*)                                            AS total,
-                COUNT(*) FILTER (WHERE dt_acesso::date = CURRENT_DATE)                AS hoje,
-                COUNT(*) FILTER (WHERE dt_acesso >= NOW() - INTERVAL '7 days')        AS semana,
-                COUNT(*) FILTER (WHERE dt_acesso >= NOW() - INTERVAL '30 days')       AS mes,
-                COUNT(DISTINCT ip) FILTER (WHERE dt_acesso::date = CURRENT_DATE)      AS ips_hoje,
-                COUNT(*) FILTER (WHERE tipo_acesso = 'erro'
-                                   AND dt_acesso::date = CURRENT_DATE)                AS erros_hoje
-            FROM access_log
-            WHERE dt_acesso >= NOW() - INTERVAL '6 months'
+                COALESCE(SUM(acessos), 0)                                          AS total,
+                COALESCE(SUM(acessos) FILTER (WHERE dia = CURRENT_DATE), 0)        AS hoje,
+                COALESCE(SUM(acessos) FILTER (WHERE dia > CURRENT_DATE - 7), 0)    AS semana,
+                COALESCE(SUM(acessos) FILTER (WHERE dia > CURRENT_DATE - 30), 0)   AS mes,
+                COUNT(DISTINCT ip) FILTER (WHERE dia = CURRENT_DATE)               AS ips_hoje,
+                COALESCE(SUM(acessos) FILTER (WHERE tipo_acesso = 'erro'
+                                                AND dia = CURRENT_DATE), 0)        AS erros_hoje
+            FROM access_log_dia
+            WHERE dia >= CURRENT_DATE - INTERVAL '6 months'
         """)
         totais = cur.fetchone()
 
         # Tipo mais acessado hoje
         cur.execute("""
-            SELECT tipo_acesso, COUNT(*) AS n
-            FROM access_log
-            WHERE dt_acesso::date = CURRENT_DATE
+            SELECT NULLIF(tipo_acesso, '') AS tipo_acesso, SUM(acessos) AS n
+            FROM access_log_dia
+            WHERE dia = CURRENT_DATE
             GROUP BY tipo_acesso
             ORDER BY n DESC
             LIMIT 10
@@ -237,13 +240,13 @@ def get_stats():
 
         # Top painéis 7 dias
         cur.execute("""
-            SELECT painel_codigo, painel_nome,
-                   COUNT(*)            AS acessos,
+            SELECT painel_codigo, MAX(painel_nome) AS painel_nome,
+                   SUM(acessos)        AS acessos,
                    COUNT(DISTINCT ip)  AS computadores
-            FROM access_log
-            WHERE painel_codigo IS NOT NULL
-              AND dt_acesso >= NOW() - INTERVAL '7 days'
-            GROUP BY painel_codigo, painel_nome
+            FROM access_log_dia
+            WHERE painel_codigo <> ''
+              AND dia > CURRENT_DATE - 7
+            GROUP BY painel_codigo
             ORDER BY acessos DESC
             LIMIT 10
         """)
@@ -251,12 +254,12 @@ def get_stats():
 
         # Acessos por hora hoje (para gráfico)
         cur.execute("""
-            SELECT EXTRACT(HOUR FROM dt_acesso)::int AS hora,
-                   COUNT(*) AS n
-            FROM access_log
-            WHERE dt_acesso::date = CURRENT_DATE
-            GROUP BY hora
-            ORDER BY hora
+            SELECT EXTRACT(HOUR FROM hora)::int AS hora,
+                   SUM(acessos) AS n
+            FROM access_log_hora
+            WHERE hora >= CURRENT_DATE
+            GROUP BY 1
+            ORDER BY 1
         """)
         por_hora = {r['hora']: r['n'] for r in cur.fetchall()}
         acessos_por_hora = [por_hora.get(h, 0) for h in range(24)]
@@ -264,11 +267,11 @@ def get_stats():
         # Top IPs 7 dias
         cur.execute("""
             SELECT ip,
-                   COUNT(*)            AS acessos,
-                   MAX(dt_acesso)      AS ultimo,
-                   COUNT(DISTINCT painel_codigo) AS paineis_distintos
-            FROM access_log
-            WHERE dt_acesso >= NOW() - INTERVAL '7 days'
+                   SUM(acessos)        AS acessos,
+                   MAX(ultimo_acesso)  AS ultimo,
+                   COUNT(DISTINCT NULLIF(painel_codigo, '')) AS paineis_distintos
+            FROM access_log_dia
+            WHERE dia > CURRENT_DATE - 7
             GROUP BY ip
             ORDER BY acessos DESC
             LIMIT 10
@@ -306,87 +309,72 @@ def get_stats():
 @acessos_bp.route('/exportar', methods=['GET'])
 @admin_required
 def exportar_csv():
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'erro': 'Banco indisponível'}), 503
-
+    # Cursor no servidor + CSV em streaming: memoria constante, sem limite de linhas
+    q_data, params = _build_historico_query(request.args)
     try:
-        from psycopg2.extras import RealDictCursor
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-
-        q_data, params = _build_historico_query(request.args)
-        # Limita a 50k linhas por segurança
-        cur.execute(q_data + ' LIMIT 50000', params)
-        rows = cur.fetchall()
-        cur.close()
-
-        output = io.StringIO()
-        writer = csv.writer(output, quoting=csv.QUOTE_ALL)
-
-        # Cabeçalho em português, linguagem simples
-        writer.writerow([
-            'Data e Hora', 'IP do Computador', 'Usuário do Sistema',
-            'Painel / Tela Acessada', 'Descrição do Acesso',
-            'Tipo de Acesso', 'Resultado', 'Duração (ms)', 'Código HTTP',
-        ])
+        linhas = consulta_stream(q_data, params)
+    except ConnectionError:
+        return jsonify({'erro': 'Banco indisponível'}), 503
+    except Exception:
+        return jsonify({'erro': 'Erro interno'}), 500
 
-        for r in rows:
-            dt = r['dt_acesso'].strftime('%d/%m/%Y %H:%M:%S') if r['dt_acesso'] else ''
-            status = r['status_code']
-            if status is None:
-                resultado = '—'
-            elif status < 300:
-                resultado = 'Sucesso'
-            elif status == 401:
-                resultado = 'Não autenticado'
-            elif status == 403:
-                resultado = 'Sem permissão'
-            elif status == 404:
-                resultado = 'Não encontrado'
-            elif status >= 500:
-                resultado = 'Erro no servidor'
-            else:
-                resultado = str(status)
-
-            tipos_pt = {
-                'painel':  'Visualização de Painel',
-                'login':   'Login no Sistema',
-                'logout':  'Logout do Sistema',
-                'admin':   'Ação Administrativa',
-                'erro':    'Erro de Acesso',
-                'sistema': 'Acesso ao Sistema',
-                'evento':  'Ação do Usuário',
-            }
-            tipo_pt = tipos_pt.get(r['tipo_acesso'] or '', r['tipo_acesso'] or '—')
-
-            writer.writerow([
-                dt,
-                r['ip'] or '—',
-                r['usuario_nome'] or 'Não identificado',
-                r['painel_nome'] or r['painel_codigo'] or 'Sistema',
-                r['descricao'] or '—',
-                tipo_pt,
-                resultado,
-                r['duracao_ms'] if r['duracao_ms'] is not None else '—',
-                status or '—',
-            ])
-
-        # BOM para Excel reconhecer UTF-8 corretamente
-        csv_bytes = ('﻿' + output.getvalue()).encode('utf-8')
-        nome_arquivo = 'log_acessos_HAC_{}.csv'.format(
-            datetime.now().strftime('%Y%m%d_%H%M'))
+    # Cabeçalho em português, linguagem simples
+    cabecalho = [
+        'Data e Hora', 'IP do Computador', 'Usuário do Sistema',
+        'Painel / Tela Acessada', 'Descrição do Acesso',
+        'Tipo de Acesso', 'Resultado', 'Duração (ms)', 'Código HTTP',
+    ]
+    nome_arquivo = 'log_acessos_HAC_{}.csv'.format(
+        datetime.now().strftime('%Y%m%d_%H%M'))
+
+    return csv_response(
+        nome_arquivo, cabecalho, (_linha_csv(r) for r in linhas),
+        quoting=csv.QUOTE_ALL, ao_fechar=linhas.fechar,
+    )
 
-        return Response(
-            csv_bytes,
-            mimetype='text/csv; charset=utf-8',
-            headers={'Content-Disposition': 'attachment; filename="{}"'.format(nome_arquivo)}
-        )
 
-    except Exception as e:
-        return jsonify({'erro': 'Erro interno'}), 500
-    finally:
-        if not conn.closed:
-            conn.close()
+_TIPOS_PT = {
+    'painel':  'Visualização de Painel',
+    'login':   'Login no Sistema',
+    'logout':  'Logout do Sistema',
+    'admin':   'Ação Administrativa',
+    'erro':    'Erro de Acesso',
+    'sistema': 'Acesso ao Sistema',
+    'evento':  'Ação do Usuário',
+}
+
+
+def _linha_csv(r):
+    dt = r['dt_acesso'].strftime('%d/%m/%Y %H:%M:%S') if r['dt_acesso'] else ''
+    status = r['status_code']
+    if status is None:
+        resultado = '—'
+    elif status < 300:
+        resultado = 'Sucesso'
+    elif status == 401:
+        resultado = 'Não autenticado'
+    elif status == 403:
+        resultado = 'Sem permissão'
+    elif status == 404:
+        resultado = 'Não encontrado'
+    elif status >= 500:
+        resultado = 'Erro no servidor'
+    else:
+        resultado = str(status)
+
+    tipo_pt = _TIPOS_PT.get(r['tipo_acesso'] or '', r['tipo_acesso'] or '—')
+
+    return [
+        dt,
+        r['ip'] or '—',
+        r['usuario_nome'] or 'Não identificado',
+        r['painel_nome'] or r['painel_codigo'] or 'Sistema',
+        r['descricao'] or '—',
+        tipo_pt,
+        resultado,
+        r['duracao_ms'] if r['duracao_ms'] is not None else '—',
+        status or '—',
+    ]
 
 
 # ─────────────────────────────────────────────────────────
@@ -414,17 +402,18 @@ def exportar_mensal_paineis():
         from psycopg2.extras import RealDictCursor
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
-        # Requisições por painel × mês
+        # Requisições por painel × mês (rollup diário — 24 meses de histórico
+        # mesmo com a tabela bruta retendo só 6)
         cur.execute("""
             SELECT
                 COALESCE(MAX(painel_nome), painel_codigo) AS nome,
                 painel_codigo,
-                TO_CHAR(DATE_TRUNC('month', dt_acesso), 'YYYY-MM') AS mes,
-                COUNT(*)            AS requisicoes
-            FROM access_log
-            WHERE painel_codigo IS NOT NULL
-              AND dt_acesso >= DATE_TRUNC('month', NOW())
-                              - (%s - 1) * INTERVAL '1 month'
+                TO_CHAR(DATE_TRUNC('month', dia), 'YYYY-MM') AS mes,
+                SUM(acessos)        AS requisicoes
+            FROM access_log_dia
+            WHERE painel_codigo <> ''
+              AND dia >= DATE_TRUNC('month', CURRENT_DATE)
+                         - (%s - 1) * INTERVAL '1 month'
             GROUP BY painel_codigo, mes
             ORDER BY painel_codigo, mes
         """, (meses,))
@@ -435,12 +424,12 @@ def exportar_mensal_paineis():
             SELECT
                 COALESCE(MAX(painel_nome), painel_codigo) AS nome,
                 painel_codigo,
-                COUNT(*)            AS total_periodo,
+                SUM(acessos)        AS total_periodo,
                 COUNT(DISTINCT ip)  AS computadores_periodo
-            FROM access_log
-            WHERE painel_codigo IS NOT NULL
-              AND dt_acesso >= DATE_TRUNC('month', NOW())
-                              - (%s - 1) * INTERVAL '1 month'
+            FROM access_log_dia
+            WHERE painel_codigo <> ''
+              AND dia >= DATE_TRUNC('month', CURRENT_DATE)
+                         - (%s - 1) * INTERVAL '1 month'
             GROUP BY painel_codigo
         """, (meses,))
         totais = {r['painel_codigo']: dict(r) for r in cur.fetchall()}
@@ -581,15 +570,14 @@ def limpeza():
     if not conn:
         return jsonify({'erro': 'Banco indisponível'}), 503
     try:
-        cur = conn.cursor()
-        cur.execute(
-            "DELETE FROM access_log WHERE dt_acesso < NOW() - INTERVAL '6 months'")
-        removidos = cur.rowcount
-        conn.commit()
-        cur.close()
+        # Retenção por partição: DROP do mês inteiro em vez de DELETE linha a linha
+        resultado = aplicar_retencao(conn)
+        removidos = resultado['linhas_estimadas']
         return jsonify({
             'removidos': removidos,
-            'msg': '{} registro(s) removido(s) (anteriores a 6 meses)'.format(removidos)
+            'particoes': resultado['particoes'],
+            'msg': '~{} registro(s) removido(s) (anteriores a 6 meses, {} partição(ões))'.format(
+                removidos, len(resultado['particoes']))
         })
     except Exception as e:
         return jsonify({'erro': 'Erro interno'}), 500
@@ -613,11 +601,11 @@ def paineis_lista():
         from psycopg2.extras import RealDictCursor
         cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute("""
-            SELECT painel_codigo, painel_nome, COUNT(*) AS total
-            FROM access_log
-            WHERE painel_codigo IS NOT NULL
-              AND dt_acesso >= NOW() - INTERVAL '6 months'
-            GROUP BY painel_codigo, painel_nome
+            SELECT painel_codigo, MAX(painel_nome) AS painel_nome, SUM(acessos) AS total
+            FROM access_log_dia
+            WHERE painel_codigo <> ''
+              AND dia >= CURRENT_DATE - INTERVAL '6 months'
+            GROUP BY painel_codigo
             ORDER BY total DESC
         """)
         lista = [dict(r) for r in cur.fetchall()]
@@ -132,6 +132,36 @@ def api_estatisticas():
         return jsonify({'success': False, 'error': 'Erro interno'}), 500
 
 
+@admin_bp.route('/admin/queries', methods=['GET'])
+@admin_required
+def api_query_stats():
+    """
+    Consultas SQL mais custosas desde o ultimo restart/reset
+    GET /api/admin/queries?ordem=total|media|max|count|slow&limite=20
+    """
+    try:
+        from backend.query_stats import query_stats
+        limite = min(request.args.get('limite', 20, type=int) or 20, 200)
+        return jsonify({'success': True, **query_stats(request.args.get('ordem', 'total'), limite)}), 200
+
+    except Exception as e:
+        current_app.logger.error(f'Erro ao obter estatísticas de consultas: {e}', exc_info=True)
+        return jsonify({'success': False, 'error': 'Erro interno'}), 500
+
+
+@admin_bp.route('/admin/queries/reset', methods=['POST'])
+@admin_required
+def api_query_stats_reset():
+    """
+    Zera as estatisticas de consultas SQL
+    POST /api/admin/queries/reset
+    """
+    from backend.query_stats import query_stats_reset
+    query_stats_reset()
+    current_app.logger.info(f'Estatísticas de consultas zeradas por {session.get("usuario")}')
+    return jsonify({'success': True}), 200
+
+
 @admin_bp.route('/admin/usuarios/<int:usuario_id>', methods=['PUT'])
 @admin_required
 def api_editar_usuario(usuario_id):
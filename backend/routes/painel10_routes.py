@@ -24,6 +24,7 @@ from psycopg2.extras import RealDictCursor
 from backend.database import get_db_cursor
 from backend.middleware.decorators import login_required, panel_permission_required
 from backend.cache import cache_route
+from backend.espera_ps import estimador_espera
 
 logger = logging.getLogger(__name__)
 
@@ -129,7 +130,7 @@ def painel10():
 @painel10_bp.route('/api/paineis/painel10/dashboard', methods=['GET'])
 @login_required
 @panel_permission_required('painel10')
-@cache_route(ttl=120, key_prefix='painel10:dashboard', vary_by_user=False)
+@cache_route(ttl=120, key_prefix='painel10:dashboard', vary_by_user=False, stale_ttl=120)
 def api_painel10_dashboard():
     """
     Resumo geral do dia.
@@ -164,7 +165,7 @@ def api_painel10_dashboard():
 @painel10_bp.route('/api/paineis/painel10/tempo-clinica', methods=['GET'])
 @login_required
 @panel_permission_required('painel10')
-@cache_route(ttl=120, key_prefix='painel10:tempo-clinica', vary_by_user=False, vary_by_query=True)
+@cache_route(ttl=120, key_prefix='painel10:tempo-clinica', vary_by_user=False, vary_by_query=True, stale_ttl=120)
 def api_painel10_tempo_clinica():
     """
     Tempo medio de espera por clinica.
@@ -190,7 +191,7 @@ def api_painel10_tempo_clinica():
 @painel10_bp.route('/api/paineis/painel10/aguardando-clinica', methods=['GET'])
 @login_required
 @panel_permission_required('painel10')
-@cache_route(ttl=90, key_prefix='painel10:aguardando-clinica', vary_by_user=False, vary_by_query=True)
+@cache_route(ttl=90, key_prefix='painel10:aguardando-clinica', vary_by_user=False, vary_by_query=True, stale_ttl=90)
 def api_painel10_aguardando_clinica():
     """
     Pacientes aguardando atendimento por clinica.
@@ -216,7 +217,7 @@ def api_painel10_aguardando_clinica():
 @painel10_bp.route('/api/paineis/painel10/atendimentos-hora', methods=['GET'])
 @login_required
 @panel_permission_required('painel10')
-@cache_route(ttl=120, key_prefix='painel10:atendimentos-hora', vary_by_user=False)
+@cache_route(ttl=120, key_prefix='painel10:atendimentos-hora', vary_by_user=False, stale_ttl=120)
 def api_painel10_atendimentos_hora():
     """
     Distribuicao de atendimentos por hora do dia.
@@ -242,7 +243,7 @@ def api_painel10_atendimentos_hora():
 @painel10_bp.route('/api/paineis/painel10/desempenho-medico', methods=['GET'])
 @login_required
 @panel_permission_required('painel10')
-@cache_route(ttl=180, key_prefix='painel10:desempenho-medico', vary_by_user=False, vary_by_query=True)
+@cache_route(ttl=180, key_prefix='painel10:desempenho-medico', vary_by_user=False, vary_by_query=True, stale_ttl=180)
 def api_painel10_desempenho_medico():
     """
     Desempenho dos medicos do dia.
@@ -268,7 +269,7 @@ def api_painel10_desempenho_medico():
 @painel10_bp.route('/api/paineis/painel10/desempenho-recepcao', methods=['GET'])
 @login_required
 @panel_permission_required('painel10')
-@cache_route(ttl=180, key_prefix='painel10:desempenho-recepcao', vary_by_user=False)
+@cache_route(ttl=180, key_prefix='painel10:desempenho-recepcao', vary_by_user=False, stale_ttl=180)
 def api_painel10_desempenho_recepcao():
     """
     Metricas de desempenho da recepcao.
@@ -300,7 +301,8 @@ def api_painel10_desempenho_recepcao():
 @painel10_bp.route('/api/paineis/painel10/clinicas-consolidado', methods=['GET'])
 @login_required
 @panel_permission_required('painel10')
-@cache_route(ttl=90, key_prefix='painel10:clinicas-consolidado', vary_by_user=False)
+@cache_route(ttl=90, key_prefix='painel10:clinicas-consolidado', vary_by_user=False, stale_ttl=90,
+             depends_on=('painel_ps_analise', 'painel17_atendimentos_ps', 'medicos_ps'))
 def api_painel10_clinicas_consolidado():
     """
     Endpoint unificado que combina dados de aguardando, tempo por clínica e mediana.
@@ -339,28 +341,14 @@ def api_painel10_clinicas_consolidado():
             except Exception as e_max:
                 logger.warning('Maior espera indisponivel (painel_ps_analise): %s', str(e_max))
 
-            # Mediana de espera por clínica — mesma lógica do painel17:
-            # painel17_atendimentos_ps com COALESCE(retirada_senha, dt_entrada) como início
+            # Mediana de espera por clínica — a mesma do painel17 (estimador em
+            # memória alimentado por painel17_atendimentos_ps)
             mediana_rows = {}
             try:
-                cursor.execute("""
-                    SELECT
-                        clinica,
-                        ROUND(PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY
-                            EXTRACT(EPOCH FROM (
-                                dt_inicio_atendimento_med - COALESCE(retirada_senha, dt_entrada)
-                            )) / 60
-                        ))::int AS mediana_espera_min
-                    FROM painel17_atendimentos_ps
-                    WHERE dt_inicio_atendimento_med IS NOT NULL
-                      AND dt_entrada >= NOW() - INTERVAL '24 hours'
-                      AND clinica IS NOT NULL
-                      AND EXTRACT(EPOCH FROM (
-                          dt_inicio_atendimento_med - COALESCE(retirada_senha, dt_entrada)
-                      )) / 60 BETWEEN 1 AND 300
-                    GROUP BY clinica
-                """)
-                mediana_rows = {_norm(r['clinica']): r['mediana_espera_min'] for r in cursor.fetchall()}
+                agora = datetime.now()
+                estimador_espera.atualizar(cursor, agora)
+                mediana_rows = {_norm(nome): mediana
+                                for nome, mediana in estimador_espera.medianas_por_clinica(agora).items()}
             except Exception as e_med:
                 logger.warning('Mediana indisponivel (painel17_atendimentos_ps): %s', str(e_med))
 
@@ -7,10 +7,32 @@ from datetime import datetime
 from psycopg2.extras import RealDictCursor
 from backend.database import get_db_cursor
 from backend.middleware.decorators import login_required, panel_permission_required
+from backend.cache import cache_route
 
 # Cria o Blueprint
 painel14_bp = Blueprint('painel14', __name__)
 
+# Tag dos chamados ativos: invalidada aqui nas escritas e pelo painel15
+# na abertura, para a TV receber o chamado novo pelo stream
+TAG_CHAMADOS = 'chamados_ti'
+
+
+@painel14_bp.after_request
+def invalidar_chamados_on_write(response):
+    """
+    Invalida dashboard e lista de chamados apos escrita bem sucedida
+    nos chamados. Config, locais e problemas nao alteram essas respostas.
+    """
+    if (request.method in ('POST', 'PUT', 'DELETE')
+            and 200 <= response.status_code < 300
+            and '/chamados/' in request.path):
+        try:
+            from backend.cache import cache_invalidate_tags_async
+            cache_invalidate_tags_async([TAG_CHAMADOS])
+        except Exception as e:
+            current_app.logger.warning(f'Erro ao invalidar cache do painel14: {e}')
+    return response
+
 
 # =========================================================
 # ROTAS DE PAGINA HTML
@@ -31,6 +53,7 @@ def painel14():
 @painel14_bp.route('/api/paineis/painel14/dashboard', methods=['GET'])
 @login_required
 @panel_permission_required('painel14')
+@cache_route(ttl=10, key_prefix='painel14:dashboard', vary_by_user=False, tags=(TAG_CHAMADOS,))
 def api_painel14_dashboard():
     """
     Estatisticas gerais dos chamados
@@ -70,6 +93,7 @@ def api_painel14_dashboard():
 @painel14_bp.route('/api/paineis/painel14/chamados', methods=['GET'])
 @login_required
 @panel_permission_required('painel14')
+@cache_route(ttl=10, key_prefix='painel14:chamados', vary_by_user=False, tags=(TAG_CHAMADOS,))
 def api_painel14_chamados():
     """
     Lista chamados ativos (abertos e em atendimento)
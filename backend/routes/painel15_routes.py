@@ -12,6 +12,19 @@ from backend.middleware.decorators import login_required, panel_permission_requi
 painel15_bp = Blueprint('painel15', __name__)
 
 
+@painel15_bp.after_request
+def invalidar_chamados_on_write(response):
+    """Chamado aberto entra no dashboard e na lista do painel14"""
+    if request.method == 'POST' and 200 <= response.status_code < 300:
+        try:
+            from backend.cache import cache_invalidate_tags_async
+            from backend.routes.painel14_routes import TAG_CHAMADOS
+            cache_invalidate_tags_async([TAG_CHAMADOS])
+        except Exception as e:
+            current_app.logger.warning(f'Erro ao invalidar cache do painel14: {e}')
+    return response
+
+
 # =========================================================
 # ROTA DE PAGINA HTML
 # =========================================================
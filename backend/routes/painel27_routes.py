@@ -198,6 +198,8 @@ def api_painel27_dados():
 @painel27_bp.route('/api/paineis/painel27/historico-sinais/<int:nr_atendimento>', methods=['GET'])
 @login_required
 @panel_permission_required('painel27')
+@cache_route(ttl=120, key_prefix='painel27:historico-sinais', vary_by_user=False,
+             vary_by_query=True, tags=('atendimento:{nr_atendimento}',))
 def api_painel27_historico_sinais(nr_atendimento):
 
     try:
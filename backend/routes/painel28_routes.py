@@ -9,7 +9,7 @@ import uuid
 import threading
 import traceback
 from datetime import datetime, date
-from flask import current_app, Blueprint, request, jsonify, send_from_directory, session
+from flask import current_app, Blueprint, g, request, jsonify, send_from_directory, session
 from psycopg2.extras import RealDictCursor
 from backend.database import get_db_cursor
 from backend.middleware.decorators import login_required, panel_permission_required
@@ -30,17 +30,44 @@ painel28_bp = Blueprint(
 def painel28():
     return send_from_directory('paineis/painel28', 'formulario.html')
 
+# Tag das respostas da fila (fila-pacientes e proximo-paciente). A fila e uma
+# lista unica de todos os setores, ordenada pelas visitas de todos os pacientes:
+# qualquer visita gravada pode mudar a ordem, entao uma tag por visita/setor
+# nao pouparia nada aqui. Os detalhes por entidade usam 'visita:<id>' e
+# 'ronda:<id>'.
+_TAG_FILA = 'sentir_agir:fila'
+
+
+def _invalidar_tags(*tags):
+    """
+    Marca tags de entidades que nao estao na URL (ex.: a ronda de uma
+    visita) para invalidar junto apos a resposta de escrita.
+    """
+    g.setdefault('tags_invalidar', set()).update(tags)
+
+
 @painel28_bp.after_request
 def invalidate_cache_on_write(response):
     """
-    Invalida o cache do painel28 automaticamente apos
-    qualquer operacao de escrita (POST, PUT, DELETE) bem sucedida.
+    Invalida o cache da fila apos qualquer operacao de escrita (POST, PUT,
+    DELETE) bem sucedida, mais a visita/ronda da URL e as marcadas por
+    _invalidar_tags. Cadastro de categorias/itens do formulario nao
+    altera a fila. Por tag, e nao por padrao 'painel28:*', que tambem
+    apagava as reservas de visita (painel28:em_visita:*) guardadas no Redis.
     """
     from flask import request
     if request.method in ['POST', 'PUT', 'DELETE'] and 200 <= response.status_code < 300:
+        if '/categorias' in request.path or '/itens' in request.path:
+            return response
+        tags = {_TAG_FILA} | g.get('tags_invalidar', set())
+        view_args = request.view_args or {}
+        if view_args.get('visita_id') is not None:
+            tags.add('visita:{}'.format(view_args['visita_id']))
+        if view_args.get('ronda_id') is not None:
+            tags.add('ronda:{}'.format(view_args['ronda_id']))
         try:
-            from backend.cache import cache_delete_pattern
-            cache_delete_pattern('painel28:*')
+            from backend.cache import cache_invalidate_tags_async
+            cache_invalidate_tags_async(sorted(tags))
             current_app.logger.debug(f'Cache invalidado via {request.method} {request.path}')
         except Exception as e:
             current_app.logger.warning(f'Erro ao invalidar cache do painel28: {e}')
@@ -529,7 +556,8 @@ _FILA_SQL = """
 @painel28_bp.route('/api/paineis/painel28/fila-pacientes', methods=['GET'])
 @login_required
 @panel_permission_required('painel28')
-@cache_route(ttl=15, key_prefix='painel28:fila', vary_by_user=False, vary_by_query=True)
+@cache_route(ttl=15, key_prefix='painel28:fila', vary_by_user=False, vary_by_query=True,
+             tags=(_TAG_FILA,))
 def fila_pacientes():
     try:
         limite = request.args.get('limite', '20')
@@ -580,7 +608,7 @@ def fila_pacientes():
 @painel28_bp.route('/api/paineis/painel28/proximo-paciente', methods=['GET'])
 @login_required
 @panel_permission_required('painel28')
-@cache_route(ttl=15, key_prefix='painel28:proximo', vary_by_user=False)
+@cache_route(ttl=15, key_prefix='painel28:proximo', vary_by_user=False, tags=(_TAG_FILA,))
 def proximo_paciente():
     try:
         with get_db_cursor() as cursor:
@@ -969,6 +997,7 @@ def registrar_visita():
                   nm_paciente, setor_ocupacao, qt_dias_internacao,
                   observacoes, avaliacao_final))
             visita_id = cursor.fetchone()['id']
+            _invalidar_tags('ronda:{}'.format(ronda_id))
 
             # Pré-buscar critico_quando dos itens desta visita
             item_ids = [av['item_id'] for av in avaliacoes if av.get('item_id')]
@@ -1107,8 +1136,9 @@ def upload_imagem():
         ip = _get_ip()
         with get_db_cursor() as cursor:
 
-            cursor.execute("SELECT id FROM sentir_agir_visitas WHERE id = %s", (visita_id,))
-            if not cursor.fetchone():
+            cursor.execute("SELECT id, ronda_id FROM sentir_agir_visitas WHERE id = %s", (visita_id,))
+            visita = cursor.fetchone()
+            if not visita:
                 return jsonify({'success': False, 'error': 'Visita nao encontrada'}), 404
 
             # Busca todas as configs de imagem em 1 query (P2.13)
@@ -1156,6 +1186,7 @@ def upload_imagem():
             """, (visita_id, caminho_relativo, arquivo.filename, descricao, tamanho_bytes, tipo_mime))
             imagem_id = cursor.fetchone()['id']
             _registrar_log(cursor, 'imagem', imagem_id, 'criacao', usuario, ip_origem=ip)
+            _invalidar_tags('visita:{}'.format(visita_id), 'ronda:{}'.format(visita['ronda_id']))
             return jsonify(
                 {'success': True, 'data': {'id': imagem_id, 'caminho': caminho_relativo}, 'message': 'Imagem enviada'}), 201
     except Exception as e:
@@ -1191,7 +1222,12 @@ def deletar_imagem(imagem_id):
         usuario = _get_usuario()
         ip = _get_ip()
         with get_db_cursor() as cursor:
-            cursor.execute("SELECT id, caminho_arquivo, nome_original FROM sentir_agir_imagens WHERE id = %s", (imagem_id,))
+            cursor.execute("""
+                SELECT i.id, i.caminho_arquivo, i.nome_original, i.visita_id, v.ronda_id
+                FROM sentir_agir_imagens i
+                JOIN sentir_agir_visitas v ON v.id = i.visita_id
+                WHERE i.id = %s
+            """, (imagem_id,))
             imagem = cursor.fetchone()
             if not imagem:
                 return jsonify({'success': False, 'error': 'Imagem nao encontrada'}), 404
@@ -1208,6 +1244,7 @@ def deletar_imagem(imagem_id):
             cursor.execute("DELETE FROM sentir_agir_imagens WHERE id = %s", (imagem_id,))
             _registrar_log(cursor, 'imagem', imagem_id, 'exclusao', usuario,
                            valor_anterior=imagem['nome_original'], ip_origem=ip)
+            _invalidar_tags('visita:{}'.format(imagem['visita_id']), 'ronda:{}'.format(imagem['ronda_id']))
             return jsonify({'success': True, 'message': 'Imagem removida'})
     except Exception as e:
         current_app.logger.error("Erro no endpoint: %s", e, exc_info=True)
@@ -1221,6 +1258,7 @@ def deletar_imagem(imagem_id):
 @painel28_bp.route('/api/paineis/painel28/rondas/<int:ronda_id>/visitas', methods=['GET'])
 @login_required
 @panel_permission_required('painel28')
+@cache_route(ttl=60, key_prefix='painel28:ronda_visitas', vary_by_user=False, tags=('ronda:{ronda_id}',))
 def listar_visitas_ronda(ronda_id):
     try:
         with get_db_cursor() as cursor:
@@ -1257,6 +1295,7 @@ def listar_visitas_ronda(ronda_id):
 @painel28_bp.route('/api/paineis/painel28/visitas/<int:visita_id>', methods=['GET'])
 @login_required
 @panel_permission_required('painel28')
+@cache_route(ttl=60, key_prefix='painel28:visita', vary_by_user=False, tags=('visita:{visita_id}',))
 def detalhe_visita(visita_id):
     try:
         with get_db_cursor() as cursor:
@@ -1420,6 +1459,10 @@ def atualizar_visita(visita_id):
                   AND item_id NOT IN %s
             """, (visita_id, tuple(itens_criticos_novos) if itens_criticos_novos else (0,)))
 
+            # O detalhe da tratativa (painel30) traz os campos da visita: invalida todas
+            cursor.execute("SELECT id FROM sentir_agir_tratativas WHERE visita_id = %s", (visita_id,))
+            _invalidar_tags(*('tratativa:{}'.format(t['id']) for t in cursor.fetchall()))
+
             # Remover somente avaliações (não carregam dedup, podem ser recriadas)
             cursor.execute("DELETE FROM sentir_agir_avaliacoes WHERE visita_id = %s", (visita_id,))
 
@@ -1490,6 +1533,7 @@ def atualizar_visita(visita_id):
                 """, (visita_id,))
 
             _registrar_log(cursor, 'visita', visita_id, 'edicao', usuario, ip_origem=ip)
+            _invalidar_tags('ronda:{}'.format(visita['ronda_id']))
 
             msg = 'Visita atualizada'
             if tratativas_criadas > 0:
@@ -1597,13 +1641,15 @@ def excluir_visita(visita_id):
                     pass
 
             cursor.execute("DELETE FROM sentir_agir_imagens WHERE visita_id = %s", (visita_id,))
-            cursor.execute("DELETE FROM sentir_agir_tratativas WHERE visita_id = %s", (visita_id,))
+            cursor.execute("DELETE FROM sentir_agir_tratativas WHERE visita_id = %s RETURNING id", (visita_id,))
+            _invalidar_tags(*('tratativa:{}'.format(t['id']) for t in cursor.fetchall()))
             cursor.execute("DELETE FROM sentir_agir_avaliacoes WHERE visita_id = %s", (visita_id,))
             cursor.execute("DELETE FROM sentir_agir_visitas WHERE id = %s", (visita_id,))
 
             _registrar_log(cursor, 'visita', visita_id, 'exclusao', usuario,
                            valor_anterior='%s - %s' % (visita['nm_paciente'] or '', visita['leito']),
                            ip_origem=ip)
+            _invalidar_tags('ronda:{}'.format(visita['ronda_id']))
             return jsonify({'success': True, 'message': 'Visita removida'})
     except Exception as e:
         current_app.logger.error("Erro no endpoint: %s", e, exc_info=True)
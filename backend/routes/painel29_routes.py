@@ -14,13 +14,43 @@ from openpyxl.styles import (
 )
 from openpyxl.utils import get_column_letter
 from decimal import Decimal
-from flask import Blueprint, request, jsonify, send_from_directory, send_file, session, current_app
+from flask import Blueprint, g, request, jsonify, send_from_directory, send_file, session, current_app
 from psycopg2.extras import RealDictCursor
 from backend.database import get_db_cursor
 from backend.middleware.decorators import login_required, panel_permission_required
+from backend.cache import cache_invalidate_tags_async
 
 painel29_bp = Blueprint('painel29', __name__)
 
+# Mesma tag da fila do painel28: edicao de visita (setor, atendimento) e de
+# precaucao de contato mudam a fila de pacientes.
+_TAG_FILA = 'sentir_agir:fila'
+
+
+def _invalidar_tags(*tags):
+    """Marca tags de entidades fora da URL para invalidar apos a resposta de escrita."""
+    g.setdefault('tags_invalidar', set()).update(tags)
+
+
+@painel29_bp.after_request
+def invalidar_cache_on_write(response):
+    """
+    Invalida a fila e o detalhe em cache (painel28) da visita/ronda editada
+    apos qualquer escrita (POST, PUT, DELETE) bem sucedida.
+    """
+    if request.method in ['POST', 'PUT', 'DELETE'] and 200 <= response.status_code < 300:
+        tags = {_TAG_FILA} | g.get('tags_invalidar', set())
+        view_args = request.view_args or {}
+        if view_args.get('visita_id') is not None:
+            tags.add('visita:{}'.format(view_args['visita_id']))
+        if view_args.get('ronda_id') is not None:
+            tags.add('ronda:{}'.format(view_args['ronda_id']))
+        try:
+            cache_invalidate_tags_async(sorted(tags))
+        except Exception as e:
+            current_app.logger.warning(f'Erro ao invalidar cache do painel29: {e}')
+    return response
+
 
 # ============================================================
 # HELPERS
@@ -695,6 +725,13 @@ def editar_visita(visita_id):
                                     'novo': novo_obs or ''
                                 })
 
+            if alteracoes:
+                # O detalhe da tratativa (painel30) traz os campos da visita e a
+                # descricao_problema: invalida todas as tratativas da visita
+                cursor.execute("SELECT id FROM sentir_agir_tratativas WHERE visita_id = %s", (visita_id,))
+                _invalidar_tags('ronda:{}'.format(visita['ronda_id']),
+                                *('tratativa:{}'.format(t['id']) for t in cursor.fetchall()))
+
             # Registrar logs
             for alt in alteracoes:
                 _registrar_log(
@@ -6,6 +6,7 @@
 
 import os
 import json
+import logging
 import traceback
 from datetime import datetime, date, timedelta
 from decimal import Decimal
@@ -13,16 +14,28 @@ from flask import current_app, Blueprint, request, jsonify, send_from_directory,
 from psycopg2.extras import RealDictCursor
 from backend.database import get_db_connection, get_db_cursor
 from backend.middleware.decorators import login_required, panel_permission_required
+from backend.cache import cache_route, cache_invalidate_tags_async
+from backend.notificador_despacho import despacho
 from backend.notificador_utils import render_email
 
-try:
-    import apprise as _apprise_lib
-    from urllib.parse import quote as _url_encode
-    _APPRISE_OK = True
-except ImportError:
-    _APPRISE_OK = False
-
 painel30_bp = Blueprint('painel30', __name__)
+logger = logging.getLogger(__name__)
+
+
+@painel30_bp.after_request
+def invalidar_tratativa_on_write(response):
+    """
+    Invalida o detalhe em cache da tratativa apos qualquer escrita
+    (PUT, POST, DELETE) bem sucedida em /tratativas/<tratativa_id>/...
+    """
+    tratativa_id = (request.view_args or {}).get('tratativa_id')
+    if (tratativa_id is not None and request.method in ['POST', 'PUT', 'DELETE']
+            and 200 <= response.status_code < 300):
+        try:
+            cache_invalidate_tags_async(['tratativa:{}'.format(tratativa_id)])
+        except Exception as e:
+            current_app.logger.warning(f'Erro ao invalidar cache da tratativa {tratativa_id}: {e}')
+    return response
 
 
 # ============================================================
@@ -161,21 +174,19 @@ def _encontrar_responsavel_auto(cursor, categoria_id, setor_id):
     return resp['id'] if resp else None
 
 
-def _enviar_notificacao_tratativa(dados):
+def _enviar_notificacao_tratativa(dados, ao_concluir=None):
     """
-    Envia email de notificacao para responsaveis de uma tratativa via Apprise.
+    Enfileira o email de notificacao para responsaveis de uma tratativa no
+    despachante (nao espera o servidor SMTP). ao_concluir(ok, detalhe) roda
+    apos o envio, na thread do despachante.
     dados deve conter: tratativa_id, item_descricao, categoria_nome, setor_nome,
                        nm_paciente, nr_atendimento, leito, data_ronda_fmt, dupla_nome,
                        destinatarios=[{email, nome}]
+    Retorna (enfileirado, mensagem).
     """
-    if not _APPRISE_OK:
-        return False, 'Apprise nao disponivel'
-
     smtp_host = os.getenv('SMTP_HOST', '')
-    smtp_port = os.getenv('SMTP_PORT', '587')
     smtp_user = os.getenv('SMTP_USER', '')
     smtp_pass = os.getenv('SMTP_PASS', '')
-    smtp_from = os.getenv('SMTP_FROM', '') or smtp_user
 
     if not smtp_host or not smtp_user or not smtp_pass:
         return False, 'SMTP nao configurado'
@@ -215,24 +226,55 @@ def _enviar_notificacao_tratativa(dados):
         enviado_em=datetime.now().strftime('%d/%m/%Y %H:%M')
     )
 
-    try:
-        ap = _apprise_lib.Apprise()
-        user_enc = _url_encode(smtp_user, safe='')
-        pass_enc = _url_encode(smtp_pass, safe='')
-        for dest in destinatarios:
-            url = 'mailtos://{u}:{p}@{h}:{port}?from={f}&to={t}&name=Notificacao+HAC'.format(
-                u=user_enc, p=pass_enc, h=smtp_host, port=smtp_port,
-                f=_url_encode(smtp_from, safe=''), t=_url_encode(dest['email'], safe='')
-            )
-            ap.add(url)
-        ok = ap.notify(
-            title=titulo, body=html,
-            body_format=_apprise_lib.NotifyFormat.HTML,
-            notify_type=_apprise_lib.NotifyType.WARNING
-        )
-        return ok, 'OK' if ok else 'Falha no envio'
-    except Exception as e:
-        return False, str(e)
+    despacho.enfileirar('email', {
+        'destinatarios': [d['email'] for d in destinatarios],
+        'titulo': titulo,
+        'html': html,
+        'remetente': 'Notificacao HAC',
+    }, ao_concluir=ao_concluir)
+    return True, 'Email enfileirado'
+
+
+def _registrar_email_tratativa(tratativa_id, tratativa, destinatarios):
+    """
+    Callback do despachante: grava o envio manual no notificacoes_log quando
+    o email sai de fato (roda fora da requisicao, em conexao propria).
+    """
+    def registrar(ok, detalhe):
+        if not ok:
+            logger.warning('[painel30] Email da tratativa %s nao enviado: %s', tratativa_id, detalhe)
+            return
+        conn = get_db_connection()
+        if conn is None:
+            return
+        try:
+            cur = conn.cursor()
+            agora = datetime.now()
+            cur.execute("""
+                INSERT INTO notificacoes_log
+                    (tipo_evento, chave_evento, nr_atendimento, nm_setor,
+                     dados_extra, topico_ntfy, status, dt_detectado,
+                     dt_primeira_notificacao, dt_ultima_notificacao,
+                     qt_notificacoes, resposta_ntfy)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (
+                'sentir_agir_tratativa',
+                'sentir_agir_trat_{}'.format(tratativa_id),
+                str(tratativa.get('nr_atendimento') or ''),
+                tratativa.get('setor_nome', ''),
+                json.dumps({
+                    'destinatarios_email': ', '.join(d['email'] for d in destinatarios),
+                    'categoria': tratativa.get('categoria_nome', ''),
+                    'setor': tratativa.get('setor_nome', ''),
+                    'acao_manual': True
+                }, ensure_ascii=False),
+                '', 'notificado', agora, agora, agora, 1, detalhe
+            ))
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+    return registrar
 
 
 def _build_filtros_tratativas():
@@ -661,6 +703,7 @@ def categorias_criticas():
 @painel30_bp.route('/api/paineis/painel30/tratativas/<int:tratativa_id>', methods=['GET'])
 @login_required
 @panel_permission_required('painel30')
+@cache_route(ttl=60, key_prefix='painel30:tratativa', tags=('tratativa:{tratativa_id}',))
 def detalhe_tratativa(tratativa_id):
     try:
         with get_db_cursor() as cursor:
@@ -1146,42 +1189,14 @@ def atualizar_responsavel_auto(tratativa_id):
                     'dupla_nome': tratativa.get('dupla_nome', '-'),
                     'destinatarios': destinatarios
                 }
-                email_enviado, email_msg = _enviar_notificacao_tratativa(dados_email)
-
-                if email_enviado:
-                    try:
-                        conn2 = get_db_connection()
-                        cur2 = conn2.cursor()
-                        agora = datetime.now()
-                        cur2.execute("""
-                            INSERT INTO notificacoes_log
-                                (tipo_evento, chave_evento, nr_atendimento, nm_setor,
-                                 dados_extra, topico_ntfy, status, dt_detectado,
-                                 dt_primeira_notificacao, dt_ultima_notificacao,
-                                 qt_notificacoes, resposta_ntfy)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        """, (
-                            'sentir_agir_tratativa',
-                            'sentir_agir_trat_{}'.format(tratativa_id),
-                            str(tratativa.get('nr_atendimento') or ''),
-                            tratativa.get('setor_nome', ''),
-                            json.dumps({
-                                'destinatarios_email': ', '.join(d['email'] for d in destinatarios),
-                                'categoria': tratativa.get('categoria_nome', ''),
-                                'setor': tratativa.get('setor_nome', ''),
-                                'acao_manual': True
-                            }, ensure_ascii=False),
-                            '', 'notificado', agora, agora, agora, 1, email_msg
-                        ))
-                        conn2.commit()
-                        cur2.close()
-                        conn2.close()
-                    except Exception:
-                        pass
+                email_enviado, email_msg = _enviar_notificacao_tratativa(
+                    dados_email,
+                    ao_concluir=_registrar_email_tratativa(tratativa_id, tratativa, destinatarios)
+                )
 
             msg = 'Responsavel atualizado'
             if email_enviado:
-                msg += ' e email enviado para ' + responsavel_nome
+                msg += ' e email enfileirado para ' + responsavel_nome
             elif destinatarios:
                 msg += ' (falha no email: ' + email_msg + ')'
 
@@ -296,6 +296,8 @@ def api_painel31_modelo_detalhe(nome_modelo):
 @painel31_bp.route('/api/paineis/painel31/previsoes/<nome_modelo>', methods=['GET'])
 @login_required
 @panel_permission_required('painel31')
+@cache_route(ttl=300, key_prefix='painel31:previsoes', vary_by_user=False,
+             tags=('modelo:{nome_modelo}',))
 def api_painel31_previsoes(nome_modelo):
     """
     Retorna:
@@ -7,33 +7,38 @@ Consulta a view vw_painel33_autorizacoes.
 Filtros aceitam valores multiplos separados por virgula.
 """
 
-import io
-import csv
 import time
 import threading
 import traceback
 import statistics
 from datetime import datetime, date
 from decimal import Decimal
-from flask import current_app, Blueprint, request, jsonify, send_from_directory, session, Response
+from flask import current_app, Blueprint, request, jsonify, send_from_directory, session
 from psycopg2.extras import RealDictCursor
 from backend.database import get_db_connection
 from backend.middleware.decorators import login_required, panel_permission_required
 from backend.cache import cache_route
+from backend.export import consulta_stream, csv_response
 
 painel33_bp = Blueprint('painel33', __name__)
 
+# Tag das respostas que leem painel33_responsaveis_convenio (lista e visao-geral)
+_TAG_RESPONSAVEIS = 'painel33:responsaveis'
+
+
 @painel33_bp.after_request
 def invalidate_cache_on_write(response):
     """
     Invalida o cache do painel33 automaticamente apos
     qualquer operacao de escrita (POST, PUT, DELETE) bem sucedida.
+    As unicas escritas sao no cadastro de responsaveis: so as respostas
+    marcadas com essa tag saem do cache (dashboards da view seguem no TTL).
     """
     from flask import request
     if request.method in ['POST', 'PUT', 'DELETE'] and 200 <= response.status_code < 300:
         try:
-            from backend.cache import cache_delete_pattern
-            cache_delete_pattern('painel33:*')
+            from backend.cache import cache_invalidate_tags_async
+            cache_invalidate_tags_async([_TAG_RESPONSAVEIS])
             current_app.logger.debug(f'Cache invalidado via {request.method} {request.path}')
         except Exception as e:
             current_app.logger.warning(f'Erro ao invalidar cache do painel33: {e}')
@@ -384,6 +389,28 @@ def painel33_filtros():
 # API: EXPORT (CSV)
 # ============================================================
 
+# Colunas do CSV de exportacao: (expressao, cabecalho)
+_EXPORT_COLUNAS = [
+    ('v.nm_paciente',          'Paciente'),
+    ('v.nr_atendimento',       'Atendimento'),
+    ('v.ds_convenio',          'Convenio'),
+    ('v.ds_tipo_guia',         'Tipo Guia'),
+    ('v.ds_tipo_autorizacao',  'Tipo Autorizacao'),
+    ('v.ds_estagio',           'Estagio'),
+    ('v.grupo_estagio',        'Grupo'),
+    ('v.ds_setor_origem',      'Setor'),
+    ('v.nm_medico_solicitante', 'Medico'),
+    ('v.dt_pedido_medico',     'Dt Pedido'),
+    ('v.dt_autorizacao',       'Dt Autorizacao'),
+    ('v.status_sla',           'SLA'),
+    ('v.dias_total_sla',       'Dias SLA'),
+    ('v.qt_materiais',         'Qt Materiais'),
+    ('v.qt_procedimentos',     'Qt Procedimentos'),
+    ('v.qt_documentos',        'Qt Documentos'),
+    ('v.status_semaforo',      'Semaforo'),
+]
+
+
 @painel33_bp.route('/api/paineis/painel33/export', methods=['GET'])
 @login_required
 @panel_permission_required('painel33')
@@ -393,47 +420,23 @@ def painel33_export():
         where = ('WHERE ' + ' AND '.join(condicoes)) if condicoes else ''
 
         sql = """
-            SELECT
-                v.nm_paciente          AS "Paciente",
-                v.nr_atendimento       AS "Atendimento",
-                v.ds_convenio          AS "Convenio",
-                v.ds_tipo_guia         AS "Tipo Guia",
-                v.ds_tipo_autorizacao  AS "Tipo Autorizacao",
-                v.ds_estagio           AS "Estagio",
-                v.grupo_estagio        AS "Grupo",
-                v.ds_setor_origem      AS "Setor",
-                v.nm_medico_solicitante AS "Medico",
-                v.dt_pedido_medico     AS "Dt Pedido",
-                v.dt_autorizacao       AS "Dt Autorizacao",
-                v.status_sla           AS "SLA",
-                v.dias_total_sla       AS "Dias SLA",
-                v.qt_materiais         AS "Qt Materiais",
-                v.qt_procedimentos     AS "Qt Procedimentos",
-                v.qt_documentos        AS "Qt Documentos",
-                v.status_semaforo      AS "Semaforo"
+            SELECT {colunas}
             FROM vw_painel33_autorizacoes v
             {where}
             ORDER BY v.nm_paciente, v.dt_pedido_medico DESC NULLS LAST
-        """.format(where=where)
-
-        with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(sql, params)
-                rows = cur.fetchall()
-
-        output = io.StringIO()
-        if rows:
-            writer = csv.DictWriter(output, fieldnames=rows[0].keys())
-            writer.writeheader()
-            for row in rows:
-                writer.writerow({k: (_serial(v) if v is not None else '') for k, v in row.items()})
+        """.format(
+            colunas=', '.join('{} AS "{}"'.format(expr, nome) for expr, nome in _EXPORT_COLUNAS),
+            where=where,
+        )
 
-        output.seek(0)
+        # Cursor no servidor + CSV em streaming (sem fetchall)
+        linhas = consulta_stream(sql, params)
+        cabecalho = [nome for _, nome in _EXPORT_COLUNAS]
         ts = datetime.now().strftime('%Y%m%d_%H%M%S')
-        return Response(
-            output.getvalue().encode('utf-8-sig'),
-            mimetype='text/csv',
-            headers={'Content-Disposition': 'attachment; filename=autorizacoes_{}.csv'.format(ts)}
+        return csv_response(
+            'autorizacoes_{}.csv'.format(ts), cabecalho,
+            ([_serial(row[c]) if row[c] is not None else '' for c in cabecalho] for row in linhas),
+            ao_fechar=linhas.fechar,
         )
 
     except Exception as e:
@@ -460,7 +463,8 @@ def _ensure_responsaveis_table(cur):
 @painel33_bp.route('/api/paineis/painel33/responsaveis', methods=['GET'])
 @login_required
 @panel_permission_required('painel33')
-@cache_route(ttl=300, key_prefix='painel33:responsaveis', vary_by_user=False)
+@cache_route(ttl=300, key_prefix='painel33:responsaveis', vary_by_user=False,
+             tags=(_TAG_RESPONSAVEIS,))
 def painel33_responsaveis_listar():
     try:
         with get_db_connection() as conn:
@@ -536,7 +540,8 @@ def painel33_responsaveis_excluir():
 @painel33_bp.route('/api/paineis/painel33/visao-geral', methods=['GET'])
 @login_required
 @panel_permission_required('painel33')
-@cache_route(ttl=120, key_prefix='painel33:visao-geral', vary_by_user=False, vary_by_query=True)
+@cache_route(ttl=120, key_prefix='painel33:visao-geral', vary_by_user=False, vary_by_query=True,
+             tags=(_TAG_RESPONSAVEIS,))
 def painel33_visao_geral():
     try:
         from flask import session as flask_session
@@ -1,16 +1,17 @@
 """
 Painel 36 - Gestao e Relatorios do Sistema Padioleiro
 """
-from flask import Blueprint, jsonify, request, send_from_directory, send_file, session, current_app
+from flask import Blueprint, jsonify, request, send_from_directory, session, current_app
 from datetime import datetime, date
 from decimal import Decimal
 from backend.database import get_db_cursor
 from backend.middleware.decorators import login_required, panel_permission_required
 from backend.cache import cache_route
-import io
-import openpyxl
+from backend.export import consulta_stream, xlsx_workbook, xlsx_response
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
 from openpyxl.chart import BarChart, Reference
 from openpyxl.formatting.rule import ColorScaleRule
 
@@ -34,6 +35,11 @@ _X_STATUS   = {
     'concluido': _X_VERDE, 'cancelado': _X_VERMELHO,
     'aguardando': _X_HAC,  'aceito': _X_AZUL, 'em_transporte': _X_LARANJA,
 }
+# Larguras da aba Chamados (mesma ordem de hdrs1)
+_X_LARGURAS_CHAMADOS = [
+    10, 20, 32, 14, 14, 24, 24, 18, 12, 15,
+    24, 24, 40, 18, 18, 18, 18, 18, 36, 14, 14, 14, 14,
+]
 
 
 # ── Helpers ───────────────────────────────────────────────────
@@ -93,31 +99,54 @@ def _cfg_atualizar(tabela, campos_wl, dados, rec_id, mensagem, log_tag, strip_st
         return jsonify({'success': False, 'error': 'Erro ao atualizar'}), 500
 
 
-# ── Helpers Excel ─────────────────────────────────────────────
-
-def _x_hdr(cell, cor=_X_HAC):
-    cell.font      = Font(bold=True, color=_X_BRANCO, size=11)
-    cell.fill      = PatternFill("solid", fgColor=cor)
-    cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    _x_borda(cell)
-
-def _x_borda(cell):
-    s = Side(style="thin", color="CCCCCC")
-    cell.border = Border(left=s, right=s, top=s, bottom=s)
-
-def _x_autowidth(ws, min_w=10, max_w=45):
-    for col in ws.columns:
-        letra = get_column_letter(col[0].column)
-        w = max((len(str(c.value or '')) for c in col), default=0)
-        ws.column_dimensions[letra].width = min(max(w + 3, min_w), max_w)
+# ── Helpers Excel (workbook write-only) ───────────────────────
+# Estilos criados uma vez e reaproveitados em todas as celulas
+
+_X_LADO       = Side(style="thin", color="CCCCCC")
+_X_BORDA      = Border(left=_X_LADO, right=_X_LADO, top=_X_LADO, bottom=_X_LADO)
+_X_FILL_ZEBRA = PatternFill("solid", fgColor=_X_ZEBRA)
+_X_MEIO       = Alignment(vertical="center")
+_X_MEIO_WRAP  = Alignment(vertical="center", wrap_text=True)
+_X_NEGRITO    = Font(bold=True)
+
+
+def _x_cell(ws, valor, font=None, fill=None, alignment=None):
+    """Celula write-only com borda fina e estilos opcionais."""
+    cell = WriteOnlyCell(ws, value=valor)
+    cell.border = _X_BORDA
+    if font is not None:
+        cell.font = font
+    if fill is not None:
+        cell.fill = fill
+    if alignment is not None:
+        cell.alignment = alignment
+    return cell
+
+def _x_hdr(ws, hdrs, row, cor=_X_HAC, altura=None):
+    fonte = Font(bold=True, color=_X_BRANCO, size=11)
+    fundo = PatternFill("solid", fgColor=cor)
+    alinha = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    if altura:
+        ws.row_dimensions[row].height = altura
+    ws.append([_x_cell(ws, h, fonte, fundo, alinha) for h in hdrs])
+
+def _x_larguras(ws, linhas, min_w=10, max_w=45):
+    """Define a largura das colunas a partir das linhas (antes do primeiro append)."""
+    larguras = {}
+    for linha in linhas:
+        for j, v in enumerate(linha, 1):
+            larguras[j] = max(larguras.get(j, 0), len(str(v if v is not None else '')))
+    for j, w in larguras.items():
+        ws.column_dimensions[get_column_letter(j)].width = min(max(w + 3, min_w), max_w)
 
 def _x_titulo(ws, texto, ncols, row=1):
-    ws.merge_cells(start_row=row, start_column=1, end_row=row, end_column=ncols)
-    c = ws.cell(row=row, column=1, value=texto)
+    c = WriteOnlyCell(ws, value=texto)
     c.font      = Font(bold=True, color=_X_BRANCO, size=13)
     c.fill      = PatternFill("solid", fgColor=_X_HAC)
     c.alignment = Alignment(horizontal="center", vertical="center")
     ws.row_dimensions[row].height = 28
+    ws.append([c])
+    ws.merged_cells.add(CellRange(min_col=1, min_row=row, max_col=ncols, max_row=row))
 
 def _x_cor_tempo(ws, col_letra, row_ini, row_fim):
     ws.conditional_formatting.add(
@@ -395,39 +424,14 @@ def api_painel36_exportar():
     data_fim    = request.args.get('data_fim', '').strip()
 
     try:
-        with get_db_cursor() as cursor:
-            where, params = _periodo_where(request)
-            if status:    where.append("status = %s");                params.append(status)
-            if prioridade: where.append("prioridade = %s");           params.append(prioridade)
-            if setor:     where.append("setor_origem_nome ILIKE %s"); params.append(f'%{setor}%')
-            where_sql = ' AND '.join(where)
-
-            cursor.execute(f"""
-                SELECT
-                    id, tipo_movimento_nome, nm_paciente, nr_atendimento,
-                    leito_origem, setor_origem_nome, destino_nome, destino_complemento,
-                    prioridade, status, solicitante_nome, padioleiro_nome, observacao,
-                    TO_CHAR(criado_em,            'DD/MM/YYYY HH24:MI') AS criado_em,
-                    TO_CHAR(dt_aceite,            'DD/MM/YYYY HH24:MI') AS dt_aceite,
-                    TO_CHAR(dt_inicio_transporte, 'DD/MM/YYYY HH24:MI') AS dt_inicio_transporte,
-                    TO_CHAR(dt_conclusao,         'DD/MM/YYYY HH24:MI') AS dt_conclusao,
-                    TO_CHAR(dt_cancelamento,      'DD/MM/YYYY HH24:MI') AS dt_cancelamento,
-                    motivo_cancelamento,
-                    CASE WHEN dt_aceite IS NOT NULL
-                         THEN ROUND(EXTRACT(EPOCH FROM (dt_aceite - criado_em)) / 60, 1) END AS t_aceite_min,
-                    CASE WHEN dt_inicio_transporte IS NOT NULL AND dt_aceite IS NOT NULL
-                         THEN ROUND(EXTRACT(EPOCH FROM (dt_inicio_transporte - dt_aceite)) / 60, 1) END AS t_deslocamento_min,
-                    CASE WHEN dt_conclusao IS NOT NULL AND dt_inicio_transporte IS NOT NULL
-                         THEN ROUND(EXTRACT(EPOCH FROM (dt_conclusao - dt_inicio_transporte)) / 60, 1) END AS t_transporte_min,
-                    CASE WHEN dt_conclusao IS NOT NULL
-                         THEN ROUND(EXTRACT(EPOCH FROM (dt_conclusao - criado_em)) / 60, 1)
-                         WHEN status = 'cancelado' AND dt_cancelamento IS NOT NULL
-                         THEN ROUND(EXTRACT(EPOCH FROM (dt_cancelamento - criado_em)) / 60, 1)
-                    END AS t_total_min
-                FROM padioleiro_chamados WHERE {where_sql} ORDER BY criado_em DESC
-            """, params)
-            chamados = [dict(r) for r in cursor.fetchall()]
+        where, params = _periodo_where(request)
+        if status:    where.append("status = %s");                params.append(status)
+        if prioridade: where.append("prioridade = %s");           params.append(prioridade)
+        if setor:     where.append("setor_origem_nome ILIKE %s"); params.append(f'%{setor}%')
+        where_sql = ' AND '.join(where)
 
+        # Resumos (poucas linhas) vem inteiros; o detalhe vem por cursor no servidor
+        with get_db_cursor() as cursor:
             cursor.execute(f"""
                 SELECT
                     COALESCE(padioleiro_nome,'(não atribuído)') AS padioleiro,
@@ -472,15 +476,13 @@ def api_painel36_exportar():
         if prioridade: filtros_txt += f"  |  Prioridade: {prioridade}"
         if setor:     filtros_txt += f"  |  Setor: {setor}"
 
-        # ── Workbook ──────────────────────────────────────────
-        wb = openpyxl.Workbook()
-        wb.remove(wb.active)
+        # ── Workbook write-only: linhas vao para disco, memoria constante ──
+        wb = xlsx_workbook()
 
         # Aba 1: Chamados
         ws1 = wb.create_sheet("Chamados")
         ws1.sheet_view.showGridLines = False
         ws1.freeze_panes = "A3"
-        _x_titulo(ws1, f"CHAMADOS PADIOLEIRO — HAC — {now.strftime('%d/%m/%Y %H:%M')}  |  {filtros_txt}", 23)
 
         hdrs1 = [
             "#", "Tipo Movimento", "Paciente", "Atendimento", "Leito Origem",
@@ -489,10 +491,6 @@ def api_painel36_exportar():
             "Criado Em", "Aceito Em", "Ini. Transporte", "Conclusão", "Cancelado Em",
             "Motivo Cancelamento", "T.Aceite(min)", "T.Desloc.(min)", "T.Transp.(min)", "T.Total(min)",
         ]
-        for j, h in enumerate(hdrs1, 1):
-            _x_hdr(ws1.cell(row=2, column=j, value=h))
-        ws1.row_dimensions[2].height = 22
-
         keys1 = [
             'id','tipo_movimento_nome','nm_paciente','nr_atendimento','leito_origem',
             'setor_origem_nome','destino_nome','destino_complemento',
@@ -500,52 +498,87 @@ def api_painel36_exportar():
             'criado_em','dt_aceite','dt_inicio_transporte','dt_conclusao','dt_cancelamento',
             'motivo_cancelamento','t_aceite_min','t_deslocamento_min','t_transporte_min','t_total_min',
         ]
-        for i, row in enumerate(chamados, 3):
-            zebra = i % 2 == 0
-            for j, key in enumerate(keys1, 1):
-                v    = row.get(key)
-                cell = ws1.cell(row=i, column=j, value=v)
-                _x_borda(cell)
-                cell.alignment = Alignment(vertical="center", wrap_text=(j in (13, 19)))
-                if zebra and key not in ('prioridade', 'status'):
-                    cell.fill = PatternFill("solid", fgColor=_X_ZEBRA)
-                if key == 'status' and v in _X_STATUS:
-                    cell.font = Font(bold=True, color=_X_BRANCO)
-                    cell.fill = PatternFill("solid", fgColor=_X_STATUS[v])
-                elif key == 'prioridade' and v == 'urgente':
-                    cell.font = Font(bold=True, color=_X_BRANCO)
-                    cell.fill = PatternFill("solid", fgColor=_X_LARANJA)
-
-        last1 = 2 + len(chamados)
-        if chamados:
+        # Largura fixa (o detalhe nao fica em memoria para medir)
+        for j, w in enumerate(_X_LARGURAS_CHAMADOS, 1):
+            ws1.column_dimensions[get_column_letter(j)].width = w
+        _x_titulo(ws1, f"CHAMADOS PADIOLEIRO — HAC — {now.strftime('%d/%m/%Y %H:%M')}  |  {filtros_txt}", 23)
+        _x_hdr(ws1, hdrs1, 2, altura=22)
+
+        fonte_destaque = Font(bold=True, color=_X_BRANCO)
+        fill_status = {k: PatternFill("solid", fgColor=cor) for k, cor in _X_STATUS.items()}
+        fill_urgente = PatternFill("solid", fgColor=_X_LARANJA)
+
+        chamados = consulta_stream(f"""
+            SELECT
+                id, tipo_movimento_nome, nm_paciente, nr_atendimento,
+                leito_origem, setor_origem_nome, destino_nome, destino_complemento,
+                prioridade, status, solicitante_nome, padioleiro_nome, observacao,
+                TO_CHAR(criado_em,            'DD/MM/YYYY HH24:MI') AS criado_em,
+                TO_CHAR(dt_aceite,            'DD/MM/YYYY HH24:MI') AS dt_aceite,
+                TO_CHAR(dt_inicio_transporte, 'DD/MM/YYYY HH24:MI') AS dt_inicio_transporte,
+                TO_CHAR(dt_conclusao,         'DD/MM/YYYY HH24:MI') AS dt_conclusao,
+                TO_CHAR(dt_cancelamento,      'DD/MM/YYYY HH24:MI') AS dt_cancelamento,
+                motivo_cancelamento,
+                CASE WHEN dt_aceite IS NOT NULL
+                     THEN ROUND(EXTRACT(EPOCH FROM (dt_aceite - criado_em)) / 60, 1) END AS t_aceite_min,
+                CASE WHEN dt_inicio_transporte IS NOT NULL AND dt_aceite IS NOT NULL
+                     THEN ROUND(EXTRACT(EPOCH FROM (dt_inicio_transporte - dt_aceite)) / 60, 1) END AS t_deslocamento_min,
+                CASE WHEN dt_conclusao IS NOT NULL AND dt_inicio_transporte IS NOT NULL
+                     THEN ROUND(EXTRACT(EPOCH FROM (dt_conclusao - dt_inicio_transporte)) / 60, 1) END AS t_transporte_min,
+                CASE WHEN dt_conclusao IS NOT NULL
+                     THEN ROUND(EXTRACT(EPOCH FROM (dt_conclusao - criado_em)) / 60, 1)
+                     WHEN status = 'cancelado' AND dt_cancelamento IS NOT NULL
+                     THEN ROUND(EXTRACT(EPOCH FROM (dt_cancelamento - criado_em)) / 60, 1)
+                END AS t_total_min
+            FROM padioleiro_chamados WHERE {where_sql} ORDER BY criado_em DESC
+        """, params)
+        last1 = 2
+        try:
+            for i, row in enumerate(chamados, 3):
+                zebra = i % 2 == 0
+                linha = []
+                for j, key in enumerate(keys1, 1):
+                    v = row.get(key)
+                    font, fill = None, (_X_FILL_ZEBRA if zebra and key not in ('prioridade', 'status') else None)
+                    if key == 'status' and v in _X_STATUS:
+                        font, fill = fonte_destaque, fill_status[v]
+                    elif key == 'prioridade' and v == 'urgente':
+                        font, fill = fonte_destaque, fill_urgente
+                    linha.append(_x_cell(ws1, v, font, fill, _X_MEIO_WRAP if j in (13, 19) else _X_MEIO))
+                ws1.append(linha)
+                last1 = i
+        finally:
+            chamados.fechar()
+
+        if last1 > 2:
             for col_n in range(20, 24):
                 _x_cor_tempo(ws1, get_column_letter(col_n), 3, last1)
-        _x_autowidth(ws1)
 
         # Aba 2: Por Padioleiro
         ws2 = wb.create_sheet("Por Padioleiro")
         ws2.sheet_view.showGridLines = False
         hdrs2 = ["Padioleiro","Total","Concluídos","Cancelados","Urgentes",
                  "T.Aceite(min)","T.Desloc.(min)","T.Transp.(min)","T.Total(min)"]
-        _x_titulo(ws2, f"POR PADIOLEIRO — {filtros_txt}", len(hdrs2))
-        for j, h in enumerate(hdrs2, 1):
-            _x_hdr(ws2.cell(row=2, column=j, value=h))
-
         pad_cols = [
             ('padioleiro',None),('total',None),('concluidos',_X_VERDE),
             ('cancelados',_X_VERMELHO),('urgentes',_X_LARANJA),
             ('media_aceite_min',None),('media_deslocamento_min',None),
             ('media_transporte_min',None),('media_total_min',None),
         ]
-        for i, p in enumerate(por_padioleiro, 3):
-            zebra = i % 2 == 0
-            for j, (key, cor_txt) in enumerate(pad_cols, 1):
-                v    = p.get(key)
-                cell = ws2.cell(row=i, column=j, value=float(v) if v is not None and j > 5 else v)
-                _x_borda(cell)
-                if zebra:    cell.fill = PatternFill("solid", fgColor=_X_ZEBRA)
-                if j == 1:   cell.font = Font(bold=True)
-                elif cor_txt: cell.font = Font(bold=True, color=cor_txt)
+        valores2 = [
+            [float(p.get(key)) if p.get(key) is not None and j > 5 else p.get(key)
+             for j, (key, _) in enumerate(pad_cols, 1)]
+            for p in por_padioleiro
+        ]
+        _x_larguras(ws2, [hdrs2] + valores2)
+        _x_titulo(ws2, f"POR PADIOLEIRO — {filtros_txt}", len(hdrs2))
+        _x_hdr(ws2, hdrs2, 2)
+        for i, valores in enumerate(valores2, 3):
+            fill = _X_FILL_ZEBRA if i % 2 == 0 else None
+            ws2.append([
+                _x_cell(ws2, v, _X_NEGRITO if j == 1 else (Font(bold=True, color=cor_txt) if cor_txt else None), fill)
+                for j, (v, (_, cor_txt)) in enumerate(zip(valores, pad_cols), 1)
+            ])
 
         last2 = 2 + len(por_padioleiro)
         if por_padioleiro:
@@ -562,28 +595,25 @@ def api_painel36_exportar():
                 if idx < len(c.series):
                     c.series[idx].graphicalProperties.solidFill = cor
             ws2.add_chart(c, f"A{last2 + 3}")
-        _x_autowidth(ws2)
 
         # Aba 3: Por Setor
         ws3 = wb.create_sheet("Por Setor")
         ws3.sheet_view.showGridLines = False
         hdrs3 = ["Setor","Total","Concluídos","Cancelados","Urgentes"]
-        _x_titulo(ws3, f"POR SETOR — {filtros_txt}", len(hdrs3))
-        for j, h in enumerate(hdrs3, 1):
-            _x_hdr(ws3.cell(row=2, column=j, value=h))
-
         set_cols = [
             ('setor',None),('total',None),('concluidos',_X_VERDE),
             ('cancelados',_X_VERMELHO),('urgentes',_X_LARANJA),
         ]
-        for i, s in enumerate(por_setor, 3):
-            zebra = i % 2 == 0
-            for j, (key, cor_txt) in enumerate(set_cols, 1):
-                cell = ws3.cell(row=i, column=j, value=s.get(key))
-                _x_borda(cell)
-                if zebra:    cell.fill = PatternFill("solid", fgColor=_X_ZEBRA)
-                if j == 1:   cell.font = Font(bold=True)
-                elif cor_txt: cell.font = Font(bold=True, color=cor_txt)
+        valores3 = [[s.get(key) for key, _ in set_cols] for s in por_setor]
+        _x_larguras(ws3, [hdrs3] + valores3)
+        _x_titulo(ws3, f"POR SETOR — {filtros_txt}", len(hdrs3))
+        _x_hdr(ws3, hdrs3, 2)
+        for i, valores in enumerate(valores3, 3):
+            fill = _X_FILL_ZEBRA if i % 2 == 0 else None
+            ws3.append([
+                _x_cell(ws3, v, _X_NEGRITO if j == 1 else (Font(bold=True, color=cor_txt) if cor_txt else None), fill)
+                for j, (v, (_, cor_txt)) in enumerate(zip(valores, set_cols), 1)
+            ])
 
         last3 = 2 + len(por_setor)
         if por_setor:
@@ -598,17 +628,8 @@ def api_painel36_exportar():
                 if idx < len(c2.series):
                     c2.series[idx].graphicalProperties.solidFill = cor
             ws3.add_chart(c2, f"A{last3 + 3}")
-        _x_autowidth(ws3)
-
-        buf = io.BytesIO()
-        wb.save(buf)
-        buf.seek(0)
-        return send_file(
-            buf,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=f'chamados_padioleiro_{date.today().strftime("%Y%m%d")}.xlsx',
-        )
+
+        return xlsx_response(wb, f'chamados_padioleiro_{date.today().strftime("%Y%m%d")}.xlsx')
 
     except Exception as e:
         current_app.logger.error(f'Erro exportar painel36: {e}', exc_info=True)
@@ -2,14 +2,13 @@
 Painel 43 - Gestão Nutrição
 Relatórios, analytics, exportação CSV e configurações do sistema de dietas.
 """
-import csv
-import io
 from datetime import datetime, date
 
 from flask import Blueprint, jsonify, request, send_from_directory, session, current_app, Response
 from backend.database import get_db_cursor
 from backend.middleware.decorators import login_required, panel_permission_required, admin_required
 from backend.cache import cache_delete_pattern
+from backend.export import consulta_stream, csv_response
 
 painel43_bp = Blueprint('painel43', __name__)
 
@@ -331,65 +330,57 @@ def api_p43_exportar():
     now  = datetime.now()
 
     try:
-        with get_db_cursor() as cursor:
-            cursor.execute("""
-                SELECT id, codigo_entrega, nm_paciente, leito, setor_nome, ds_clinica,
-                    tipo_dieta_nome, refeicao_nome, quantidade, restricoes, observacao,
-                    prioridade, status, solicitante_nome, responsavel_nome, entregue_por,
-                    TO_CHAR(criado_em,         'DD/MM/YYYY HH24:MI') AS criado_em,
-                    TO_CHAR(dt_aceite,         'DD/MM/YYYY HH24:MI') AS dt_aceite,
-                    TO_CHAR(dt_inicio_preparo, 'DD/MM/YYYY HH24:MI') AS dt_inicio_preparo,
-                    TO_CHAR(dt_pronto,         'DD/MM/YYYY HH24:MI') AS dt_pronto,
-                    TO_CHAR(dt_inicio_entrega, 'DD/MM/YYYY HH24:MI') AS dt_inicio_entrega,
-                    TO_CHAR(dt_entrega,        'DD/MM/YYYY HH24:MI') AS dt_entrega,
-                    TO_CHAR(dt_cancelamento,   'DD/MM/YYYY HH24:MI') AS dt_cancelamento,
-                    motivo_cancelamento, observacao_entrega,
-                    CASE WHEN dt_entrega IS NOT NULL
-                        THEN ROUND(EXTRACT(EPOCH FROM (dt_entrega - criado_em))/60)::int
-                    END AS t_total_min
-                FROM nutricao_solicitacoes
-                WHERE """ + fd_where + """
-                ORDER BY criado_em DESC
-            """, fd_params)
-            rows = cursor.fetchall()
-
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow([
+        # Cursor no servidor + CSV em streaming (sem fetchall)
+        linhas = consulta_stream("""
+            SELECT id, codigo_entrega, nm_paciente, leito, setor_nome, ds_clinica,
+                tipo_dieta_nome, refeicao_nome, quantidade, restricoes, observacao,
+                prioridade, status, solicitante_nome, responsavel_nome, entregue_por,
+                TO_CHAR(criado_em,         'DD/MM/YYYY HH24:MI') AS criado_em,
+                TO_CHAR(dt_aceite,         'DD/MM/YYYY HH24:MI') AS dt_aceite,
+                TO_CHAR(dt_inicio_preparo, 'DD/MM/YYYY HH24:MI') AS dt_inicio_preparo,
+                TO_CHAR(dt_pronto,         'DD/MM/YYYY HH24:MI') AS dt_pronto,
+                TO_CHAR(dt_inicio_entrega, 'DD/MM/YYYY HH24:MI') AS dt_inicio_entrega,
+                TO_CHAR(dt_entrega,        'DD/MM/YYYY HH24:MI') AS dt_entrega,
+                TO_CHAR(dt_cancelamento,   'DD/MM/YYYY HH24:MI') AS dt_cancelamento,
+                motivo_cancelamento, observacao_entrega,
+                CASE WHEN dt_entrega IS NOT NULL
+                    THEN ROUND(EXTRACT(EPOCH FROM (dt_entrega - criado_em))/60)::int
+                END AS t_total_min
+            FROM nutricao_solicitacoes
+            WHERE """ + fd_where + """
+            ORDER BY criado_em DESC
+        """, fd_params)
+
+        cabecalho = [
             'ID', 'Código', 'Paciente', 'Leito', 'Setor', 'Clínica',
             'Dieta', 'Refeição', 'Qtd', 'Restrições', 'Observação',
             'Prioridade', 'Status', 'Solicitante', 'Responsável', 'Entregue Por',
             'Criado', 'Aceito', 'Início Preparo', 'Pronto', 'Início Entrega',
             'Entregue', 'Cancelado', 'Motivo Cancelamento', 'Obs. Entrega', 'T.Total(min)'
-        ])
-        for r in rows:
-            writer.writerow([
-                r['id'], r['codigo_entrega'], r['nm_paciente'], r['leito'] or '',
-                r['setor_nome'] or '', r['ds_clinica'] or '',
-                r['tipo_dieta_nome'] or '', r['refeicao_nome'] or '',
-                r['quantidade'] or 1, r['restricoes'] or '', r['observacao'] or '',
-                r['prioridade'], r['status'],
-                r['solicitante_nome'] or '', r['responsavel_nome'] or '', r['entregue_por'] or '',
-                r['criado_em'] or '', r['dt_aceite'] or '', r['dt_inicio_preparo'] or '',
-                r['dt_pronto'] or '', r['dt_inicio_entrega'] or '', r['dt_entrega'] or '',
-                r['dt_cancelamento'] or '', r['motivo_cancelamento'] or '',
-                r['observacao_entrega'] or '', r['t_total_min'] or ''
-            ])
-
-        bom      = b'\xef\xbb\xbf'
-        conteudo = bom + output.getvalue().encode('utf-8')
-        nome     = 'nutricao_hac_{}.csv'.format(now.strftime('%d%m%Y'))
-
-        return Response(
-            conteudo,
-            mimetype='text/csv',
-            headers={'Content-Disposition': 'attachment; filename="{}"'.format(nome)}
-        )
+        ]
+        nome = 'nutricao_hac_{}.csv'.format(now.strftime('%d%m%Y'))
+        return csv_response(nome, cabecalho, (_linha_exportar(r) for r in linhas),
+                            ao_fechar=linhas.fechar)
     except Exception as e:
         current_app.logger.error('Erro exportar p43: %s', e, exc_info=True)
         return jsonify({'success': False, 'error': 'Erro ao exportar'}), 500
 
 
+def _linha_exportar(r):
+    return [
+        r['id'], r['codigo_entrega'], r['nm_paciente'], r['leito'] or '',
+        r['setor_nome'] or '', r['ds_clinica'] or '',
+        r['tipo_dieta_nome'] or '', r['refeicao_nome'] or '',
+        r['quantidade'] or 1, r['restricoes'] or '', r['observacao'] or '',
+        r['prioridade'], r['status'],
+        r['solicitante_nome'] or '', r['responsavel_nome'] or '', r['entregue_por'] or '',
+        r['criado_em'] or '', r['dt_aceite'] or '', r['dt_inicio_preparo'] or '',
+        r['dt_pronto'] or '', r['dt_inicio_entrega'] or '', r['dt_entrega'] or '',
+        r['dt_cancelamento'] or '', r['motivo_cancelamento'] or '',
+        r['observacao_entrega'] or '', r['t_total_min'] or ''
+    ]
+
+
 # =========================================================
 # CONFIG — EQUIPE
 # =========================================================
@@ -825,51 +816,39 @@ def api_p43_rel_assinaturas_exportar():
         where.append('ad.id IS NULL')
 
     try:
-        with get_db_cursor() as cursor:
-            cursor.execute("""
-                SELECT
-                    ns.id, ns.codigo_entrega, ns.nm_paciente, ns.leito, ns.setor_nome,
-                    ns.tipo_dieta_nome, ns.refeicao_nome, ns.responsavel_nome,
-                    TO_CHAR(ns.dt_entrega, 'DD/MM/YYYY HH24:MI') AS dt_entrega,
-                    CASE WHEN ad.id IS NOT NULL THEN 'Sim' ELSE 'Não' END AS assinado,
-                    ad.nm_signatario,
-                    ad.nm_signatario_cpf,
-                    ad.qualidade_signatario,
-                    ad.coletado_por_nome_equipe
-                FROM nutricao_solicitacoes ns
-                LEFT JOIN assinaturas_digitais ad
-                    ON ad.ref_id = ns.id
-                    AND ad.contexto = 'entrega_refeicao'
-                WHERE """ + ' AND '.join(where) + """
-                ORDER BY ns.dt_entrega DESC
-            """, params)
-            rows = cursor.fetchall()
-
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow([
+        # Cursor no servidor + CSV em streaming (sem fetchall)
+        linhas = consulta_stream("""
+            SELECT
+                ns.id, ns.codigo_entrega, ns.nm_paciente, ns.leito, ns.setor_nome,
+                ns.tipo_dieta_nome, ns.refeicao_nome, ns.responsavel_nome,
+                TO_CHAR(ns.dt_entrega, 'DD/MM/YYYY HH24:MI') AS dt_entrega,
+                CASE WHEN ad.id IS NOT NULL THEN 'Sim' ELSE 'Não' END AS assinado,
+                ad.nm_signatario,
+                ad.nm_signatario_cpf,
+                ad.qualidade_signatario,
+                ad.coletado_por_nome_equipe
+            FROM nutricao_solicitacoes ns
+            LEFT JOIN assinaturas_digitais ad
+                ON ad.ref_id = ns.id
+                AND ad.contexto = 'entrega_refeicao'
+            WHERE """ + ' AND '.join(where) + """
+            ORDER BY ns.dt_entrega DESC
+        """, params)
+
+        cabecalho = [
             'ID', 'Código', 'Paciente', 'Leito', 'Setor',
             'Dieta', 'Refeição', 'Responsável', 'Entregue em',
             'Assinado', 'Assinante', 'CPF Assinante', 'Qualidade', 'Coletado por'
-        ])
-        for r in rows:
-            writer.writerow([
-                r['id'], r['codigo_entrega'], r['nm_paciente'], r['leito'] or '',
-                r['setor_nome'] or '', r['tipo_dieta_nome'] or '', r['refeicao_nome'] or '',
-                r['responsavel_nome'] or '', r['dt_entrega'] or '',
-                r['assinado'],
-                r['nm_signatario'] or '', r['nm_signatario_cpf'] or '',
-                r['qualidade_signatario'] or '', r['coletado_por_nome_equipe'] or ''
-            ])
-
-        bom      = b'\xef\xbb\xbf'
-        conteudo = bom + output.getvalue().encode('utf-8')
-        nome     = 'assinaturas_entrega_{}.csv'.format(datetime.now().strftime('%d%m%Y'))
-        return Response(
-            conteudo,
-            mimetype='text/csv',
-            headers={'Content-Disposition': 'attachment; filename="{}"'.format(nome)}
-        )
+        ]
+        nome = 'assinaturas_entrega_{}.csv'.format(datetime.now().strftime('%d%m%Y'))
+        return csv_response(nome, cabecalho, ([
+            r['id'], r['codigo_entrega'], r['nm_paciente'], r['leito'] or '',
+            r['setor_nome'] or '', r['tipo_dieta_nome'] or '', r['refeicao_nome'] or '',
+            r['responsavel_nome'] or '', r['dt_entrega'] or '',
+            r['assinado'],
+            r['nm_signatario'] or '', r['nm_signatario_cpf'] or '',
+            r['qualidade_signatario'] or '', r['coletado_por_nome_equipe'] or ''
+        ] for r in linhas), ao_fechar=linhas.fechar)
     except Exception as e:
         current_app.logger.error('Erro rel-assinaturas exportar p43: %s', e, exc_info=True)
         return jsonify({'success': False, 'error': 'Erro ao exportar'}), 500
@@ -0,0 +1,50 @@
+"""
+Canal de push (Server-Sent Events) para as TVs dos paineis
+Substitui o setInterval por painel: a TV so busca dados quando mudaram.
+"""
+import re
+from flask import Blueprint, jsonify, request, current_app
+from backend.middleware.decorators import login_required, verificar_acesso_painel
+from backend import stream
+
+stream_bp = Blueprint('stream', __name__)
+
+_PAINEL_RE = re.compile(r'^painel\d{1,3}$')
+
+
+@stream_bp.route('/api/stream/<painel>')
+@login_required
+def api_stream(painel):
+    """
+    GET /api/stream/<painel> — text/event-stream
+
+    Eventos: hello (versao atual), update (dados do painel mudaram) e
+    ": ping" periodico. Ao receber update a TV refaz suas chamadas normais,
+    que sao servidas do cache ja recalculado.
+
+    404: painel sem endpoints compartilhados em cache (cliente usa polling)
+    503: limite de conexoes SSE atingido (cliente usa polling)
+    """
+    if not _PAINEL_RE.match(painel):
+        return jsonify({'success': False, 'error': 'Painel invalido'}), 400
+
+    # Mesma verificacao de permissao das rotas do proprio painel
+    negado = verificar_acesso_painel(painel)
+    if negado is not None:
+        return negado
+
+    if not stream.disponivel(painel):
+        return jsonify({'success': False, 'error': 'Push indisponivel para este painel'}), 404
+
+    assinatura = stream.assinar(current_app._get_current_object(), painel)
+    if assinatura is None:
+        return jsonify({'success': False, 'error': 'Limite de conexoes de push atingido'}), 503
+
+    ultima = request.headers.get('Last-Event-ID', type=int)
+    response = current_app.response_class(
+        assinatura.eventos(ultima),
+        mimetype='text/event-stream',
+    )
+    response.call_on_close(assinatura.encerrar)
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
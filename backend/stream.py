@@ -0,0 +1,254 @@
+"""
+Canal de Push (Server-Sent Events) dos Paineis
+Sistema de Paineis Hospitalares
+
+Funcionalidades:
+- Um canal por painel com numero de versao (incrementado a cada mudanca)
+- Um produtor por painel: enquanto houver TVs conectadas, recalcula os
+  endpoints compartilhados do painel quando expiram (via camada de cache)
+- Mudancas chegam pelo cache (on_cache_change) ou pela invalidacao do ETL
+- Limite de conexoes simultaneas: no gthread cada conexao SSE ocupa uma thread
+
+Principio: a TV mantem UMA conexao aberta e so busca dados quando o
+servidor avisa que mudaram. Se o canal estiver indisponivel (limite de
+conexoes, painel sem cache), o cliente volta ao polling normal.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from backend.cache import on_cache_change, cache_revalidate_prefix, has_shared_routes
+
+logger = logging.getLogger(__name__)
+
+# Cada conexao SSE prende uma thread do gunicorn (gthread). O worker sobe com
+# SSE_THREADS_RESERVADAS threads para requisicoes normais + SSE_TVS para as TVs
+# em push (dimensionamento documentado no gunicorn.conf.py, que exporta os valores).
+SSE_TVS                = int(os.getenv('SSE_TVS', '40'))
+SSE_THREADS_RESERVADAS = int(os.getenv('SSE_THREADS_RESERVADAS', '8'))
+_GUNICORN_THREADS      = int(os.getenv('GUNICORN_THREADS', str(SSE_THREADS_RESERVADAS + SSE_TVS)))
+SSE_MAX_CONEXOES       = int(os.getenv('SSE_MAX_CONEXOES',
+                                       str(max(0, _GUNICORN_THREADS - SSE_THREADS_RESERVADAS))))
+SSE_HEARTBEAT          = int(os.getenv('SSE_HEARTBEAT', '25'))      # comentario ": ping"
+SSE_MAX_DURACAO        = int(os.getenv('SSE_MAX_DURACAO', '900'))   # reconecta a cada 15 min
+SSE_DEBOUNCE           = float(os.getenv('SSE_DEBOUNCE', '2'))     # agrupa mudancas proximas
+SSE_PRODUTOR_INTERVALO = int(os.getenv('SSE_PRODUTOR_INTERVALO', '15'))
+
+# key_prefix → painel: 'painel4:dashboard' → painel4, 'p41:setores' → painel41
+_PREFIXO_RE = re.compile(r'^(?:painel|p)(\d+):')
+
+
+class _Canal:
+    """Estado de um painel: versao, prefixos alterados e assinantes."""
+
+    def __init__(self, painel: str):
+        self.painel = painel
+        self.versao = 0
+        self.prefixos = {}            # prefixo -> versao em que mudou
+        self.cond = threading.Condition()
+        self.assinantes = 0
+        self.produtor = None
+
+    def publicar(self, prefixo: str = None):
+        with self.cond:
+            self.versao += 1
+            if prefixo:
+                self.prefixos[prefixo] = self.versao
+            self.cond.notify_all()
+
+    def aguardar(self, versao: int, timeout: float) -> bool:
+        """Bloqueia ate a versao mudar ou o timeout expirar. True se mudou."""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.versao != versao, timeout)
+
+    def alterados_desde(self, versao: int) -> list:
+        with self.cond:
+            return sorted(p for p, v in self.prefixos.items() if v > versao)
+
+
+_canais = {}                      # painel -> _Canal
+_canais_lock = threading.Lock()
+_conexoes = 0
+_conexoes_lock = threading.Lock()
+
+
+def _canal(painel: str) -> _Canal:
+    with _canais_lock:
+        canal = _canais.get(painel)
+        if canal is None:
+            canal = _Canal(painel)
+            _canais[painel] = canal
+        return canal
+
+
+def painel_da_chave(cache_key: str):
+    """Extrai o painel de uma chave de cache ('painel4:dashboard:g3' → 'painel4')."""
+    m = _PREFIXO_RE.match(cache_key)
+    return f'painel{m.group(1)}' if m else None
+
+
+def _on_cache_change(cache_key: str):
+    painel = painel_da_chave(cache_key)
+    if painel is None:
+        return
+    with _canais_lock:
+        canal = _canais.get(painel)
+    # Sem canal aberto ninguem esta ouvindo — nada a fazer
+    if canal is not None:
+        canal.publicar(':'.join(cache_key.split(':', 2)[:2]))
+
+
+on_cache_change(_on_cache_change)
+
+
+def publicar(painel: str):
+    """Avisa as TVs do painel que os dados mudaram (ex: apos carga do ETL)."""
+    with _canais_lock:
+        canal = _canais.get(painel)
+    if canal is not None:
+        canal.publicar()
+
+
+def disponivel(painel: str) -> bool:
+    """O painel pode usar push se tiver endpoints compartilhados em cache."""
+    return SSE_MAX_CONEXOES > 0 and has_shared_routes(painel)
+
+
+# =========================================================
+# PRODUTOR POR PAINEL
+# =========================================================
+
+def _iniciar_produtor(app, canal: _Canal):
+    """
+    Uma thread por painel com assinantes: revalida os endpoints compartilhados
+    que expiraram. O recalculo grava no cache, que dispara _on_cache_change
+    se o conteudo mudou. Encerra sozinha quando a ultima TV desconecta.
+    """
+    def _run():
+        logger.info('[stream] Produtor %s iniciado', canal.painel)
+        while True:
+            with canal.cond:
+                if canal.assinantes <= 0:
+                    canal.produtor = None
+                    break
+            try:
+                cache_revalidate_prefix(app, canal.painel)
+            except Exception as e:
+                logger.warning('[stream] Erro no produtor %s: %s', canal.painel, e)
+            time.sleep(SSE_PRODUTOR_INTERVALO)
+        logger.info('[stream] Produtor %s encerrado (sem assinantes)', canal.painel)
+
+    t = threading.Thread(target=_run, name=f'stream_{canal.painel}', daemon=True)
+    canal.produtor = t
+    t.start()
+
+
+# =========================================================
+# ASSINATURA (gerador do corpo SSE)
+# =========================================================
+
+def _evento(nome: str, dados: dict, versao: int) -> str:
+    return f'id: {versao}\nevent: {nome}\ndata: {json.dumps(dados)}\n\n'
+
+
+def _reservar_conexao() -> bool:
+    global _conexoes
+    with _conexoes_lock:
+        if _conexoes >= SSE_MAX_CONEXOES:
+            return False
+        _conexoes += 1
+        return True
+
+
+def _liberar_conexao():
+    global _conexoes
+    with _conexoes_lock:
+        _conexoes = max(0, _conexoes - 1)
+
+
+class Assinatura:
+    """
+    Uma TV conectada ao canal de um painel.
+
+    Criada por assinar(); o corpo text/event-stream vem de eventos() e a vaga
+    e liberada por encerrar() (idempotente — registrar com call_on_close, que
+    roda mesmo se o cliente desconectar antes do primeiro evento).
+    """
+
+    def __init__(self, canal: _Canal):
+        self.canal = canal
+        self._encerrada = False
+        self._lock = threading.Lock()
+
+    def eventos(self, ultima_versao=None):
+        """
+        Eventos:
+            hello  — versao atual (perdeu_eventos=True se o cliente reconectou
+                     depois de uma mudanca e deve recarregar)
+            update — {painel, versao, endpoints: [prefixos alterados]}
+            ": ping" a cada SSE_HEARTBEAT s para manter a conexao viva
+        """
+        canal = self.canal
+        versao = canal.versao
+        yield 'retry: 5000\n\n'
+        yield _evento('hello', {
+            'painel': canal.painel,
+            'versao': versao,
+            'perdeu_eventos': ultima_versao is not None and ultima_versao != versao,
+        }, versao)
+
+        fim = time.monotonic() + SSE_MAX_DURACAO
+        while time.monotonic() < fim and not self._encerrada:
+            if not canal.aguardar(versao, SSE_HEARTBEAT):
+                yield ': ping\n\n'
+                continue
+            # Agrupa as mudancas de um mesmo ciclo de recalculo em um evento
+            time.sleep(SSE_DEBOUNCE)
+            anterior, versao = versao, canal.versao
+            yield _evento('update', {
+                'painel': canal.painel,
+                'versao': versao,
+                'endpoints': canal.alterados_desde(anterior),
+            }, versao)
+
+    def encerrar(self):
+        with self._lock:
+            if self._encerrada:
+                return
+            self._encerrada = True
+        with self.canal.cond:
+            self.canal.assinantes -= 1
+        _liberar_conexao()
+
+
+def assinar(app, painel: str):
+    """
+    Inscreve uma TV no canal do painel e garante o produtor rodando.
+    Retorna None se o limite de conexoes SSE foi atingido (cliente usa polling).
+    """
+    if not _reservar_conexao():
+        return None
+    canal = _canal(painel)
+    with canal.cond:
+        canal.assinantes += 1
+        if canal.produtor is None:
+            _iniciar_produtor(app, canal)
+    return Assinatura(canal)
+
+
+def stream_health() -> dict:
+    """Resumo dos canais SSE para o health check."""
+    with _canais_lock:
+        canais = {
+            p: {'assinantes': c.assinantes, 'versao': c.versao, 'produtor': c.produtor is not None}
+            for p, c in _canais.items() if c.assinantes > 0
+        }
+    return {
+        'conexoes': _conexoes,
+        'max_conexoes': SSE_MAX_CONEXOES,
+        'canais': canais,
+    }
@@ -11,14 +11,18 @@ VERSAO 3.0 - Seguranca Aprimorada
 """
 
 import bcrypt
+import os
 import re
 import logging
+import threading
+import time
 from contextlib import contextmanager
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple, Any, Union
 
 from backend.database import get_db_connection, release_connection
 from backend.auth import validar_senha_forte
+from backend.cache import get_generations, cache_bump_generation
 
 
 # ==============================================================================
@@ -478,7 +482,9 @@ def editar_usuario(
 
             logger.info(f'Usuario {usuario_id} editado por admin {admin_id}')
 
-            return {'success': True, 'message': 'Usuario atualizado com sucesso'}
+        if 'is_admin' in dados_validos or 'ativo' in dados_validos:
+            invalidar_cache_permissoes()
+        return {'success': True, 'message': 'Usuario atualizado com sucesso'}
 
     except ConnectionError as e:
         return {'success': False, 'error': str(e)}
@@ -542,10 +548,11 @@ def alterar_status_usuario(
             status_texto = 'ativado' if ativo else 'desativado'
             logger.info(f'Usuario {usuario_id} {status_texto} por admin {admin_id}')
 
-            return {
-                'success': True,
-                'message': f"Usuario {status_texto} com sucesso"
-            }
+        invalidar_cache_permissoes()
+        return {
+            'success': True,
+            'message': f"Usuario {status_texto} com sucesso"
+        }
 
     except ConnectionError as e:
         return {'success': False, 'error': str(e)}
@@ -719,7 +726,8 @@ def adicionar_permissao(
                 f'por admin {admin_id}'
             )
 
-            return {'success': True, 'message': 'Permissao adicionada com sucesso'}
+        invalidar_cache_permissoes()
+        return {'success': True, 'message': 'Permissao adicionada com sucesso'}
 
     except ConnectionError as e:
         return {'success': False, 'error': str(e)}
@@ -778,7 +786,8 @@ def remover_permissao(
                 f'por admin {admin_id}'
             )
 
-            return {'success': True, 'message': 'Permissao removida com sucesso'}
+        invalidar_cache_permissoes()
+        return {'success': True, 'message': 'Permissao removida com sucesso'}
 
     except ConnectionError as e:
         return {'success': False, 'error': str(e)}
@@ -814,13 +823,89 @@ def buscar_permissoes_usuario(usuario_id: Union[int, str]) -> set:
         return set()
 
 
+# ==============================================================================
+# CACHE DE PERMISSOES (por processo, versionado)
+# ==============================================================================
+
+# Geracao global no hash de geracoes do cache (Redis), sincronizada a cada
+# CACHE_GEN_SYNC_INTERVAL s: alteracoes feitas em qualquer processo valem
+# no proximo poll. Sem Redis a geracao fica so no processo (e um HINCRBY
+# que falhou ou um flush do Redis tambem perdem o aviso): por isso cada
+# entrada expira apos PERMISSOES_CACHE_MAX_SEG e volta a ser lida do banco.
+_GERACAO_PERMISSOES = 'permissoes'
+PERMISSOES_CACHE_MAX = 4096
+PERMISSOES_CACHE_MAX_SEG = int(os.getenv('PERMISSOES_CACHE_MAX_SEG', '30'))
+
+# usuario_id -> (geracao, expira_em monotonic, acesso)
+_permissoes_cache: Dict[int, Tuple[int, float, Optional[Tuple[bool, frozenset]]]] = {}
+_permissoes_lock = threading.Lock()
+
+
+def _geracao_permissoes() -> int:
+    return get_generations([_GERACAO_PERMISSOES])[_GERACAO_PERMISSOES]
+
+
+def invalidar_cache_permissoes() -> None:
+    """
+    Descarta as permissoes em cache de todos os usuarios (todos os processos).
+    Chamar apos o commit de qualquer alteracao em permissoes_paineis ou em
+    usuarios.is_admin / usuarios.ativo.
+    """
+    cache_bump_generation([_GERACAO_PERMISSOES])
+    with _permissoes_lock:
+        _permissoes_cache.clear()
+
+
+def _acesso_usuario(usuario_id: int) -> Optional[Tuple[bool, frozenset]]:
+    """
+    (is_admin, paineis liberados) do usuario ativo, ou None se inativo /
+    inexistente / erro de banco. Uma consulta por usuario a cada geracao,
+    e no maximo PERMISSOES_CACHE_MAX_SEG de idade.
+    """
+    geracao = _geracao_permissoes()
+    entrada = _permissoes_cache.get(usuario_id)
+    if entrada is not None and entrada[0] == geracao and entrada[1] > time.monotonic():
+        return entrada[2]
+
+    try:
+        with get_db_cursor() as (cursor, conn):
+            cursor.execute(
+                "SELECT is_admin FROM usuarios WHERE id = %s AND ativo = TRUE",
+                (usuario_id,)
+            )
+            resultado = cursor.fetchone()
+
+            if not resultado:
+                acesso = None
+            elif resultado[0]:  # is_admin = True
+                acesso = (True, frozenset())
+            else:
+                cursor.execute(
+                    "SELECT painel_nome FROM permissoes_paineis WHERE usuario_id = %s",
+                    (usuario_id,)
+                )
+                acesso = (False, frozenset(row[0] for row in cursor.fetchall()))
+
+    except Exception as e:
+        # Erro de banco nao e cacheado: a proxima requisicao tenta de novo
+        logger.error(f'Erro ao verificar permissao: {e}')
+        return None
+
+    with _permissoes_lock:
+        if len(_permissoes_cache) >= PERMISSOES_CACHE_MAX:
+            _permissoes_cache.clear()
+        _permissoes_cache[usuario_id] = (geracao, time.monotonic() + PERMISSOES_CACHE_MAX_SEG, acesso)
+    return acesso
+
+
 def verificar_permissao_painel(
     usuario_id: Union[int, str],
     painel_nome: str
 ) -> bool:
     """
     Verifica se usuario tem permissao para acessar um painel.
-    Consulta o cache de sessao primeiro; cai no banco apenas se necessario.
+    Consulta o cache de sessao primeiro; depois o cache de permissoes do
+    processo, que so vai ao banco na primeira consulta de cada geracao.
 
     Args:
         usuario_id: ID do usuario
@@ -847,33 +932,14 @@ def verificar_permissao_painel(
     except Exception:
         pass
 
-    # Consulta direta ao banco — permissoes nao sao cacheadas em sessao para
-    # garantir que alteracoes feitas pelo admin entrem em vigor imediatamente,
-    # sem exigir que o usuario faca logout/login
-    try:
-        with get_db_cursor() as (cursor, conn):
-            cursor.execute(
-                "SELECT is_admin FROM usuarios WHERE id = %s AND ativo = TRUE",
-                (usuario_id,)
-            )
-            resultado = cursor.fetchone()
-
-            if not resultado:
-                return False
-
-            if resultado[0]:  # is_admin = True
-                return True
-
-            cursor.execute("""
-                SELECT id FROM permissoes_paineis
-                WHERE usuario_id = %s AND painel_nome = %s
-            """, (usuario_id, painel_nome))
-
-            return cursor.fetchone() is not None
-
-    except Exception as e:
-        logger.error(f'Erro ao verificar permissao: {e}')
+    # Permissoes nao sao cacheadas em sessao para garantir que alteracoes
+    # feitas pelo admin entrem em vigor imediatamente, sem logout/login.
+    # O cache do processo e descartado a cada nova geracao de permissoes.
+    acesso = _acesso_usuario(usuario_id)
+    if acesso is None:
         return False
+    is_admin, paineis = acesso
+    return is_admin or painel_nome in paineis
 
 
 def verificar_acesso_hub(usuario_id: Union[int, str]) -> bool:
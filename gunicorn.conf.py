@@ -2,22 +2,46 @@
 Configuração Gunicorn — Sistema de Paineis Hospitalares
 ======================================================
 
-Arquitetura escolhida: 1 worker + gthread (threads)
-  - Múltiplos workers fork o processo → cada worker reiniciaria os 6
-    notificadores/workers daemon (pareceres, sentir-agir, IMAP, etc.)
-    causando e-mails duplicados e múltiplas execuções simultâneas.
-  - 1 worker com threads resolve a concorrência sem esse problema.
-
-Capacidade: 8 threads simultâneas — suficiente para 50+ usuários
-  (paineis têm refresh de 10-30s e queries de ~200-500ms cada)
+Arquitetura: N workers + gthread (threads)
+  - Os 8 notificadores/workers daemon (pareceres, sentir-agir, IMAP, etc.)
+    rodam em UM worker só: o líder eleito por advisory lock no PostgreSQL
+    (backend/job_host.py). Os demais workers só atendem HTTP — sem e-mails
+    duplicados. Se o líder morrer, outro worker assume em até
+    JOB_HOST_INTERVALO_SEG segundos.
+  - GUNICORN_WORKERS > 1 usa mais núcleos (um GIL por processo). O pool de
+    conexões é dividido entre os workers (DB_POOL_BUDGET // GUNICORN_WORKERS).
+  - Cache em memória (L1, estimadores) e canais SSE são por worker; o Redis
+    continua compartilhado.
+  - Métricas (/api/health/metrics) também são por worker: cada scrape traz
+    só o worker que atendeu, com label worker="<pid>" (backend/metrics.py).
+
+Capacidade: 8 threads HTTP simultâneas por worker — 1 worker é suficiente
+  para 50+ usuários (paineis têm refresh de 10-30s e queries de ~200-500ms cada)
+
+Push (SSE, /api/stream/<painel>) — dimensionamento (único lugar):
+  cada TV conectada ocupa uma thread do gthread enquanto a conexão estiver
+  aberta. Por isso o worker sobe com
+      threads = SSE_THREADS_RESERVADAS (8, requisições normais) + SSE_TVS (40)
+  e o canal aceita até SSE_TVS conexões (SSE_MAX_CONEXOES): as TVs em push
+  não tomam as threads das requisições normais. Ajuste SSE_TVS ao número
+  de TVs atendidas por worker; a TV excedente recebe 503 e volta ao polling.
+  Threads esperando evento não consomem CPU nem conexão de banco (só a
+  pilha, poucas centenas de KB de RSS cada).
+  backend/stream.py lê os mesmos valores do ambiente (exportados abaixo).
 """
 
 import os
 
 # ── Processo ────────────────────────────────────────────────────────────────
-workers     = int(os.getenv('GUNICORN_WORKERS', '1'))   # Mantenha 1 (veja nota acima)
+workers     = int(os.getenv('GUNICORN_WORKERS', '1'))   # Jobs de background só no líder (veja nota acima)
 worker_class = 'gthread'                                 # Threads por worker (não processos)
-threads     = int(os.getenv('GUNICORN_THREADS', '8'))   # Requisições simultâneas
+# Threads = requisições normais + uma por TV em push (veja nota acima)
+threads_http = int(os.getenv('SSE_THREADS_RESERVADAS', '8'))
+sse_tvs      = int(os.getenv('SSE_TVS', '40'))
+threads      = int(os.getenv('GUNICORN_THREADS', str(threads_http + sse_tvs)))
+# Os workers herdam o ambiente: backend/stream.py calcula o limite com os mesmos valores
+os.environ.setdefault('GUNICORN_THREADS', str(threads))
+os.environ.setdefault('SSE_THREADS_RESERVADAS', str(threads_http))
 # Reinicia o worker após N requisições para liberar fragmentação de memória.
 # Jitter evita que todos os workers reiniciem ao mesmo tempo.
 max_requests        = int(os.getenv('GUNICORN_MAX_REQUESTS', '5000'))
@@ -45,9 +69,23 @@ def on_starting(server):
     server.log.info("Gunicorn iniciando — Sistema de Paineis HAC")
 
 def post_fork(server, worker):
+    # Worker que perde a liderança dos jobs sai e o arbiter sobe outro (backend/job_host.py)
+    os.environ.setdefault('JOB_HOST_RECICLAR', 'true')
     server.log.info(f"Worker {worker.pid} iniciado ({threads} threads)")
 
 def worker_exit(server, worker):
+    # Libera a liderança dos jobs de background para outro worker
+    try:
+        from backend.job_host import job_host
+        job_host.parar()
+    except Exception:
+        pass
+    # Fila do access_log primeiro — o escritor ainda precisa do pool
+    try:
+        from backend.access_tracker import parar_escritor_log
+        parar_escritor_log()
+    except Exception:
+        pass
     try:
         from backend.database import close_connection_pool
         close_connection_pool()
@@ -55,7 +55,7 @@ function inicializar() {
     cachearElementos();
     configurarBotoes();
     carregarTudo();
-    setInterval(carregarTudo, CONFIG.intervaloRefresh);
+    PainelStream.iniciar('painel10', carregarTudo, CONFIG.intervaloRefresh);
 
     // Recarrega ao voltar para aba
     document.addEventListener('visibilitychange', function() {
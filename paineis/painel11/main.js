@@ -115,7 +115,7 @@
         P11.carregarFiltrosDinamicos();
         P11.carregarDados();
 
-        Estado.intervalos.refresh = setInterval(function () { P11.carregarDados(); }, P11.CONFIG.intervaloRefresh);
+        Estado.intervalos.refresh = PainelStream.iniciar('painel11', function () { P11.carregarDados(); }, P11.CONFIG.intervaloRefresh);
     }
 
     window.addEventListener('DOMContentLoaded', inicializar);
@@ -28,8 +28,8 @@ function inicializar() {
     configurarBotoes();
     carregarDados();
 
-    // Auto-refresh a cada 30 segundos
-    setInterval(carregarDados, CONFIG.intervaloRefresh);
+    // Auto-refresh: push do servidor (SSE), com polling de 30s como fallback
+    PainelStream.iniciar('painel12', carregarDados, CONFIG.intervaloRefresh);
 
     console.log('Painel 12 inicializado!');
 }
@@ -1334,7 +1334,7 @@ var PAINEL_VERSAO = '1.0.09';
         carregarSetores().then(function() {
             return carregarDados();
         }).then(function() {
-            Estado.intervalos.refresh = setInterval(carregarDados, CONFIG.intervaloRefresh);
+            Estado.intervalos.refresh = PainelStream.iniciar('painel13', carregarDados, CONFIG.intervaloRefresh);
             console.log('[Painel13] Inicializado com sucesso');
         });
     }
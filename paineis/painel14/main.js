@@ -52,7 +52,7 @@ var PAINEL_VERSAO = '1.0.46';
         carregarConfiguracoes();
         carregarDados();
 
-        estado.refreshInterval = setInterval(carregarDados, CONFIG.intervaloRefresh);
+        estado.refreshInterval = PainelStream.iniciar('painel14', carregarDados, CONFIG.intervaloRefresh);
 
         console.log('Painel 14 inicializado com sucesso');
     }
@@ -355,8 +355,8 @@ var PAINEL_VERSAO = '1.0.46';
                     atualizarIconeSom();
 
                     if (CONFIG.intervaloRefresh !== 10000 && estado.refreshInterval) {
-                        clearInterval(estado.refreshInterval);
-                        estado.refreshInterval = setInterval(carregarDados, CONFIG.intervaloRefresh);
+                        estado.refreshInterval.parar();
+                        estado.refreshInterval = PainelStream.iniciar('painel14', carregarDados, CONFIG.intervaloRefresh);
                     }
                 }
             })
@@ -41,7 +41,7 @@ function inicializar() {
     console.log('Inicializando Painel 16...');
     configurarBotoes();
     carregarTudo();
-    setInterval(carregarTudo, CONFIG.intervaloRefresh);
+    PainelStream.iniciar('painel16', carregarTudo, CONFIG.intervaloRefresh);
     console.log('Painel 16 inicializado.');
 }
 
@@ -21,7 +21,7 @@
         }
 
         window.P17.carregarDados();
-        setInterval(window.P17.carregarDados, window.P17.CONFIG.intervaloRefresh);
+        PainelStream.iniciar('painel17', window.P17.carregarDados, window.P17.CONFIG.intervaloRefresh);
     }
 
     window.addEventListener('DOMContentLoaded', inicializar);
@@ -42,8 +42,8 @@ function inicializar() {
     configurarBotoes();
     carregarDados();
 
-    // Auto-refresh
-    setInterval(carregarDados, CONFIG.intervaloRefresh);
+    // Auto-refresh: push do servidor (SSE), com polling de fallback
+    PainelStream.iniciar('painel4', carregarDados, CONFIG.intervaloRefresh);
 
     // Auto-scroll apos delay
     setTimeout(function () {
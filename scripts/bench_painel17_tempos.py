@@ -0,0 +1,299 @@
+"""
+Benchmark do endpoint /api/paineis/painel17/tempos
+Compara o loop antigo (3 consultas por clinica), a consulta unica com o
+agregado em SQL e o estimador em memoria (backend.espera_ps: carga
+completa e incremento) para 10, 50 e 200 clinicas. A consulta unica e a
+referencia: as medianas do estimador tem de bater com ela.
+
+Os dados sao sinteticos, numa tabela TEMP com o mesmo nome da tabela
+real: ela so existe na sessao do benchmark e nao toca em nada do banco.
+
+Uso: python scripts/bench_painel17_tempos.py [--repeticoes 20] [--por-clinica 300]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+
+from backend.database import DB_CONFIG                                   # noqa: E402
+from backend.espera_ps import (                                          # noqa: E402
+    EstimadorEspera, CHAVE_ACOLHIMENTO, DIAS_HISTORICO, JANELA_RECENTES, MAX_ESPERA_MINUTOS,
+)
+
+CENARIOS = (10, 50, 200)
+
+
+# ========================================
+# AGREGADO SQL (referencia)
+# ========================================
+
+def _cte_metricas(chave, campo_fim, filtro=''):
+    """
+    CTE 'metricas' com um agregado por `chave`: ultimos JANELA_RECENTES
+    atendidos (ROW_NUMBER), mediana/percentis da espera, mediana da janela
+    de tendencia (1-2h atras) e o ultimo atendimento. Espera fora de
+    (0, MAX_ESPERA_MINUTOS] fica fora dos agregados.
+    """
+    return f"""
+        atendidos AS (
+            SELECT {chave} AS chave,
+                   {campo_fim} AS fim,
+                   EXTRACT(EPOCH FROM ({campo_fim} - COALESCE(retirada_senha, dt_entrada))) / 60.0 AS espera,
+                   ROW_NUMBER() OVER (PARTITION BY {chave} ORDER BY {campo_fim} DESC) AS pos,
+                   {campo_fim} BETWEEN %(tendencia_ini)s AND %(tendencia_fim)s AS na_tendencia,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY {chave}, {campo_fim} BETWEEN %(tendencia_ini)s AND %(tendencia_fim)s
+                       ORDER BY {campo_fim} DESC
+                   ) AS pos_tendencia
+            FROM painel17_atendimentos_ps
+            WHERE {campo_fim} IS NOT NULL
+              AND {campo_fim} >= %(desde)s
+              {filtro}
+        ),
+        amostras AS (
+            SELECT chave, fim,
+                   pos <= %(janela)s                               AS recente,
+                   na_tendencia AND pos_tendencia <= %(janela)s    AS tendencia,
+                   espera > 0 AND espera <= %(max_espera)s         AS valido,
+                   ROUND(espera::numeric, 1)                       AS espera
+            FROM atendidos
+            WHERE pos <= %(janela)s OR (na_tendencia AND pos_tendencia <= %(janela)s)
+        ),
+        metricas AS (
+            SELECT chave,
+                   MAX(fim) AS ultimo,
+                   COUNT(*) FILTER (WHERE recente AND valido) AS amostra,
+                   PERCENTILE_CONT(0.5)  WITHIN GROUP (ORDER BY espera) FILTER (WHERE recente AND valido) AS mediana,
+                   PERCENTILE_DISC(0.35) WITHIN GROUP (ORDER BY espera) FILTER (WHERE recente AND valido) AS p35,
+                   PERCENTILE_DISC(0.65) WITHIN GROUP (ORDER BY espera) FILTER (WHERE recente AND valido) AS p65,
+                   PERCENTILE_CONT(0.5)  WITHIN GROUP (ORDER BY espera) FILTER (WHERE tendencia AND valido) AS mediana_1h
+            FROM amostras
+            GROUP BY chave
+        )
+    """
+
+
+SQL_TEMPOS_CLINICAS = "WITH" + _cte_metricas('cd_clinica', 'dt_inicio_atendimento_med') + """,
+    clinicas AS (
+        SELECT DISTINCT cd_clinica, clinica
+        FROM painel17_atendimentos_ps
+        WHERE dt_entrada >= %(desde)s
+    ),
+    fila AS (
+        SELECT cd_clinica, COUNT(*) AS fila
+        FROM painel17_atendimentos_ps
+        WHERE dt_inicio_atendimento_med IS NULL
+          AND dt_alta IS NULL
+          AND dt_entrada >= NOW() - INTERVAL '24 hours'
+        GROUP BY cd_clinica
+    )
+    SELECT c.cd_clinica, c.clinica, COALESCE(f.fila, 0) AS fila,
+           m.ultimo, COALESCE(m.amostra, 0) AS amostra, m.mediana, m.p35, m.p65, m.mediana_1h
+    FROM clinicas c
+    LEFT JOIN metricas m ON m.chave = c.cd_clinica
+    LEFT JOIN fila f     ON f.cd_clinica = c.cd_clinica
+    ORDER BY c.clinica
+"""
+
+
+def _params_tempos(agora):
+    return {
+        'desde': agora - timedelta(days=DIAS_HISTORICO),
+        'tendencia_ini': agora - timedelta(hours=2),
+        'tendencia_fim': agora - timedelta(hours=1),
+        'janela': JANELA_RECENTES,
+        'max_espera': MAX_ESPERA_MINUTOS,
+    }
+
+
+# ========================================
+# DADOS SINTETICOS
+# ========================================
+
+def criar_dados(cur, n_clinicas, por_clinica):
+    """Tabela TEMP com ~por_clinica atendimentos por clinica nos ultimos 7 dias."""
+    cur.execute("DROP TABLE IF EXISTS pg_temp.painel17_atendimentos_ps")
+    cur.execute("""
+        CREATE TEMP TABLE painel17_atendimentos_ps (
+            id                        SERIAL PRIMARY KEY,
+            nr_atendimento            SERIAL,
+            cd_clinica                INTEGER,
+            clinica                   VARCHAR(100),
+            dt_entrada                TIMESTAMP,
+            retirada_senha            TIMESTAMP,
+            dt_inicio_atendimento     TIMESTAMP,
+            dt_inicio_atendimento_med TIMESTAMP,
+            dt_fim_atendimento        TIMESTAMP,
+            dt_alta                   TIMESTAMP,
+            nm_medico                 VARCHAR(200)
+        )
+    """)
+    cur.execute("""
+        INSERT INTO painel17_atendimentos_ps
+            (cd_clinica, clinica, dt_entrada, retirada_senha,
+             dt_inicio_atendimento, dt_inicio_atendimento_med, nm_medico)
+        SELECT c, 'Clinica ' || c, e, e - INTERVAL '3 minutes',
+               e + INTERVAL '5 minutes',
+               -- 10% ainda na fila
+               CASE WHEN random() < 0.9 THEN e + (5 + random() * 60) * INTERVAL '1 minute' END,
+               'Medico ' || (c * 10 + (random() * 4)::int)
+        FROM generate_series(1, %s) AS c,
+             LATERAL (SELECT LOCALTIMESTAMP - random() * INTERVAL '7 days' AS e
+                      FROM generate_series(1, %s)) AS t
+    """, (n_clinicas, por_clinica))
+    # Indice que o loop antigo usa (cd_clinica + ultimo atendimento)
+    cur.execute("""
+        CREATE INDEX ON painel17_atendimentos_ps (cd_clinica, dt_inicio_atendimento_med DESC)
+    """)
+    cur.execute("ANALYZE painel17_atendimentos_ps")
+
+
+# ========================================
+# IMPLEMENTACOES
+# ========================================
+
+def _espera(row):
+    fim = row['dt_inicio_atendimento_med']
+    inicio = row['retirada_senha'] or row['dt_entrada']
+    diff = (fim - inicio).total_seconds() / 60.0
+    return round(diff, 1) if 0 < diff <= MAX_ESPERA_MINUTOS else None
+
+
+def loop_antigo(cur, agora):
+    """Versao anterior: lista de clinicas + 3 consultas por clinica."""
+    consultas = 1
+    cur.execute("""
+        SELECT DISTINCT cd_clinica, clinica
+        FROM painel17_atendimentos_ps
+        WHERE dt_entrada >= NOW() - INTERVAL '7 days'
+        ORDER BY clinica
+    """)
+    medianas = {}
+    for clin in cur.fetchall():
+        cd = clin['cd_clinica']
+        cur.execute("""
+            SELECT dt_entrada, retirada_senha, dt_inicio_atendimento_med
+            FROM painel17_atendimentos_ps
+            WHERE cd_clinica = %s
+              AND dt_inicio_atendimento_med IS NOT NULL
+            ORDER BY dt_inicio_atendimento_med DESC
+            LIMIT %s
+        """, (cd, JANELA_RECENTES))
+        recentes = cur.fetchall()
+        cur.execute("""
+            SELECT dt_entrada, retirada_senha, dt_inicio_atendimento_med
+            FROM painel17_atendimentos_ps
+            WHERE cd_clinica = %s
+              AND dt_inicio_atendimento_med IS NOT NULL
+              AND dt_inicio_atendimento_med BETWEEN %s AND %s
+            ORDER BY dt_inicio_atendimento_med DESC
+            LIMIT %s
+        """, (cd, agora - timedelta(hours=2), agora - timedelta(hours=1), JANELA_RECENTES))
+        cur.fetchall()
+        cur.execute("""
+            SELECT COUNT(*) AS total
+            FROM painel17_atendimentos_ps
+            WHERE cd_clinica = %s
+              AND dt_inicio_atendimento_med IS NULL
+              AND dt_alta IS NULL
+              AND dt_entrada >= NOW() - INTERVAL '24 hours'
+        """, (cd,))
+        cur.fetchone()
+        consultas += 3
+        tempos = [t for t in map(_espera, recentes) if t is not None]
+        medianas[cd] = statistics.median(tempos) if tempos else None
+    return consultas, medianas
+
+
+def consulta_unica(cur, agora):
+    cur.execute(SQL_TEMPOS_CLINICAS, _params_tempos(agora))
+    medianas = {r['cd_clinica']: (float(r['mediana']) if r['mediana'] is not None else None)
+                for r in cur.fetchall()}
+    return 1, medianas
+
+
+def _medianas(estimador, agora):
+    return {cd: ag['mediana'] for cd, ag in estimador.agregados(agora).items()
+            if cd != CHAVE_ACOLHIMENTO}
+
+
+def estimador_completo(cur, agora):
+    """Estimador novo: carga completa dos ultimos DIAS_HISTORICO dias."""
+    estimador = EstimadorEspera()
+    estimador.atualizar(cur, agora)
+    return 1, _medianas(estimador, agora)
+
+
+def estimador_incremental(estimador):
+    """Estimador ja carregado: so a margem de sobreposicao volta do banco."""
+    def _executar(cur, agora):
+        estimador.atualizar(cur, agora, forcar=True)
+        return 1, _medianas(estimador, agora)
+    return _executar
+
+
+def _iguais(referencia, medianas):
+    return all(
+        (a is None and medianas.get(cd) is None)
+        or (a is not None and medianas.get(cd) is not None and abs(a - medianas[cd]) < 0.05)
+        for cd, a in referencia.items()
+    )
+
+
+def medir(funcao, cur, agora, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        consultas, medianas = funcao(cur, agora)
+        tempos.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(tempos), consultas, medianas
+
+
+# ========================================
+# EXECUCAO
+# ========================================
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeticoes', type=int, default=20)
+    parser.add_argument('--por-clinica', type=int, default=300)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
+    cur = conn.cursor()
+    agora = datetime.now()
+
+    print("=" * 72)
+    print(f"PAINEL17 /tempos — {args.repeticoes} repeticoes, {args.por_clinica} atendimentos/clinica")
+    print("=" * 72)
+    print(f"{'clinicas':>9} | {'antigo (ms)':>12} {'consultas':>10} | {'unica (ms)':>11} "
+          f"{'estimador (ms)':>15} {'incremento (ms)':>16} | medianas")
+    try:
+        for n in CENARIOS:
+            criar_dados(cur, n, args.por_clinica)
+            ms_antigo, q_antigo, med_antigo = medir(loop_antigo, cur, agora, args.repeticoes)
+            ms_unica, _, med_unica = medir(consulta_unica, cur, agora, args.repeticoes)
+            ms_est, _, med_est = medir(estimador_completo, cur, agora, args.repeticoes)
+            carregado = EstimadorEspera()
+            carregado.atualizar(cur, agora)
+            ms_inc, _, med_inc = medir(estimador_incremental(carregado), cur, agora, args.repeticoes)
+            iguais = (_iguais(med_unica, med_antigo) and _iguais(med_unica, med_est)
+                      and _iguais(med_unica, med_inc))
+            print(f"{n:>9} | {ms_antigo:>12.1f} {q_antigo:>10} | {ms_unica:>11.1f} "
+                  f"{ms_est:>15.1f} {ms_inc:>16.1f} | {'iguais' if iguais else 'DIFERENTES'}")
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Migração: converte access_log (tabela comum) em tabela particionada por mês
+- a tabela antiga vira a partição access_log_legado (sem copiar linhas)
+- CHECK NOT VALID + VALIDATE e índice CONCURRENTLY antes da troca: as
+  escritas continuam durante as etapas pesadas; a troca só mexe em catálogo
+- refaz os rollups access_log_hora / access_log_dia a partir das linhas brutas
+
+Roda fora do boot dos workers (o init_db só avisa que falta migrar).
+Pode ser executado com a aplicação no ar e é seguro repetir.
+"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.database import get_db_connection
+from backend.access_log_store import converter_legado, recalcular_rollups
+
+
+def migrate():
+    conn = get_db_connection()
+    if not conn:
+        print("Erro: Não foi possível conectar ao banco de dados")
+        sys.exit(1)
+
+    try:
+        limite = converter_legado(conn)
+        if limite is None:
+            print("  access_log já é particionada — pulando conversão")
+        else:
+            print(f"  access_log convertida (partição legado até {limite})")
+        recalcular_rollups(conn)
+        print("  Rollups recalculados")
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro na migração: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+    print("\nMigração concluída!")
+
+
+if __name__ == '__main__':
+    migrate()
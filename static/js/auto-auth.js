@@ -65,17 +65,77 @@
         });
     }
 
+    // -------------------------------------------------------------------------
+    // Requisições condicionais (ETag / If-None-Match) nas APIs em cache.
+    // As respostas /api/ são no-store (dados médicos), então o navegador não
+    // guarda nada: o último corpo de cada URL fica aqui em memória e, quando o
+    // servidor responde 304 (dado não mudou), é devolvido ao painel como 200.
+    // -------------------------------------------------------------------------
+    var MAX_RESPOSTAS = 40;
+    var _respostas = new Map();   // url -> {etag, corpo, tipo}
+
+    function urlCondicional(input, init) {
+        if (typeof input !== 'string' && !(input instanceof URL)) return null;
+        var metodo = ((init && init.method) || 'GET').toUpperCase();
+        if (metodo !== 'GET') return null;
+        var url = new URL(input, window.location.href);
+        if (url.origin !== window.location.origin) return null;
+        if (url.pathname.indexOf('/api/') !== 0) return null;
+        return url.href;
+    }
+
+    function guardarResposta(url, response) {
+        var etag = response.headers.get('ETag');
+        if (!etag) {
+            _respostas.delete(url);
+            return;
+        }
+        var tipo = response.headers.get('Content-Type') || 'application/json';
+        response.clone().text().then(function (corpo) {
+            _respostas.delete(url);
+            _respostas.set(url, {etag: etag, corpo: corpo, tipo: tipo});
+            if (_respostas.size > MAX_RESPOSTAS) {
+                _respostas.delete(_respostas.keys().next().value);
+            }
+        }).catch(function () { /* corpo ilegível — não guarda */ });
+    }
+
     // -------------------------------------------------------------------------
     // Sobrescreve window.fetch para capturar respostas 401 em qualquer chamada
+    // e enviar If-None-Match nas APIs que já têm corpo guardado
     // -------------------------------------------------------------------------
-    window.fetch = function () {
-        return _fetchOriginal.apply(this, arguments).then(function (response) {
+    window.fetch = function (input, init) {
+        var args = arguments;
+        var url = urlCondicional(input, init);
+        var guardada = url ? _respostas.get(url) : null;
+
+        if (guardada) {
+            var headers = new Headers((init && init.headers) || {});
+            if (!headers.has('If-None-Match')) {
+                headers.set('If-None-Match', guardada.etag);
+                var novoInit = Object.assign({}, init || {}, {headers: headers});
+                args = [input, novoInit];
+            }
+        }
+
+        return _fetchOriginal.apply(this, args).then(function (response) {
             if (response.status === 401) {
                 tentarReconectarTV();
                 // Retorna uma promise que nunca resolve para interromper
                 // o processamento do painel sem gerar erros desnecessários
                 return new Promise(function () {});
             }
+            if (response.status === 304 && guardada) {
+                // Dado não mudou: devolve o corpo guardado como resposta normal
+                return new Response(guardada.corpo, {
+                    status: 200,
+                    statusText: 'OK',
+                    headers: {'Content-Type': guardada.tipo, 'ETag': guardada.etag, 'X-Cache': 'NOT-MODIFIED'}
+                });
+            }
+            if (url && response.ok) {
+                guardarResposta(url, response);
+            }
             return response;
         });
         // Erros de rede (servidor offline) não disparam redirecionamento
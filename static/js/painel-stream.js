@@ -0,0 +1,82 @@
+/**
+ * Canal de push dos paineis (Server-Sent Events)
+ *
+ * Substitui o setInterval de refresh: a TV mantem uma conexao aberta em
+ * /api/stream/<painel> e so recarrega quando o servidor avisa que os dados
+ * mudaram (a recarga e servida do cache ja recalculado).
+ *
+ * Se o push nao estiver disponivel (navegador sem EventSource, painel sem
+ * cache compartilhado, limite de conexoes atingido) volta ao polling com o
+ * intervalo original e tenta o push de novo mais tarde.
+ *
+ * Uso:
+ *     PainelStream.iniciar('painel4', carregarDados, CONFIG.intervaloRefresh);
+ */
+(function () {
+    'use strict';
+
+    var NOVA_TENTATIVA_MS = 5 * 60 * 1000;
+
+    function iniciar(painel, recarregar, intervalo) {
+        var fonte = null;
+        var timerPolling = null;
+        var timerTentativa = null;
+        var parado = false;
+
+        function iniciarPolling() {
+            if (timerPolling || parado) return;
+            timerPolling = setInterval(recarregar, intervalo);
+        }
+
+        function pararPolling() {
+            if (timerPolling) clearInterval(timerPolling);
+            timerPolling = null;
+        }
+
+        function conectar() {
+            timerTentativa = null;
+            if (parado) return;
+            if (typeof window.EventSource === 'undefined') {
+                iniciarPolling();
+                return;
+            }
+
+            fonte = new EventSource('/api/stream/' + encodeURIComponent(painel));
+
+            fonte.addEventListener('hello', function (e) {
+                pararPolling();
+                var dados = {};
+                try { dados = JSON.parse(e.data); } catch (err) { /* ignora */ }
+                // Reconectou depois de uma mudanca: recarrega o que perdeu
+                if (dados.perdeu_eventos) recarregar();
+            });
+
+            fonte.addEventListener('update', function () {
+                recarregar();
+            });
+
+            fonte.onerror = function () {
+                // CONNECTING: o navegador reconecta sozinho (fim de ciclo, restart)
+                if (fonte.readyState !== EventSource.CLOSED) return;
+                // CLOSED: servidor recusou (404/503) — polling e nova tentativa depois
+                fonte = null;
+                iniciarPolling();
+                if (!parado) timerTentativa = setTimeout(conectar, NOVA_TENTATIVA_MS);
+            };
+        }
+
+        conectar();
+
+        return {
+            parar: function () {
+                parado = true;
+                pararPolling();
+                if (timerTentativa) clearTimeout(timerTentativa);
+                if (fonte) fonte.close();
+                fonte = null;
+            }
+        };
+    }
+
+    window.PainelStream = { iniciar: iniciar };
+})();
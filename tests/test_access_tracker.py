@@ -0,0 +1,239 @@
+"""
+Testes do escritor em lote do access_log (backend.access_tracker) e das
+particoes/retencao (backend.access_log_store).
+
+Cobertura:
+- lote fechado por tamanho (ACCESS_LOG_BATCH) e por prazo
+- fila cheia descarta e conta, sem bloquear a requisicao
+- um INSERT multi-linha e um commit por lote
+- parar_escritor_log grava o que resta na fila
+- particoes mensais a frente, respeitando a particao legado
+- retencao por DROP de particao (e DELETE sem particionamento e na
+  particao legado ainda dentro da janela)
+- init_db nao migra a tabela antiga; retencao registrada so no lider
+"""
+import queue
+import threading
+import pytest
+from unittest.mock import patch, MagicMock
+
+from backend import access_tracker as at
+
+
+@pytest.fixture
+def escritor():
+    """Fila, evento de parada e contadores novos para cada teste."""
+    stats = {k: (None if k == 'ultimo_lote_ms' else 0) for k in at._log_stats}
+    with patch.multiple(at, _fila_log=queue.Queue(maxsize=100), _escritor_parar=threading.Event(),
+                        _escritor_thread=None, _log_stats=stats,
+                        ACCESS_LOG_BATCH=3, ACCESS_LOG_FLUSH_MS=50):
+        yield at
+
+
+def _logar(mod, n):
+    for i in range(n):
+        mod._write_log_async('10.0.0.%d' % i, 'painel4', 'Ocupação', '/api/paineis/painel4/dados',
+                             'desc', 'GET', 200, 5, None, 'teste', 'painel')
+
+
+class TestEscritorAccessLog:
+    @pytest.mark.database
+    def test_lote_por_tamanho(self, escritor):
+        with patch.object(escritor, '_garantir_escritor'):
+            _logar(escritor, 7)
+        assert [len(escritor._coletar_lote()) for _ in range(3)] == [3, 3, 1]
+        assert escritor._coletar_lote() == []
+
+    @pytest.mark.database
+    def test_fila_cheia_descarta(self, escritor):
+        with patch.object(escritor, '_fila_log', queue.Queue(maxsize=2)), \
+             patch.object(escritor, '_garantir_escritor'):
+            _logar(escritor, 5)
+            stats = escritor.access_log_stats()
+        assert stats['enfileirados'] == 2
+        assert stats['descartados'] == 3
+
+    @pytest.mark.database
+    def test_um_commit_por_lote(self, escritor):
+        conn = MagicMock()
+        with patch.object(escritor, '_garantir_escritor'):
+            _logar(escritor, 3)
+        lote = escritor._coletar_lote()
+        with patch('backend.database.get_db_connection', return_value=conn), \
+             patch('backend.database.release_connection') as release, \
+             patch('psycopg2.extras.execute_values') as ev:
+            assert escritor._gravar_lote(lote) is True
+        assert ev.call_count == 1
+        assert len(ev.call_args.args[2]) == 3
+        conn.commit.assert_called_once()
+        release.assert_called_once_with(conn)
+        assert escritor.access_log_stats()['lotes'] == 1
+
+    @pytest.mark.database
+    def test_falha_conta_perdidos(self, escritor):
+        with patch('backend.database.get_db_connection', return_value=None):
+            assert escritor._gravar_lote([('x',)] * 4) is False
+        assert escritor.access_log_stats()['perdidos'] == 4
+
+    @pytest.mark.database
+    def test_shutdown_grava_fila(self, escritor):
+        conn = MagicMock()
+        with patch('backend.database.get_db_connection', return_value=conn), \
+             patch('backend.database.release_connection'), \
+             patch('psycopg2.extras.execute_values'):
+            _logar(escritor, 8)
+            assert escritor.parar_escritor_log(timeout=2) == 0
+            stats = escritor.access_log_stats()
+        assert stats['gravados'] == 8
+        assert not stats['escritor_ativo']
+        # Depois do shutdown nada mais entra na fila
+        _logar(escritor, 1)
+        assert escritor.access_log_stats()['fila'] == 0
+
+
+class _CursorCatalogo:
+    """Cursor falso: responde as consultas de catalogo e grava o DDL executado."""
+
+    def __init__(self, relkind='p', particoes=()):
+        self.relkind = relkind
+        self.particoes = list(particoes)
+        self.executados = []
+        self._resultado = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        self.executados.append((' '.join(sql.split()), params))
+        if 'relkind' in sql:
+            self._resultado = [(self.relkind,)]
+        elif 'pg_inherits' in sql:
+            self._resultado = list(self.particoes)
+        elif 'reltuples' in sql:
+            self._resultado = [(1000,)]
+        else:
+            self._resultado = []
+
+    def fetchone(self):
+        return self._resultado[0] if self._resultado else None
+
+    def fetchall(self):
+        return self._resultado
+
+    def close(self):
+        pass
+
+    def ddl(self, trecho):
+        return [sql for sql, _ in self.executados if trecho in sql]
+
+
+def _limite(d):
+    return "FOR VALUES FROM ('x') TO ('{} 00:00:00-03')".format(d.isoformat())
+
+
+class TestParticoesAccessLog:
+    @pytest.mark.database
+    def test_somar_meses(self):
+        from datetime import date
+        from backend.access_log_store import _somar_meses
+        assert _somar_meses(date(2026, 11, 1), 2) == date(2027, 1, 1)
+        assert _somar_meses(date(2026, 3, 1), -6) == date(2025, 9, 1)
+
+    @pytest.mark.database
+    def test_cria_mes_atual_e_seguintes(self):
+        from datetime import date
+        from backend.access_log_store import garantir_particoes, _somar_meses
+        cur = _CursorCatalogo()
+        criadas = garantir_particoes(cur, meses_a_frente=2)
+        inicio = date.today().replace(day=1)
+        assert criadas == ['access_log_{:%Y%m}'.format(_somar_meses(inicio, n)) for n in range(3)]
+        assert len(cur.ddl('PARTITION OF access_log')) == 3
+
+    @pytest.mark.database
+    def test_pula_meses_do_legado(self):
+        from datetime import date
+        from backend.access_log_store import garantir_particoes, _somar_meses
+        proximo = _somar_meses(date.today().replace(day=1), 1)
+        cur = _CursorCatalogo(particoes=[('access_log_legado', _limite(proximo))])
+        criadas = garantir_particoes(cur, meses_a_frente=2)
+        assert criadas == ['access_log_{:%Y%m}'.format(_somar_meses(proximo, n)) for n in range(2)]
+
+    @pytest.mark.database
+    def test_retencao_descarta_particoes_antigas(self):
+        from datetime import date
+        from backend.access_log_store import aplicar_retencao, _somar_meses
+        mes = date.today().replace(day=1)
+        antiga, recente = _somar_meses(mes, -7), _somar_meses(mes, -2)
+        cur = _CursorCatalogo(particoes=[
+            ('access_log_{:%Y%m}'.format(antiga), _limite(_somar_meses(antiga, 1))),
+            ('access_log_{:%Y%m}'.format(recente), _limite(_somar_meses(recente, 1))),
+            ('access_log_{:%Y%m}'.format(mes), _limite(_somar_meses(mes, 1))),
+        ])
+        conn = MagicMock()
+        conn.cursor.return_value = cur
+        resultado = aplicar_retencao(conn)
+        assert resultado['particoes'] == ['access_log_{:%Y%m}'.format(antiga)]
+        assert resultado['linhas_estimadas'] == 1000
+        assert cur.ddl('DROP TABLE access_log_{:%Y%m}'.format(antiga))
+        assert not cur.ddl('DELETE FROM access_log WHERE')
+        conn.commit.assert_called_once()
+
+    @pytest.mark.database
+    def test_retencao_sem_particoes_usa_delete(self):
+        from backend.access_log_store import aplicar_retencao
+        cur = _CursorCatalogo(relkind='r')
+        conn = MagicMock()
+        conn.cursor.return_value = cur
+        aplicar_retencao(conn)
+        assert cur.ddl('DELETE FROM access_log WHERE dt_acesso')
+        assert not cur.ddl('DROP TABLE')
+
+    @pytest.mark.database
+    def test_retencao_poda_particao_legado_por_delete(self):
+        from datetime import date
+        from backend.access_log_store import aplicar_retencao, _somar_meses
+        proximo = _somar_meses(date.today().replace(day=1), 1)
+        cur = _CursorCatalogo(particoes=[('access_log_legado', _limite(proximo))])
+        conn = MagicMock()
+        conn.cursor.return_value = cur
+        resultado = aplicar_retencao(conn)
+        assert cur.ddl('DELETE FROM access_log_legado WHERE dt_acesso <')
+        assert not cur.ddl('DETACH PARTITION')
+        assert resultado['particoes'] == []
+
+    @pytest.mark.database
+    def test_init_nao_converte_tabela_antiga(self):
+        from backend.access_log_store import init_access_log
+        cur = _CursorCatalogo(relkind='r')
+        execute = cur.execute
+
+        def _execute(sql, params=None):
+            execute(sql, params)
+            if 'IS NOT NULL' in sql and 'to_regclass' in sql:
+                cur._resultado = [(True,)]
+        cur.execute = _execute
+        conn = MagicMock()
+        conn.cursor.return_value = cur
+        assert init_access_log(conn) is True
+        assert not cur.ddl('RENAME TO access_log_legado')
+        assert not cur.ddl('ATTACH PARTITION')
+        assert not cur.ddl('INSERT INTO access_log_dia')
+
+
+class TestRetencaoNoLider:
+    @pytest.mark.database
+    def test_registrada_no_agendador(self):
+        from backend.agendador import Horarios
+        with patch('backend.agendador.agendador.registrar') as registrar:
+            evento = at.start_retencao_access_log()
+        nome, funcao, gatilho = registrar.call_args.args
+        assert nome == 'access_log_retencao' and isinstance(gatilho, Horarios)
+        assert registrar.call_args.kwargs['parar'] is evento
+
+    @pytest.mark.database
+    def test_falha_sobe_para_o_agendador(self):
+        conn = MagicMock()
+        with patch('backend.database.get_db_connection', return_value=conn), \
+             patch('backend.database.release_connection') as release, \
+             patch.object(at, 'aplicar_retencao', side_effect=RuntimeError('lock timeout')):
+            with pytest.raises(RuntimeError):
+                at._retencao_access_log()
+        release.assert_called_once_with(conn)
@@ -0,0 +1,197 @@
+"""
+Testes do agendador unico dos jobs de background (backend.agendador).
+
+Cobertura:
+- gatilhos: intervalo, horarios fixos com dias da semana, uma vez
+- disparo com jitter e proximo horario
+- sobreposicao (max_concorrencia) e politica de disparo perdido
+- timeout e erro viram status no historico
+- job parado pelo Event sai do agendador
+- recuperacao do horario perdido com base no historico
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+from unittest.mock import MagicMock
+
+
+AGORA = datetime(2026, 10, 16, 15, 0)   # sexta-feira
+
+
+class _Relogio:
+    def __init__(self, agora=AGORA):
+        self.agora = agora
+
+    def __call__(self):
+        return self.agora
+
+    def avancar(self, **kw):
+        self.agora += timedelta(**kw)
+
+
+def _banco(ultimo_inicio=None):
+    """Conexao falsa: registra os INSERTs e responde a consulta do ultimo inicio."""
+    gravados = []
+    cursor = MagicMock()
+
+    def execute(sql, params=None):
+        if 'INSERT INTO agendador_execucoes' in sql:
+            gravados.append(params)
+        cursor.fetchone.return_value = (ultimo_inicio,)
+
+    cursor.execute.side_effect = execute
+    conn = MagicMock()
+    conn.cursor.return_value = cursor
+    return (lambda: conn), gravados
+
+
+@pytest.fixture
+def criar(monkeypatch):
+    from backend.agendador import Agendador
+    monkeypatch.setattr(Agendador, 'iniciar', lambda self: None)
+
+    def _criar(relogio=None, ultimo_inicio=None):
+        conectar, gravados = _banco(ultimo_inicio)
+        ag = Agendador(threads=0, relogio=relogio or _Relogio(), conectar=conectar)
+        ag.gravados = gravados
+        return ag
+    return _criar
+
+
+def _rodar_fila(ag):
+    """Executa o que o despachante enfileirou (no lugar do pool)."""
+    n = 0
+    while not ag._fila.empty():
+        ag.executar(*ag._fila.get_nowait())
+        n += 1
+    return n
+
+
+class TestGatilhos:
+    @pytest.mark.workers
+    def test_horarios_e_dias_da_semana(self):
+        from backend.agendador import Horarios
+        h = Horarios(['06:00', '18:00', 'lixo'])
+        assert h.proximo(AGORA) == AGORA.replace(hour=18)
+        assert h.anterior(AGORA) == AGORA.replace(hour=6)
+        segunda = Horarios(['08:00'], dias_semana=[0])
+        assert segunda.proximo(AGORA) == datetime(2026, 10, 19, 8, 0)
+        assert segunda.anterior(AGORA) == datetime(2026, 10, 12, 8, 0)
+
+    @pytest.mark.workers
+    def test_horarios_relidos_da_configuracao(self):
+        from backend.agendador import Horarios
+        cfg = {'horarios': ['16:00']}
+        h = Horarios(lambda: cfg['horarios'])
+        assert h.proximo(AGORA).hour == 16
+        cfg['horarios'] = ['17:30']
+        assert h.proximo(AGORA) == AGORA.replace(hour=17, minute=30)
+
+
+class TestDisparo:
+    @pytest.mark.workers
+    def test_intervalo_imediato_com_jitter(self, criar):
+        from backend.agendador import Intervalo
+        relogio = _Relogio()
+        ag = criar(relogio)
+        chamadas = []
+        job = ag.registrar('job', lambda: chamadas.append(1), Intervalo(300), imediato=True, jitter_seg=20)
+        assert AGORA <= job.proximo <= AGORA + timedelta(seconds=20)
+
+        relogio.avancar(seconds=20)
+        ag.despachar()
+        assert _rodar_fila(ag) == 1 and chamadas == [1]
+        assert job.previsto == relogio.agora + timedelta(seconds=300)
+        assert job.contagem['ok'] == 1
+        assert ag.gravados[-1][6] == 'ok'
+
+    @pytest.mark.workers
+    def test_ciclo_sobreposto_e_pulado(self, criar):
+        from backend.agendador import Intervalo
+        relogio = _Relogio()
+        ag = criar(relogio)
+        job = ag.registrar('job', lambda: None, Intervalo(60), imediato=True, jitter_seg=0)
+        ag.despachar()                      # ciclo 1 na fila (ainda nao terminou)
+        relogio.avancar(seconds=60)
+        ag.despachar()
+        assert ag._fila.qsize() == 1
+        assert job.contagem['sobreposto'] == 1
+        assert ag.gravados[-1][6] == 'sobreposto'
+
+    @pytest.mark.workers
+    def test_disparo_perdido_pular_ou_executar_uma_vez(self, criar):
+        from backend.agendador import Intervalo
+        relogio = _Relogio()
+        ag = criar(relogio)
+        pular = ag.registrar('pular', lambda: None, Intervalo(60), imediato=True,
+                             jitter_seg=0, perdidos='pular')
+        executar = ag.registrar('executar', lambda: None, Intervalo(60), imediato=True, jitter_seg=0)
+        relogio.avancar(minutes=30)         # processo parado por 30 ciclos
+        ag.despachar()
+        assert pular.contagem['perdido'] == 1
+        assert _rodar_fila(ag) == 1 and executar.contagem['ok'] == 1
+        assert executar.previsto == relogio.agora + timedelta(seconds=60)
+
+    @pytest.mark.workers
+    def test_uma_vez(self, criar):
+        from backend.agendador import UmaVez
+        ag = criar()
+        job = ag.registrar('inicial', lambda: None, UmaVez(), imediato=True, jitter_seg=0)
+        ag.despachar()
+        assert _rodar_fila(ag) == 1
+        assert job.proximo is None
+        ag.despachar()
+        assert _rodar_fila(ag) == 0
+
+
+class TestResultado:
+    @pytest.mark.workers
+    def test_erro_e_timeout_no_historico(self, criar):
+        from backend.agendador import Intervalo
+
+        def falha():
+            raise RuntimeError('banco fora')
+
+        ag = criar()
+        ag.registrar('falha', falha, Intervalo(60), imediato=True, jitter_seg=0)
+        ag.registrar('lento', lambda: time.sleep(0.02), Intervalo(60), imediato=True,
+                     jitter_seg=0, timeout_seg=0.001)
+        ag.despachar()
+        _rodar_fila(ag)
+        status = {g[0]: (g[6], g[7]) for g in ag.gravados}
+        assert status['falha'] == ('erro', 'banco fora')
+        assert status['lento'] == ('timeout', None)
+        assert ag.estado()['jobs']['lento']['ultima']['status'] == 'timeout'
+
+    @pytest.mark.workers
+    def test_job_parado_sai_do_agendador(self, criar):
+        from backend.agendador import Intervalo
+        ag = criar()
+        parar = threading.Event()
+        ag.registrar('job', lambda: None, Intervalo(60), imediato=True, jitter_seg=0, parar=parar)
+        parar.set()
+        ag.despachar()
+        assert _rodar_fila(ag) == 0
+        assert 'job' not in ag.estado()['jobs']
+
+
+class TestRecuperacao:
+    @pytest.mark.workers
+    def test_horario_perdido_na_troca_de_lider(self, criar):
+        from backend.agendador import Horarios
+        relogio = _Relogio(AGORA.replace(hour=6, minute=20))
+        ag = criar(relogio, ultimo_inicio=AGORA.replace(hour=6) - timedelta(days=1))
+        job = ag.registrar('relatorio', lambda: None, Horarios(['06:00', '18:00']), jitter_seg=0)
+        assert job.previsto == relogio.agora
+
+    @pytest.mark.workers
+    def test_horario_ja_executado_nao_recupera(self, criar):
+        from backend.agendador import Horarios
+        relogio = _Relogio(AGORA.replace(hour=6, minute=20))
+        ag = criar(relogio, ultimo_inicio=AGORA.replace(hour=6, minute=0, second=5))
+        job = ag.registrar('relatorio', lambda: None, Horarios(['06:00', '18:00']), jitter_seg=0)
+        assert job.previsto == AGORA.replace(hour=18)
+        # Sem historico (job novo) tambem nao recupera
+        ag2 = criar(relogio, ultimo_inicio=None)
+        assert ag2.registrar('novo', lambda: None, Horarios(['06:00']), jitter_seg=0).previsto.day == 17
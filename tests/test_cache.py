@@ -6,6 +6,17 @@ Cobertura:
 - cache_health: status quando ativo vs inativo
 - cache_get / cache_set: operacoes basicas
 - cache_route decorator: hit, miss, bypass POST, fallback
+- _LocalCache (L1): TTL, LRU, orcamento de bytes
+- single-flight: coalescencia de misses concorrentes
+- stale-while-revalidate e refresher proativo
+- geracoes de carga (ETL) e refresh por painel via registro de endpoints
+- canal SSE: notificacao de mudanca e assinatura por painel
+- ETag / If-None-Match: 304 para corpo inalterado
+- compressao do corpo guardado e Content-Encoding na resposta
+- metricas por key_prefix e exposicao Prometheus
+- chave por parametro de URL (view_args) e invalidacao por tag
+- tags em cache_set e invalidacao assincrona com tombstone
+- invalidacao de tags propagada ao L1 dos outros workers (pub/sub)
 """
 import pytest
 import json
@@ -98,3 +109,838 @@ class TestCacheDelete:
             from backend.cache import cache_delete
             result = cache_delete('key')
             assert result is None
+
+
+class TestLocalCache:
+    @pytest.mark.cache
+    def test_ttl_expirado(self):
+        from backend.cache import _LocalCache
+        l1 = _LocalCache(max_items=10, max_bytes=1024)
+        with patch('backend.cache.time.monotonic', return_value=100.0):
+            l1.set('k', b'{"a":1}', ttl=5)
+        with patch('backend.cache.time.monotonic', return_value=104.0):
+            assert l1.get('k') == b'{"a":1}'
+        with patch('backend.cache.time.monotonic', return_value=106.0):
+            assert l1.get('k') is None
+
+    @pytest.mark.cache
+    def test_lru_por_numero_de_itens(self):
+        from backend.cache import _LocalCache
+        l1 = _LocalCache(max_items=2, max_bytes=1024)
+        l1.set('a', b'1', ttl=60)
+        l1.set('b', b'2', ttl=60)
+        l1.get('a')                 # 'a' passa a ser o mais recente
+        l1.set('c', b'3', ttl=60)   # remove 'b'
+        assert l1.get('b') is None
+        assert l1.get('a') == b'1'
+        assert l1.get('c') == b'3'
+
+    @pytest.mark.cache
+    def test_orcamento_de_bytes(self):
+        from backend.cache import _LocalCache
+        l1 = _LocalCache(max_items=100, max_bytes=10)
+        l1.set('a', b'12345', ttl=60)
+        l1.set('b', b'12345', ttl=60)
+        l1.set('c', b'12345', ttl=60)
+        assert l1.stats()['bytes'] <= 10
+        assert l1.get('a') is None
+        l1.set('grande', b'x' * 11, ttl=60)
+        assert l1.get('grande') is None
+
+    @pytest.mark.cache
+    def test_delete_pattern(self):
+        from backend.cache import _LocalCache
+        l1 = _LocalCache(max_items=10, max_bytes=1024)
+        l1.set('painel4:dashboard', b'1', ttl=60)
+        l1.set('painel4:setores', b'2', ttl=60)
+        l1.set('painel10:dashboard', b'3', ttl=60)
+        assert l1.delete_pattern('painel4:*') == 2
+        assert l1.get('painel10:dashboard') == b'3'
+
+
+class TestCacheRoute:
+    @pytest.fixture(autouse=True)
+    def _limpa_l1(self):
+        from backend.cache import _l1
+        _l1.clear()
+        yield
+        _l1.clear()
+
+    def _endpoint(self, chamadas, status=200):
+        from flask import jsonify
+        from backend.cache import cache_route
+
+        @cache_route(ttl=60, key_prefix='teste:l1', vary_by_user=False)
+        def handler():
+            chamadas.append(1)
+            return jsonify({'n': len(chamadas)}), status
+        return handler
+
+    @pytest.mark.cache
+    def test_l1_serve_sem_redis(self, app):
+        chamadas = []
+        handler = self._endpoint(chamadas)
+        with patch('backend.cache._redis_client', None):
+            with app.test_request_context('/api/teste'):
+                r1 = handler()
+            with app.test_request_context('/api/teste'):
+                r2 = handler()
+        assert len(chamadas) == 1
+        assert r1.headers['X-Cache'] == 'MISS'
+        assert r2.headers['X-Cache'] == 'HIT'
+        assert r2.get_json() == {'n': 1}
+
+    @pytest.mark.cache
+    def test_miss_grava_corpo_serializado_no_redis(self, app, mock_redis):
+        chamadas = []
+        handler = self._endpoint(chamadas)
+        with patch('backend.cache._redis_client', mock_redis):
+            with app.test_request_context('/api/teste'):
+                handler()
+        from backend.cache import _decode
+        key, ttl, body = mock_redis.setex.call_args[0]
+        assert key == 'teste:l1'
+        assert ttl == 60
+        assert json.loads(_decode(body)) == {'n': 1}
+
+    @pytest.mark.cache
+    def test_hit_redis_promove_para_l1(self, app, mock_redis):
+        mock_redis.get.return_value = '{"n": 42}'
+        mock_redis.pttl.return_value = 30000
+        chamadas = []
+        handler = self._endpoint(chamadas)
+        with patch('backend.cache._redis_client', mock_redis):
+            with app.test_request_context('/api/teste'):
+                r1 = handler()
+            with app.test_request_context('/api/teste'):
+                r2 = handler()
+        assert chamadas == []
+        assert r1.get_json() == {'n': 42}
+        assert r2.get_json() == {'n': 42}
+        assert mock_redis.get.call_count == 1
+
+    @pytest.mark.cache
+    def test_erro_nao_e_cacheado(self, app):
+        chamadas = []
+        handler = self._endpoint(chamadas, status=500)
+        with patch('backend.cache._redis_client', None):
+            with app.test_request_context('/api/teste'):
+                handler()
+            with app.test_request_context('/api/teste'):
+                handler()
+        assert len(chamadas) == 2
+
+
+class TestSingleFlight:
+    @pytest.fixture(autouse=True)
+    def _limpa_l1(self):
+        from backend.cache import _l1
+        _l1.clear()
+        yield
+        _l1.clear()
+
+    @pytest.mark.cache
+    def test_misses_concorrentes_executam_handler_uma_vez(self, app):
+        import threading
+        import time as _time
+        from flask import jsonify
+        from backend.cache import cache_route
+
+        chamadas = []
+
+        @cache_route(ttl=60, key_prefix='teste:sf', vary_by_user=False)
+        def handler():
+            chamadas.append(1)
+            _time.sleep(0.2)
+            return jsonify({'ok': True})
+
+        resultados = []
+
+        def req():
+            with app.test_request_context('/api/teste'):
+                resultados.append(handler().get_json())
+
+        with patch('backend.cache._redis_client', None):
+            threads = [threading.Thread(target=req) for _ in range(6)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        assert len(chamadas) == 1
+        assert resultados == [{'ok': True}] * 6
+
+    @pytest.mark.cache
+    def test_lock_de_outro_worker_serve_copia_velha(self, app, mock_redis):
+        from flask import jsonify
+        from backend.cache import cache_route, _l1
+
+        chamadas = []
+
+        @cache_route(ttl=60, key_prefix='teste:sf-stale', vary_by_user=False)
+        def handler():
+            chamadas.append(1)
+            return jsonify({'novo': True})
+
+        _l1.set('teste:sf-stale', b'{"velho": true}', ttl=60)
+        mock_redis.set.return_value = None   # lock ja pertence a outro worker
+        with patch('backend.cache._redis_client', mock_redis), \
+             patch('backend.cache._l1.get', return_value=None):
+            with app.test_request_context('/api/teste'):
+                resp = handler()
+
+        assert chamadas == []
+        assert resp.headers['X-Cache'] == 'STALE'
+        assert resp.get_json() == {'velho': True}
+
+    @pytest.mark.cache
+    def test_lock_de_outro_worker_nao_serve_copia_fora_da_janela(self, app, mock_redis):
+        from flask import jsonify
+        from backend.cache import cache_route, _l1
+
+        chamadas = []
+
+        @cache_route(ttl=60, key_prefix='teste:sf-velho', vary_by_user=False)
+        def handler():
+            chamadas.append(1)
+            return jsonify({'novo': True})
+
+        # stale_ttl=0: a copia morreu junto com o ttl, mesmo sem ter sido despejada
+        with patch('backend.cache.time.monotonic', return_value=0.0):
+            _l1.set('teste:sf-velho', b'{"velho": true}', ttl=1)
+        mock_redis.set.return_value = None   # lock ja pertence a outro worker
+        espera = MagicMock(return_value=None)
+        with patch('backend.cache._redis_client', mock_redis), \
+             patch('backend.cache._wait_remote', espera):
+            with app.test_request_context('/api/teste'):
+                resp = handler()
+
+        espera.assert_called_once()
+        assert chamadas == [1]
+        assert resp.headers['X-Cache'] == 'MISS'
+        assert resp.get_json() == {'novo': True}
+
+
+class TestStaleWhileRevalidate:
+    @pytest.fixture(autouse=True)
+    def _limpa_l1(self):
+        from backend.cache import _l1
+        _l1.clear()
+        yield
+        _l1.clear()
+
+    def _aguarda_background(self, key):
+        import time as _time
+        from backend.cache import _inflight
+        for _ in range(100):
+            if key not in _inflight:
+                return
+            _time.sleep(0.01)
+
+    @pytest.mark.cache
+    def test_entrada_stale_e_servida_e_recalculada(self, app):
+        from flask import jsonify
+        from backend.cache import cache_route, _l1
+
+        chamadas = []
+
+        @cache_route(ttl=60, key_prefix='teste:swr', vary_by_user=False, stale_ttl=120)
+        def handler():
+            chamadas.append(1)
+            return jsonify({'versao': 2})
+
+        # Entrada ja expirada (ttl=0) mas dentro da janela stale
+        _l1.set('teste:swr', b'{"versao": 1}', ttl=0, stale_ttl=120)
+        with patch('backend.cache._redis_client', None):
+            with app.test_request_context('/api/teste'):
+                resp = handler()
+            assert resp.headers['X-Cache'] == 'STALE'
+            assert resp.get_json() == {'versao': 1}
+
+            self._aguarda_background('teste:swr')
+            assert chamadas == [1]
+
+            with app.test_request_context('/api/teste'):
+                resp = handler()
+        assert resp.headers['X-Cache'] == 'HIT'
+        assert resp.get_json() == {'versao': 2}
+
+    @pytest.mark.cache
+    def test_fora_da_janela_stale_executa_handler(self, app):
+        from flask import jsonify
+        from backend.cache import cache_route, _l1
+
+        chamadas = []
+
+        @cache_route(ttl=60, key_prefix='teste:swr-velho', vary_by_user=False, stale_ttl=5)
+        def handler():
+            chamadas.append(1)
+            return jsonify({'versao': 2})
+
+        with patch('backend.cache.time.monotonic', return_value=0.0):
+            _l1.set('teste:swr-velho', b'{"versao": 1}', ttl=1, stale_ttl=5)
+        with patch('backend.cache._redis_client', None):
+            with app.test_request_context('/api/teste'):
+                resp = handler()
+        assert resp.headers['X-Cache'] == 'MISS'
+        assert chamadas == [1]
+
+    @pytest.mark.cache
+    def test_redis_stale_ttl_fisico(self, app, mock_redis):
+        from flask import jsonify
+        from backend.cache import cache_route
+
+        @cache_route(ttl=60, key_prefix='teste:swr-redis', vary_by_user=False, stale_ttl=30)
+        def handler():
+            return jsonify({'ok': True})
+
+        with patch('backend.cache._redis_client', mock_redis):
+            with app.test_request_context('/api/teste'):
+                handler()
+        assert mock_redis.setex.call_args[0][1] == 90
+
+    @pytest.mark.cache
+    def test_refresher_reaquece_chaves_quentes(self, app):
+        from flask import jsonify
+        from backend.cache import cache_route, _refresh_hot_keys, _hot_keys, _l1, _decode
+
+        chamadas = []
+
+        @cache_route(ttl=10, key_prefix='teste:hot', vary_by_user=False)
+        def handler():
+            chamadas.append(1)
+            return jsonify({'n': len(chamadas)})
+
+        _hot_keys.clear()
+        with patch('backend.cache._redis_client', None), \
+             patch('backend.cache.CACHE_PROACTIVE_REFRESH', True), \
+             patch('backend.cache.CACHE_REFRESH_AHEAD', 15):
+            with app.test_request_context('/api/teste?x=1'):
+                handler()
+            assert 'teste:hot' in _hot_keys
+            assert _refresh_hot_keys(app) == 1
+            self._aguarda_background('teste:hot')
+        assert chamadas == [1, 1]
+        assert _decode(_l1.get('teste:hot')) == b'{"n":2}\n'
+        _hot_keys.clear()
+
+
+class TestGeracoesEtl:
+    @pytest.fixture(autouse=True)
+    def _limpa(self):
+        from backend.cache import _l1, _generations
+        _l1.clear()
+        _generations.clear()
+        yield
+        _l1.clear()
+        _generations.clear()
+
+    @pytest.mark.cache
+    def test_nova_carga_troca_a_chave(self, app):
+        from flask import jsonify
+        from backend.cache import cache_route, cache_bump_generation
+
+        chamadas = []
+
+        @cache_route(ttl=600, key_prefix='teste:gen', vary_by_user=False,
+                     depends_on=('tabela_etl',))
+        def handler():
+            chamadas.append(1)
+            return jsonify({'carga': len(chamadas)})
+
+        with patch('backend.cache._redis_client', None):
+            with app.test_request_context('/api/teste'):
+                handler()
+            with app.test_request_context('/api/teste'):
+                assert handler().headers['X-Cache'] == 'HIT'
+
+            assert cache_bump_generation(['tabela_etl']) == {'tabela_etl': 1}
+
+            with app.test_request_context('/api/teste'):
+                resp = handler()
+        assert resp.headers['X-Cache'] == 'MISS'
+        assert resp.get_json() == {'carga': 2}
+
+    @pytest.mark.cache
+    def test_bump_usa_redis(self, mock_redis):
+        from backend.cache import cache_bump_generation
+        mock_redis.hincrby.return_value = 7
+        with patch('backend.cache._redis_client', mock_redis):
+            assert cache_bump_generation(['t1']) == {'t1': 7}
+        mock_redis.hincrby.assert_called_once_with('cache:geracoes', 't1', 1)
+
+    @pytest.mark.cache
+    def test_refresh_prefix_recalcula_variantes(self, app):
+        import time as _time
+        from flask import jsonify, request
+        from backend.cache import cache_route, cache_refresh_prefix, _l1, _inflight
+
+        chamadas = []
+
+        @cache_route(ttl=60, key_prefix='painel999:dados', vary_by_user=False, vary_by_query=True)
+        def handler():
+            chamadas.append(request.args.get('setor'))
+            return jsonify({'setor': request.args.get('setor'), 'n': len(chamadas)})
+
+        with patch('backend.cache._redis_client', None):
+            for setor in ('A', 'B'):
+                with app.test_request_context(f'/api/painel999/dados?setor={setor}'):
+                    handler()
+            assert cache_refresh_prefix(app, 'painel999') == {'agendados': 2, 'removidos': 0}
+            for _ in range(100):
+                if not any(k.startswith('painel999') for k in _inflight):
+                    break
+                _time.sleep(0.01)
+            with app.test_request_context('/api/painel999/dados?setor=A'):
+                resp = handler()
+
+        assert sorted(chamadas) == ['A', 'A', 'B', 'B']
+        assert resp.headers['X-Cache'] == 'HIT'
+        assert resp.get_json()['n'] >= 3
+
+
+class TestCanalStream:
+    @pytest.fixture(autouse=True)
+    def _limpa(self):
+        from backend.cache import _digests
+        from backend import stream
+        _digests.clear()
+        stream._canais.clear()
+        with patch('backend.stream._iniciar_produtor'), \
+             patch('backend.stream.SSE_DEBOUNCE', 0), \
+             patch('backend.stream.SSE_HEARTBEAT', 0.05), \
+             patch('backend.stream.SSE_MAX_CONEXOES', 1):
+            yield
+        _digests.clear()
+        stream._canais.clear()
+
+    @pytest.mark.cache
+    def test_notifica_apenas_quando_conteudo_muda(self):
+        from backend.cache import _notify_change, _change_listeners
+        recebidos = []
+        _change_listeners.append(recebidos.append)
+        try:
+            _notify_change('painel4:dados', b'{"a": 1, "timestamp": "2024-01-01T10:00:00"}')
+            _notify_change('painel4:dados', b'{"a": 1, "timestamp": "2024-01-01T10:00:30"}')
+            _notify_change('painel4:dados', b'{"a": 2, "timestamp": "2024-01-01T10:01:00"}')
+        finally:
+            _change_listeners.remove(recebidos.append)
+        assert recebidos == ['painel4:dados', 'painel4:dados']
+
+    @pytest.mark.cache
+    def test_painel_da_chave(self):
+        from backend.stream import painel_da_chave
+        assert painel_da_chave('painel4:dashboard:g3') == 'painel4'
+        assert painel_da_chave('p41:setores') == 'painel41'
+        assert painel_da_chave('perm:12') is None
+
+    @pytest.mark.cache
+    def test_assinatura_recebe_update_e_libera_vaga(self, app):
+        from backend import stream
+
+        assinatura = stream.assinar(app, 'painel998')
+        assert assinatura is not None
+        assert stream.assinar(app, 'painel998') is None      # limite de 1 conexao
+
+        eventos = assinatura.eventos()
+        assert next(eventos).startswith('retry:')
+        assert 'event: hello' in next(eventos)
+        assert next(eventos) == ': ping\n\n'
+
+        stream._on_cache_change('painel998:dados:g1')
+        update = next(eventos)
+        assert 'event: update' in update
+        assert json.loads(update.split('data: ')[1])['endpoints'] == ['painel998:dados']
+
+        assinatura.encerrar()
+        assinatura.encerrar()                                # idempotente
+        assert stream._conexoes == 0
+        assert stream._canais['painel998'].assinantes == 0
+
+
+class TestEtagCondicional:
+    @pytest.fixture(autouse=True)
+    def _limpa(self):
+        from backend.cache import _l1
+        _l1.clear()
+        yield
+        _l1.clear()
+
+    @pytest.mark.cache
+    def test_if_none_match_responde_304(self, app):
+        from flask import jsonify
+        from backend.cache import cache_route
+
+        @cache_route(ttl=60, key_prefix='teste:etag', vary_by_user=False)
+        def handler():
+            return jsonify({'leitos': 42})
+
+        with patch('backend.cache._redis_client', None):
+            with app.test_request_context('/api/teste'):
+                miss = handler()
+            etag = miss.headers['ETag']
+            assert miss.status_code == 200 and etag
+
+            with app.test_request_context('/api/teste', headers={'If-None-Match': etag}):
+                resp = handler()
+            assert resp.status_code == 304
+            assert resp.headers['ETag'] == etag
+            assert resp.headers['X-Cache'] == 'HIT'
+
+            with app.test_request_context('/api/teste', headers={'If-None-Match': '"outro"'}):
+                resp = handler()
+            assert resp.status_code == 200
+            assert resp.get_json() == {'leitos': 42}
+
+    @pytest.mark.cache
+    def test_resposta_nao_cacheavel_sem_etag(self, app):
+        from flask import jsonify
+        from backend.cache import cache_route
+
+        @cache_route(ttl=60, key_prefix='teste:etag-erro', vary_by_user=False)
+        def handler():
+            return jsonify({'error': 'falhou'}), 500
+
+        with patch('backend.cache._redis_client', None):
+            with app.test_request_context('/api/teste'):
+                resp = handler()
+        assert resp.status_code == 500
+        assert 'ETag' not in resp.headers
+
+
+class TestCompressao:
+    @pytest.fixture(autouse=True)
+    def _limpa(self):
+        from backend.cache import _l1
+        _l1.clear()
+        yield
+        _l1.clear()
+
+    def _endpoint(self, n):
+        from flask import jsonify
+        from backend.cache import cache_route
+
+        @cache_route(ttl=60, key_prefix=f'teste:gz{n}', vary_by_user=False)
+        def handler():
+            return jsonify({'leitos': [{'id': i, 'status': 'ocupado'} for i in range(n)]})
+        return handler
+
+    @pytest.mark.cache
+    def test_encode_decode(self):
+        from backend.cache import _encode, _decode
+        grande = b'{"x": "' + b'a' * 5000 + b'"}'
+        assert _encode(b'{}') == b'j{}'
+        assert _encode(grande)[:1] == b'g'
+        assert len(_encode(grande)) < len(grande)
+        assert _decode(_encode(grande)) == grande
+        assert _decode(b'{"legado": 1}') == b'{"legado": 1}'
+
+    @pytest.mark.cache
+    def test_hit_servido_comprimido_quando_aceito(self, app):
+        import gzip
+        handler = self._endpoint(500)
+        with patch('backend.cache._redis_client', None):
+            with app.test_request_context('/api/teste'):
+                handler()
+            with app.test_request_context('/api/teste', headers={'Accept-Encoding': 'gzip, deflate'}):
+                resp = handler()
+        assert resp.headers['X-Cache'] == 'HIT'
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in resp.headers['Vary']
+        assert len(json.loads(gzip.decompress(resp.get_data()))['leitos']) == 500
+
+    @pytest.mark.cache
+    def test_cliente_sem_gzip_recebe_corpo_descomprimido(self, app):
+        handler = self._endpoint(500)
+        with patch('backend.cache._redis_client', None):
+            with app.test_request_context('/api/teste', headers={'Accept-Encoding': 'gzip'}):
+                comprimida = handler()
+            with app.test_request_context('/api/teste'):
+                resp = handler()
+        assert 'Content-Encoding' not in resp.headers
+        assert len(resp.get_json()['leitos']) == 500
+        # Representacoes diferentes, ETags diferentes
+        assert resp.headers['ETag'] != comprimida.headers['ETag']
+
+
+class TestMetricas:
+    @pytest.fixture(autouse=True)
+    def _limpa(self):
+        from backend.cache import _l1
+        _l1.clear()
+        yield
+        _l1.clear()
+
+    @pytest.mark.cache
+    def test_conta_resultados_por_prefixo(self, app):
+        from flask import jsonify
+        from backend.cache import cache_route, cache_metrics
+
+        @cache_route(ttl=60, key_prefix='teste:metricas', vary_by_user=False)
+        def handler():
+            return jsonify({'ok': True})
+
+        with patch('backend.cache._redis_client', None):
+            with app.test_request_context('/api/teste'):
+                etag = handler().headers['ETag']
+            with app.test_request_context('/api/teste'):
+                handler()
+            with app.test_request_context('/api/teste', headers={'If-None-Match': etag}):
+                handler()
+
+        m = cache_metrics()['rotas']['teste:metricas']
+        assert (m['miss'], m['hit'], m['not_modified']) == (1, 2, 1)
+        assert m['compute']['count'] == 1
+        assert m['payload_bytes'] > 0 and m['ttl'] == 60
+
+    @pytest.mark.cache
+    def test_render_prometheus(self, app):
+        from flask import jsonify
+        from backend.cache import cache_route
+        from backend.metrics import render_prometheus
+
+        @cache_route(ttl=30, key_prefix='teste:prom', vary_by_user=False)
+        def handler():
+            return jsonify({'ok': True})
+
+        with patch('backend.cache._redis_client', None):
+            with app.test_request_context('/api/teste'):
+                handler()
+        with patch('backend.database._connection_pool', None):
+            texto = render_prometheus()
+
+        assert '# TYPE painel_cache_requests_total counter' in texto
+        assert 'painel_cache_requests_total{prefix="teste:prom",result="miss"} 1' in texto
+        assert 'painel_cache_compute_seconds_bucket{prefix="teste:prom",le="+Inf"} 1' in texto
+        assert 'painel_db_pool_up 0' in texto
+        assert texto.count('# TYPE painel_cache_requests_total') == 1
+
+    @pytest.mark.cache
+    def test_render_prometheus_multi_worker_leva_pid(self):
+        import os
+        from backend.metrics import render_prometheus
+        with patch('backend.metrics.METRICAS_LABEL_WORKER', True), \
+             patch('backend.database._connection_pool', None):
+            texto = render_prometheus()
+        assert 'painel_db_pool_up{worker="%d"} 0' % os.getpid() in texto
+        assert all('worker="' in linha for linha in texto.splitlines() if not linha.startswith('#'))
+
+    @pytest.mark.cache
+    def test_histogram_buckets_cumulativos(self):
+        from backend.metrics import Histogram
+        h = Histogram(buckets=(0.1, 1.0))
+        for v in (0.05, 0.5, 0.7, 5):
+            h.observe(v)
+        snap = h.snapshot()
+        assert snap['buckets'] == [(0.1, 1), (1.0, 3), ('+Inf', 4)]
+        assert snap['count'] == 4
+
+
+class TestChavePorPathETags:
+    @pytest.fixture(autouse=True)
+    def _limpa(self):
+        from backend.cache import _l1, _tag_index
+        _l1.clear()
+        _tag_index.clear()
+        yield
+        _l1.clear()
+        _tag_index.clear()
+
+    def _endpoint(self, chamadas, **kwargs):
+        from flask import jsonify
+        from backend.cache import cache_route
+
+        @cache_route(ttl=60, key_prefix='teste:pac', vary_by_user=False, **kwargs)
+        def handler(nr_atendimento):
+            chamadas.append(nr_atendimento)
+            return jsonify({'nr': nr_atendimento})
+        return handler
+
+    def _chamar(self, app, handler, nr):
+        with app.test_request_context(f'/api/teste/paciente/{nr}'):
+            from flask import request
+            request.view_args = {'nr_atendimento': nr}
+            return handler(nr_atendimento=nr)
+
+    @pytest.mark.cache
+    def test_parametro_da_url_separa_entradas(self, app):
+        chamadas = []
+        handler = self._endpoint(chamadas)
+        with patch('backend.cache._redis_client', None):
+            assert self._chamar(app, handler, 1).get_json() == {'nr': 1}
+            assert self._chamar(app, handler, 2).get_json() == {'nr': 2}
+            assert self._chamar(app, handler, 1).headers['X-Cache'] == 'HIT'
+        assert chamadas == [1, 2]
+
+    @pytest.mark.cache
+    def test_build_key_com_view_args(self):
+        from backend.cache import _build_key
+        assert _build_key('p51:pac', view_args={'nr_atendimento': 123}) == 'p51:pac:123'
+        chave = _build_key('p31:prev', view_args={'nome': 'a b/c'})
+        assert chave.startswith('p31:prev:p') and '/' not in chave
+
+    @pytest.mark.cache
+    def test_invalidacao_por_tag_remove_apenas_a_entidade(self, app):
+        from backend.cache import cache_invalidate_tags
+        chamadas = []
+        handler = self._endpoint(chamadas, tags=('atendimento:{nr_atendimento}',))
+        with patch('backend.cache._redis_client', None):
+            self._chamar(app, handler, 1)
+            self._chamar(app, handler, 2)
+            assert cache_invalidate_tags(['atendimento:1']) == 1
+            assert self._chamar(app, handler, 1).headers['X-Cache'] == 'MISS'
+            assert self._chamar(app, handler, 2).headers['X-Cache'] == 'HIT'
+        assert chamadas == [1, 2, 1]
+
+    @pytest.mark.cache
+    def test_tags_indexadas_no_redis(self, app, mock_redis):
+        from backend.cache import cache_invalidate_tags
+        mock_redis.get.return_value = None
+        mock_redis.set.return_value = True
+        handler = self._endpoint([], tags=('atendimento:{nr_atendimento}',))
+        with patch('backend.cache._redis_client', mock_redis):
+            self._chamar(app, handler, 7)
+            pipe = mock_redis.pipeline.return_value
+            assert pipe.eval.call_args[0][2:4] == ('cache:tag:atendimento:7', 'teste:pac:7')
+            mock_redis.smembers.return_value = {'teste:pac:7'}
+            assert cache_invalidate_tags(['atendimento:7']) == 1
+        mock_redis.delete.assert_any_call('teste:pac:7')
+
+
+class TestInvalidacaoAssincrona:
+    @pytest.fixture(autouse=True)
+    def _limpa(self):
+        from backend.cache import _l1, _tag_index, _tombstones
+        _l1.clear()
+        _tag_index.clear()
+        _tombstones.clear()
+        yield
+        _l1.clear()
+        _tag_index.clear()
+        _tombstones.clear()
+
+    @pytest.mark.cache
+    def test_cache_set_indexa_tags(self, mock_redis):
+        from backend.cache import cache_set, _tag_index
+        with patch('backend.cache._redis_client', mock_redis):
+            assert cache_set('painel28:fila', {'x': 1}, ttl=30, tags=['sentir_agir:fila'])
+        assert 'painel28:fila' in _tag_index['sentir_agir:fila']
+        pipe = mock_redis.pipeline.return_value
+        assert pipe.eval.call_args[0][2:4] == ('cache:tag:sentir_agir:fila', 'painel28:fila')
+
+    @pytest.mark.cache
+    def test_async_limpa_l1_na_hora_e_redis_em_background(self, mock_redis):
+        from backend.cache import (_l1, _store, _lookup, _tombstones,
+                                   cache_invalidate_tags_async, _get_invalidate_pool)
+        with patch('backend.cache._redis_client', mock_redis), \
+             patch('backend.cache._body_redis', lambda: mock_redis):
+            _store('painel33:responsaveis', b'{"a":1}', 60, tags=('painel33:responsaveis',))
+            mock_redis.smembers.return_value = {'painel33:responsaveis'}
+            evento = __import__('threading').Event()
+            _get_invalidate_pool().submit(evento.wait, 5)   # segura a fila
+            assert cache_invalidate_tags_async(['painel33:responsaveis']) == 1
+            assert _l1.get('painel33:responsaveis') is None
+            # Enquanto o Redis nao foi limpo, a copia antiga nao volta ao L1
+            mock_redis.get.reset_mock()
+            assert _lookup('painel33:responsaveis', 60) == (None, False)
+            mock_redis.get.assert_not_called()
+            evento.set()
+            _get_invalidate_pool().submit(lambda: None).result(timeout=5)
+        mock_redis.delete.assert_any_call('painel33:responsaveis')
+        assert 'painel33:responsaveis' not in _tombstones
+
+    @pytest.mark.cache
+    def test_store_remove_tombstone(self):
+        import time
+        from backend.cache import _store, _tombstones, _tombstoned
+        _tombstones['k'] = time.monotonic() + 60
+        with patch('backend.cache._redis_client', None), \
+             patch('backend.cache._body_redis', lambda: None):
+            _store('k', b'{}', 60)
+        assert not _tombstoned('k')
+
+    @pytest.mark.cache
+    def test_async_sem_redis_nao_agenda(self):
+        from backend.cache import _store, _tombstones, cache_invalidate_tags_async
+        with patch('backend.cache._redis_client', None), \
+             patch('backend.cache._body_redis', lambda: None):
+            _store('p28:x', b'{}', 60, tags=('sentir_agir:fila',))
+            assert cache_invalidate_tags_async(['sentir_agir:fila']) == 1
+        assert _tombstones == {}
+
+
+class TestInvalidacaoEntreWorkers:
+    @pytest.fixture(autouse=True)
+    def _limpa(self):
+        from backend.cache import _l1, _tag_index
+        _l1.clear()
+        _tag_index.clear()
+        yield
+        _l1.clear()
+        _tag_index.clear()
+
+    @pytest.mark.cache
+    def test_invalidacao_publica_chaves(self, mock_redis):
+        from backend.cache import _invalidate_remote, _INVALIDATE_CHANNEL
+        mock_redis.smembers.return_value = {'painel30:tratativa:7'}
+        with patch('backend.cache._redis_client', mock_redis), \
+             patch('backend.cache.CACHE_INVALIDACAO_PUBSUB', True):
+            _invalidate_remote(['tratativa:7'])
+        canal, mensagem = mock_redis.publish.call_args[0]
+        assert canal == _INVALIDATE_CHANNEL
+        assert json.loads(mensagem)['chaves'] == ['painel30:tratativa:7']
+
+    @pytest.mark.cache
+    def test_aviso_de_outro_processo_limpa_l1(self):
+        import os
+        from backend.cache import _l1, _tag_index, _aplicar_invalidacao
+        _l1.set('a', b'1', 60)
+        _l1.set('b', b'2', 60)
+        _l1.set('c', b'3', 60)
+        _tag_index['tratativa:7'] = {'b'}
+        aviso = {'pid': os.getpid() + 1, 'tags': ['tratativa:7'], 'chaves': ['a']}
+        assert _aplicar_invalidacao(json.dumps(aviso)) == 2
+        assert _l1.get('a') is None and _l1.get('b') is None
+        assert _l1.get('c') is not None
+        # O proprio aviso (mesmo pid) e ignorado: o L1 local ja foi limpo
+        assert _aplicar_invalidacao(json.dumps(dict(aviso, pid=os.getpid(), chaves=['c']))) == 0
+
+    @pytest.mark.cache
+    def test_assinante_aplica_e_descarta_apos_queda(self):
+        import os
+        import threading
+        from backend.cache import _l1, _tag_index, _escutar_invalidacoes
+        _l1.set('a', b'1', 60)
+        _l1.set('t', b'2', 60)
+        _tag_index['x'] = {'t'}
+        parar = threading.Event()
+        aviso = {'type': 'message', 'data': json.dumps({'pid': os.getpid() + 1, 'tags': [], 'chaves': ['a']})}
+        mensagens = [aviso, ConnectionError('redis caiu')]
+
+        def get_message(timeout):
+            if not mensagens:
+                parar.set()
+                return None
+            item = mensagens.pop(0)
+            if isinstance(item, Exception):
+                raise item
+            return item
+
+        client = MagicMock()
+        client.pubsub.return_value.get_message.side_effect = get_message
+        with patch('backend.cache.time.sleep'):
+            _escutar_invalidacoes(client, parar)
+        assert _l1.get('a') is None
+        assert _l1.get('t') is None and _tag_index == {}   # resubscreveu: descarta com tag
+        assert client.pubsub.call_count == 2
+
+    @pytest.mark.cache
+    def test_multi_worker_sem_redis_nao_guarda_com_tag_no_l1(self):
+        from backend.cache import _l1, _store
+        with patch('backend.cache._redis_client', None), \
+             patch('backend.cache._body_redis', lambda: None), \
+             patch('backend.cache._MULTI_WORKER', True):
+            _store('p28:fila', b'{}', 60, tags=('sentir_agir:fila',))
+            _store('p2:geral', b'{}', 60)
+        assert _l1.get('p28:fila') is None
+        assert _l1.get('p2:geral') is not None
@@ -0,0 +1,220 @@
+"""
+Testes do pool de conexoes bloqueante (backend.database).
+
+Cobertura:
+- limite de conexoes e espera com timeout (sem conexao direta extra)
+- ordem FIFO na entrega de conexoes devolvidas
+- sub-pools web / worker conforme o contexto da thread
+- validacao de conexao ociosa e descarte de conexao quebrada
+- pool_health com sub-pools e histograma de espera
+- instrumentacao de consultas: fingerprint, agregado, slow-query e EXPLAIN
+  do plano generico (sem ANALYZE e sem os valores dos parametros)
+"""
+import threading
+import time
+import pytest
+from unittest.mock import patch, MagicMock
+
+
+def _conexao():
+    conn = MagicMock()
+    conn.closed = 0
+    return conn
+
+
+@pytest.fixture
+def subpool():
+    from backend.database import _SubPool
+    return _SubPool('teste', 0, 1, _conexao)
+
+
+class TestSubPool:
+    @pytest.mark.database
+    def test_timeout_quando_esgotado(self, subpool):
+        from backend.database import PoolTimeout
+        subpool.getconn()
+        with pytest.raises(PoolTimeout):
+            subpool.getconn(timeout=0.05)
+        assert subpool.stats()['timeouts'] == 1
+        assert subpool.stats()['opened'] == 1
+
+    @pytest.mark.database
+    def test_devolucao_atende_fila_em_ordem(self, subpool):
+        conn = subpool.getconn()
+        ordem = []
+
+        def esperar(nome):
+            c = subpool.getconn(timeout=2)
+            ordem.append(nome)
+            subpool.putconn(c)
+
+        threads = []
+        for nome in ('a', 'b', 'c'):
+            t = threading.Thread(target=esperar, args=(nome,))
+            t.start()
+            threads.append(t)
+            while subpool.stats()['waiting'] < len(threads):
+                time.sleep(0.005)
+        subpool.putconn(conn)
+        for t in threads:
+            t.join(2)
+        assert ordem == ['a', 'b', 'c']
+        assert subpool.stats()['opened'] == 1
+        assert subpool.espera.snapshot()['count'] == 4
+
+    @pytest.mark.database
+    def test_conexao_quebrada_libera_vaga(self, subpool):
+        conn = subpool.getconn()
+        subpool.putconn(conn, close=True)
+        assert subpool.stats()['used'] == 0
+        assert subpool.getconn(timeout=0.05) is not conn
+
+    @pytest.mark.database
+    def test_ociosa_antiga_e_validada(self, subpool):
+        conn = subpool.getconn()
+        conn.cursor.return_value.execute.side_effect = Exception('server closed')
+        subpool.putconn(conn)
+        with patch('backend.database.POOL_IDLE_CHECK', 0):
+            nova = subpool.getconn()
+        assert nova is not conn
+        assert subpool.stats()['discarded'] == 1
+
+
+class TestBlockingPool:
+    @pytest.mark.database
+    def test_subpool_por_contexto(self, app):
+        from backend.database import BlockingConnectionPool
+        with patch('backend.database.psycopg2.connect', side_effect=lambda **kw: _conexao()):
+            pool = BlockingConnectionPool(0, 4, 1)
+            with app.test_request_context('/api/teste'):
+                sp, _ = pool.getconn()
+            assert sp.nome == 'web'
+            # Threads em background nao tem contexto de requisicao
+            nomes = []
+            t = threading.Thread(target=lambda: nomes.append(pool.getconn()[0].nome))
+            t.start()
+            t.join(2)
+            assert nomes == ['worker']
+        assert pool.subpools['web'].maxconn == 3
+
+    @pytest.mark.database
+    def test_pool_esgotado_nao_abre_conexao_extra(self):
+        from backend.database import BlockingConnectionPool, PoolTimeout, pool_health
+        with patch('backend.database.psycopg2.connect', side_effect=lambda **kw: _conexao()) as connect:
+            pool = BlockingConnectionPool(0, 2, 1)
+            sp, conn = pool.getconn('worker')
+            with pytest.raises(PoolTimeout):
+                pool.getconn('worker', timeout=0.05)
+            assert connect.call_count == 1
+            with patch('backend.database._connection_pool', pool):
+                saude = pool_health()
+                assert saude['subpools']['worker']['timeouts'] == 1
+                sp.putconn(conn)
+                assert pool_health()['available'] == 1
+
+
+class _CursorFalso:
+    """Base minima no formato do cursor psycopg2."""
+
+    def __init__(self, rowcount=3, demora=0.0, falha=None):
+        self.rowcount = rowcount
+        self.demora = demora
+        self.falha = falha
+
+    def execute(self, query, vars=None):
+        time.sleep(self.demora)
+        if self.falha:
+            raise self.falha
+
+    def mogrify(self, query, vars=None):
+        return (query % tuple(repr(v) for v in vars)).encode()
+
+
+class TestQueryStats:
+    @pytest.fixture(autouse=True)
+    def _limpa(self):
+        from backend.query_stats import query_stats_reset
+        query_stats_reset()
+        yield
+        query_stats_reset()
+
+    def _cursor(self, **kwargs):
+        from backend.query_stats import instrumentar
+        return instrumentar(_CursorFalso)(**kwargs)
+
+    @pytest.mark.database
+    def test_fingerprint_ignora_literais(self):
+        from backend.query_stats import fingerprint, normalizar
+        a = fingerprint("SELECT * FROM t WHERE id = 10 AND nome = 'x' AND s IN (1, 2, 3)")
+        b = fingerprint("select *  from t where id = 99 and nome = 'y''z' and s in (4,5)")
+        assert a[0] == b[0]
+        assert normalizar('SELECT a FROM t WHERE x = %s AND y = %(y)s -- fim') == \
+            'SELECT a FROM t WHERE x = ? AND y = ?'
+
+    @pytest.mark.database
+    def test_agrega_por_fingerprint_e_origem(self, app):
+        from backend.query_stats import query_stats
+        cur = self._cursor()
+        t = threading.Thread(target=cur.execute, args=('SELECT * FROM leitos WHERE setor = %s', (1,)),
+                             name='notificador')
+        t.start()
+        t.join(2)
+        with app.test_request_context('/api/paineis/painel4/dashboard'):
+            cur.execute('SELECT * FROM leitos WHERE setor = %s', (2,))
+        dados = query_stats()
+        assert dados['fingerprints'] == 1
+        q = dados['queries'][0]
+        assert q['count'] == 2 and q['rows'] == 6
+        assert q['endpoints']['thread:notificador'] == 1
+        assert len(q['endpoints']) == 2
+        assert q['histogram']['count'] == 2
+
+    @pytest.mark.database
+    def test_erro_contabilizado_e_propagado(self):
+        from backend.query_stats import query_stats
+        cur = self._cursor(falha=RuntimeError('boom'))
+        with pytest.raises(RuntimeError):
+            cur.execute('UPDATE t SET a = 1')
+        assert query_stats()['queries'][0]['errors'] == 1
+
+    @pytest.mark.database
+    def test_lenta_agenda_explain_somente_leitura(self):
+        from backend import query_stats as qs
+        cur = self._cursor(demora=0.02)
+        with patch.object(qs, 'SLOW_QUERY_MS', 10), \
+             patch.object(qs, 'SLOW_QUERY_EXPLAIN_RATE', 1.0), \
+             patch.object(qs, '_get_explain_pool') as pool:
+            cur.execute('SELECT * FROM t WHERE id = %s', (5,))
+            cur.execute('DELETE FROM t WHERE id = %s', (5,))
+        assert qs.query_stats()['slow'] == 2
+        pool.return_value.submit.assert_called_once()
+        # Texto com marcadores, nunca os valores
+        assert pool.return_value.submit.call_args[0][2:] == ('SELECT * FROM t WHERE id = $1', 1)
+
+    @pytest.mark.database
+    def test_parametrizar_marcadores(self):
+        from backend.query_stats import parametrizar
+        assert parametrizar("SELECT a FROM t WHERE x = %s AND y LIKE 'a%%' AND z = %s") == \
+            ("SELECT a FROM t WHERE x = $1 AND y LIKE 'a%' AND z = $2", 2)
+        assert parametrizar('SELECT a FROM t WHERE x = %(x)s OR y = %(y)s OR z = %(x)s') == \
+            ('SELECT a FROM t WHERE x = $1 OR y = $2 OR z = $1', 2)
+
+    @pytest.mark.database
+    def test_explain_plano_generico_sem_analyze(self):
+        from backend import query_stats as qs
+        conn = MagicMock()
+        cur = conn.cursor.return_value
+        cur.fetchall.return_value = [("Index Scan using t_pkey on t",),
+                                     ("  Filter: (nome = 'Maria'::text)",)]
+        c = qs._Consulta('abc123', 'SELECT * FROM t WHERE id = ?')
+        with patch('backend.database.get_db_connection', return_value=conn), \
+             patch('backend.database.release_connection') as release:
+            qs._explain(c, 'SELECT * FROM t WHERE id = $1', 1)
+        executados = [chamada[0][0] for chamada in cur.execute.call_args_list]
+        assert 'PREPARE query_stats_abc123 AS SELECT * FROM t WHERE id = $1' in executados
+        assert 'EXPLAIN EXECUTE query_stats_abc123(NULL)' in executados
+        assert 'DEALLOCATE query_stats_abc123' in executados
+        assert not any('ANALYZE' in str(sql) for sql in executados)
+        assert "'Maria'" not in c.plano and "'?'" in c.plano
+        release.assert_called_once_with(conn)
+
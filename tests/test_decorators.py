@@ -5,6 +5,7 @@ Cobertura:
 - @login_required: bloqueio sem sessao, acesso com sessao
 - @admin_required: bloqueio sem admin, acesso com admin
 - @panel_permission_required: verificacao por painel
+- verificar_acesso_painel: mesma verificacao sem decorator (rota SSE)
 """
 import pytest
 from flask import Blueprint, jsonify
@@ -77,3 +78,15 @@ class TestPanelPermissionRequired:
     def test_admin_acessa_tudo(self, app, admin_client):
         resp = admin_client.get('/test/painel5-only')
         assert resp.status_code == 200
+
+
+class TestVerificarAcessoPainel:
+    @pytest.mark.decorators
+    def test_retorna_none_ou_resposta_de_negacao(self, app):
+        from flask import session
+        from backend.middleware.decorators import verificar_acesso_painel
+        with app.test_request_context('/api/stream/painel5'):
+            assert verificar_acesso_painel('painel5')[1] == 401
+            session.update({'usuario_id': 7, 'usuario': 'tv', 'is_tv': True, 'permissoes': ['painel5']})
+            assert verificar_acesso_painel('painel5') is None
+            assert verificar_acesso_painel('painel9')[1] == 403
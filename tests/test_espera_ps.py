@@ -0,0 +1,159 @@
+"""
+Testes do estimador de espera do PS (backend.espera_ps).
+
+Cobertura:
+- mediana/percentis dos ultimos JANELA_RECENTES atendidos (espera invalida
+  ocupa posicao mas nao entra na amostra)
+- janela de tendencia (1-2h atras) e acolhimento antes do medico
+- ingestao incremental: so o que passou da marca, atualizacao por
+  nr_atendimento sem duplicar, poda da janela
+- nova consulta so quando a geracao da tabela muda
+- leitura dos agregados nao espera a consulta ao banco
+- painel10 usa a mesma mediana do painel17
+"""
+import threading
+from datetime import datetime, timedelta
+import pytest
+from unittest.mock import patch, MagicMock
+
+
+AGORA = datetime(2026, 10, 17, 15, 0)
+
+
+def _atend(nr, espera, minutos_atras, cd=1, clinica='Clinica Medica', acolhimento=None):
+    """Linha de painel17_atendimentos_ps atendida ha `minutos_atras` com `espera` minutos."""
+    fim = AGORA - timedelta(minutes=minutos_atras)
+    inicio = fim - timedelta(minutes=espera)
+    return {'nr_atendimento': nr, 'cd_clinica': cd, 'clinica': clinica,
+            'dt_entrada': inicio, 'retirada_senha': None,
+            'dt_inicio_atendimento': inicio + timedelta(minutes=acolhimento) if acolhimento else None,
+            'dt_inicio_atendimento_med': fim}
+
+
+def _cursor(*cargas):
+    cursor = MagicMock()
+    cursor.fetchall.side_effect = [list(c) for c in cargas]
+    return cursor
+
+
+@pytest.fixture
+def estimador():
+    from backend.espera_ps import EstimadorEspera
+    with patch('backend.espera_ps.get_generations', return_value={'painel17_atendimentos_ps': 1}):
+        yield EstimadorEspera()
+
+
+class TestAgregadosEspera:
+    @pytest.mark.routes
+    def test_ultimos_n_e_percentis(self, estimador):
+        # 6 atendidos: o mais antigo sai da janela; 400 min e invalido mas ocupa posicao
+        linhas = [_atend(1, 90, 60), _atend(2, 10, 50), _atend(3, 20, 40),
+                  _atend(4, 400, 30), _atend(5, 30, 20), _atend(6, 40, 10)]
+        estimador.atualizar(_cursor(linhas), AGORA)
+        ag = estimador.agregados(AGORA)[1]
+        assert ag['amostra'] == 4
+        assert ag['mediana'] == 25.0
+        assert (ag['p35'], ag['p65']) == (20.0, 30.0)
+        assert ag['ultimo'] == AGORA - timedelta(minutes=10)
+        assert ag['clinica'] == 'Clinica Medica'
+
+    @pytest.mark.routes
+    def test_tendencia_e_acolhimento(self, estimador):
+        from backend.espera_ps import CHAVE_ACOLHIMENTO
+        linhas = [_atend(1, 20, 90, acolhimento=5), _atend(2, 40, 80), _atend(3, 30, 10, acolhimento=8)]
+        estimador.atualizar(_cursor(linhas), AGORA)
+        ags = estimador.agregados(AGORA)
+        assert ags[1]['mediana_1h'] == 30.0
+        assert ags[CHAVE_ACOLHIMENTO]['amostra'] == 2
+        assert ags[CHAVE_ACOLHIMENTO]['mediana'] == 6.5
+
+    @pytest.mark.routes
+    def test_historico_expirado(self, estimador):
+        estimador.atualizar(_cursor([_atend(1, 20, 60 * 24 * 8)]), AGORA)
+        assert estimador.agregados(AGORA) == {}
+
+
+class TestIngestaoIncremental:
+    @pytest.mark.routes
+    def test_incremento_a_partir_da_marca(self, estimador):
+        from backend.espera_ps import ESPERA_PS_SOBREPOSICAO_MIN
+        cursor = _cursor([_atend(1, 20, 30)], [_atend(2, 40, 5)])
+        estimador.atualizar(cursor, AGORA)
+        with patch('backend.espera_ps.get_generations', return_value={'painel17_atendimentos_ps': 2}):
+            assert estimador.atualizar(cursor, AGORA) == 1
+        desde = cursor.execute.call_args.args[1]['desde']
+        assert desde == AGORA - timedelta(minutes=30 + ESPERA_PS_SOBREPOSICAO_MIN)
+        assert estimador.agregados(AGORA)[1]['mediana'] == 30.0
+
+    @pytest.mark.routes
+    def test_sem_carga_nova_nao_consulta(self, estimador):
+        cursor = _cursor([_atend(1, 20, 30)])
+        estimador.atualizar(cursor, AGORA)
+        assert estimador.atualizar(cursor, AGORA) == 0
+        assert cursor.execute.call_count == 1
+
+    @pytest.mark.routes
+    def test_linha_atualizada_nao_duplica(self, estimador):
+        cursor = _cursor([_atend(1, 20, 30)], [_atend(1, 50, 30, cd=2, clinica='Pediatria')])
+        estimador.atualizar(cursor, AGORA)
+        estimador.atualizar(cursor, AGORA, forcar=True)
+        ags = estimador.agregados(AGORA)
+        assert 1 not in ags
+        assert ags[2]['amostra'] == 1 and ags[2]['mediana'] == 50.0
+
+    @pytest.mark.routes
+    def test_poda_mantem_janela_e_tendencia(self, estimador):
+        from backend.espera_ps import JANELA_RECENTES
+        # 20 atendidos antigos (3-23h atras) + 3 na ultima hora
+        linhas = [_atend(i, 20, 60 * (3 + i)) for i in range(20)]
+        linhas += [_atend(100 + i, 30, 10 * (i + 1)) for i in range(3)]
+        estimador.atualizar(_cursor(linhas), AGORA)
+        assert len(estimador._janelas[1]) == JANELA_RECENTES
+        assert len(estimador._indice) == JANELA_RECENTES
+
+
+    @pytest.mark.routes
+    def test_leitura_nao_espera_consulta(self, estimador):
+        estimador.atualizar(_cursor([_atend(1, 20, 30)]), AGORA)
+        no_banco, liberar = threading.Event(), threading.Event()
+        cursor = MagicMock()
+        cursor.execute.side_effect = lambda *a: (no_banco.set(), liberar.wait(5))
+        cursor.fetchall.return_value = [_atend(2, 40, 5)]
+        t = threading.Thread(target=estimador.atualizar, args=(cursor, AGORA), kwargs={'forcar': True})
+        t.start()
+        try:
+            assert no_banco.wait(5)
+            assert estimador._lock.acquire(timeout=1)
+            estimador._lock.release()
+            assert estimador.agregados(AGORA)[1]['amostra'] == 1
+        finally:
+            liberar.set()
+            t.join(5)
+        assert estimador.agregados(AGORA)[1]['amostra'] == 2
+
+
+class TestMedianaCompartilhada:
+    @pytest.mark.routes
+    def test_painel10_usa_mediana_do_painel17(self, app, monkeypatch):
+        import inspect
+        from backend.espera_ps import EstimadorEspera, calcular_metricas
+        from backend.routes import painel10_routes as p10
+
+        estimador = EstimadorEspera()
+        monkeypatch.setattr(p10, 'estimador_espera', estimador)
+        monkeypatch.setattr(p10, 'datetime', MagicMock(now=lambda: AGORA))
+        linhas = [_atend(1, 12, 30, clinica='CLÍNICA MÉDICA'), _atend(2, 18, 20, clinica='CLÍNICA MÉDICA')]
+        cursor = MagicMock()
+        # tempo, aguardando, maior espera, ingestao do estimador, medicos, alta
+        cursor.fetchall.side_effect = [
+            [{'ds_clinica': 'CLINICA MEDICA', 'total_atendimentos': 2, 'atendimentos_realizados': 2}],
+            [], [], linhas, [], [],
+        ]
+        cm = MagicMock()
+        cm.__enter__.return_value = cursor
+        monkeypatch.setattr(p10, 'get_db_cursor', lambda: cm)
+
+        with patch('backend.espera_ps.get_generations', return_value={'painel17_atendimentos_ps': 1}):
+            dados = inspect.unwrap(p10.api_painel10_clinicas_consolidado)().get_json()
+        painel17 = calcular_metricas(estimador.agregados(AGORA)[1], AGORA)
+        assert dados['data'][0]['mediana_espera_min'] == painel17['mediana'] == 15
@@ -0,0 +1,101 @@
+"""
+Testes da exportacao em streaming (backend.export).
+
+Cobertura:
+- cursor nomeado com itersize e devolucao da conexao ao fim da iteracao
+- fechar() idempotente (cliente que desconecta no meio do download)
+- CSV em blocos com BOM e resposta em streaming
+- XLSX write-only salvo em arquivo temporario
+"""
+import io
+import pytest
+from unittest.mock import patch, MagicMock
+
+
+def _conexao(linhas):
+    conn = MagicMock()
+    cursor = MagicMock()
+    cursor.__iter__.return_value = iter(linhas)
+    conn.cursor.return_value = cursor
+    return conn, cursor
+
+
+class TestConsultaStream:
+    @pytest.mark.database
+    def test_cursor_nomeado_e_devolucao(self):
+        from backend.export import ConsultaStream
+        conn, cursor = _conexao([{'a': 1}, {'a': 2}])
+        with patch('backend.export.get_db_connection', return_value=conn), \
+             patch('backend.export.release_connection') as release:
+            stream = ConsultaStream('SELECT 1', itersize=50)
+            assert conn.cursor.call_args.kwargs['name'].startswith('export_')
+            assert cursor.itersize == 50
+            assert list(stream) == [{'a': 1}, {'a': 2}]
+        cursor.close.assert_called_once()
+        conn.rollback.assert_called_once()
+        release.assert_called_once_with(conn)
+
+    @pytest.mark.database
+    def test_fechar_idempotente(self):
+        from backend.export import ConsultaStream
+        conn, _ = _conexao([])
+        with patch('backend.export.get_db_connection', return_value=conn), \
+             patch('backend.export.release_connection') as release:
+            stream = ConsultaStream('SELECT 1')
+            stream.fechar()
+            stream.fechar()
+        release.assert_called_once_with(conn)
+
+    @pytest.mark.database
+    def test_erro_no_execute_libera_conexao(self):
+        from backend.export import ConsultaStream
+        conn, cursor = _conexao([])
+        cursor.execute.side_effect = RuntimeError('sintaxe')
+        with patch('backend.export.get_db_connection', return_value=conn), \
+             patch('backend.export.release_connection') as release:
+            with pytest.raises(RuntimeError):
+                ConsultaStream('SELEC 1')
+        release.assert_called_once_with(conn)
+
+    @pytest.mark.database
+    def test_sem_conexao(self):
+        from backend.export import ConsultaStream
+        with patch('backend.export.get_db_connection', return_value=None):
+            with pytest.raises(ConnectionError):
+                ConsultaStream('SELECT 1')
+
+
+class TestCsvXlsx:
+    @pytest.mark.database
+    def test_csv_em_blocos_com_bom(self):
+        from backend import export
+        linhas = ([i, 'x' * 20] for i in range(200))
+        with patch.object(export, 'EXPORT_CHUNK_BYTES', 512):
+            blocos = list(export.csv_stream(['id', 'nome'], linhas))
+        assert len(blocos) > 1
+        corpo = b''.join(blocos).decode('utf-8')
+        assert corpo.startswith('\ufeffid,nome')
+        assert corpo.count('\n') == 201
+
+    @pytest.mark.database
+    def test_csv_response_chama_ao_fechar(self, app):
+        from backend.export import csv_response
+        ao_fechar = MagicMock()
+        resp = csv_response('a.csv', ['c'], iter([[1]]), ao_fechar=ao_fechar)
+        assert resp.is_streamed
+        assert 'attachment; filename="a.csv"' in resp.headers['Content-Disposition']
+        resp.close()
+        ao_fechar.assert_called_once()
+
+    @pytest.mark.database
+    def test_xlsx_write_only(self, app):
+        import openpyxl
+        from backend.export import xlsx_workbook, xlsx_response
+        wb = xlsx_workbook()
+        ws = wb.create_sheet('Dados')
+        ws.append(['a', 'b'])
+        ws.append([1, 2])
+        resp = xlsx_response(wb, 'r.xlsx')
+        resp.direct_passthrough = False
+        lido = openpyxl.load_workbook(io.BytesIO(resp.get_data()))
+        assert lido['Dados']['B2'].value == 2
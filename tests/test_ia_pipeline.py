@@ -0,0 +1,177 @@
+"""
+Testes do pipeline de analises IA (backend.ia_pipeline).
+
+Cobertura:
+- token bucket de requisicoes e tokens por minuto
+- prioridade CRITICO > ALTO > MODERADO, com ordem de chegada no empate
+- 429 volta para a fila com backoff e desiste apos GROQ_MAX_TENTATIVAS
+- um unico escritor reaproveitando a mesma conexao
+- limitar=False cobrando o bucket por chamada real com consumir()
+- parar() grava o resultado de chamadas em andamento antes de encerrar
+"""
+import threading
+import pytest
+from unittest.mock import patch, MagicMock
+
+from backend import ia_pipeline as ia
+
+
+class _Relogio:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def _pipeline(conn=None, **kw):
+    conn = conn or MagicMock(closed=False)
+    limitador = ia.LimitadorTaxa(rpm=6000, tpm=10 ** 7)
+    return ia.PipelineIA('teste', conectar=lambda: conn, limitador=limitador, **kw), conn
+
+
+class TestLimitadorTaxa:
+    @pytest.mark.workers
+    def test_requisicoes_por_minuto(self):
+        relogio = _Relogio()
+        lim = ia.LimitadorTaxa(rpm=2, tpm=10000, relogio=relogio)
+        assert lim.tentar(10) == 0 and lim.tentar(10) == 0
+        assert lim.tentar(10) == pytest.approx(30.0)
+        relogio.t = 30.0
+        assert lim.tentar(10) == 0
+
+    @pytest.mark.workers
+    def test_tokens_por_minuto(self):
+        relogio = _Relogio()
+        lim = ia.LimitadorTaxa(rpm=100, tpm=1200, relogio=relogio)
+        assert lim.tentar(1000) == 0
+        assert lim.tentar(800) == pytest.approx(30.0)
+
+    @pytest.mark.workers
+    def test_segurar_apos_429(self):
+        relogio = _Relogio()
+        lim = ia.LimitadorTaxa(rpm=100, tpm=10000, relogio=relogio)
+        lim.segurar(5)
+        assert lim.tentar(1) == pytest.approx(5.0)
+
+    @pytest.mark.workers
+    def test_prioridade_normaliza_acento(self):
+        assert ia.prioridade('CRÍTICO') == ia.prioridade('critico') == 0
+        assert ia.prioridade(None) == ia.prioridade('???') == ia.PRIORIDADES['MODERADO']
+
+
+class TestPipelineIA:
+    @pytest.mark.workers
+    def test_criticos_primeiro(self):
+        pipeline, _ = _pipeline(concorrencia=1)
+        ordem = []
+        liberar = threading.Event()
+        # Segura a unica thread enquanto a fila e montada
+        futuros = [pipeline.submeter(lambda: liberar.wait(2) and 'x', lambda c, r: True, nivel='BAIXO')]
+        for rotulo, nivel in [('m1', 'MODERADO'), ('a1', 'ALTO'), ('c1', 'CRÍTICO'), ('m2', 'MODERADO')]:
+            futuros.append(pipeline.submeter(lambda r=rotulo: ordem.append(r) or r,
+                                             lambda c, r: True, nivel=nivel))
+        liberar.set()
+        assert pipeline.aguardar(futuros, timeout=5) == {'sucessos': 5, 'falhas': 0}
+        pipeline.parar()
+        assert ordem == ['c1', 'a1', 'm1', 'm2']
+
+    @pytest.mark.workers
+    def test_429_reagenda(self):
+        pipeline, _ = _pipeline()
+        chamadas = []
+
+        def executar():
+            chamadas.append(1)
+            if len(chamadas) < 3:
+                raise ia.ErroLimiteTaxa(retry_after=0.01)
+            return 'ok'
+
+        futuro = pipeline.submeter(executar, lambda c, r: r == 'ok')
+        assert futuro.result(timeout=5) is True
+        pipeline.parar()
+        assert len(chamadas) == 3
+        assert pipeline.stats['limite_429'] == 2
+
+    @pytest.mark.workers
+    def test_429_desiste(self):
+        pipeline, _ = _pipeline()
+        with patch.object(ia, 'GROQ_MAX_TENTATIVAS', 2):
+            futuro = pipeline.submeter(MagicMock(side_effect=ia.ErroLimiteTaxa(retry_after=0.01)),
+                                       lambda c, r: True)
+            assert futuro.result(timeout=5) is False
+        pipeline.parar()
+
+    @pytest.mark.workers
+    def test_escritor_unico_reusa_conexao(self):
+        conn = MagicMock(closed=False)
+        conectar = MagicMock(return_value=conn)
+        pipeline = ia.PipelineIA('teste', conectar=conectar, limitador=ia.LimitadorTaxa(6000, 10 ** 7))
+        threads = set()
+
+        def gravar(c, r):
+            threads.add(threading.current_thread().name)
+            return r != 'ruim'
+
+        futuros = [pipeline.submeter(lambda r=r: r, gravar) for r in ('a', 'b', 'ruim', 'c')]
+        assert pipeline.aguardar(futuros, timeout=5) == {'sucessos': 3, 'falhas': 1}
+        pipeline.parar()
+        assert conectar.call_count == 1
+        assert conn.commit.call_count == 3
+        assert conn.rollback.call_count == 1
+        assert threads == {'ia_teste_escritor'}
+
+    @pytest.mark.workers
+    def test_falha_na_chamada_nao_grava(self):
+        pipeline, conn = _pipeline()
+        gravar = MagicMock()
+        futuro = pipeline.submeter(lambda: None, gravar)
+        assert futuro.result(timeout=5) is False
+        pipeline.parar()
+        gravar.assert_not_called()
+
+    @pytest.mark.workers
+    def test_parar_grava_resultado_de_chamada_em_andamento(self):
+        pipeline, conn = _pipeline(concorrencia=1)
+        iniciou = threading.Event()
+
+        def executar():
+            iniciou.set()
+            threading.Event().wait(0.2)
+            return 'ok'
+
+        gravar = MagicMock(return_value=True)
+        futuro = pipeline.submeter(executar, gravar)
+        assert iniciou.wait(5)
+        pipeline.parar()
+        assert futuro.result(timeout=0) is True
+        gravar.assert_called_once_with(conn, 'ok')
+
+    @pytest.mark.workers
+    def test_resultado_apos_parar_termina_como_falha(self):
+        pipeline, _ = _pipeline()
+        pipeline.submeter(lambda: None, MagicMock()).result(timeout=5)
+        pipeline.parar()
+        tarefa = ia._Tarefa(None, MagicMock(), 0, True, 'tardia')
+        pipeline._entregar(tarefa, 'ok')
+        assert tarefa.futuro.result(timeout=0) is False
+
+    @pytest.mark.workers
+    def test_consumir_cobra_cada_chamada_da_tarefa(self):
+        relogio = _Relogio()
+        limitador = ia.LimitadorTaxa(rpm=2, tpm=10 ** 6, relogio=relogio)
+        pipeline = ia.PipelineIA('teste', conectar=MagicMock, limitador=limitador)
+        chamadas = []
+
+        def executar():
+            # fallback: dois modelos tentados, duas requisicoes
+            for modelo in ('a', 'b'):
+                assert pipeline.consumir(100)
+                chamadas.append(modelo)
+            return 'ok'
+
+        futuro = pipeline.submeter(executar, lambda c, r: True, limitar=False)
+        assert futuro.result(timeout=5) is True
+        pipeline.parar()
+        assert chamadas == ['a', 'b']
+        assert limitador.tentar(100) == pytest.approx(30.0)
@@ -0,0 +1,221 @@
+"""
+Testes do worker IMAP de respostas de tratativas
+(backend.notificadores.workers.imap_tratativas).
+
+Cobertura:
+- lote de UIDs vira faixas num unico comando
+- cabecalhos de todos os nao lidos num FETCH; corpo so dos [TRAT:N]
+- um STORE para todos; uma conexao de banco por verificacao
+- email nao devolvido pelo servidor (cabecalho ou corpo) fica nao lido
+- IDLE: email novo, renovacao e resposta marcada consumida
+- servidor sem IDLE cai para polling; queda de sessao reconecta
+"""
+import logging
+import threading
+import pytest
+from unittest.mock import MagicMock, patch
+
+
+def _literal(uid, corpo, uid_no_fim=False):
+    if uid_no_fim:
+        return [(b'%d (BODY[] {%d}' % (uid, len(corpo)), corpo), b' UID %d)' % uid]
+    return [(b'%d (UID %d BODY[] {%d}' % (uid, uid, len(corpo)), corpo), b')']
+
+
+class _IMAPFalso:
+    """Responde SEARCH/FETCH/STORE por UID e registra os comandos."""
+
+    def __init__(self, mensagens):
+        self.mensagens = mensagens          # uid -> (assunto, corpo)
+        self.comandos = []
+
+    def _bruto(self, uid, so_cabecalho):
+        assunto, corpo = self.mensagens[uid]
+        cab = 'Subject: {}\r\nFrom: Resp <resp@hac>\r\nDate: Fri, 16 Oct 2026 10:09:00 -0300\r\n\r\n'.format(assunto)
+        return (cab if so_cabecalho else cab + corpo).encode()
+
+    def uid(self, comando, *args):
+        self.comandos.append((comando,) + args)
+        if comando == 'SEARCH':
+            return 'OK', [' '.join(str(u) for u in self.mensagens).encode()]
+        if comando == 'FETCH':
+            from backend.notificadores.workers.imap_tratativas.imap import CAMPOS_CABECALHO
+            uids = _expandir(args[0])
+            data = []
+            for u in uids:
+                data += _literal(u, self._bruto(u, args[1] == CAMPOS_CABECALHO), uid_no_fim=u % 2 == 0)
+            return 'OK', data
+        return 'OK', [None]
+
+
+def _expandir(conjunto):
+    uids = []
+    for parte in conjunto.split(','):
+        a, _, b = parte.partition(':')
+        uids += range(int(a), int(b or a) + 1)
+    return uids
+
+
+@pytest.fixture
+def modulo():
+    with patch('backend.notificador_utils.setup_notificador_logging',
+               side_effect=lambda nome, arquivo: logging.getLogger(nome)):
+        from backend.notificadores.workers.imap_tratativas import main
+        yield main
+
+
+class TestLote:
+    @pytest.mark.workers
+    def test_conjunto_uids(self, modulo):
+        from backend.notificadores.workers.imap_tratativas.imap import conjunto_uids
+        assert conjunto_uids([10, 9, 1, 2, 3, 7]) == '1:3,7,9:10'
+        assert conjunto_uids([5]) == '5'
+
+    @pytest.mark.workers
+    def test_cabecalhos_primeiro_corpo_so_dos_tokens(self, modulo, monkeypatch):
+        imap = _IMAPFalso({
+            101: ('Newsletter', 'propaganda'),
+            102: ('RE: Sentir e Agir - CRITICO [TRAT:55]', 'Ja resolvido\r\n> citacao'),
+            103: ('Outro', 'x'),
+            104: ('Res: [trat:56]', 'Em andamento'),
+        })
+        conexoes = []
+        monkeypatch.setattr(modulo, '_get_conn', lambda: conexoes.append(MagicMock(closed=False)) or conexoes[-1])
+        processar = MagicMock(return_value=True)
+        monkeypatch.setattr(modulo, 'processar_resposta', processar)
+
+        assert modulo.processar_caixa(imap) == 2
+        fetches = [c for c in imap.comandos if c[0] == 'FETCH']
+        assert fetches[0][1:] == ('101:104', '(BODY.PEEK[HEADER.FIELDS (SUBJECT FROM DATE)])')
+        assert fetches[1][1:] == ('102,104', '(BODY.PEEK[])')
+        assert [c for c in imap.comandos if c[0] == 'STORE'] == [('STORE', '101:104', '+FLAGS.SILENT', '(\\Seen)')]
+        assert [(c.args[1], c.args[3]) for c in processar.call_args_list] == [(55, 'Ja resolvido'), (56, 'Em andamento')]
+        assert 'Resp <resp@hac>' == processar.call_args_list[0].args[2]
+        assert len(conexoes) == 1 and conexoes[0].close.called
+
+    @pytest.mark.workers
+    def test_erro_no_banco_ainda_marca_lido(self, modulo, monkeypatch):
+        imap = _IMAPFalso({7: ('[TRAT:1]', 'ok')})
+        monkeypatch.setattr(modulo, '_get_conn', MagicMock(side_effect=RuntimeError('banco fora')))
+        assert modulo.processar_caixa(imap) == 0
+        assert imap.comandos[-1][:2] == ('STORE', '7')
+
+    @pytest.mark.workers
+    def test_nao_retornados_ficam_nao_lidos(self, modulo, monkeypatch):
+        imap = _IMAPFalso({
+            11: ('Newsletter', 'x'),
+            12: ('[TRAT:5]', 'ok'),
+            13: ('[TRAT:6]', 'sumiu'),
+            14: ('Outro', 'y'),
+        })
+        fetch = imap.uid
+
+        def uid(comando, *args):
+            resposta = fetch(comando, *args)
+            if comando == 'FETCH':
+                # 14 falha no parse do cabecalho; 13 nao volta no FETCH completo
+                perdido = 14 if args[1] != '(BODY.PEEK[])' else 13
+                dados = resposta[1]
+                i = next(i for i, item in enumerate(dados)
+                         if isinstance(item, tuple) and b'%d (' % perdido in item[0])
+                return 'OK', dados[:i] + dados[i + 2:]
+            return resposta
+        imap.uid = uid
+        monkeypatch.setattr(modulo, '_get_conn', lambda: MagicMock(closed=False))
+        monkeypatch.setattr(modulo, 'processar_resposta', MagicMock(return_value=True))
+
+        assert modulo.processar_caixa(imap) == 1
+        assert imap.comandos[-1] == ('STORE', '11:12', '+FLAGS.SILENT', '(\\Seen)')
+
+    @pytest.mark.workers
+    def test_caixa_vazia(self, modulo):
+        imap = _IMAPFalso({})
+        assert modulo.processar_caixa(imap) == 0
+        assert [c[0] for c in imap.comandos] == ['SEARCH']
+
+
+class _ConexaoIdle:
+    def __init__(self, linhas, idle=True):
+        self.linhas = list(linhas)
+        self.enviados = []
+        self.idle = idle
+        self.logout = MagicMock()
+        self.sock = None
+
+    def select(self, caixa):
+        return 'OK', [b'3']
+
+    def capability(self):
+        return 'OK', [b'IMAP4rev1 UIDPLUS' + (b' IDLE' if self.idle else b'')]
+
+    def _new_tag(self):
+        return b'A001'
+
+    def send(self, dados):
+        self.enviados.append(dados)
+
+    def readline(self):
+        return self.linhas.pop(0) if self.linhas else b''
+
+
+class TestIdle:
+    def _sessao(self, conexao, monkeypatch):
+        from backend.notificadores.workers.imap_tratativas.imap import SessaoIMAP
+        sessao = SessaoIMAP(conectar=lambda: conexao)
+        sessao.abrir()
+        monkeypatch.setattr(sessao, '_pronto', lambda espera: True)
+        return sessao
+
+    @pytest.mark.workers
+    def test_email_novo_encerra_idle(self, modulo, monkeypatch):
+        conexao = _ConexaoIdle([b'+ idling\r\n', b'* 4 EXISTS\r\n', b'* 1 RECENT\r\n',
+                                b'A001 OK IDLE terminated\r\n'])
+        sessao = self._sessao(conexao, monkeypatch)
+        assert sessao.suporta_idle
+        assert sessao.aguardar(threading.Event(), renovar_seg=60) is True
+        assert conexao.enviados == [b'A001 IDLE\r\n', b'DONE\r\n']
+        assert conexao.linhas == []
+
+    @pytest.mark.workers
+    def test_renovacao_sem_email(self, modulo, monkeypatch):
+        conexao = _ConexaoIdle([b'+ idling\r\n', b'A001 OK\r\n'])
+        sessao = self._sessao(conexao, monkeypatch)
+        monkeypatch.setattr(sessao, '_pronto', lambda espera: False)
+        assert sessao.aguardar(threading.Event(), renovar_seg=0.01) is False
+        assert conexao.enviados[-1] == b'DONE\r\n'
+
+    @pytest.mark.workers
+    def test_sem_idle_faz_polling(self, modulo, monkeypatch):
+        sessao = self._sessao(_ConexaoIdle([], idle=False), monkeypatch)
+        parar = MagicMock()
+        assert sessao.aguardar(parar, poll_seg=42) is False
+        parar.wait.assert_called_once_with(42)
+
+    @pytest.mark.workers
+    def test_queda_reconecta(self, modulo, monkeypatch):
+        parar = threading.Event()
+        sessoes = []
+
+        class _Sessao:
+            aberta = False
+            suporta_idle = True
+            imap = object()
+
+            def abrir(self):
+                sessoes.append(1)
+                self.aberta = True
+
+            def fechar(self):
+                self.aberta = False
+
+            def aguardar(self, parar_):
+                if len(sessoes) == 1:
+                    raise OSError('conexao perdida')
+                parar.set()
+                return False
+
+        ciclos = []
+        monkeypatch.setattr(modulo, 'processar_caixa', lambda imap: ciclos.append(imap))
+        monkeypatch.setattr(parar, 'wait', lambda t=None: False)
+        modulo.escutar(parar, sessao=_Sessao())
+        assert len(sessoes) == 2 and len(ciclos) == 2
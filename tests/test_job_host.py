@@ -0,0 +1,138 @@
+"""
+Testes do host de jobs de background com eleicao de lider (backend.job_host).
+
+Cobertura:
+- so o processo que obtem o advisory lock inicia os jobs
+- seguidor assume quando o lock fica livre (failover)
+- lider que perde a conexao continua e retoma o lock
+- lider rebaixado (lock com outro processo) para os jobs e nao concorre de novo
+- parar() sinaliza os jobs e fecha a conexao do lock
+"""
+import threading
+import pytest
+from unittest.mock import MagicMock
+
+
+class _Banco:
+    """Simula o advisory lock de sessao: um dono por vez, liberado ao fechar a conexao."""
+
+    def __init__(self):
+        self.dono = None
+        self.fora = False
+
+    def conectar(self):
+        if self.fora:
+            raise ConnectionError('banco fora')
+        conn = MagicMock(closed=False)
+        banco = self
+
+        def execute(sql, params=None):
+            if banco.fora:
+                raise ConnectionError('conexao perdida')
+            if 'pg_try_advisory_lock' in sql:
+                if banco.dono is None:
+                    banco.dono = conn
+                cur.fetchone.return_value = (banco.dono is conn,)
+            else:
+                cur.fetchone.return_value = (1,)
+
+        def close():
+            conn.closed = True
+            if banco.dono is conn:
+                banco.dono = None
+
+        cur = MagicMock()
+        cur.execute.side_effect = execute
+        conn.cursor.return_value = cur
+        conn.close.side_effect = close
+        return conn
+
+
+def _host(banco, iniciados):
+    from backend.job_host import HostJobs
+    host = HostJobs(conectar=banco.conectar, chave=1, intervalo=0)
+
+    def iniciar():
+        evento = threading.Event()
+        iniciados.append(evento)
+        return evento
+
+    host.registrar('notificador_teste', iniciar)
+    host.registrar('desligado', lambda: None)
+    return host
+
+
+class TestEleicao:
+    @pytest.mark.workers
+    def test_so_o_lider_inicia_os_jobs(self):
+        banco, jobs_a, jobs_b = _Banco(), [], []
+        a, b = _host(banco, jobs_a), _host(banco, jobs_b)
+        assert a.ciclo() is True
+        assert b.ciclo() is False
+        assert len(jobs_a) == 1 and jobs_b == []
+        assert a.estado()['em_execucao'] == ['notificador_teste']
+
+    @pytest.mark.workers
+    def test_failover_quando_lider_encerra(self):
+        banco, jobs_a, jobs_b = _Banco(), [], []
+        a, b = _host(banco, jobs_a), _host(banco, jobs_b)
+        a.ciclo()
+        b.ciclo()
+        a.parar()
+        assert jobs_a[0].is_set()
+        assert b.ciclo() is True
+        assert len(jobs_b) == 1
+
+    @pytest.mark.workers
+    def test_heartbeat_do_lider_nao_reinicia_jobs(self):
+        banco, jobs = _Banco(), []
+        a = _host(banco, jobs)
+        for _ in range(3):
+            assert a.ciclo() is True
+        assert len(jobs) == 1
+
+
+class TestPerdaDeConexao:
+    @pytest.mark.workers
+    def test_lider_retoma_lock_apos_queda(self):
+        banco, jobs = _Banco(), []
+        a = _host(banco, jobs)
+        a.ciclo()
+        banco.fora = True
+        assert a.ciclo() is True            # jobs continuam sem banco
+        assert not jobs[0].is_set()
+        banco.fora, banco.dono = False, None  # servidor liberou a sessao morta
+        assert a.ciclo() is True
+        assert len(jobs) == 1 and not jobs[0].is_set()
+
+    @pytest.mark.workers
+    def test_lider_rebaixado_quando_outro_pegou_o_lock(self):
+        banco, jobs_a, jobs_b = _Banco(), [], []
+        a, b = _host(banco, jobs_a), _host(banco, jobs_b)
+        a.ciclo()
+        banco.fora = True
+        a.ciclo()
+        banco.fora, banco.dono = False, None
+        assert b.ciclo() is True
+        assert a.ciclo() is False
+        assert jobs_a[0].is_set()
+        assert a.estado()['rebaixado'] is True
+        # Mesmo com o lock livre, o processo rebaixado nao volta a concorrer
+        b.parar()
+        assert a.ciclo() is False
+        assert len(jobs_a) == 1
+
+    @pytest.mark.workers
+    def test_rebaixado_recicla_o_worker(self, monkeypatch):
+        from backend import job_host as mod
+        kill = MagicMock()
+        monkeypatch.setattr(mod.os, 'kill', kill)
+        banco, outro = _Banco(), _Banco().conectar()
+        a = _host(banco, [])
+        a.reciclar = True
+        a.ciclo()
+        banco.fora = True
+        a.ciclo()
+        banco.fora, banco.dono = False, outro
+        a.ciclo()
+        kill.assert_called_once_with(mod.os.getpid(), mod.signal.SIGTERM)
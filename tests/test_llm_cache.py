@@ -0,0 +1,125 @@
+"""
+Testes do cache de respostas LLM (backend.llm_cache).
+
+Cobertura:
+- chave estavel com espaco em branco normalizado; modelo/versao/parametros mudam a chave
+- acerto em memoria e no banco (apos reinicio) sem chamar a API
+- resposta vazia nao e gravada; banco fora do ar vira falha de cache
+- taxa de acerto no resumo
+- acerto em memoria nao espera a ida ao banco de outra thread
+"""
+import threading
+import time
+import pytest
+from unittest.mock import MagicMock
+
+from backend import llm_cache
+
+
+class _BancoFalso:
+    """Conexao que guarda llm_cache num dict (UPDATE ... RETURNING / INSERT ... ON CONFLICT)."""
+
+    def __init__(self):
+        self.linhas = {}
+        self.closed = False
+        self.commit = MagicMock()
+        self._ultimo = None
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        if sql.lstrip().startswith('UPDATE llm_cache'):
+            resposta = self.linhas.get(params[0])
+            self._ultimo = (resposta, 3600.0) if resposta else None
+        elif 'INSERT INTO llm_cache' in sql:
+            self.linhas[params[0]] = params[3]
+
+    def fetchone(self):
+        return self._ultimo
+
+    def close(self):
+        pass
+
+
+def _msgs(texto):
+    return [{'role': 'system', 'content': 'sistema'}, {'role': 'user', 'content': texto}]
+
+
+class TestChaveLLM:
+    @pytest.mark.workers
+    def test_normaliza_espacos(self):
+        assert llm_cache.chave_llm('v1', 'm', _msgs('PA 120/80\n  FC 90')) == \
+            llm_cache.chave_llm('v1', 'm', _msgs('PA 120/80 FC 90  '))
+
+    @pytest.mark.workers
+    def test_versao_modelo_e_parametros(self):
+        base = llm_cache.chave_llm('v1', 'm', _msgs('x'), temperature=0.3)
+        assert base != llm_cache.chave_llm('v2', 'm', _msgs('x'), temperature=0.3)
+        assert base != llm_cache.chave_llm('v1', 'outro', _msgs('x'), temperature=0.3)
+        assert base != llm_cache.chave_llm('v1', 'm', _msgs('x'), temperature=0.7)
+
+
+class TestCacheLLM:
+    @pytest.mark.workers
+    def test_acerto_em_memoria(self):
+        cache = llm_cache.CacheLLM(_BancoFalso)
+        chamar = MagicMock(return_value='analise')
+        assert cache.resolver('v1', 'm', _msgs('x'), chamar) == 'analise'
+        assert cache.resolver('v1', 'm', _msgs('x'), chamar) == 'analise'
+        chamar.assert_called_once()
+        resumo = cache.resumo()
+        assert (resumo['acertos'], resumo['falhas'], resumo['taxa_acerto']) == (1, 1, 0.5)
+
+    @pytest.mark.workers
+    def test_acerto_no_banco_apos_reinicio(self):
+        banco = _BancoFalso()
+        llm_cache.CacheLLM(lambda: banco).resolver('v1', 'm', _msgs('x'), lambda: 'analise')
+        novo = llm_cache.CacheLLM(lambda: banco)
+        chamar = MagicMock()
+        assert novo.contem('v1', 'm', _msgs('x'))
+        assert novo.resolver('v1', 'm', _msgs('x'), chamar) == 'analise'
+        chamar.assert_not_called()
+        assert novo.resumo()['lidos_banco'] == 1
+
+    @pytest.mark.workers
+    def test_resposta_vazia_nao_grava(self):
+        banco = _BancoFalso()
+        cache = llm_cache.CacheLLM(lambda: banco)
+        assert cache.resolver('v1', 'm', _msgs('x'), lambda: None) is None
+        assert banco.linhas == {}
+
+    @pytest.mark.workers
+    def test_banco_fora_do_ar(self):
+        cache = llm_cache.CacheLLM(MagicMock(side_effect=RuntimeError('sem banco')))
+        assert cache.resolver('v1', 'm', _msgs('x'), lambda: 'analise') == 'analise'
+        assert cache.resumo()['erros_banco'] == 2
+        # A memoria continua servindo
+        assert cache.resolver('v1', 'm', _msgs('x'), MagicMock()) == 'analise'
+
+    @pytest.mark.workers
+    def test_memoria_nao_espera_banco(self):
+        banco = _BancoFalso()
+        cache = llm_cache.CacheLLM(lambda: banco)
+        cache.resolver('v1', 'm', _msgs('x'), lambda: 'analise')
+        no_banco, liberar = threading.Event(), threading.Event()
+        execute = banco.execute
+
+        def execute_lento(sql, params=None):
+            no_banco.set()
+            liberar.wait(5)
+            execute(sql, params)
+
+        banco.execute = execute_lento
+        t = threading.Thread(target=cache.resolver, args=('v1', 'm', _msgs('y'), lambda: 'outra'))
+        t.start()
+        try:
+            assert no_banco.wait(5)
+            inicio = time.monotonic()
+            assert cache.resolver('v1', 'm', _msgs('x'), MagicMock()) == 'analise'
+            # Respondido sem esperar a outra thread sair do banco
+            assert time.monotonic() - inicio < 1
+            assert cache.resumo()['acertos'] == 1
+        finally:
+            liberar.set()
+            t.join(5)
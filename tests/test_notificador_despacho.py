@@ -0,0 +1,186 @@
+"""
+Testes do despachante de notificacoes (backend.notificador_despacho).
+
+Cobertura:
+- fan-out ntfy em paralelo, resultado na ordem dos topicos
+- enfileirar() nao bloqueia; ao_concluir roda apos o envio
+- falha transitoria volta com backoff; permanente termina na hora
+- HTTP 429/5xx transitorio (Retry-After), 4xx permanente
+- conexao SMTP reusada entre mensagens e reaberta se o servidor derrubou
+- nova tentativa nao reenvia para destinatario ja atendido
+- parar() descarta novas tentativas agendadas
+"""
+import smtplib
+import threading
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+
+
+class _Remetente:
+    def __init__(self, atraso=0.0, falhas=None, liberar=None):
+        self.atraso = atraso
+        self.falhas = list(falhas or [])
+        self.liberar = liberar
+        self.enviados = []
+        self.fechado = 0
+
+    def enviar(self, msg):
+        if self.liberar is not None:
+            self.liberar.wait(2)
+        time.sleep(self.atraso)
+        if self.falhas:
+            raise self.falhas.pop(0)
+        self.enviados.append(msg)
+        return 'ok {}'.format(msg.get('topico', ''))
+
+    def fechar(self):
+        self.fechado += 1
+
+
+@pytest.fixture
+def criar(monkeypatch):
+    from backend import notificador_despacho as mod
+    monkeypatch.setattr(mod, 'DESPACHO_BACKOFF_BASE', 0.01)
+    criados = []
+
+    def _criar(remetente, concorrencia=4, ocioso_seg=5):
+        canal = mod.Canal('teste', lambda: remetente, concorrencia, ocioso_seg=ocioso_seg)
+        desp = mod.Despachante({'ntfy': canal, 'email': canal})
+        criados.append(desp)
+        return desp
+    yield _criar
+    for desp in criados:
+        desp.parar(timeout=1)
+
+
+class TestFila:
+    @pytest.mark.workers
+    def test_fan_out_em_paralelo(self, criar):
+        desp = criar(_Remetente(atraso=0.1), concorrencia=8)
+        inicio = time.monotonic()
+        resultado = desp.enviar_ntfy(['t{}'.format(i) for i in range(8)], 'titulo', 'msg')
+        assert time.monotonic() - inicio < 0.5          # sequencial levaria 0.8s
+        assert [r[0] for r in resultado] == ['t{}'.format(i) for i in range(8)]
+        assert all(ok for _, ok, _ in resultado)
+
+    @pytest.mark.workers
+    def test_enfileirar_nao_bloqueia(self, criar):
+        liberar = threading.Event()
+        desp = criar(_Remetente(liberar=liberar))
+        concluidos = []
+        inicio = time.monotonic()
+        futuro = desp.enfileirar('email', {'destinatarios': ['a@b']},
+                                 ao_concluir=lambda ok, d: concluidos.append(ok))
+        assert time.monotonic() - inicio < 0.05 and not futuro.done()
+        liberar.set()
+        assert futuro.result(2) == (True, 'ok ')
+        assert concluidos == [True]
+
+    @pytest.mark.workers
+    def test_transitoria_repete_permanente_nao(self, criar):
+        from backend.notificador_despacho import FalhaEnvio
+        remetente = _Remetente(falhas=[FalhaEnvio('Timeout', transitoria=True)])
+        desp = criar(remetente, concorrencia=1)
+        assert desp.enfileirar('ntfy', {'topico': 'x'}).result(2) == (True, 'ok x')
+        assert desp.canais['ntfy'].estado()['novas_tentativas'] == 1
+
+        remetente.falhas = [FalhaEnvio('HTTP 400')]
+        assert desp.enfileirar('ntfy', {'topico': 'y'}).result(2) == (False, 'HTTP 400')
+
+        remetente.falhas = [FalhaEnvio('Timeout', transitoria=True)] * 5
+        assert desp.enfileirar('ntfy', {'topico': 'z'}, max_tentativas=2).result(2) == (False, 'Timeout')
+
+    @pytest.mark.workers
+    def test_parar_descarta_tentativas_agendadas(self, criar):
+        from backend.notificador_despacho import FalhaEnvio
+        remetente = _Remetente(falhas=[FalhaEnvio('503', transitoria=True, retry_after=30)])
+        desp = criar(remetente, concorrencia=1)
+        futuro = desp.enfileirar('ntfy', {'topico': 'x'})
+        time.sleep(0.05)
+        desp.parar(timeout=1)
+        assert futuro.result(1) == (False, 'Descartado no shutdown')
+        assert remetente.fechado >= 1
+        assert desp.enfileirar('ntfy', {'topico': 'y'}).result(1)[0] is False
+
+
+class TestNtfy:
+    @pytest.mark.workers
+    def test_status_http(self):
+        from backend.notificador_despacho import RemetenteNtfy, FalhaEnvio
+        remetente = RemetenteNtfy()
+        sessao = MagicMock()
+        remetente.sessao = lambda: sessao
+        msg = {'url': 'http://ntfy', 'topico': 't', 'titulo': 'Título', 'mensagem': 'm'}
+
+        sessao.post.return_value = MagicMock(status_code=200)
+        assert remetente.enviar(msg) == 'HTTP 200'
+        assert sessao.post.call_args.args[0] == 'http://ntfy/t'
+
+        sessao.post.return_value = MagicMock(status_code=429, headers={'retry-after': '7'})
+        with pytest.raises(FalhaEnvio) as e:
+            remetente.enviar(msg)
+        assert e.value.transitoria and e.value.retry_after == 7.0
+
+        sessao.post.return_value = MagicMock(status_code=403, headers={})
+        with pytest.raises(FalhaEnvio) as e:
+            remetente.enviar(msg)
+        assert not e.value.transitoria
+
+    @pytest.mark.workers
+    def test_sessao_unica_por_processo(self):
+        from backend.notificador_despacho import RemetenteNtfy
+        remetente = RemetenteNtfy()
+        assert remetente.sessao() is remetente.sessao()
+
+
+class TestSMTP:
+    CONFIG = {'host': 'smtp', 'port': 587, 'user': 'u', 'password': 'p', 'sender': 'hac@x'}
+
+    def _msg(self, *dest):
+        return {'destinatarios': list(dest), 'titulo': 'Crítico', 'html': '<p>x</p>'}
+
+    @pytest.mark.workers
+    def test_conexao_reusada(self):
+        from backend.notificador_despacho import ConexaoSMTP
+        with patch('backend.notificador_despacho.smtplib.SMTP') as smtp:
+            conexao = ConexaoSMTP(self.CONFIG)
+            for i in range(3):
+                conexao.enviar(self._msg('a@x', 'b@x'))
+            assert smtp.call_count == 1
+            servidor = smtp.return_value
+            servidor.login.assert_called_once_with('u', 'p')
+            assert servidor.sendmail.call_count == 6
+            conexao.fechar()
+            servidor.quit.assert_called_once()
+
+    @pytest.mark.workers
+    def test_reabre_conexao_derrubada(self):
+        from backend.notificador_despacho import ConexaoSMTP
+        with patch('backend.notificador_despacho.smtplib.SMTP') as smtp:
+            conexao = ConexaoSMTP(self.CONFIG)
+            conexao.enviar(self._msg('a@x'))
+            smtp.return_value.sendmail.side_effect = [smtplib.SMTPServerDisconnected(), {}]
+            assert conexao.enviar(self._msg('b@x')) == 'Email enviado para 1'
+            assert smtp.call_count == 2
+
+    @pytest.mark.workers
+    def test_nova_tentativa_nao_repete_destinatario(self):
+        from backend.notificador_despacho import ConexaoSMTP, FalhaEnvio
+        with patch('backend.notificador_despacho.smtplib.SMTP') as smtp:
+            servidor = smtp.return_value
+            servidor.sendmail.side_effect = [{}, smtplib.SMTPResponseException(421, b'ocupado'), {}]
+            conexao = ConexaoSMTP(self.CONFIG)
+            msg = self._msg('a@x', 'b@x')
+            with pytest.raises(FalhaEnvio) as e:
+                conexao.enviar(msg)
+            assert e.value.transitoria
+            conexao.enviar(msg)
+            assert [c.args[1] for c in servidor.sendmail.call_args_list] == [['a@x'], ['b@x'], ['b@x']]
+
+    @pytest.mark.workers
+    def test_sem_configuracao_e_permanente(self):
+        from backend.notificador_despacho import ConexaoSMTP, FalhaEnvio
+        with pytest.raises(FalhaEnvio) as e:
+            ConexaoSMTP(dict(self.CONFIG, password='')).enviar(self._msg('a@x'))
+        assert not e.value.transitoria
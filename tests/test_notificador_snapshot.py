@@ -0,0 +1,190 @@
+"""
+Testes do diff de snapshot e do log em lote dos notificadores
+(backend.notificador_snapshot, pareceres e admissao).
+
+Cobertura:
+- diff: novos/alterados/removidos/primeira execucao a partir das linhas do banco
+- log: renotificacao vira UPDATE, o resto INSERT, cada um num execute_values
+- renotificacao respeita limite e intervalo
+- verificar_pareceres e prescricao: idas ao banco nao crescem com o numero
+  de pareceres/pacientes
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+import pytest
+from unittest.mock import MagicMock, patch
+
+
+class _BancoFalso:
+    """Emula notificacoes_snapshot (dict por tipo) e notificacoes_log (lista) por SQL."""
+
+    def __init__(self, snapshot=None, log=None, consultas=None):
+        self.snapshot = snapshot or {}          # tipo -> {nr: dados}
+        self.log = log or []                    # dicts de notificacoes_log
+        self.consultas = consultas or {}        # trecho do SQL -> linhas
+        self.execucoes = []
+        self.commit = MagicMock()
+        self.closed = False
+        self._linhas = []
+
+    def cursor(self, cursor_factory=None):
+        return self
+
+    def execute(self, sql, params=None):
+        self.execucoes.append(sql)
+        if 'WITH atual AS' in sql:
+            self._linhas = self._diff(params)
+        elif 'FROM notificacoes_log' in sql and 'DISTINCT ON (chave_evento)' in sql:
+            chaves, status = params
+            self._linhas = [(r['chave_evento'], r['id'], r['status'], r['qt_notificacoes'],
+                             r['dt_ultima_notificacao'])
+                            for r in self.log if r['chave_evento'] in chaves and r['status'] in status]
+        else:
+            self._linhas = next((linhas for trecho, linhas in self.consultas.items() if trecho in sql), [])
+
+    def _diff(self, params):
+        anterior = self.snapshot.get(params['tipo'], {})
+        atual = {nr: (json.loads(d) if d else None) for nr, d in zip(params['nrs'], params['dados'])}
+        linhas = [('novo', nr, None) for nr in atual if nr not in anterior]
+        linhas += [('alterado', nr, anterior[nr]) for nr in atual
+                   if nr in anterior and anterior[nr] != atual[nr]]
+        linhas += [('removido', nr, None) for nr in anterior if nr not in atual]
+        if not anterior:
+            linhas.append(('vazio', None, None))
+        self.snapshot[params['tipo']] = atual
+        return linhas
+
+    def fetchall(self):
+        return self._linhas
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def execute_values():
+    with patch('backend.notificador_snapshot.execute_values') as ev:
+        yield ev
+
+
+@pytest.fixture
+def sem_log_em_arquivo():
+    """Os configs dos notificadores abrem logs/*.log na importacao."""
+    with patch('backend.notificador_utils.setup_notificador_logging',
+               side_effect=lambda nome, arquivo: logging.getLogger(nome)):
+        yield
+
+
+class TestDiffSnapshot:
+    @pytest.mark.workers
+    def test_novos_alterados_removidos(self):
+        from backend.notificador_snapshot import diff_snapshot
+        banco = _BancoFalso(snapshot={'t': {1: {'p': 'Nao'}, 2: {'p': 'Nao'}, 3: None}})
+        delta = diff_snapshot(banco, 't', {1: {'p': 'Nao'}, 2: {'p': 'Sim'}, 4: None})
+        assert delta == {'novos': {4}, 'alterados': {2: {'p': 'Nao'}},
+                         'removidos': {3}, 'primeira_execucao': False}
+        assert len(banco.execucoes) == 1
+        banco.commit.assert_not_called()
+
+    @pytest.mark.workers
+    def test_primeira_execucao(self):
+        from backend.notificador_snapshot import diff_snapshot
+        banco = _BancoFalso()
+        delta = diff_snapshot(banco, 't', dict.fromkeys([1, 2]))
+        assert delta['primeira_execucao'] and delta['novos'] == {1, 2}
+
+
+class TestLogEmLote:
+    @pytest.mark.workers
+    def test_update_para_existentes_insert_para_novos(self, execute_values):
+        from backend.notificador_snapshot import gravar_notificacoes
+        agora = datetime(2026, 10, 17, 12, 0)
+        linhas = [{'tipo_evento': 'x', 'chave_evento': c, 'sucesso': c != 'b', 'resposta': 'r',
+                   'nr_atendimento': 10, 'dados_extra': {'a': 1}} for c in 'abc']
+        gravar_notificacoes(MagicMock(), linhas, existentes={'a': {'id': 7}}, agora=agora)
+        (upd, ins) = execute_values.call_args_list
+        assert 'UPDATE notificacoes_log' in upd.args[1]
+        assert upd.args[2] == [(7, 'notificado', 'r', agora)]
+        assert [r[1] for r in ins.args[2]] == ['b', 'c']
+        assert ins.args[2][0][9] == 'erro' and ins.args[2][0][13] == 0
+        assert ins.args[2][1][7] == '{"a": 1}'
+
+    @pytest.mark.workers
+    def test_renotificacao(self, sem_log_em_arquivo):
+        from backend.notificadores.admissao.snapshot import precisa_renotificar
+        agora = datetime(2026, 10, 17, 12, 0)
+        config = {'max_renotificacoes': 2, 'intervalo_renotificacao_min': 60}
+        reg = {'status': 'notificado', 'qt_notificacoes': 1, 'dt_ultima_notificacao': agora - timedelta(hours=2)}
+        assert precisa_renotificar(reg, config, agora)
+        assert not precisa_renotificar(dict(reg, dt_ultima_notificacao=agora), config, agora)
+        assert not precisa_renotificar(dict(reg, qt_notificacoes=3), config, agora)
+        assert not precisa_renotificar(dict(reg, status='pendente'), config, agora)
+
+
+class TestIdasAoBanco:
+    @pytest.mark.workers
+    @pytest.mark.parametrize('n', [3, 300])
+    def test_pareceres_constante(self, n, sem_log_em_arquivo, execute_values, monkeypatch):
+        from backend.notificadores.pareceres import main
+        pareceres = [{'nr_parecer': i, 'nr_atendimento': 1000 + i, 'especialidade_destino': 'Cardio',
+                      'horas_pendente': 0.1, 'ds_tipo_atendimento': '-', 'status_parecer': 'A'}
+                     for i in range(n)]
+        # Snapshot anterior: so o parecer 0; chega n-1 novos
+        banco = _BancoFalso(snapshot={'pareceres_ativos': {0: None, -1: None}},
+                            consultas={'FROM pareceres_pendentes': pareceres})
+        destinatarios = MagicMock(return_value=[{'email': 'a@b'}])
+        enviar_email = MagicMock(return_value=(True, 'ok'))
+        monkeypatch.setattr(main, 'get_connection', lambda: banco)
+        monkeypatch.setattr(main, 'buscar_topicos_ntfy', lambda conn: ['t1'])
+        monkeypatch.setattr(main, 'buscar_destinatarios_email', destinatarios)
+        monkeypatch.setattr(main, 'montar_email_html', lambda p: '<p>')
+        monkeypatch.setattr(main, 'enviar_email', enviar_email)
+        monkeypatch.setattr(main, 'enviar_ntfy_topicos', MagicMock())
+
+        main.verificar_pareceres()
+        assert enviar_email.call_count == n - 1
+        assert destinatarios.call_count == 1            # uma vez por especialidade
+        # parecer atual + diff + chaves do log (+ execute_values, patcheado)
+        assert len(banco.execucoes) == 3
+        assert execute_values.call_count == 1
+        assert len(execute_values.call_args.args[2]) == n - 1
+        assert set(banco.snapshot['pareceres_ativos']) == set(range(n))
+        banco.commit.assert_called_once()
+
+    @pytest.mark.workers
+    def test_pareceres_primeira_execucao_nao_notifica(self, sem_log_em_arquivo, monkeypatch):
+        from backend.notificadores.pareceres import main
+        banco = _BancoFalso(consultas={'FROM pareceres_pendentes': [
+            {'nr_parecer': 1, 'nr_atendimento': 2, 'especialidade_destino': None, 'horas_pendente': 0}]})
+        enviar_email = MagicMock()
+        monkeypatch.setattr(main, 'get_connection', lambda: banco)
+        monkeypatch.setattr(main, 'buscar_topicos_ntfy', lambda conn: [])
+        monkeypatch.setattr(main, 'enviar_email', enviar_email)
+        main.verificar_pareceres()
+        enviar_email.assert_not_called()
+        assert banco.snapshot['pareceres_ativos'] == {1: None}
+        banco.commit.assert_called_once()
+
+    @pytest.mark.workers
+    def test_prescricao_renotifica_em_lote(self, sem_log_em_arquivo, execute_values, monkeypatch):
+        from backend.notificadores.admissao import prescricao
+        agora = datetime.now()
+        hoje = agora.strftime('%Y-%m-%d')
+        pac = lambda nr: {'nr_atendimento': nr, 'nm_setor': 'S', 'ds_convenio': 'C'}
+        log = [{'chave_evento': 'prescricao_novo_{}_1'.format(hoje), 'id': 1, 'status': 'notificado',
+                'qt_notificacoes': 1, 'dt_ultima_notificacao': agora}]
+        banco = _BancoFalso(log=log, consultas={"INTERVAL '2 hours'": [pac(1), pac(2), pac(3)]})
+        ntfy = MagicMock(return_value=(True, 'ok'))
+        monkeypatch.setattr(prescricao, 'get_connection', lambda: banco)
+        monkeypatch.setattr(prescricao, 'buscar_topicos_ntfy', lambda conn, tipo: ['t'])
+        monkeypatch.setattr(prescricao, 'enviar_ntfy_topicos', ntfy)
+        config = {'titulo_template': 'x', 'mensagem_template': 'y', 'horario_inicio': None}
+        monkeypatch.setattr(prescricao, 'dentro_do_horario', lambda c: True)
+
+        prescricao.verificar_prescricao_pendente({'prescricao_pendente': config})
+        assert ntfy.call_count == 2                     # paciente 1 ja notificado hoje
+        consultas_log = [s for s in banco.execucoes if 'FROM notificacoes_log' in s]
+        assert len(consultas_log) == 1
+        assert execute_values.call_count == 1
+        banco.commit.assert_called_once()
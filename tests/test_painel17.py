@@ -0,0 +1,89 @@
+"""
+Testes do calculo de tempos do painel17 (backend.routes.painel17_routes
+e calcular_metricas de backend.espera_ps).
+
+Cobertura:
+- faixa estreita a partir dos percentis do agregado
+- tendencia contra a mediana de 1-2h atras
+- inatividade (TEMPO_PADRAO_INATIVIDADE) e clinica sem dados
+- consultas da rota nao crescem com o numero de clinicas
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+import pytest
+from unittest.mock import MagicMock
+
+
+AGORA = datetime(2026, 10, 17, 15, 0)
+
+
+def _agregado(**kw):
+    row = {'ultimo': AGORA - timedelta(minutes=10), 'amostra': 5,
+           'mediana': 30.0, 'p35': Decimal('28.0'), 'p65': Decimal('32.0'), 'mediana_1h': None}
+    row.update(kw)
+    return row
+
+
+class TestMetricasPainel17:
+    @pytest.mark.routes
+    def test_faixa_e_estavel(self):
+        from backend.espera_ps import calcular_metricas as _calcular_metricas
+        m = _calcular_metricas(_agregado(), AGORA)
+        assert m == {'mediana': 30, 'faixa_min': 28, 'faixa_max': 32,
+                     'tendencia': 'estavel', 'amostra': 5}
+
+    @pytest.mark.routes
+    def test_tendencia(self):
+        from backend.espera_ps import calcular_metricas as _calcular_metricas
+        assert _calcular_metricas(_agregado(mediana_1h=20.0), AGORA)['tendencia'] == 'subindo'
+        assert _calcular_metricas(_agregado(mediana_1h=40.0), AGORA)['tendencia'] == 'descendo'
+
+    @pytest.mark.routes
+    def test_amostra_pequena_usa_spread_minimo(self):
+        from backend.espera_ps import calcular_metricas as _calcular_metricas, SPREAD_MIN
+        m = _calcular_metricas(_agregado(amostra=2, p35=None, p65=None), AGORA)
+        assert m['faixa_max'] - m['faixa_min'] >= SPREAD_MIN
+
+    @pytest.mark.routes
+    def test_inatividade_e_sem_dados(self):
+        from backend.espera_ps import calcular_metricas as _calcular_metricas, TEMPO_PADRAO_INATIVIDADE
+        inativa = _calcular_metricas(_agregado(ultimo=AGORA - timedelta(hours=3)), AGORA)
+        assert inativa['mediana'] == TEMPO_PADRAO_INATIVIDADE
+        assert inativa['tendencia'] == 'sem_dados'
+        assert _calcular_metricas({}, AGORA)['mediana'] is None
+        # Atendimento recente, mas nenhuma espera valida
+        assert _calcular_metricas(_agregado(amostra=0), AGORA)['mediana'] is None
+
+
+class TestRotaTemposPainel17:
+    @pytest.mark.routes
+    def test_consultas_nao_crescem_com_clinicas(self, app, monkeypatch):
+        import inspect
+        from backend.espera_ps import EstimadorEspera
+        from backend.routes import painel17_routes as p17
+
+        ingestao = [{'nr_atendimento': i, 'cd_clinica': i, 'clinica': f'Clinica {i}',
+                     'dt_entrada': None, 'retirada_senha': AGORA - timedelta(minutes=40),
+                     'dt_inicio_atendimento': None,
+                     'dt_inicio_atendimento_med': AGORA - timedelta(minutes=10)}
+                    for i in range(50)]
+        fila = [{'cd_clinica': 0, 'clinica': 'Clinica 0', 'fila': 2, 'fila_acolhimento': 1},
+                {'cd_clinica': 99, 'clinica': 'So Fila', 'fila': 1, 'fila_acolhimento': 0}]
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [[], [], ingestao, fila]
+        cursor.fetchone.return_value = {'fila_total': 3, 'atendidos_hoje': 50, 'medicos_total': 0}
+        cm = MagicMock()
+        cm.__enter__.return_value = cursor
+        monkeypatch.setattr(p17, 'get_db_cursor', lambda: cm)
+        monkeypatch.setattr(p17, 'estimador_espera', EstimadorEspera())
+        monkeypatch.setattr(p17, 'datetime', MagicMock(now=lambda: AGORA))
+
+        # Handler sem login/permissao/cache
+        dados = inspect.unwrap(p17.api_painel17_tempos)().get_json()
+        assert len(dados['clinicas']) == 52
+        assert cursor.execute.call_count == 5
+        por_nome = {c['clinica']: c for c in dados['clinicas']}
+        assert por_nome['Clinica 0']['mediana'] == 30
+        assert por_nome['Clinica 0']['fila'] == 2
+        assert por_nome['So Fila']['mediana'] is None
+        assert por_nome['Acolhimento']['fila'] == 1
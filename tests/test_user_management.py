@@ -7,8 +7,11 @@ Cobertura:
 - validar_nome_painel (SQL injection prevention)
 - validar_id
 - validar_campo_editavel
+- cache de permissoes versionado (verificar_permissao_painel), com idade maxima
 """
 import pytest
+from contextlib import contextmanager
+from unittest.mock import patch, MagicMock
 from backend.user_management import (
     validar_email,
     sanitizar_campos,
@@ -174,3 +177,78 @@ class TestSanitizarString:
     @pytest.mark.validators
     def test_input_nao_string(self):
         assert sanitizar_string(123) == ''
+
+
+class TestCachePermissoes:
+    @pytest.fixture(autouse=True)
+    def _limpa(self):
+        from backend.user_management import _permissoes_cache
+        _permissoes_cache.clear()
+        with patch('backend.cache._redis_client', None):
+            yield
+        _permissoes_cache.clear()
+
+    def _banco(self, is_admin=False, paineis=('painel5',)):
+        cursor = MagicMock()
+        cursor.fetchone.return_value = (is_admin,)
+        cursor.fetchall.return_value = [(p,) for p in paineis]
+
+        @contextmanager
+        def _get_db_cursor(commit=False):
+            yield cursor, MagicMock()
+        return cursor, patch('backend.user_management.get_db_cursor', _get_db_cursor)
+
+    @pytest.mark.decorators
+    def test_segunda_verificacao_nao_consulta_banco(self):
+        from backend.user_management import verificar_permissao_painel
+        cursor, banco = self._banco()
+        with banco:
+            assert verificar_permissao_painel(7, 'painel5') is True
+            assert verificar_permissao_painel(7, 'painel9') is False
+            assert verificar_permissao_painel(7, 'painel5') is True
+        assert cursor.execute.call_count == 2   # is_admin + lista de paineis, uma vez
+
+    @pytest.mark.decorators
+    def test_nova_geracao_recarrega_permissoes(self):
+        from backend.user_management import verificar_permissao_painel, invalidar_cache_permissoes
+        cursor, banco = self._banco()
+        with banco:
+            assert verificar_permissao_painel(7, 'painel9') is False
+            cursor.fetchall.return_value = [('painel5',), ('painel9',)]
+            invalidar_cache_permissoes()
+            assert verificar_permissao_painel(7, 'painel9') is True
+        assert cursor.execute.call_count == 4
+
+    @pytest.mark.decorators
+    def test_usuario_inativo_negado(self):
+        from backend.user_management import verificar_permissao_painel
+        cursor, banco = self._banco()
+        cursor.fetchone.return_value = None
+        with banco:
+            assert verificar_permissao_painel(7, 'painel5') is False
+            assert verificar_permissao_painel(7, 'painel5') is False
+        assert cursor.execute.call_count == 1
+
+    @pytest.mark.decorators
+    def test_erro_de_banco_nao_e_cacheado(self):
+        from backend.user_management import verificar_permissao_painel, _permissoes_cache
+        cursor, banco = self._banco()
+        cursor.execute.side_effect = Exception('timeout')
+        with banco:
+            assert verificar_permissao_painel(7, 'painel5') is False
+        assert 7 not in _permissoes_cache
+
+    @pytest.mark.decorators
+    def test_entrada_expira_sem_nova_geracao(self):
+        """Revogacao feita em outro worker (sem Redis) vale apos a idade maxima."""
+        from backend.user_management import verificar_permissao_painel, PERMISSOES_CACHE_MAX_SEG
+        cursor, banco = self._banco()
+        with banco, patch('backend.user_management.time.monotonic') as agora:
+            agora.return_value = 1000.0
+            assert verificar_permissao_painel(7, 'painel5') is True
+            cursor.fetchall.return_value = []
+            agora.return_value = 1000.0 + PERMISSOES_CACHE_MAX_SEG - 1
+            assert verificar_permissao_painel(7, 'painel5') is True
+            agora.return_value = 1000.0 + PERMISSOES_CACHE_MAX_SEG + 1
+            assert verificar_permissao_painel(7, 'painel5') is False
+        assert cursor.execute.call_count == 4